@@ -2,15 +2,154 @@
 Celery 应用配置
 """
 
+import time
+
 from app.core.config import settings
 from celery import Celery
+from celery.signals import (
+    before_task_publish,
+    task_failure,
+    task_postrun,
+    task_prerun,
+    worker_init,
+    worker_process_init,
+    worker_process_shutdown,
+    worker_ready,
+)
 
 celery_app = Celery("WeDocX", broker=settings.REDIS_URL, backend=settings.REDIS_URL)
 
+# 渲染任务和投递任务分别进入各自的队列，由不同的worker消费
+_RENDER_TASKS = (
+    "app.workers.tasks.create_pdf_task",
+    "app.workers.tasks.create_pdfs_task",
+    "app.workers.tasks.export_task",
+)
+_DELIVER_TASKS = (
+    "app.workers.tasks.send_email_task",
+    "app.workers.tasks.send_emails_task",
+    "app.workers.tasks.send_digest_task",
+)
+
 celery_app.conf.update(
     task_serializer="json",
     result_serializer="json",
     accept_content=["json"],
     timezone="Asia/Shanghai",
     enable_utc=True,
+    task_routes={
+        **{name: {"queue": settings.CELERY_RENDER_QUEUE} for name in _RENDER_TASKS},
+        **{name: {"queue": settings.CELERY_DELIVER_QUEUE} for name in _DELIVER_TASKS},
+    },
+    # 未按队列启动的worker（同时消费两个队列）也不预取多个渲染任务
+    worker_prefetch_multiplier=settings.CELERY_RENDER_PREFETCH_MULTIPLIER,
 )
+
+
+@worker_process_init.connect
+def _start_async_runtime(**kwargs):
+    """worker子进程启动时创建常驻事件循环线程，并为子进程初始化追踪"""
+    from app.core.runtime import get_runtime
+    from app.core.tracing import init_tracing
+
+    get_runtime()
+    init_tracing("wedocx-worker")
+
+
+@worker_process_shutdown.connect
+def _shutdown_async_runtime(**kwargs):
+    """worker子进程退出时关闭常驻浏览器池、SMTP连接池和事件循环线程，写入剩余的进度事件"""
+    from app.core.metrics import mark_process_dead
+    from app.core.runtime import stop_runtime
+    from app.core.tracing import shutdown_tracing
+    from app.services.pdf_service import shutdown_browser_pool
+    from app.services.smtp_pool import close_smtp_pool
+    from app.services.task_progress import flush_progress
+
+    shutdown_browser_pool()
+    close_smtp_pool()
+    flush_progress()
+    stop_runtime()
+    mark_process_dead()
+    # 子进程退出时不执行atexit，需要主动导出剩余的span
+    shutdown_tracing()
+
+
+@worker_init.connect
+def _start_metrics_exporter(**kwargs):
+    """
+    worker主进程启动时导出Prometheus指标；
+    solo/threads模式下任务在主进程执行，同时初始化追踪
+    """
+    from app.core.metrics import start_worker_exporter
+    from app.core.tracing import init_tracing
+
+    start_worker_exporter()
+    init_tracing("wedocx-worker")
+
+
+# task_id -> 开始执行的时间
+_task_started = {}
+
+
+@before_task_publish.connect
+def _inject_trace_context(headers=None, **kwargs):
+    """发布任务时把当前trace context写入消息头（API请求或任务链中的前一个任务）"""
+    from app.core.tracing import inject
+
+    inject(headers)
+
+
+@task_prerun.connect
+def _record_task_start(task_id=None, task=None, **kwargs):
+    from app.core.tracing import start_task_span
+
+    _task_started[task_id] = time.perf_counter()
+    # 发布时写入的消息头是task.request的属性
+    carrier = {}
+    for key in ("traceparent", "tracestate"):
+        value = getattr(task.request, key, None)
+        if value:
+            carrier[key] = value
+    start_task_span(task_id, getattr(task, "name", "unknown"), carrier)
+
+
+@task_failure.connect
+def _record_task_failure(task_id=None, exception=None, **kwargs):
+    from app.core.tracing import record_task_exception
+
+    record_task_exception(task_id, exception)
+
+
+@task_postrun.connect
+def _record_task_end(task_id=None, task=None, state=None, **kwargs):
+    """记录任务耗时和结束状态（SUCCESS、FAILURE、RETRY等）"""
+    from app.core.metrics import observe_task
+    from app.core.tracing import end_task_span
+
+    started = _task_started.pop(task_id, None)
+    elapsed = None if started is None else time.perf_counter() - started
+    observe_task(getattr(task, "name", "unknown"), state or "UNKNOWN", elapsed)
+    end_task_span(task_id, state)
+
+
+@task_postrun.connect
+def _release_render_slot(task_id=None, task=None, **kwargs):
+    """启用公平调度时，渲染任务结束后释放其占用的发布窗口并发布下一个任务"""
+    if getattr(task, "name", None) not in _RENDER_TASKS:
+        return
+    from app.services.fair_scheduler import get_fair_scheduler
+
+    scheduler = get_fair_scheduler()
+    if scheduler is not None:
+        scheduler.complete(task_id)
+
+
+@worker_ready.connect
+def _pump_scheduler(**kwargs):
+    """worker启动后发布窗口内可执行的待调度任务（如调度器中积压的任务）"""
+    from app.services.fair_scheduler import get_fair_scheduler
+
+    scheduler = get_fair_scheduler()
+    if scheduler is not None:
+        scheduler.pump()
@@ -4,7 +4,7 @@
 
 import os
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional
 
 from pydantic_settings import BaseSettings
 
@@ -25,6 +25,190 @@ class Settings(BaseSettings):
     SMTP_USER: str = ""
     SMTP_PASSWORD: str = ""
     SENDER_EMAIL: Optional[str] = None
+    # 输出SMTP协议调试日志（包含完整邮件内容）
+    SMTP_DEBUG: bool = False
+    SMTP_TIMEOUT: int = 30
+
+    # SMTP连接池（每个worker进程独立）
+    SMTP_POOL_ENABLED: bool = True
+    SMTP_POOL_SIZE: int = 2
+    # 空闲会话保留时长和NOOP保活间隔（秒）
+    SMTP_POOL_MAX_IDLE: int = 240
+    SMTP_KEEPALIVE_INTERVAL: int = 60
+    SMTP_MAX_MESSAGES_PER_CONNECTION: int = 100
+    # 投递任务改用异步邮件服务，在worker的异步运行时上发送：批量邮件同时使用
+    # 最多EMAIL_ASYNC_MAX_CONCURRENCY个SMTP会话；同时消费渲染队列的worker中
+    # SMTP上传与渲染共用同一个事件循环。不使用SMTP连接池和大附件的流式编码
+    EMAIL_ASYNC_ENABLED: bool = False
+    # 异步邮件服务批量发送时同时使用的SMTP会话数
+    EMAIL_ASYNC_MAX_CONCURRENCY: int = 4
+
+    # 浏览器池配置（每个worker进程）
+    BROWSER_POOL_SIZE: int = 1
+    BROWSER_RECYCLE_AFTER_PAGES: int = 100
+    BROWSER_HEALTH_CHECK_INTERVAL: int = 60
+    # 单个浏览器同时打开的页面（上下文）上限
+    BROWSER_MAX_PAGES_PER_BROWSER: int = 8
+    # 单个worker进程同时进行的渲染上限
+    RENDER_MAX_IN_FLIGHT: int = 8
+
+    # 多格式导出时DOCX/TXT转换线程数
+    EXPORT_CONVERT_WORKERS: int = 2
+
+    # HTML解析方式：html.parser、lxml或stream（不建树的流式解析，与html.parser结果一致）
+    DOCUMENT_PARSER: str = "stream"
+    TXT_PARSER: str = "stream"
+    # DOCX边生成边写入文件，不在内存中构建完整文档（配合stream解析时内存占用与文档长度无关）
+    DOCX_STREAMING: bool = True
+    # DOCX中表格生成为Word表格（支持合并单元格），嵌套列表按层级缩进；关闭时逐行写为段落
+    DOCX_STRUCTURED: bool = True
+
+    # DOCX图片嵌入：图片取自已加载页面的响应，不重新下载
+    DOCX_EMBED_IMAGES: bool = True
+    # 按显示尺寸缩放到该DPI；正文宽度（英寸）为图片显示宽度上限
+    DOCX_IMAGE_DPI: int = 150
+    DOCX_IMAGE_MAX_WIDTH_IN: float = 6.0
+    # 重新编码为JPEG时的质量
+    DOCX_IMAGE_JPEG_QUALITY: int = 85
+    # 单个文档图片总大小上限（字节），超出后的图片不再嵌入
+    DOCX_IMAGE_BYTE_BUDGET: int = 20 * 1024 * 1024
+    # 图片缩放/重新编码线程数（进程级）
+    DOCX_IMAGE_WORKERS: int = 2
+
+    # 页面稳定检测上限（毫秒）
+    SETTLE_SCROLL_TIMEOUT_MS: int = 5000
+    SETTLE_IMAGE_TIMEOUT_MS: int = 8000
+    SETTLE_DOM_QUIET_MS: int = 200
+    SETTLE_DOM_TIMEOUT_MS: int = 2000
+    SETTLE_NETWORK_IDLE_MS: int = 300
+    SETTLE_NETWORK_TIMEOUT_MS: int = 3000
+
+    # 请求拦截配置
+    REQUEST_FILTER_ENABLED: bool = True
+    REQUEST_BLOCK_RESOURCE_TYPES: List[str] = [
+        "media",
+        "ping",
+        "prefetch",
+        "texttrack",
+        "manifest",
+        "websocket",
+        "eventsource",
+        "cspviolationreport",
+    ]
+    # 在内置广告/统计域名之外额外拦截的域名
+    REQUEST_BLOCK_DOMAINS: List[str] = []
+    REQUEST_BLOCK_THIRD_PARTY_SCRIPTS: bool = False
+
+    # 静态资源磁盘缓存（本机所有worker共享）
+    ASSET_CACHE_ENABLED: bool = True
+    ASSET_CACHE_DIR: Path = Path("cache/assets")
+    ASSET_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+    ASSET_CACHE_MAX_ENTRY_BYTES: int = 10 * 1024 * 1024
+    ASSET_CACHE_RESOURCE_TYPES: List[str] = ["image", "font", "stylesheet"]
+
+    # 渲染结果去重缓存（秒）
+    RENDER_CACHE_ENABLED: bool = True
+    RENDER_CACHE_TTL: int = 24 * 3600
+    # 渲染锁超时，应大于单次渲染的最长耗时
+    RENDER_CACHE_LOCK_TTL: int = 300
+
+    # 产物存储：local、memory或s3（S3兼容存储如MinIO，需要安装boto3）
+    ARTIFACT_STORE: str = "local"
+    S3_ENDPOINT_URL: Optional[str] = None
+    S3_BUCKET: str = "wedocx"
+    S3_ACCESS_KEY: str = ""
+    S3_SECRET_KEY: str = ""
+    S3_REGION: Optional[str] = None
+
+    # 附件总大小超过该值时流式编码发送邮件（字节）
+    EMAIL_STREAM_THRESHOLD_BYTES: int = 5 * 1024 * 1024
+    # 邮件中的产物：attachment（作为附件）、link（只附下载链接）或
+    # auto（附件总大小超过EMAIL_LINK_THRESHOLD_BYTES时改为链接），链接需要配置DOWNLOAD_SECRET
+    EMAIL_ATTACHMENT_MODE: str = "attachment"
+    EMAIL_LINK_THRESHOLD_BYTES: int = 10 * 1024 * 1024
+
+    # 产物下载（/api/v1/download）：签名密钥，为空时不提供下载；API和worker需相同
+    DOWNLOAD_SECRET: str = ""
+    # 链接中的服务地址和有效期（秒）
+    DOWNLOAD_BASE_URL: str = "http://localhost:8000"
+    DOWNLOAD_LINK_TTL: int = 7 * 24 * 3600
+    # 部署在nginx后面时设置为internal location的前缀（如/protected/），
+    # 由nginx用sendfile发送文件并处理Range请求，API只校验签名
+    DOWNLOAD_ACCEL_REDIRECT: str = ""
+
+    # Prometheus指标：API在/metrics导出，worker在METRICS_WORKER_PORT导出（为0时不导出）
+    METRICS_ENABLED: bool = True
+    METRICS_WORKER_PORT: int = 9808
+    # 在/metrics中报告长度的Celery队列
+    METRICS_QUEUES: List[str] = ["render", "deliver", "celery"]
+
+    # 分布式追踪：none、console、otlp（需要安装opentelemetry-exporter-otlp-proto-http）
+    # 或file（每行一个JSON），启用时需要安装opentelemetry-sdk
+    TRACING_EXPORTER: str = "none"
+    TRACING_OTLP_ENDPOINT: str = "http://localhost:4318/v1/traces"
+    TRACING_FILE_PATH: str = "output/traces.jsonl"
+    # 根span的采样比例，子span跟随父span
+    TRACING_SAMPLE_RATIO: float = 1.0
+
+    # Celery队列：渲染（浏览器、文档转换）和投递（发邮件）分开，
+    # 发邮件不必排在耗时的渲染后面；各队列的worker启动参数见app.workers.launch
+    CELERY_RENDER_QUEUE: str = "render"
+    CELERY_DELIVER_QUEUE: str = "deliver"
+    # 每个worker的子进程数
+    CELERY_RENDER_CONCURRENCY: int = 2
+    CELERY_DELIVER_CONCURRENCY: int = 8
+    # 每个子进程预取的任务数：渲染只取正在执行的一个，避免占住其他worker能执行的任务
+    CELERY_RENDER_PREFETCH_MULTIPLIER: int = 1
+    CELERY_DELIVER_PREFETCH_MULTIPLIER: int = 4
+    # 子进程常驻内存超过该值（KB）时执行完当前任务后重启，0为不限制
+    CELERY_RENDER_MAX_MEMORY_PER_CHILD: int = 1536 * 1024
+    CELERY_DELIVER_MAX_MEMORY_PER_CHILD: int = 256 * 1024
+    # 子进程执行该数量的任务后重启，0为不限制
+    CELERY_RENDER_MAX_TASKS_PER_CHILD: int = 200
+    CELERY_DELIVER_MAX_TASKS_PER_CHILD: int = 0
+
+    # 任务进度（/api/v1/tasks/{id}及其SSE事件流）：最新进度在Redis中的保留时间（秒）、
+    # 每个进程待写入事件的队列长度（满时丢弃）、SSE保活间隔和单个连接的最长时间（秒）
+    PROGRESS_ENABLED: bool = True
+    PROGRESS_TTL: int = 24 * 3600
+    PROGRESS_QUEUE_SIZE: int = 1000
+    PROGRESS_SSE_KEEPALIVE: int = 15
+    PROGRESS_SSE_MAX_SECONDS: int = 900
+
+    # 批量提交（/api/v1/process-urls）：单次链接数上限、每个渲染任务包含的链接数
+    BATCH_MAX_URLS: int = 500
+    BATCH_CHUNK_SIZE: int = 5
+    # 批量渲染任务的消息优先级：Redis broker中数字越小越先消费，默认任务为0，
+    # 渲染worker空闲时才执行批量任务，单个请求不排在批量任务后面
+    BATCH_RENDER_PRIORITY: int = 9
+    # 汇总邮件附件总大小上限（字节），超出时拆成多封
+    BATCH_DIGEST_MAX_BYTES: int = 20 * 1024 * 1024
+
+    # 渲染任务公平调度（见app.services.fair_scheduler）：按API Key或邮箱分租户轮转发布，
+    # 单个请求走interactive通道优先执行，积压较多的用户降入bulk通道
+    FAIR_SCHEDULER_ENABLED: bool = False
+    # 已发布到Celery但未完成的渲染任务上限，应略大于全部渲染worker的子进程总数
+    FAIR_DISPATCH_WINDOW: int = 4
+    # interactive和bulk都有任务时，每N次发布至少有一次给bulk
+    FAIR_BULK_SHARE: int = 4
+    # 同一租户在interactive中积压超过该数量时，后续任务降入bulk
+    FAIR_INTERACTIVE_BURST: int = 3
+    # 待调度任务上限，超过时返回429
+    FAIR_MAX_PENDING_PER_TENANT: int = 500
+    FAIR_MAX_PENDING: int = 5000
+    # 批量提交（/api/v1/process-urls）：每个租户尚未渲染完的链接数上限，超过时返回429；
+    # 没有未完成链接的租户总可以提交一批。计数在批量渲染任务结束时减少，
+    # 丢失的任务（如worker崩溃）占用的计数在BATCH_PENDING_TTL秒后过期
+    FAIR_BATCH_MAX_PENDING_URLS: int = 1000
+    FAIR_BATCH_PENDING_TTL: int = 6 * 3600
+    # 租户权重：以API Key或邮箱为键，每轮连续发布的任务数，默认1
+    FAIR_TENANT_WEIGHTS: Dict[str, int] = {}
+    # 已发布任务超过该时间（秒）未结束时视为丢失，释放其窗口
+    FAIR_INFLIGHT_TTL: int = 600
+    # 估算重试等待时间：尚无统计时的单个任务耗时（秒）、滑动平均系数和等待上限（秒）
+    FAIR_DEFAULT_RENDER_SECONDS: float = 15.0
+    FAIR_EWMA_ALPHA: float = 0.2
+    FAIR_RETRY_AFTER_MAX: int = 3600
 
     # Redis配置（用于Celery）
     REDIS_HOST: str = "localhost"
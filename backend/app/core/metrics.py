@@ -0,0 +1,326 @@
+"""
+Prometheus指标
+
+各处理阶段的耗时统一记录在wedocx_stage_duration_seconds中，以stage标签区分：
+浏览器启动、页面访问、页面稳定的各阶段、PDF打印、DOCX/TXT转换、SMTP连接/登录/发送等。
+Celery任务的耗时和结果由celery_app中的信号处理记录，队列长度在抓取时从Redis读取。
+静态资源缓存的命中情况由AssetCacheSession、请求拦截的结果由RequestFilter逐个请求计数。
+
+API在/metrics暴露指标，worker在启动时另起一个HTTP端口（METRICS_WORKER_PORT）。
+prefork模式的worker指标分散在各子进程中，需要在启动前设置环境变量
+PROMETHEUS_MULTIPROC_DIR指向一个空目录，由主进程的导出端口汇总各子进程的指标。
+"""
+
+import logging
+import os
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.core import tracing
+from app.core.config import settings
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# 覆盖毫秒级的SMTP命令到分钟级的大页面渲染
+_STAGE_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+)
+_TASK_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+STAGE_DURATION = Histogram(
+    "wedocx_stage_duration_seconds",
+    "各处理阶段耗时",
+    ["stage"],
+    buckets=_STAGE_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "wedocx_stage_errors_total",
+    "各处理阶段抛出异常的次数",
+    ["stage"],
+)
+TASK_DURATION = Histogram(
+    "wedocx_task_duration_seconds",
+    "Celery任务执行耗时",
+    ["task"],
+    buckets=_TASK_BUCKETS,
+)
+TASKS = Counter(
+    "wedocx_tasks_total",
+    "Celery任务执行次数，按结束状态区分",
+    ["task", "state"],
+)
+RENDERS_IN_FLIGHT = Gauge(
+    "wedocx_renders_in_flight",
+    "正在渲染的页面数",
+    multiprocess_mode="livesum",
+)
+ASSET_CACHE_REQUESTS = Counter(
+    "wedocx_asset_cache_requests_total",
+    "静态资源缓存处理的请求数，按结果区分（hit、revalidated、miss）",
+    ["result"],
+)
+ASSET_CACHE_BYTES_SERVED = Counter(
+    "wedocx_asset_cache_bytes_served_total",
+    "由静态资源缓存直接返回的字节数（含304重新校验）",
+)
+ASSET_CACHE_SAVED_SECONDS = Counter(
+    "wedocx_asset_cache_saved_seconds_total",
+    "缓存命中节省的网络时间，按资源首次下载耗时估算",
+)
+FILTER_REQUESTS = Counter(
+    "wedocx_request_filter_requests_total",
+    "请求拦截器处理的请求数，按结果（allowed、blocked）和拦截原因区分",
+    ["decision", "reason"],
+)
+FILTER_ALLOWED_BYTES = Counter(
+    "wedocx_request_filter_allowed_bytes_total",
+    "放行请求的响应体字节数（按Content-Length统计）",
+)
+
+
+def _multiprocess_dir() -> Optional[str]:
+    return os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+
+class _StageTimer:
+    """记录一个阶段耗时的上下文管理器，异常时同时计入错误次数；启用追踪时同时创建span"""
+
+    __slots__ = ("_duration", "_errors", "_start", "_span")
+
+    def __init__(self, name, duration, errors):
+        self._duration = duration
+        self._errors = errors
+        self._span = tracing.span(name)
+
+    def __enter__(self) -> "_StageTimer":
+        self._span.__enter__()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self._duration.observe(time.perf_counter() - self._start)
+        if exc_type is not None:
+            self._errors.inc()
+        self._span.__exit__(exc_type, exc, tb)
+        return False
+
+    async def __aenter__(self) -> "_StageTimer":
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        return self.__exit__(exc_type, exc, tb)
+
+
+# stage -> (耗时子指标, 错误子指标)，避免每次记录都按标签查找
+_stage_children: Dict[str, Tuple[object, object]] = {}
+
+
+def _children(name: str) -> Tuple[object, object]:
+    children = _stage_children.get(name)
+    if children is None:
+        children = (STAGE_DURATION.labels(name), STAGE_ERRORS.labels(name))
+        _stage_children[name] = children
+    return children
+
+
+def stage(name: str):
+    """
+    记录一个处理阶段的耗时，可用于with和async with；启用追踪时该阶段同时是一个span
+
+    :param name: 阶段名，如navigation、page_pdf、smtp_send
+    """
+    if not settings.METRICS_ENABLED:
+        return tracing.span(name)
+    return _StageTimer(name, *_children(name))
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    """
+    记录已在别处测得的阶段耗时（如页面稳定检测的各阶段）
+
+    :param name: 阶段名
+    :param seconds: 耗时秒数
+    """
+    if settings.METRICS_ENABLED:
+        _children(name)[0].observe(seconds)
+
+
+def observe_task(task: str, state: str, seconds: Optional[float]) -> None:
+    """
+    记录一次Celery任务的结束状态和耗时
+
+    :param task: 任务名
+    :param state: 结束状态，如SUCCESS、FAILURE、RETRY
+    :param seconds: 执行耗时，未知时为None
+    """
+    if not settings.METRICS_ENABLED:
+        return
+    TASKS.labels(task, state).inc()
+    if seconds is not None:
+        TASK_DURATION.labels(task).observe(seconds)
+
+
+def count_asset_cache(
+    result: str, bytes_served: int = 0, saved_seconds: float = 0.0
+) -> None:
+    """
+    记录静态资源缓存处理的一次请求
+
+    :param result: hit、revalidated或miss
+    :param bytes_served: 由缓存返回的字节数
+    :param saved_seconds: 估算节省的网络时间
+    """
+    if not settings.METRICS_ENABLED:
+        return
+    ASSET_CACHE_REQUESTS.labels(result).inc()
+    if bytes_served:
+        ASSET_CACHE_BYTES_SERVED.inc(bytes_served)
+    if saved_seconds:
+        ASSET_CACHE_SAVED_SECONDS.inc(saved_seconds)
+
+
+def count_filtered_request(reason: Optional[str]) -> None:
+    """
+    记录请求拦截器的一次判定
+
+    :param reason: 拦截原因，放行时为None
+    """
+    if not settings.METRICS_ENABLED:
+        return
+    if reason is None:
+        FILTER_REQUESTS.labels("allowed", "").inc()
+    else:
+        FILTER_REQUESTS.labels("blocked", reason).inc()
+
+
+def count_allowed_bytes(size: int) -> None:
+    """记录放行请求的响应体字节数"""
+    if settings.METRICS_ENABLED:
+        FILTER_ALLOWED_BYTES.inc(size)
+
+
+# kombu的Redis传输把带优先级的消息放在各优先级档位的子列表中：档位0即队列本身，
+# 其他档位为"队列名\x06\x16档位"（kombu默认的档位和分隔符，本项目未修改）
+_PRIORITY_STEPS = (0, 3, 6, 9)
+_PRIORITY_SEP = "\x06\x16"
+
+
+def _priority_lists(queue: str) -> List[str]:
+    return [queue] + [f"{queue}{_PRIORITY_SEP}{step}" for step in _PRIORITY_STEPS[1:]]
+
+
+class QueueDepthCollector:
+    """抓取时从Redis读取各Celery队列中等待执行的任务数（各优先级档位之和）"""
+
+    def __init__(self, queues: Iterable[str], client=None):
+        self.queues = list(queues)
+        self._client = client
+
+    def _redis(self):
+        if self._client is None:
+            import redis
+
+            self._client = redis.Redis.from_url(
+                settings.REDIS_URL, socket_timeout=1, socket_connect_timeout=1
+            )
+        return self._client
+
+    def collect(self):
+        family = GaugeMetricFamily(
+            "wedocx_queue_depth", "Celery队列中等待执行的任务数", labels=["queue"]
+        )
+        try:
+            pipe = self._redis().pipeline(transaction=False)
+            for queue in self.queues:
+                for name in _priority_lists(queue):
+                    pipe.llen(name)
+            lengths = pipe.execute()
+        except Exception as e:
+            logger.debug(f"读取队列长度失败: {e}")
+            return
+        steps = len(_PRIORITY_STEPS)
+        for i, queue in enumerate(self.queues):
+            family.add_metric([queue], sum(lengths[i * steps : (i + 1) * steps]))
+        yield family
+
+
+def build_registry(queues: Optional[Iterable[str]] = None) -> CollectorRegistry:
+    """
+    创建用于导出的指标注册表
+
+    :param queues: 可选，需要报告长度的Celery队列
+    :return: 多进程模式下汇总各进程的指标，否则为本进程的指标
+    """
+    registry = CollectorRegistry(auto_describe=False)
+    if _multiprocess_dir():
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry.register(REGISTRY)
+    if queues:
+        registry.register(QueueDepthCollector(queues))
+    return registry
+
+
+_api_registry: Optional[CollectorRegistry] = None
+
+
+def render_latest() -> Tuple[bytes, str]:
+    """
+    生成API进程/metrics的响应内容，包含队列长度
+
+    :return: (指标文本, Content-Type)
+    """
+    global _api_registry
+    if _api_registry is None:
+        _api_registry = build_registry(settings.METRICS_QUEUES)
+    return generate_latest(_api_registry), CONTENT_TYPE_LATEST
+
+
+def start_worker_exporter(port: Optional[int] = None) -> bool:
+    """
+    在worker主进程中启动指标HTTP服务
+
+    :param port: 监听端口，默认取配置METRICS_WORKER_PORT，为0时不启动
+    :return: 是否已启动
+    """
+    port = settings.METRICS_WORKER_PORT if port is None else port
+    if not settings.METRICS_ENABLED or not port:
+        return False
+    try:
+        start_http_server(port, registry=build_registry())
+    except OSError as e:
+        logger.warning(f"worker指标端口 {port} 启动失败: {e}")
+        return False
+    logger.info(f"worker指标已在端口 {port} 导出")
+    return True
+
+
+def mark_process_dead(pid: Optional[int] = None) -> None:
+    """多进程模式下清理已退出子进程的实时指标（livesum类Gauge）"""
+    if _multiprocess_dir():
+        multiprocess.mark_process_dead(pid or os.getpid())
@@ -0,0 +1,132 @@
+"""
+worker进程级异步运行时
+
+在独立线程中运行一个常驻事件循环，同步代码（如Celery任务）把协程提交到该循环上执行，
+从而复用浏览器池等绑定事件循环的资源，并允许多个渲染在同一进程内并发进行。
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import logging
+import os
+import threading
+from typing import Any, Coroutine, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRuntime:
+    """常驻事件循环线程"""
+
+    def __init__(self, name: str = "wedocx-async-runtime"):
+        self.name = name
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._started = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def is_running(self) -> bool:
+        return (
+            self._thread is not None
+            and self._thread.is_alive()
+            and self.loop is not None
+            and not self.loop.is_closed()
+        )
+
+    def start(self) -> "AsyncRuntime":
+        """启动事件循环线程，重复调用无副作用"""
+        with self._lock:
+            if self.is_running:
+                return self
+            self._started.clear()
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._run_loop, name=self.name, daemon=True
+            )
+            self._thread.start()
+        self._started.wait()
+        logger.info(f"异步运行时已启动: 线程={self.name}, pid={os.getpid()}")
+        return self
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._started.set)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+            self.loop.close()
+
+    def submit(self, coro: Coroutine) -> concurrent.futures.Future:
+        """
+        把协程提交到运行时的事件循环，协程继承调用方的上下文变量（如当前trace）
+
+        :param coro: 待执行的协程
+        :return: 可在任意线程等待的Future
+        """
+        if not self.is_running:
+            self.start()
+        return asyncio.run_coroutine_threadsafe(
+            _run_in_context(contextvars.copy_context(), coro), self.loop
+        )
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """
+        同步执行协程并返回结果
+
+        :param coro: 待执行的协程
+        :param timeout: 可选，等待超时秒数，超时后取消协程
+        :raises: RuntimeError 在运行时线程内调用时（会导致死锁）
+        """
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("不能在异步运行时线程内同步等待协程")
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self, timeout: float = 10) -> None:
+        """停止事件循环并等待线程退出"""
+        with self._lock:
+            if not self.is_running:
+                return
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join(timeout)
+            self._thread = None
+        logger.info(f"异步运行时已停止: 线程={self.name}")
+
+
+async def _run_in_context(context: contextvars.Context, coro: Coroutine) -> Any:
+    """在事件循环线程的任务中恢复提交方线程的上下文变量后执行协程"""
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+_runtime: Optional[AsyncRuntime] = None
+_runtime_pid: Optional[int] = None
+_runtime_lock = threading.Lock()
+
+
+def get_runtime() -> AsyncRuntime:
+    """获取当前进程的异步运行时，fork后的子进程会创建自己的实例"""
+    global _runtime, _runtime_pid
+    with _runtime_lock:
+        if _runtime is None or _runtime_pid != os.getpid():
+            _runtime = AsyncRuntime()
+            _runtime_pid = os.getpid()
+    return _runtime.start()
+
+
+def stop_runtime() -> None:
+    """停止当前进程的异步运行时"""
+    global _runtime
+    with _runtime_lock:
+        runtime, _runtime = _runtime, None
+    if runtime is not None and _runtime_pid == os.getpid():
+        runtime.stop()
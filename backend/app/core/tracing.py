@@ -0,0 +1,303 @@
+"""
+分布式追踪
+
+一次/api/v1/process-url请求会拆成Celery任务链，在不同进程中执行。
+API为每个请求创建根span，发布任务时把W3C trace context写入任务消息头，
+worker执行任务时从消息头恢复上下文，任务链中后续任务的消息头由前一个任务写入，
+因此同一请求的渲染、转换和发信都在同一条trace中。
+浏览器、页面和SMTP各阶段的span由metrics.stage随耗时指标一起创建。
+
+导出方式由TRACING_EXPORTER配置：none（默认，不创建span）、console、
+otlp（发送到本地collector，需要安装opentelemetry-exporter-otlp-proto-http）、
+file（每行一个JSON）。启用时需要安装opentelemetry-sdk。
+"""
+
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# 未启用追踪时为None
+_tracer = None
+_provider = None
+_provider_pid: Optional[int] = None
+_init_lock = threading.Lock()
+
+# 正在执行的Celery任务：task_id -> (span, context token)
+_task_spans: Dict[str, tuple] = {}
+
+
+class _NullSpan:
+    """未启用追踪时使用的空上下文管理器"""
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+    async def __aenter__(self) -> "_NullSpan":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """把start_as_current_span包装为同时支持with和async with的上下文管理器"""
+
+    __slots__ = ("_cm", "_span")
+
+    def __init__(self, cm):
+        self._cm = cm
+        self._span = None
+
+    def __enter__(self):
+        self._span = self._cm.__enter__()
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return bool(self._cm.__exit__(exc_type, exc, tb))
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        return self.__exit__(exc_type, exc, tb)
+
+
+def _import_sdk():
+    try:
+        from opentelemetry.sdk import trace as sdk_trace
+    except ImportError:
+        raise RuntimeError(
+            "分布式追踪需要安装opentelemetry-sdk: pip install opentelemetry-sdk"
+        )
+    return sdk_trace
+
+
+class JsonFileSpanExporter:
+    """把结束的span按行追加写入JSON文件，便于离线统计各阶段的尾延迟"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans):
+        from opentelemetry.sdk.trace.export import SpanExportResult
+
+        lines = "".join(
+            json.dumps(json.loads(span.to_json(indent=None)), ensure_ascii=False) + "\n"
+            for span in spans
+        )
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+        except OSError as e:
+            logger.warning(f"写入追踪文件失败: {e}")
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        pass
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return True
+
+
+def _make_exporter(kind: str):
+    """
+    按配置创建span导出器
+
+    :param kind: console、otlp或file
+    :raises: RuntimeError 导出方式不支持或缺少依赖时
+    """
+    if kind == "console":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+
+        return ConsoleSpanExporter()
+    if kind == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter,
+            )
+        except ImportError:
+            raise RuntimeError(
+                "OTLP导出需要安装opentelemetry-exporter-otlp-proto-http: "
+                "pip install opentelemetry-exporter-otlp-proto-http"
+            )
+        return OTLPSpanExporter(endpoint=settings.TRACING_OTLP_ENDPOINT)
+    if kind == "file":
+        return JsonFileSpanExporter(settings.TRACING_FILE_PATH)
+    raise RuntimeError(f"不支持的追踪导出方式: {kind}")
+
+
+def init_tracing(service_name: str, exporter=None) -> bool:
+    """
+    初始化当前进程的追踪，重复调用无副作用，fork后的子进程需要重新调用
+
+    :param service_name: 服务名，如wedocx-api、wedocx-worker
+    :param exporter: 可选，span导出器，默认按配置TRACING_EXPORTER创建
+    :return: 是否已启用；配置错误或缺少依赖时记录警告并保持关闭，不影响服务
+    """
+    global _tracer, _provider, _provider_pid
+    kind = (settings.TRACING_EXPORTER or "none").lower()
+    if exporter is None and kind == "none":
+        return False
+    with _init_lock:
+        if _tracer is not None and _provider_pid == os.getpid():
+            return True
+        try:
+            sdk_trace = _import_sdk()
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor
+            from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+
+            if exporter is None:
+                exporter = _make_exporter(kind)
+        except RuntimeError as e:
+            logger.warning(f"追踪未启用: {e}")
+            return False
+
+        provider = sdk_trace.TracerProvider(
+            resource=Resource.create({"service.name": service_name}),
+            sampler=ParentBased(TraceIdRatioBased(settings.TRACING_SAMPLE_RATIO)),
+        )
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+        _provider, _provider_pid = provider, os.getpid()
+        _tracer = provider.get_tracer("wedocx")
+    logger.info(f"追踪已启用: 服务={service_name}, 导出={kind}")
+    return True
+
+
+def shutdown_tracing() -> None:
+    """导出剩余的span并关闭追踪"""
+    global _tracer, _provider
+    with _init_lock:
+        provider, _provider, _tracer = _provider, None, None
+    if provider is not None and _provider_pid == os.getpid():
+        provider.shutdown()
+
+
+def is_enabled() -> bool:
+    return _tracer is not None
+
+
+def span(name: str, carrier: Optional[dict] = None, kind=None, **attributes):
+    """
+    创建一个作为当前span的上下文管理器，可用于with和async with
+
+    :param name: span名称
+    :param carrier: 可选，含traceparent的请求头或消息头，给出时以其中的上下文为父span
+    :param kind: 可选，SpanKind的名称，如server、client
+    :param attributes: span属性
+    """
+    if _tracer is None:
+        return _NULL_SPAN
+    options = {}
+    if carrier is not None:
+        options["context"] = extract(carrier)
+    if kind is not None:
+        from opentelemetry.trace import SpanKind
+
+        options["kind"] = SpanKind[kind.upper()]
+    return _Span(
+        _tracer.start_as_current_span(name, attributes=attributes or None, **options)
+    )
+
+
+def inject(carrier: dict) -> None:
+    """把当前trace context写入carrier（HTTP头或任务消息头）"""
+    if _tracer is None or carrier is None:
+        return
+    from opentelemetry import propagate
+
+    propagate.inject(carrier)
+
+
+def extract(carrier: dict):
+    """从carrier中恢复trace context"""
+    from opentelemetry import propagate
+
+    return propagate.extract(carrier)
+
+
+@contextmanager
+def use_context(carrier: Optional[dict]) -> Iterator[None]:
+    """
+    在with块内以carrier中的trace context为当前上下文，carrier为空时不带trace；
+    用于延迟发布的消息沿用提交者的trace，而不是发布时恰好所在的span
+
+    :param carrier: inject写入的字典
+    """
+    if _tracer is None:
+        yield
+        return
+    from opentelemetry import context
+
+    token = context.attach(extract(carrier or {}))
+    try:
+        yield
+    finally:
+        context.detach(token)
+
+
+def start_task_span(task_id: str, name: str, carrier: dict) -> None:
+    """
+    开始一个Celery任务的span并设为当前span，由task_prerun信号调用
+
+    :param carrier: 任务的消息头，包含发布者写入的traceparent
+    """
+    if _tracer is None or task_id is None:
+        return
+    from opentelemetry import context, trace
+
+    current = _tracer.start_span(
+        name,
+        context=extract(carrier),
+        kind=trace.SpanKind.CONSUMER,
+        attributes={"celery.task_id": task_id},
+    )
+    token = context.attach(trace.set_span_in_context(current))
+    _task_spans[task_id] = (current, token)
+
+
+def record_task_exception(task_id: str, exception: BaseException) -> None:
+    """在任务span上记录异常，由task_failure信号调用"""
+    entry = _task_spans.get(task_id)
+    if entry is None:
+        return
+    from opentelemetry.trace import Status, StatusCode
+
+    entry[0].record_exception(exception)
+    entry[0].set_status(Status(StatusCode.ERROR, str(exception)))
+
+
+def end_task_span(task_id: str, state: Optional[str] = None) -> None:
+    """结束任务span并恢复之前的上下文，由task_postrun信号调用"""
+    entry = _task_spans.pop(task_id, None)
+    if entry is None:
+        return
+    from opentelemetry import context
+
+    current, token = entry
+    if state:
+        current.set_attribute("celery.state", state)
+    context.detach(token)
+    current.end()
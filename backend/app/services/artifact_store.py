@@ -0,0 +1,232 @@
+"""
+产物存储模块
+
+渲染产物（PDF/DOCX/TXT）以URI的形式在任务之间传递，由可替换的存储后端保存：
+- 本地文件系统：URI即文件的绝对路径，与原有直接传路径的方式兼容
+- 内存：URI形如 mem://<name>，仅在同一进程内有效（如eager模式、测试）
+- S3兼容存储（如MinIO）：URI形如 s3://<bucket>/<key>，需要安装boto3
+"""
+
+import abc
+import hashlib
+import os
+import tempfile
+import threading
+from io import BytesIO
+from typing import BinaryIO, Dict, Optional
+from urllib.parse import urlsplit
+
+from app.core.config import settings
+
+
+class ArtifactStore(abc.ABC):
+    """产物存储后端基类"""
+
+    @abc.abstractmethod
+    def put_bytes(self, name: str, data: bytes) -> str:
+        """保存内容并返回URI"""
+
+    @abc.abstractmethod
+    def open(self, uri: str) -> BinaryIO:
+        """以二进制流打开产物，调用方负责关闭"""
+
+    @abc.abstractmethod
+    def exists(self, uri: str) -> bool:
+        """产物是否存在"""
+
+    @abc.abstractmethod
+    def size(self, uri: str) -> int:
+        """产物大小（字节）"""
+
+    @abc.abstractmethod
+    def delete(self, uri: str) -> None:
+        """删除产物，不存在时忽略"""
+
+
+class LocalArtifactStore(ArtifactStore):
+    """本地文件系统存储"""
+
+    def __init__(self, root: str = None):
+        self.root = os.path.abspath(str(root or settings.OUTPUT_DIR))
+        os.makedirs(self.root, exist_ok=True)
+
+    def put_bytes(self, name: str, data: bytes) -> str:
+        path = name if os.path.isabs(name) else os.path.join(self.root, name)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        return path
+
+    def open(self, uri: str) -> BinaryIO:
+        return open(uri, "rb")
+
+    def exists(self, uri: str) -> bool:
+        return os.path.exists(uri)
+
+    def size(self, uri: str) -> int:
+        return os.path.getsize(uri)
+
+    def delete(self, uri: str) -> None:
+        if os.path.exists(uri):
+            os.remove(uri)
+
+
+class MemoryArtifactStore(ArtifactStore):
+    """进程内存储，不落盘"""
+
+    SCHEME = "mem"
+
+    def __init__(self):
+        self._data: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, uri: str) -> str:
+        return uri[len(self.SCHEME) + 3 :]
+
+    def put_bytes(self, name: str, data: bytes) -> str:
+        name = os.path.basename(name)
+        with self._lock:
+            self._data[name] = data
+        return f"{self.SCHEME}://{name}"
+
+    def open(self, uri: str) -> BinaryIO:
+        try:
+            return BytesIO(self._data[self._key(uri)])
+        except KeyError:
+            raise FileNotFoundError(uri)
+
+    def exists(self, uri: str) -> bool:
+        return self._key(uri) in self._data
+
+    def size(self, uri: str) -> int:
+        try:
+            return len(self._data[self._key(uri)])
+        except KeyError:
+            raise FileNotFoundError(uri)
+
+    def delete(self, uri: str) -> None:
+        with self._lock:
+            self._data.pop(self._key(uri), None)
+
+
+class S3ArtifactStore(ArtifactStore):
+    """S3兼容对象存储（如MinIO）"""
+
+    SCHEME = "s3"
+
+    def __init__(
+        self,
+        bucket: str = None,
+        endpoint_url: Optional[str] = None,
+        access_key: str = None,
+        secret_key: str = None,
+        region: Optional[str] = None,
+    ):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("S3产物存储需要安装boto3: pip install boto3")
+        self.bucket = bucket or settings.S3_BUCKET
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or settings.S3_ENDPOINT_URL,
+            aws_access_key_id=access_key or settings.S3_ACCESS_KEY or None,
+            aws_secret_access_key=secret_key or settings.S3_SECRET_KEY or None,
+            region_name=region or settings.S3_REGION,
+        )
+
+    def _split(self, uri: str):
+        parts = urlsplit(uri)
+        return parts.netloc, parts.path.lstrip("/")
+
+    def put_bytes(self, name: str, data: bytes) -> str:
+        key = os.path.basename(name)
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+        return f"{self.SCHEME}://{self.bucket}/{key}"
+
+    def open(self, uri: str) -> BinaryIO:
+        bucket, key = self._split(uri)
+        try:
+            return self.client.get_object(Bucket=bucket, Key=key)["Body"]
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(uri)
+
+    def exists(self, uri: str) -> bool:
+        try:
+            self.size(uri)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def size(self, uri: str) -> int:
+        bucket, key = self._split(uri)
+        try:
+            return self.client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        except Exception:
+            raise FileNotFoundError(uri)
+
+    def delete(self, uri: str) -> None:
+        bucket, key = self._split(uri)
+        self.client.delete_object(Bucket=bucket, Key=key)
+
+
+_stores: Dict[str, ArtifactStore] = {}
+_stores_lock = threading.Lock()
+
+_STORE_CLASSES = {
+    "local": LocalArtifactStore,
+    "memory": MemoryArtifactStore,
+    "s3": S3ArtifactStore,
+}
+
+
+def get_artifact_store(name: str = None) -> ArtifactStore:
+    """
+    获取产物存储后端
+
+    :param name: local、memory或s3，默认取配置ARTIFACT_STORE
+    """
+    name = name or settings.ARTIFACT_STORE
+    if name not in _STORE_CLASSES:
+        raise ValueError(f"未知的产物存储: {name}")
+    with _stores_lock:
+        if name not in _stores:
+            _stores[name] = _STORE_CLASSES[name]()
+        return _stores[name]
+
+
+def store_for_uri(uri: str) -> ArtifactStore:
+    """根据URI的协议找到对应的存储后端，普通路径视为本地文件"""
+    scheme = urlsplit(uri).scheme
+    if scheme == MemoryArtifactStore.SCHEME:
+        return get_artifact_store("memory")
+    if scheme == S3ArtifactStore.SCHEME:
+        return get_artifact_store("s3")
+    return get_artifact_store("local")
+
+
+def open_artifact(uri: str) -> BinaryIO:
+    return store_for_uri(uri).open(uri)
+
+
+def artifact_exists(uri: str) -> bool:
+    return store_for_uri(uri).exists(uri)
+
+
+def artifact_size(uri: str) -> int:
+    return store_for_uri(uri).size(uri)
+
+
+def artifact_name(uri: str) -> str:
+    """产物的文件名（用于附件名）"""
+    return os.path.basename(uri.split("://", 1)[-1])
+
+
+def artifact_sha256(uri: str, chunk_size: int = 1024 * 1024) -> str:
+    """分块计算产物内容的sha256"""
+    digest = hashlib.sha256()
+    with open_artifact(uri) as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
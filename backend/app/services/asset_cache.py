@@ -0,0 +1,436 @@
+"""
+静态资源缓存模块
+
+在请求拦截层为图片、字体和样式表提供本机共享的磁盘缓存。
+资源内容按sha256寻址存放，索引保存在SQLite中并以URL为键记录ETag/Last-Modified
+等校验信息；总容量超过上限时按最近访问时间（LRU）淘汰。
+同一台机器上的所有worker进程和浏览器上下文共用一个缓存目录。
+"""
+
+import asyncio
+import email.utils
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.core.metrics import count_asset_cache
+from playwright.async_api import Page, Route
+
+logger = logging.getLogger(__name__)
+
+# 不写入缓存、也不回放给浏览器的响应头
+_DROP_HEADERS = {
+    "content-encoding",
+    "content-length",
+    "transfer-encoding",
+    "connection",
+    "keep-alive",
+    "set-cookie",
+}
+
+# 没有显式过期信息时，按 (Date - Last-Modified) 的10%估算新鲜期，最多一天
+_HEURISTIC_MAX_AGE = 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    url TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    expires_at REAL NOT NULL,
+    size INTEGER NOT NULL,
+    fetch_ms REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_entries_access ON entries (last_access);
+CREATE INDEX IF NOT EXISTS idx_entries_digest ON entries (digest);
+"""
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    digest: str
+    status: int
+    headers: Dict[str, str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    expires_at: float
+    size: int
+    fetch_ms: float
+
+    def is_fresh(self, now: float = None) -> bool:
+        return (now or time.time()) < self.expires_at
+
+    @property
+    def can_revalidate(self) -> bool:
+        return bool(self.etag or self.last_modified)
+
+
+@dataclass
+class AssetCacheStats:
+    """单个页面的缓存命中统计"""
+
+    hits: int = 0
+    revalidated: int = 0
+    misses: int = 0
+    stored: int = 0
+    bytes_served: int = 0
+    # 命中时按该资源首次下载耗时估算节省的网络时间
+    saved_ms: float = 0.0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def _freshness_lifetime(headers: Dict[str, str], now: float) -> Optional[float]:
+    """
+    根据响应头计算新鲜期（秒）
+
+    :return: None表示不可缓存（no-store/private）
+    """
+    cache_control = headers.get("cache-control", "").lower()
+    directives = {}
+    for part in cache_control.split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            directives[name] = value.strip('"')
+    if "no-store" in directives or "private" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0.0
+    for name in ("s-maxage", "max-age"):
+        if directives.get(name, "").isdigit():
+            return float(directives[name])
+    date = _parse_http_date(headers.get("date")) or now
+    expires = headers.get("expires")
+    if expires:
+        expires_at = _parse_http_date(expires)
+        return max(0.0, expires_at - date) if expires_at else 0.0
+    last_modified = _parse_http_date(headers.get("last-modified"))
+    if last_modified:
+        return min(max(0.0, (date - last_modified) * 0.1), _HEURISTIC_MAX_AGE)
+    return 0.0
+
+
+def _parse_http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class AssetCache:
+    """
+    本机共享的静态资源磁盘缓存
+
+    SQLite以WAL模式打开，多个进程可同时读写；资源文件先写临时文件再原子替换。
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path = None,
+        max_bytes: int = None,
+        max_entry_bytes: int = None,
+        resource_types=None,
+    ):
+        self.cache_dir = Path(cache_dir or settings.ASSET_CACHE_DIR)
+        self.max_bytes = max_bytes or settings.ASSET_CACHE_MAX_BYTES
+        self.max_entry_bytes = max_entry_bytes or settings.ASSET_CACHE_MAX_ENTRY_BYTES
+        self.resource_types = frozenset(
+            resource_types or settings.ASSET_CACHE_RESOURCE_TYPES
+        )
+        self.blob_dir = self.cache_dir / "blobs"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            str(self.cache_dir / "index.db"), timeout=30, check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.blob_dir / digest[:2] / digest
+
+    def lookup(self, url: str) -> Optional[CacheEntry]:
+        """按URL查找缓存条目"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url, digest, status, headers, etag, last_modified, "
+                "expires_at, size, fetch_ms FROM entries WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        return CacheEntry(
+            url=row[0],
+            digest=row[1],
+            status=row[2],
+            headers=json.loads(row[3]),
+            etag=row[4],
+            last_modified=row[5],
+            expires_at=row[6],
+            size=row[7],
+            fetch_ms=row[8],
+        )
+
+    def read(self, entry: CacheEntry) -> Optional[bytes]:
+        """读取条目内容并刷新访问时间，文件已被淘汰时返回None"""
+        try:
+            body = self._blob_path(entry.digest).read_bytes()
+        except FileNotFoundError:
+            self.delete(entry.url)
+            return None
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE entries SET last_access = ? WHERE url = ?",
+                (time.time(), entry.url),
+            )
+        return body
+
+    def touch(self, entry: CacheEntry, headers: Dict[str, str]) -> None:
+        """304重新验证成功后更新过期时间"""
+        now = time.time()
+        lifetime = _freshness_lifetime(headers, now) or 0.0
+        entry.expires_at = now + lifetime
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE entries SET expires_at = ?, last_access = ? WHERE url = ?",
+                (entry.expires_at, now, entry.url),
+            )
+
+    def store(
+        self,
+        url: str,
+        status: int,
+        headers: Dict[str, str],
+        body: bytes,
+        fetch_ms: float,
+    ) -> Optional[CacheEntry]:
+        """
+        写入缓存，不可缓存的响应返回None
+
+        :param headers: 响应头（小写键）
+        """
+        if status != 200 or len(body) > self.max_entry_bytes:
+            return None
+        now = time.time()
+        lifetime = _freshness_lifetime(headers, now)
+        etag = headers.get("etag")
+        last_modified = headers.get("last-modified")
+        # 既不新鲜又无法重新验证的响应缓存了也用不上
+        if lifetime is None or (lifetime <= 0 and not (etag or last_modified)):
+            return None
+
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._blob_path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=str(path.parent))
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+            os.replace(tmp, path)
+
+        kept = {k: v for k, v in headers.items() if k not in _DROP_HEADERS}
+        entry = CacheEntry(
+            url=url,
+            digest=digest,
+            status=status,
+            headers=kept,
+            etag=etag,
+            last_modified=last_modified,
+            expires_at=now + lifetime,
+            size=len(body),
+            fetch_ms=fetch_ms,
+        )
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    digest,
+                    status,
+                    json.dumps(kept),
+                    etag,
+                    last_modified,
+                    entry.expires_at,
+                    entry.size,
+                    fetch_ms,
+                    now,
+                ),
+            )
+        self._evict_if_needed()
+        return entry
+
+    def delete(self, url: str) -> None:
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM entries WHERE url = ?", (url,))
+
+    def total_bytes(self) -> int:
+        """缓存中不重复内容的总字节数"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM "
+                "(SELECT size FROM entries GROUP BY digest)"
+            ).fetchone()
+        return row[0]
+
+    def _evict_if_needed(self) -> None:
+        """总容量超限时按最近访问时间淘汰到上限的90%"""
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        evicted = 0
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT url, digest, size FROM entries ORDER BY last_access"
+            ).fetchall()
+            for url, digest, size in rows:
+                if total <= target:
+                    break
+                with self._db:
+                    self._db.execute("DELETE FROM entries WHERE url = ?", (url,))
+                    still_used = self._db.execute(
+                        "SELECT 1 FROM entries WHERE digest = ? LIMIT 1", (digest,)
+                    ).fetchone()
+                if not still_used:
+                    try:
+                        self._blob_path(digest).unlink()
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+                evicted += 1
+        logger.info(f"资源缓存淘汰 {evicted} 条, 当前约 {total} 字节")
+
+    def attach(self, page: Page) -> "AssetCacheSession":
+        """创建挂载到单个页面的缓存会话"""
+        return AssetCacheSession(self, page)
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+class AssetCacheSession:
+    """
+    单个页面上的缓存路由处理器
+
+    需在RequestFilter之前注册：Playwright按注册顺序的逆序调用路由处理器，
+    被拦截器放行（route.fallback）的请求才会进入缓存。
+    """
+
+    def __init__(self, cache: AssetCache, page: Page):
+        self.cache = cache
+        self.page = page
+        self.stats = AssetCacheStats()
+
+    async def install(self) -> "AssetCacheSession":
+        await self.page.route("**/*", self._handle)
+        return self
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, func, *args)
+
+    async def _handle(self, route: Route) -> None:
+        request = route.request
+        if (
+            request.method != "GET"
+            or request.resource_type not in self.cache.resource_types
+            or not re.match(r"^https?://", request.url)
+        ):
+            await route.fallback()
+            return
+
+        url = request.url
+        entry = await self._run(self.cache.lookup, url)
+        if entry is not None and entry.is_fresh():
+            body = await self._run(self.cache.read, entry)
+            if body is not None:
+                self._record_hit(entry, len(body))
+                await route.fulfill(
+                    status=entry.status, headers=entry.headers, body=body
+                )
+                return
+            entry = None
+
+        headers = dict(request.headers)
+        if entry is not None and entry.can_revalidate:
+            if entry.etag:
+                headers["if-none-match"] = entry.etag
+            if entry.last_modified:
+                headers["if-modified-since"] = entry.last_modified
+
+        start = time.monotonic()
+        try:
+            response = await route.fetch(headers=headers)
+        except Exception as e:
+            logger.debug(f"资源缓存回源失败，交由浏览器直接请求: {url} {e}")
+            await route.fallback()
+            return
+        fetch_ms = (time.monotonic() - start) * 1000
+
+        if entry is not None and response.status == 304:
+            body = await self._run(self.cache.read, entry)
+            if body is not None:
+                await self._run(self.cache.touch, entry, response.headers)
+                self.stats.revalidated += 1
+                self.stats.bytes_served += len(body)
+                count_asset_cache("revalidated", len(body))
+                await route.fulfill(
+                    status=entry.status, headers=entry.headers, body=body
+                )
+                return
+            # 缓存文件已被其他进程淘汰，重新完整请求
+            response = await route.fetch(headers=dict(request.headers))
+
+        body = await response.body()
+        self.stats.misses += 1
+        count_asset_cache("miss")
+        stored = await self._run(
+            self.cache.store, url, response.status, response.headers, body, fetch_ms
+        )
+        if stored is not None:
+            self.stats.stored += 1
+        await route.fulfill(
+            status=response.status,
+            headers={
+                k: v for k, v in response.headers.items() if k not in _DROP_HEADERS
+            },
+            body=body,
+        )
+
+    def _record_hit(self, entry: CacheEntry, size: int) -> None:
+        self.stats.hits += 1
+        self.stats.bytes_served += size
+        self.stats.saved_ms += entry.fetch_ms
+        count_asset_cache("hit", size, entry.fetch_ms / 1000)
+
+
+_cache: Optional[AssetCache] = None
+_cache_pid: Optional[int] = None
+
+
+def get_asset_cache() -> AssetCache:
+    """获取当前进程的资源缓存实例（SQLite连接不能跨fork复用）"""
+    global _cache, _cache_pid
+    if _cache is None or _cache_pid != os.getpid():
+        _cache = AssetCache()
+        _cache_pid = os.getpid()
+    return _cache
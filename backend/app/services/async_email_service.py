@@ -0,0 +1,199 @@
+"""
+异步邮件服务模块
+
+基于aiosmtplib的EmailService异步版本，供运行在事件循环上的渲染流程使用：
+邮件上传期间不占用worker线程，渲染和投递可以在同一个worker内并行。
+参数校验和错误语义与EmailService一致。
+配置EMAIL_ASYNC_ENABLED后，投递任务通过worker的异步运行时（app.core.runtime）使用本服务。
+"""
+
+import asyncio
+import logging
+import ssl
+from typing import List, Optional, Union
+
+from app.core.config import settings
+from app.core.metrics import stage
+
+from .email_service import BaseEmailService, EmailConfig, OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+
+def _import_aiosmtplib():
+    try:
+        import aiosmtplib
+    except ImportError:
+        raise RuntimeError("异步邮件服务需要安装aiosmtplib: pip install aiosmtplib")
+    return aiosmtplib
+
+
+class AsyncEmailService(BaseEmailService):
+    """异步邮件服务类"""
+
+    def __init__(
+        self,
+        config: EmailConfig,
+        max_concurrency: int = None,
+        tls_context: Optional[ssl.SSLContext] = None,
+    ):
+        """
+        Args:
+            config: 邮件配置
+            max_concurrency: send_many同时使用的SMTP会话数上限
+            tls_context: 可选，自定义TLS上下文（如信任自签名证书）
+        """
+        self._smtp = _import_aiosmtplib()
+        super().__init__(config)
+        self.max_concurrency = max(
+            1, max_concurrency or settings.EMAIL_ASYNC_MAX_CONCURRENCY
+        )
+        self.timeout = settings.SMTP_TIMEOUT
+        self.tls_context = tls_context
+
+    async def send_email(
+        self,
+        to_email: Union[str, List[str]],
+        subject: str,
+        body: str,
+        attachments: Optional[List[str]] = None,
+        body_type: str = "plain",
+    ) -> bool:
+        """
+        发送邮件
+
+        Args:
+            to_email: 收件人邮箱（单个字符串或列表）
+            subject: 邮件主题
+            body: 邮件正文
+            attachments: 附件文件路径或产物URI列表
+            body_type: 邮件正文类型（plain或html）
+
+        Returns:
+            bool: 发送是否成功
+
+        Raises:
+            ValueError: 收件人邮箱格式无效或主题为空
+            FileNotFoundError: 附件文件不存在
+            RuntimeError: 发送失败
+        """
+        email = OutgoingEmail(to_email, subject, body, attachments, body_type)
+        self._validate(email)
+
+        try:
+            smtp = await self._open()
+            try:
+                await self._deliver(smtp, email)
+            finally:
+                await self._quit(smtp)
+            logger.info("邮件发送成功")
+            return True
+        except self._smtp.SMTPResponseException as e:
+            error_msg = f"SMTP错误: {e.code} - {e.message}"
+            logger.error(error_msg)
+            raise RuntimeError(error_msg)
+        except Exception as e:
+            error_msg = f"发送邮件失败: {str(e)}"
+            logger.error(error_msg)
+            raise RuntimeError(error_msg)
+
+    async def send_many(
+        self, emails: List[Union[OutgoingEmail, dict]]
+    ) -> List[Union[bool, Exception]]:
+        """
+        并发发送多封邮件：最多max_concurrency个SMTP会话，每个会话依次发送分到的邮件
+
+        Args:
+            emails: 待发送邮件列表，元素为OutgoingEmail或同名字段的字典
+
+        Returns:
+            List: 与输入顺序一致的结果，成功为True，失败为对应的异常
+                （参数错误为ValueError/FileNotFoundError，发送失败为RuntimeError）
+        """
+        emails = [
+            e if isinstance(e, OutgoingEmail) else OutgoingEmail(**e) for e in emails
+        ]
+        results: List[Union[bool, Exception]] = [None] * len(emails)
+        queue: asyncio.Queue = asyncio.Queue()
+        for index, email in enumerate(emails):
+            try:
+                self._validate(email)
+            except (ValueError, FileNotFoundError) as e:
+                results[index] = e
+                continue
+            queue.put_nowait(index)
+
+        async def worker():
+            smtp = None
+            try:
+                while not queue.empty():
+                    index = queue.get_nowait()
+                    for attempt in range(2):
+                        try:
+                            if smtp is None:
+                                smtp = await self._open()
+                            await self._deliver(smtp, emails[index])
+                            results[index] = True
+                            break
+                        except self._smtp.SMTPServerDisconnected as e:
+                            # 会话被服务端断开：换新会话重试一次
+                            smtp = None
+                            if attempt:
+                                results[index] = RuntimeError(f"发送邮件失败: {str(e)}")
+                        except Exception as e:
+                            results[index] = RuntimeError(f"发送邮件失败: {str(e)}")
+                            if smtp is not None and not smtp.is_connected:
+                                smtp = None
+                            break
+            finally:
+                if smtp is not None:
+                    await self._quit(smtp)
+
+        workers = min(self.max_concurrency, queue.qsize())
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        sent = sum(1 for r in results if r is True)
+        logger.info(f"批量发送完成: 成功 {sent}/{len(emails)}")
+        return results
+
+    async def _open(self):
+        """
+        建立SMTP会话并登录：465端口直接TLS，其他端口必须STARTTLS
+        （与EmailService一致，服务器不支持时报错，不以明文发送密码）
+        """
+        use_tls = self.config.smtp_port == 465
+        smtp = self._smtp.SMTP(
+            hostname=self.config.smtp_server,
+            port=self.config.smtp_port,
+            use_tls=use_tls,
+            start_tls=not use_tls,
+            tls_context=self.tls_context,
+            timeout=self.timeout,
+        )
+        async with stage("smtp_connect"):
+            await smtp.connect()
+        try:
+            async with stage("smtp_login"):
+                await smtp.login(self.config.smtp_user, self.config.smtp_password)
+        except Exception:
+            smtp.close()
+            raise
+        logger.info("SMTP登录成功")
+        return smtp
+
+    async def _quit(self, smtp) -> None:
+        try:
+            await smtp.quit()
+        except Exception:
+            # QUIT阶段的异常不影响已发送的邮件
+            smtp.close()
+
+    async def _deliver(self, smtp, email: OutgoingEmail) -> None:
+        # 读取附件（可能来自对象存储）和序列化放到线程中，不阻塞事件循环
+        loop = asyncio.get_running_loop()
+        msg = await loop.run_in_executor(None, self._build_message, email)
+        async with stage("smtp_send"):
+            await smtp.send_message(
+                msg,
+                sender=email.sender or self.config.sender_email,
+                recipients=email.to_list,
+            )
@@ -0,0 +1,300 @@
+"""
+浏览器池模块，在单个worker进程内维护常驻的Chromium实例
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+
+from app.core.config import settings
+from app.core.metrics import stage
+from playwright.async_api import Browser, Page, async_playwright
+
+logger = logging.getLogger(__name__)
+
+
+class _BrowserSlot:
+    """浏览器池中的一个槽位，持有一个已启动的浏览器及其使用统计"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.browser: Optional[Browser] = None
+        self.pages_served = 0
+        self.active = 0
+        self.crashed = False
+        self.recycling = False
+        self.launched_at = 0.0
+
+    @property
+    def is_healthy(self) -> bool:
+        return (
+            self.browser is not None
+            and not self.crashed
+            and self.browser.is_connected()
+        )
+
+
+class BrowserPool:
+    """
+    常驻Chromium浏览器池
+
+    每个槽位持有一个长期存活的浏览器，每次渲染借用时新建一个隔离的
+    BrowserContext，用完即关闭。浏览器在服务满指定页数或崩溃后自动重启。
+    池对象绑定在创建它的事件循环上，不可跨事件循环使用。
+    """
+
+    def __init__(
+        self,
+        size: int = None,
+        max_pages_per_browser: int = None,
+        max_contexts_per_browser: int = None,
+        health_check_interval: float = None,
+        launch_options: Optional[dict] = None,
+    ):
+        self.size = max(1, size or settings.BROWSER_POOL_SIZE)
+        self.max_pages_per_browser = (
+            max_pages_per_browser or settings.BROWSER_RECYCLE_AFTER_PAGES
+        )
+        self.max_contexts_per_browser = max(
+            1, max_contexts_per_browser or settings.BROWSER_MAX_PAGES_PER_BROWSER
+        )
+        self.health_check_interval = (
+            settings.BROWSER_HEALTH_CHECK_INTERVAL
+            if health_check_interval is None
+            else health_check_interval
+        )
+        self.launch_options = launch_options or {}
+        self._slots: List[_BrowserSlot] = [_BrowserSlot(i) for i in range(self.size)]
+        self._playwright = None
+        self._cond: Optional[asyncio.Condition] = None
+        self._start_task: Optional[asyncio.Future] = None
+        self._started = False
+        self._closed = False
+        self._last_health_check = 0.0
+
+    async def start(self) -> "BrowserPool":
+        """
+        启动Playwright驱动并预热所有浏览器
+
+        并发调用共享同一个启动任务，只启动一个驱动，每个槽位只启动一次浏览器
+        """
+        if self._started:
+            return self
+        if self._start_task is None:
+            # 在第一个await之前创建，后到的调用者都等待这个任务
+            self._start_task = asyncio.ensure_future(self._start())
+        # 某个调用者被取消时不影响其他调用者共享的启动任务
+        await asyncio.shield(self._start_task)
+        return self
+
+    async def _start(self) -> None:
+        self._cond = asyncio.Condition()
+        try:
+            self._playwright = await async_playwright().start()
+            await asyncio.gather(*(self._launch(slot) for slot in self._slots))
+        except BaseException:
+            # 启动失败时清理已启动的部分，下次借用重新启动
+            self._start_task = None
+            for slot in self._slots:
+                if slot.browser is not None:
+                    try:
+                        await slot.browser.close()
+                    except Exception:
+                        pass
+                    slot.browser = None
+            if self._playwright is not None:
+                try:
+                    await self._playwright.stop()
+                except Exception:
+                    pass
+                self._playwright = None
+            raise
+        self._started = True
+        self._last_health_check = time.monotonic()
+        logger.info(f"浏览器池已启动: 大小={self.size}")
+
+    async def _launch(self, slot: _BrowserSlot) -> None:
+        """为槽位启动一个新的浏览器"""
+        with stage("browser_launch"):
+            browser = await self._playwright.chromium.launch(**self.launch_options)
+        browser.on("disconnected", lambda b: self._mark_crashed(slot, b))
+        slot.browser = browser
+        slot.pages_served = 0
+        slot.crashed = False
+        slot.launched_at = time.monotonic()
+
+    def _mark_crashed(self, slot: _BrowserSlot, browser: Browser) -> None:
+        # 主动关闭（重启或关池）时槽位已不再指向该浏览器
+        if slot.browser is not browser or self._closed:
+            return
+        logger.warning(f"浏览器[{slot.index}]连接断开，将在下次借用前重启")
+        slot.crashed = True
+
+    async def _recycle(self, slot: _BrowserSlot) -> None:
+        """关闭并重启槽位上的浏览器"""
+        old = slot.browser
+        slot.browser = None
+        if old is not None:
+            try:
+                await old.close()
+            except Exception as e:
+                logger.debug(f"关闭浏览器[{slot.index}]时出错: {e}")
+        await self._launch(slot)
+        logger.info(f"浏览器[{slot.index}]已重启")
+
+    def _pick_slot(self) -> Optional[_BrowserSlot]:
+        """选择负载最低且仍有空闲上下文配额的槽位"""
+        candidates = [
+            s
+            for s in self._slots
+            if not s.recycling and s.active < self.max_contexts_per_browser
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda s: s.active)
+
+    async def _recycle_reserved(self, slot: _BrowserSlot) -> None:
+        """重启已标记为recycling的槽位，完成后重新开放借用"""
+        try:
+            await self._recycle(slot)
+        except Exception as e:
+            slot.crashed = True
+            logger.error(f"浏览器[{slot.index}]重启失败: {e}")
+            raise
+        finally:
+            async with self._cond:
+                slot.recycling = False
+                self._cond.notify_all()
+
+    async def _acquire(self) -> _BrowserSlot:
+        if self._closed:
+            raise RuntimeError("浏览器池已关闭")
+        if not self._started:
+            await self.start()
+        if time.monotonic() - self._last_health_check > self.health_check_interval:
+            await self.health_check()
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._pick_slot() is not None)
+            slot = self._pick_slot()
+            slot.active += 1
+            # 只有独占时才能重启，其余借用者会在归还时触发重启
+            relaunch = not slot.is_healthy and slot.active == 1
+            if relaunch:
+                slot.recycling = True
+        if relaunch:
+            try:
+                await self._recycle_reserved(slot)
+            except Exception:
+                await self._release(slot)
+                raise
+        return slot
+
+    async def _release(self, slot: _BrowserSlot) -> None:
+        async with self._cond:
+            slot.active -= 1
+            # 只有没有其他借用者时才重启，避免打断正在渲染的页面
+            needs_recycle = (
+                not self._closed
+                and slot.active == 0
+                and not slot.recycling
+                and (
+                    not slot.is_healthy
+                    or slot.pages_served >= self.max_pages_per_browser
+                )
+            )
+            if needs_recycle:
+                slot.recycling = True
+            self._cond.notify_all()
+        if needs_recycle:
+            try:
+                await self._recycle_reserved(slot)
+            except Exception:
+                pass
+
+    @asynccontextmanager
+    async def new_page(self, **context_options) -> AsyncIterator[Page]:
+        """
+        从池中借用浏览器，在新的隔离上下文中打开页面
+
+        :param context_options: 透传给browser.new_context的参数
+        """
+        with stage("browser_acquire"):
+            slot = await self._acquire()
+        context = None
+        try:
+            context = await slot.browser.new_context(**context_options)
+            page = await context.new_page()
+            yield page
+        finally:
+            slot.pages_served += 1
+            if context is not None:
+                try:
+                    await context.close()
+                except Exception as e:
+                    logger.debug(f"关闭浏览器上下文失败: {e}")
+            await self._release(slot)
+
+    async def health_check(self) -> int:
+        """
+        检查所有空闲浏览器的健康状况，重启失联的实例
+
+        :return: 本次重启的浏览器数量
+        """
+        self._last_health_check = time.monotonic()
+        relaunched = 0
+        for slot in self._slots:
+            async with self._cond:
+                # 正在被使用的槽位由借用者归还时处理
+                if slot.is_healthy or slot.active or slot.recycling:
+                    continue
+                slot.recycling = True
+            try:
+                await self._recycle_reserved(slot)
+                relaunched += 1
+            except Exception:
+                pass
+        return relaunched
+
+    async def close(self) -> None:
+        """关闭所有浏览器和Playwright驱动"""
+        if self._closed:
+            return
+        self._closed = True
+        for slot in self._slots:
+            if slot.browser is not None:
+                try:
+                    await slot.browser.close()
+                except Exception:
+                    pass
+                slot.browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+        logger.info("浏览器池已关闭")
+
+
+_pool: Optional[BrowserPool] = None
+_pool_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+async def get_browser_pool() -> BrowserPool:
+    """获取当前事件循环上的进程级浏览器池，首次调用时创建并预热"""
+    global _pool, _pool_loop
+    loop = asyncio.get_running_loop()
+    if _pool is None or _pool_loop is not loop or _pool._closed:
+        _pool = BrowserPool()
+        _pool_loop = loop
+    # 池对象先发布再启动，并发的首批调用者等待同一个启动任务
+    pool = _pool
+    await pool.start()
+    return pool
+
+
+async def close_browser_pool() -> None:
+    """关闭进程级浏览器池"""
+    global _pool, _pool_loop
+    if _pool is not None:
+        pool, _pool, _pool_loop = _pool, None, None
+        await pool.close()
@@ -2,89 +2,718 @@
 文档服务模块，提供文档格式转换和保存功能
 """
 
+import logging
 import os
 import re
-from typing import List, Optional, Tuple
-
-from bs4 import BeautifulSoup, NavigableString, Tag
+from html.parser import HTMLParser
+from io import BytesIO
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import stage
+from bs4 import BeautifulSoup, CData, NavigableString, Tag
+from bs4.dammit import EntitySubstitution
 from docx import Document
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
-from docx.shared import Pt, RGBColor
+from docx.shared import Emu, Pt, RGBColor
+
+from .docx_stream import StreamingDocxWriter, TableCell, append_table
+from .image_pipeline import EmbeddedImage, prepare_images
+from .text_normalizer import clean_many
+from .text_normalizer import clean_text as _clean_text
+
+logger = logging.getLogger(__name__)
+
+
+class Block(NamedTuple):
+    """提取出的一段结构化文本"""
+
+    text: str
+    tag: str
+    class_name: str
+    # 列表、表格结尾块附带的结构：列表为ListItem元组，表格为各行TableCell元组的元组
+    data: Optional[tuple] = None
+
+
+class ListItem(NamedTuple):
+    """列表中的一项，嵌套列表展开后按文档顺序排列"""
+
+    # 嵌套层级，最外层为0
+    level: int
+    # 带编号或项目符号的文本，不含嵌套列表的内容
+    text: str
+
+
+_NEWLINE = Block("\n", "", "")
+_SKIP_TAGS = frozenset(["script", "style", "meta", "link"])
+_BLOCK_TAGS = frozenset(["p", "div", "h1", "h2", "h3", "h4", "h5", "h6"])
+_TABLE_SECTION_TAGS = frozenset(["thead", "tbody", "tfoot"])
+# get_text()包含的字符串类型（script、style等的内容是其子类，不包含）
+_TEXT_STRING_TYPES = (NavigableString, CData)
+# colspan/rowspan取属性值开头的数字
+_SPAN_RE = re.compile(r"\s*(\d+)")
+
+
+class _ListNode:
+    """列表（ul/ol）：segments按顺序为其中的文本和列表项"""
+
+    __slots__ = ("ordered", "segments")
+
+    def __init__(self, ordered: bool):
+        self.ordered = ordered
+        self.segments: list = []
+
+
+class _ItemNode:
+    """列表项（列表的直接子li）：segments按顺序为其中的文本和嵌套列表"""
+
+    __slots__ = ("segments",)
+
+    def __init__(self):
+        self.segments: list = []
+
+
+def _flatten(node) -> str:
+    """节点的全部文本，与对应元素的get_text()一致"""
+    parts = []
+    stack = [iter(node.segments)]
+    while stack:
+        for segment in stack[-1]:
+            if isinstance(segment, str):
+                parts.append(segment)
+            else:
+                stack.append(iter(segment.segments))
+                break
+        else:
+            stack.pop()
+    return "".join(parts)
+
+
+def _list_items(root: _ListNode) -> Tuple[ListItem, ...]:
+    """按文档顺序展开嵌套列表，项目自身的文本为空时省略（其嵌套列表保留）"""
+    entries = []
+    # [片段迭代器, 是否有序, 层级, 已遇到的项目数]
+    stack = [[iter(root.segments), root.ordered, 0, 0]]
+    while stack:
+        frame = stack[-1]
+        for segment in frame[0]:
+            if isinstance(segment, _ItemNode):
+                frame[3] += 1
+                prefix = f"{frame[3]}. " if frame[1] else "• "
+                own = "".join(p for p in segment.segments if isinstance(p, str))
+                entries.append((frame[2], prefix, own))
+                nested = [p for p in segment.segments if isinstance(p, _ListNode)]
+                for child in reversed(nested):
+                    stack.append([iter(child.segments), child.ordered, frame[2] + 1, 0])
+                break
+        else:
+            stack.pop()
+    texts = clean_many(own for _, _, own in entries)
+    return tuple(
+        ListItem(level, f"{prefix}{text}")
+        for (level, prefix, _), text in zip(entries, texts)
+        if text
+    )
+
+
+def _list_blocks(root: _ListNode, class_name: str) -> List[Block]:
+    """列表的文本块：每个直接子项一块（含嵌套内容），结尾块附带展开的列表项"""
+    blocks = []
+    items = [segment for segment in root.segments if isinstance(segment, _ItemNode)]
+    for i, text in enumerate(clean_many(_flatten(item) for item in items)):
+        prefix = f"{i+1}. " if root.ordered else "• "
+        if text:
+            blocks.append(Block(f"{prefix}{text}", "li", class_name))
+    blocks.append(Block("\n", "ulol", class_name, _list_items(root)))
+    return blocks
 
 
-def _clean_text(text: str) -> str:
-    """清理文本内容，保留换行符，处理特殊字符和多余空白"""
-    # 先替换多余的空格，但保留换行符
-    text = re.sub(r"[ \t\u3000]+", " ", text)  # 只替换空格和制表符，不动\n
-    # 清理特殊字符但保留中文、英文、标点和换行
-    text = re.sub(r'[^\w\s\u4e00-\u9fff,.?!，。？！、:：;；""' "()（）\n-]", "", text)
-    # 去除每行首尾空白
-    text = "\n".join(line.strip() for line in text.splitlines())
-    return text.strip()
+def _list_tree(elem: Tag) -> _ListNode:
+    """
+    构建列表的结构：列表的直接子li为列表项，列表项内部（不在更深的
+    嵌套列表中）的ul/ol为嵌套列表，其余元素只贡献文本
+    """
+    root = owner = _ListNode(elem.name == "ol")
+    # (子节点迭代器, 元素对应的结构节点, 进入前的owner)
+    stack = [(iter(elem.contents), root, root)]
+    while stack:
+        children, node, _ = stack[-1]
+        for child in children:
+            if isinstance(child, Tag):
+                child_node = None
+                if child.name == "li" and isinstance(node, _ListNode):
+                    child_node = _ItemNode()
+                elif child.name in ("ul", "ol") and isinstance(owner, _ItemNode):
+                    child_node = _ListNode(child.name == "ol")
+                stack.append((iter(child.contents), child_node, owner))
+                if child_node is not None:
+                    owner.segments.append(child_node)
+                    owner = child_node
+                break
+            if type(child) in _TEXT_STRING_TYPES:
+                owner.segments.append(str(child))
+        else:
+            _, node, previous = stack.pop()
+            if node is not None:
+                owner = previous
+    return root
+
+
+def _span(value: Optional[str], maximum: int) -> int:
+    """colspan/rowspan属性值，无效时为1"""
+    match = _SPAN_RE.match(value or "")
+    if match is None:
+        return 1
+    return min(int(match.group(1)), maximum)
+
+
+def _table_cell(text: str, tag: str, colspan, rowspan) -> TableCell:
+    """colspan为0时按1处理；rowspan为0表示合并到表格末尾（上限与浏览器一致）"""
+    return TableCell(
+        text, max(1, _span(colspan, 1000)), _span(rowspan, 65534), tag == "th"
+    )
+
+
+def _table_rows(table: Tag) -> Iterator[Tag]:
+    """表格的行：直接子tr及thead/tbody/tfoot的直接子tr"""
+    for child in table.children:
+        if not isinstance(child, Tag):
+            continue
+        if child.name == "tr":
+            yield child
+        elif child.name in _TABLE_SECTION_TAGS:
+            yield from child.find_all("tr", recursive=False)
 
 
-def _extract_text_with_structure(elem: Tag) -> List[Tuple[str, str, str]]:
+def _atomic_blocks(elem, images: bool = False) -> Optional[List[Block]]:
     """
-    提取HTML元素中的文本，并保持结构
-    返回格式：List of (text, tag_name, class_name)
+    不需要继续向下遍历的节点直接给出其文本块；普通容器元素返回None
+    images为True时图片产出tag为img、文本为src（懒加载图片取data-src）的块
     """
-    results = []
-
     if isinstance(elem, NavigableString):
         text = _clean_text(str(elem))
-        if text:
-            results.append((text, "", ""))
-        return results
+        return [Block(text, "", "")] if text else []
 
-    if elem.name in ["script", "style", "meta", "link"]:
-        return results
+    if elem.name in _SKIP_TAGS:
+        return []
 
     # 处理特殊标签
     if elem.name == "br":
-        results.append(("\n", "br", ""))
-        return results
+        return [Block("\n", "br", "")]
 
-    # 获取元素的class
-    class_name = " ".join(elem.get("class", []))
+    if elem.name == "img":
+        src = elem.get("src") or elem.get("data-src")
+        return [Block(src, "img", "")] if images and src else []
 
     # 处理列表
-    if elem.name in ["ul", "ol"]:
-        for i, li in enumerate(elem.find_all("li", recursive=False)):
-            prefix = f"{i+1}. " if elem.name == "ol" else "• "
-            text = _clean_text(li.get_text())
-            if text:
-                results.append((f"{prefix}{text}", "li", class_name))
-        results.append(("\n", "ulol", class_name))
-        return results
+    if elem.name in ("ul", "ol"):
+        return _list_blocks(_list_tree(elem), " ".join(elem.get("class", [])))
 
     # 处理表格
     if elem.name == "table":
-        for row in elem.find_all("tr", recursive=False):
-            cells = []
-            for cell in row.find_all(["td", "th"], recursive=False):
-                cells.append(_clean_text(cell.get_text()))
-            if cells:
-                results.append((" | ".join(cells), "table", class_name))
-        results.append(("\n", "table", ""))
-        return results
-
-    # 递归处理子元素
-    for child in elem.children:
-        if isinstance(child, (Tag, NavigableString)):
-            results.extend(_extract_text_with_structure(child))
-
-    # 为块级元素添加换行
-    if elem.name in ["p", "div", "h1", "h2", "h3", "h4", "h5", "h6"]:
-        if results and not results[-1][0].endswith("\n"):
-            results.append(("\n", "", ""))
-        if results and not results[0][0].startswith("\n"):
-            results.insert(0, ("\n", "", ""))
-
-    return results
+        class_name = " ".join(elem.get("class", []))
+        blocks = []
+        rows = []
+        for row in _table_rows(elem):
+            cells = row.find_all(["td", "th"], recursive=False)
+            texts = clean_many(cell.get_text() for cell in cells)
+            if texts:
+                blocks.append(Block(" | ".join(texts), "table", class_name))
+                rows.append(
+                    tuple(
+                        _table_cell(
+                            text, cell.name, cell.get("colspan"), cell.get("rowspan")
+                        )
+                        for text, cell in zip(texts, cells)
+                    )
+                )
+        blocks.append(Block("\n", "table", "", tuple(rows)))
+        return blocks
+
+    return None
+
+
+class _BlockWriter:
+    """
+    收集文本块并处理块级元素前后的换行
+
+    进入块级元素时先记为待定，等其第一段内容产出时再决定是否补前导换行，
+    因此不需要在结果开头插入；离开时若其中产出过内容且末尾不是换行则补一个。
+    """
+
+    def __init__(self):
+        self.out: List[Block] = []
+        # 已产出的块数、最后产出的文本、尚未产出内容的块级元素数
+        self.emitted = 0
+        self.last_text = ""
+        self.pending = 0
+
+    def write(self, block: Block) -> None:
+        if self.pending and not block.text.startswith("\n"):
+            self.out.append(_NEWLINE)
+            self.emitted += 1
+        self.pending = 0
+        self.out.append(block)
+        self.emitted += 1
+        self.last_text = block.text
+
+    def enter_block(self) -> int:
+        """进入块级元素，返回进入时的已产出块数"""
+        self.pending += 1
+        return self.emitted
+
+    def leave_block(self, entered_at: int) -> None:
+        if self.emitted == entered_at:
+            self.pending -= 1
+        elif not self.last_text.endswith("\n"):
+            self.out.append(_NEWLINE)
+            self.emitted += 1
+            self.last_text = "\n"
+
+    def drain(self) -> List[Block]:
+        """取出目前已产出的块"""
+        out, self.out = self.out, []
+        return out
+
+
+def iter_blocks(root: Tag, images: bool = False) -> Iterator[Block]:
+    """
+    单次遍历HTML元素，按文档顺序逐个产出结构化文本块。
+
+    使用显式栈代替递归，栈深度等于DOM深度而不受Python递归上限约束，
+    每个节点只访问一次。块级元素（p、div、h1-h6）的内容前后补换行。
+    images为True时同时产出图片块（列表和表格中的图片不产出）。
+    """
+    writer = _BlockWriter()
+    # (是否块级元素, 进入时的已产出块数, 子节点迭代器)
+    stack: List[Tuple[bool, int, Iterator]] = []
+    node = root
+    while True:
+        blocks = _atomic_blocks(node, images)
+        if blocks is None:
+            is_block = node.name in _BLOCK_TAGS
+            entered_at = writer.enter_block() if is_block else 0
+            stack.append((is_block, entered_at, iter(node.contents)))
+        else:
+            for block in blocks:
+                writer.write(block)
+
+        # 找到下一个待访问的节点，沿途结束已遍历完的元素
+        node = None
+        while stack:
+            is_block, entered_at, children = stack[-1]
+            for child in children:
+                if isinstance(child, (Tag, NavigableString)):
+                    node = child
+                    break
+            if node is not None:
+                break
+            stack.pop()
+            if is_block:
+                writer.leave_block(entered_at)
+        if writer.out:
+            yield from writer.drain()
+        if node is None:
+            return
+
+
+# html.parser模式下BeautifulSoup会立即闭合的空元素
+_VOID_TAGS = frozenset(
+    [
+        "area",
+        "base",
+        "basefont",
+        "bgsound",
+        "br",
+        "col",
+        "command",
+        "embed",
+        "frame",
+        "hr",
+        "image",
+        "img",
+        "input",
+        "isindex",
+        "keygen",
+        "link",
+        "menuitem",
+        "meta",
+        "nextid",
+        "param",
+        "source",
+        "spacer",
+        "track",
+        "wbr",
+    ]
+)
+# 其中的空白文本原样保留
+_PRESERVE_WHITESPACE_TAGS = frozenset(["pre", "textarea"])
+# 其中的文本是Script、TemplateString等特殊字符串，不计入get_text()
+_STRING_CONTAINER_TAGS = frozenset(["script", "style", "template", "rt", "rp"])
+_ASCII_SPACES = frozenset("\x20\x0a\x09\x0c\x0d")
+
+# 流式解析时栈中元素的角色
+_CONTAINER = 0  # 普通容器
+_SKIP = 1  # script/style等，内容丢弃
+_ATOMIC = 2  # ul/ol/table，结束时整体产出
+_INNER = 3  # 列表/表格内部的其他元素
+_ITEM = 4  # 列表（含嵌套列表）的直接子li
+_LIST = 5  # 列表项中的嵌套ul/ol
+_SECTION = 6  # 表格的直接子thead/tbody/tfoot
+_ROW = 7  # 表格或上述元素的直接子tr
+_CELL = 8  # 上述tr的直接子td/th
+
+# 流式解析时的字符串类型：普通文本、CDATA、注释/声明等
+_TEXT = 0
+_CDATA = 1
+_SPECIAL = 2
+
+
+class _Frame:
+    __slots__ = ("name", "kind", "entered_at", "class_name", "parts", "data", "node")
+
+    def __init__(self, name: str, kind: int, entered_at: int = -1):
+        self.name = name
+        self.kind = kind
+        # 块级容器进入时的已产出块数，非块级为-1
+        self.entered_at = entered_at
+        self.class_name = ""
+        # 表格行文本（表格_ATOMIC）、单元格原文（_ROW）或文本片段（_CELL）
+        self.parts: List[str] = []
+        # 表格各行的单元格（表格_ATOMIC）、单元格属性（_ROW、_CELL）
+        self.data: Optional[list] = None
+        # 列表的结构节点（列表_ATOMIC、_LIST、_ITEM）
+        self.node = None
+
+
+def _charref_text(name: str) -> str:
+    """数字字符引用转为字符，规则与BeautifulSoup一致（0x80-0x9F按Windows-1252）"""
+    digits, base = (name[1:], 16) if name[:1] in ("x", "X") else (name, 10)
+    try:
+        code = int(digits, base)
+    except ValueError:
+        return "&#" + name
+    if code == 0 or code > 0x10FFFF or 0xD800 <= code <= 0xDFFF:
+        return "\ufffd"
+    if 0x80 <= code <= 0x9F:
+        try:
+            return bytes([code]).decode("cp1252")
+        except UnicodeDecodeError:
+            pass
+    return chr(code)
+
+
+class _StreamingBlockParser(HTMLParser):
+    """
+    不构建DOM树的文本块解析器，输出与
+    iter_blocks(BeautifulSoup(html, "html.parser").body or soup)一致。
+
+    只维护一个元素栈，按BeautifulSoup在html.parser下的建树规则处理事件：
+    结束标签弹出到最近的同名元素（没有则忽略），空元素立即闭合，
+    相邻文本在下一个标签、注释或声明前合并为一段。列表和表格在结束时
+    整体产出；存在body时只保留第一个body内的内容。
+    """
+
+    def __init__(self, images: bool = False):
+        super().__init__(convert_charrefs=False)
+        self.images = images
+        self.writer = _BlockWriter()
+        self.stack: List[_Frame] = []
+        self.data: List[str] = []
+        # 所在的列表/表格元素，正在收集文本的td/th，以及列表中接收文本的结构节点
+        self.atomic: Optional[_Frame] = None
+        self.collector: Optional[_Frame] = None
+        self.list_owner = None
+        # 进入_LIST/_ITEM前的list_owner，与之一一对应
+        self.list_owners: list = []
+        self.string_containers = 0
+        self.preserve_whitespace = 0
+        self.body: Optional[_Frame] = None
+        self.done = False
+        # 已闭合、尚未遇到结束标签的空元素计数
+        self.closed_void_tags: Dict[str, int] = {}
+
+    # ---- 文本 ----
+
+    def handle_data(self, data: str) -> None:
+        self.data.append(data)
+
+    def handle_charref(self, name: str) -> None:
+        self.data.append(_charref_text(name))
+
+    def handle_entityref(self, name: str) -> None:
+        character = EntitySubstitution.HTML_ENTITY_TO_CHARACTER.get(name)
+        self.data.append(character if character is not None else f"&{name}")
+
+    def handle_comment(self, data: str) -> None:
+        self._special_string(data)
+
+    def handle_decl(self, decl: str) -> None:
+        self._special_string(decl[len("DOCTYPE ") :])
+
+    def handle_pi(self, data: str) -> None:
+        self._special_string(data)
+
+    def unknown_decl(self, data: str) -> None:
+        if data.upper().startswith("CDATA["):
+            self._special_string(data[len("CDATA[") :], _CDATA)
+        else:
+            self._special_string(data)
+
+    def _special_string(self, data: str, string_type: int = _SPECIAL) -> None:
+        self._flush()
+        self.data.append(data)
+        self._flush(string_type)
+
+    def _flush(self, string_type: int = _TEXT) -> None:
+        if not self.data:
+            return
+        text = "".join(self.data)
+        self.data = []
+        if self.done:
+            return
+        if not self.preserve_whitespace and all(c in _ASCII_SPACES for c in text):
+            text = "\n" if "\n" in text else " "
+        if self.atomic is not None:
+            # get_text()只包含普通文本和CDATA，不含注释、声明及script等特殊字符串
+            if string_type == _CDATA or (
+                string_type == _TEXT and not self.string_containers
+            ):
+                if self.list_owner is not None:
+                    self.list_owner.segments.append(text)
+                elif self.collector is not None:
+                    self.collector.parts.append(text)
+            return
+        if self.stack and self.stack[-1].kind == _SKIP:
+            return
+        text = _clean_text(text)
+        if text:
+            self.writer.write(Block(text, "", ""))
+
+    # ---- 元素 ----
+
+    def handle_starttag(self, tag: str, attrs) -> None:
+        self._flush()
+        self._push(tag, attrs)
+        if tag in _VOID_TAGS:
+            self._pop()
+            # 之后出现的同名结束标签直接忽略（也不结束当前文本段）
+            self.closed_void_tags[tag] = self.closed_void_tags.get(tag, 0) + 1
+
+    def handle_startendtag(self, tag: str, attrs) -> None:
+        self._flush()
+        self._push(tag, attrs)
+        self._pop()
+
+    def handle_endtag(self, tag: str) -> None:
+        if self.closed_void_tags.get(tag):
+            self.closed_void_tags[tag] -= 1
+            return
+        self._flush()
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i].name == tag:
+                while len(self.stack) > i:
+                    self._pop()
+                return
+
+    def _push(self, tag: str, attrs) -> None:
+        if tag in _STRING_CONTAINER_TAGS:
+            self.string_containers += 1
+        if tag in _PRESERVE_WHITESPACE_TAGS:
+            self.preserve_whitespace += 1
+
+        if tag == "body" and self.body is None and not self.done:
+            # 只输出第一个body的内容，此前产出的内容作废
+            self.writer = _BlockWriter()
+            self.atomic = self.collector = self.list_owner = None
+            self.list_owners = []
+            self.body = frame = _Frame(tag, _CONTAINER)
+        elif self.done:
+            frame = _Frame(tag, _INNER)
+        elif self.atomic is not None:
+            frame = self._atomic_child(tag, attrs)
+        elif tag in _SKIP_TAGS:
+            frame = _Frame(tag, _SKIP)
+        elif tag in ("ul", "ol", "table"):
+            frame = _Frame(tag, _ATOMIC)
+            frame.class_name = _class_name(attrs)
+            if tag == "table":
+                frame.data = []
+            else:
+                frame.node = self.list_owner = _ListNode(tag == "ol")
+            self.atomic = frame
+        else:
+            if tag == "br":
+                self.writer.write(Block("\n", "br", ""))
+            elif tag == "img" and self.images:
+                src = _attr(attrs, "src") or _attr(attrs, "data-src")
+                if src:
+                    self.writer.write(Block(src, "img", ""))
+            entered_at = self.writer.enter_block() if tag in _BLOCK_TAGS else -1
+            frame = _Frame(tag, _CONTAINER, entered_at)
+        self.stack.append(frame)
+
+    def _atomic_child(self, tag: str, attrs) -> _Frame:
+        parent = self.stack[-1]
+        if self.atomic.name == "table":
+            if parent is self.atomic and tag in _TABLE_SECTION_TAGS:
+                return _Frame(tag, _SECTION)
+            if tag == "tr" and (parent is self.atomic or parent.kind == _SECTION):
+                frame = _Frame(tag, _ROW)
+                frame.data = []
+                return frame
+            if parent.kind == _ROW and tag in ("td", "th"):
+                frame = _Frame(tag, _CELL)
+                frame.data = (tag, _attr(attrs, "colspan"), _attr(attrs, "rowspan"))
+                self.collector = frame
+                return frame
+            return _Frame(tag, _INNER)
+
+        # 列表：规则与_list_tree一致
+        owner = self.list_owner
+        if tag == "li" and isinstance(parent.node, _ListNode):
+            frame = _Frame(tag, _ITEM)
+            frame.node = _ItemNode()
+        elif tag in ("ul", "ol") and isinstance(owner, _ItemNode):
+            frame = _Frame(tag, _LIST)
+            frame.node = _ListNode(tag == "ol")
+        else:
+            return _Frame(tag, _INNER)
+        owner.segments.append(frame.node)
+        self.list_owners.append(owner)
+        self.list_owner = frame.node
+        return frame
+
+    def _pop(self) -> None:
+        frame = self.stack.pop()
+        if frame.name in _STRING_CONTAINER_TAGS:
+            self.string_containers -= 1
+        if frame.name in _PRESERVE_WHITESPACE_TAGS:
+            self.preserve_whitespace -= 1
+        if self.done:
+            return
+
+        kind = frame.kind
+        if kind == _CONTAINER:
+            if frame is self.body:
+                self.done = True
+            elif frame.entered_at >= 0:
+                self.writer.leave_block(frame.entered_at)
+        elif kind in (_ITEM, _LIST):
+            self.list_owner = self.list_owners.pop()
+        elif kind == _CELL:
+            self.collector = None
+            row = self.stack[-1]
+            row.parts.append("".join(frame.parts))
+            row.data.append(frame.data)
+        elif kind == _ROW:
+            if frame.parts:
+                texts = clean_many(frame.parts)
+                self.atomic.parts.append(" | ".join(texts))
+                self.atomic.data.append(
+                    tuple(
+                        _table_cell(text, *cell)
+                        for text, cell in zip(texts, frame.data)
+                    )
+                )
+        elif kind == _ATOMIC:
+            self.atomic = self.list_owner = None
+            self._write_atomic(frame)
+
+    def _write_atomic(self, frame: _Frame) -> None:
+        write = self.writer.write
+        if frame.name == "table":
+            for row in frame.parts:
+                write(Block(row, "table", frame.class_name))
+            write(Block("\n", "table", "", tuple(frame.data)))
+            return
+        for block in _list_blocks(frame.node, frame.class_name):
+            write(block)
+
+    def close(self) -> None:
+        super().close()
+        self._flush()
+        # 文档结束时闭合所有未闭合的元素
+        while self.stack:
+            self._pop()
+
+
+def _attr(attrs, name: str) -> str:
+    """属性值，重复的属性以最后一个为准（与BeautifulSoup一致）"""
+    value = None
+    for key, val in attrs:
+        if key == name:
+            value = val
+    return value or ""
+
+
+def _class_name(attrs) -> str:
+    return " ".join(_attr(attrs, "class").split())
+
+
+def iter_blocks_stream(
+    html_content: str, chunk_size: int = 64 * 1024, images: bool = False
+) -> Iterator[Block]:
+    """
+    直接从HTML源码流式产出文本块，不构建DOM树
+
+    输出与html.parser建树后调用iter_blocks一致，内存占用与文档大小无关；
+    在遇到body之前产出的内容需要暂存（没有body时才输出）。
+    """
+    parser = _StreamingBlockParser(images)
+    for start in range(0, len(html_content), chunk_size):
+        parser.feed(html_content[start : start + chunk_size])
+        if parser.body is not None and parser.writer.out:
+            yield from parser.writer.drain()
+    parser.close()
+    yield from parser.writer.drain()
+
+
+PARSERS = ("html.parser", "lxml", "stream")
+
+
+def extract_blocks(
+    html_content: str, parser: Optional[str] = None, images: bool = False
+) -> Iterator[Block]:
+    """
+    从HTML源码中提取结构化文本块
+
+    Args:
+        html_content: HTML内容
+        parser: 解析方式，默认html.parser
+            - html.parser: BeautifulSoup + 标准库解析器
+            - lxml: BeautifulSoup + lxml，解析更快，但会像浏览器一样修正不规范的标记
+            - stream: 不建树的流式解析，结果与html.parser一致
+        images: 是否产出图片块（tag为img，文本为图片src）
+
+    Returns:
+        Iterator[Block]: 按文档顺序的文本块
+
+    Raises:
+        ValueError: 不支持的解析方式
+    """
+    parser = parser or "html.parser"
+    if parser not in PARSERS:
+        raise ValueError(f"不支持的解析方式: {parser}")
+    if parser == "stream":
+        return iter_blocks_stream(html_content, images=images)
+    soup = BeautifulSoup(html_content, parser)
+    return iter_blocks(soup.body or soup, images)
+
+
+def _extract_text_with_structure(elem: Tag) -> List[Block]:
+    """
+    提取HTML元素中的文本，并保持结构
+    返回格式：List of (text, tag_name, class_name)
+    """
+    return list(iter_blocks(elem))
 
 
 def convert_html_to_txt(
-    html_content: str, output_path: str, title: Optional[str] = None
+    html_content: str,
+    output_path: str,
+    title: Optional[str] = None,
+    parser: Optional[str] = None,
 ) -> str:
     """
     将HTML内容转换并保存为TXT文件，保持基本结构和格式。
@@ -93,32 +722,40 @@ def convert_html_to_txt(
         html_content: HTML内容
         output_path: 输出文件路径
         title: 可选的文档标题
+        parser: 解析方式（见extract_blocks），默认取配置TXT_PARSER
 
     Returns:
         str: 保存的文件路径
     """
-    soup = BeautifulSoup(html_content, "html.parser")
+    with stage("txt_convert"):
+        blocks = extract_blocks(html_content, parser or settings.TXT_PARSER)
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        # 写入标题
-        if title:
-            f.write(f"{title}\n{'='*len(title)}\n\n")
+        with open(output_path, "w", encoding="utf-8") as f:
+            # 写入标题
+            if title:
+                f.write(f"{title}\n{'='*len(title)}\n\n")
 
-        # 提取并写入结构化文本
-        content = []
-        for text, tag, _ in _extract_text_with_structure(soup.body or soup):
-            content.append(text)
+            # 提取并写入结构化文本
+            content = []
+            for block in blocks:
+                content.append(block.text)
 
-        # 处理连续换行
-        text_content = "".join(content)
-        text_content = re.sub(r"\n{3,}", "\n\n", text_content)
-        f.write(text_content)
+            # 处理连续换行
+            text_content = "".join(content)
+            text_content = re.sub(r"\n{3,}", "\n\n", text_content)
+            f.write(text_content)
 
     return output_path
 
 
 def convert_html_to_docx(
-    html_content: str, output_path: str, title: Optional[str] = None
+    html_content: str,
+    output_path: str,
+    title: Optional[str] = None,
+    parser: Optional[str] = None,
+    streaming: Optional[bool] = None,
+    images: Optional[Dict[str, bytes]] = None,
+    structured: Optional[bool] = None,
 ) -> str:
     """
     将HTML内容转换并保存为Word(docx)文件，保持文档结构和基本样式。
@@ -127,13 +764,64 @@ def convert_html_to_docx(
         html_content: HTML内容
         output_path: 输出文件路径
         title: 可选的文档标题
+        parser: 解析方式（见extract_blocks），默认取配置DOCUMENT_PARSER
+        streaming: 是否边生成边写入文件（见docx_stream），默认取配置DOCX_STREAMING；
+            与parser="stream"一起使用时内存占用不随文档长度增长
+        images: 可选，{图片src: 原始图片内容}（见image_pipeline.ImageCapture）；
+            给出时按src嵌入图片，未给出时不含图片
+        structured: 是否生成Word表格（支持合并单元格）和按层级缩进的嵌套列表，
+            默认取配置DOCX_STRUCTURED；为False时表格每行、列表每项写为一个段落
 
     Returns:
         str: 保存的文件路径
     """
-    soup = BeautifulSoup(html_content, "html.parser")
-    doc = Document()
+    prepared: Dict[str, EmbeddedImage] = {}
+    if images:
+        try:
+            with stage("docx_images"):
+                prepared = prepare_images(images)
+        except RuntimeError as e:
+            logger.warning(f"图片处理失败，生成不含图片的文档: {e}")
+    with stage("docx_convert"):
+        blocks = extract_blocks(
+            html_content, parser or settings.DOCUMENT_PARSER, images=bool(prepared)
+        )
+        if streaming is None:
+            streaming = settings.DOCX_STREAMING
+        if structured is None:
+            structured = settings.DOCX_STRUCTURED
+
+        if streaming:
+            with StreamingDocxWriter(output_path) as doc:
+                _write_docx_content(doc, blocks, title, prepared, structured)
+        else:
+            doc = Document()
+            _write_docx_content(doc, blocks, title, prepared, structured)
+            doc.save(output_path)
+    return output_path
+
 
+# 嵌套列表各层级使用的段落样式（悬挂缩进，不带自动编号）
+_LIST_STYLES = ("List", "List 2", "List 3")
+
+
+def _write_docx_content(
+    doc,
+    blocks: Iterable[Block],
+    title: Optional[str],
+    images: Optional[Dict[str, EmbeddedImage]] = None,
+    structured: bool = False,
+) -> None:
+    """
+    按文本块写入标题、列表、表格、段落和图片
+
+    Args:
+        doc: python-docx的Document或StreamingDocxWriter
+        blocks: 结构化文本块
+        title: 可选的文档标题
+        images: {图片src: 处理后的图片}，不在其中的图片块忽略
+        structured: 按列表、表格结尾块附带的结构生成Word表格和嵌套列表
+    """
     # 设置标题
     if title:
         heading = doc.add_heading(title, level=0)
@@ -150,7 +838,7 @@ def convert_html_to_docx(
     # 遍历并处理结构化内容
     current_paragraph = None
 
-    for text, tag, classes in _extract_text_with_structure(soup.body or soup):
+    for text, tag, classes, data in blocks:
         # 处理标题
         if tag.startswith("h") and tag != "hr":
             level = get_heading_level(tag)
@@ -161,6 +849,12 @@ def convert_html_to_docx(
 
         # 处理列表和表格
         if tag in ["li", "table"]:
+            if structured:
+                # 逐行/逐项的文本块跳过，由结尾块附带的结构整体写入
+                if data:
+                    append_table(doc, data)
+                    current_paragraph = None
+                continue
             if text.strip():
                 current_paragraph = doc.add_paragraph(text.strip())
                 current_paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT
@@ -176,11 +870,24 @@ def convert_html_to_docx(
                     current_paragraph = None
             continue
 
+        if tag == "ulol":
+            if structured and data:
+                for item in data:
+                    style = _LIST_STYLES[min(item.level, len(_LIST_STYLES) - 1)]
+                    paragraph = doc.add_paragraph(item.text, style=style)
+                    paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT
+                current_paragraph = None
+            continue
+
         # 处理换行
         if tag == "br":
             current_paragraph = None
             continue
 
-    # 保存文档
-    doc.save(output_path)
-    return output_path
+        # 处理图片：单独成段
+        if tag == "img":
+            image = images.get(text) if images else None
+            if image is not None:
+                doc.add_picture(BytesIO(image.data), width=Emu(image.width_emu))
+                current_paragraph = None
+            continue
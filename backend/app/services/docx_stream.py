@@ -0,0 +1,494 @@
+"""
+流式DOCX写入模块
+
+python-docx会先在内存中构建完整的文档对象树再保存，几百页、表格较多的
+文章一次转换就要占用数百MB。这里以python-docx自带的默认模板为基础，
+除word/document.xml之外的部件原样复制，正文段落在生成的同时逐段压缩
+写入zip，已写出的内容不再保留在内存中。
+
+接口与python-docx的Document保持一致（add_heading、add_paragraph、add_picture、
+Paragraph.alignment、Paragraph.add_run），生成的正文XML与python-docx相同。
+表格由table_xml一次性生成整张表的XML，append_table对python-docx的Document
+和StreamingDocxWriter都适用，避免python-docx逐个单元格操作的开销。
+内存上限与文档长度无关：写缓冲区（buffer_size，默认64KB）、zlib压缩状态
+（约300KB）和当前段落尚未写出的段落属性。图片内容（相同图片只保留一份）
+要等document.xml写完才能写入zip，在此之前保留在内存中。
+"""
+
+import os
+import re
+import zipfile
+from typing import BinaryIO, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+from xml.sax.saxutils import escape
+
+import docx
+from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+from docx.image.image import Image
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+
+_TEMPLATE_PATH = os.path.join(
+    os.path.dirname(docx.__file__), "templates", "default.docx"
+)
+_DOCUMENT_PART = "word/document.xml"
+# 添加图片时要补充关系和内容类型，这两个部件在close时才写入
+_RELS_PART = "word/_rels/document.xml.rels"
+_CONTENT_TYPES_PART = "[Content_Types].xml"
+_IMAGE_RELTYPE = (
+    "http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"
+)
+_BODY_OPEN = "<w:body>"
+_SECT_PR = "<w:sectPr"
+
+# XML 1.0不允许的字符（python-docx遇到时会直接报错，这里删除）
+_INVALID_XML_CHARS_RE = re.compile(
+    r"[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]"
+)
+# run文本中转换为<w:tab/>、<w:br/>的字符
+_RUN_SPECIAL_RE = re.compile(r"([\t\n\r])")
+
+
+# 与python-docx的CT_Inline.new_pic_inline生成的结构相同
+_PICTURE_XML = (
+    "<w:p><w:r><w:drawing>"
+    '<wp:inline xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+    'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<wp:extent cx="{cx}" cy="{cy}"/>'
+    '<wp:docPr id="{shape_id}" name="Picture {shape_id}"/>'
+    '<wp:cNvGraphicFramePr><a:graphicFrameLocks noChangeAspect="1"/>'
+    "</wp:cNvGraphicFramePr>"
+    '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:pic><pic:nvPicPr><pic:cNvPr id="0" name="{filename}"/><pic:cNvPicPr/>'
+    "</pic:nvPicPr>"
+    '<pic:blipFill><a:blip r:embed="{rid}"/><a:stretch><a:fillRect/></a:stretch>'
+    "</pic:blipFill>"
+    '<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+    '<a:prstGeom prst="rect"/></pic:spPr>'
+    "</pic:pic></a:graphicData></a:graphic></wp:inline>"
+    "</w:drawing></w:r></w:p>"
+)
+_RID_RE = re.compile(r'Id="rId(\d+)"')
+
+# 默认模板正文宽度（twip）：页宽12240减去左右页边距各1800
+_TEXT_WIDTH_TWIPS = 8640
+_TABLE_PROPERTIES_XML = (
+    '<w:tblPr><w:tblStyle w:val="TableGrid"/><w:tblW w:type="auto" w:w="0"/>'
+    '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0" '
+    'w:noHBand="0" w:noVBand="1" w:val="04A0"/></w:tblPr>'
+)
+
+
+def _text_xml(text: str) -> str:
+    """生成<w:t>元素，首尾有空白时保留空白"""
+    if len(text.strip()) < len(text):
+        return f'<w:t xml:space="preserve">{escape(text)}</w:t>'
+    return f"<w:t>{escape(text)}</w:t>"
+
+
+def _run_xml(text: str) -> str:
+    """生成与python-docx的Run.text相同的XML：制表符为<w:tab/>，换行为<w:br/>"""
+    text = _INVALID_XML_CHARS_RE.sub("", text)
+    parts = ["<w:r>"]
+    for piece in _RUN_SPECIAL_RE.split(text):
+        if piece == "\t":
+            parts.append("<w:tab/>")
+        elif piece in ("\n", "\r"):
+            parts.append("<w:br/>")
+        elif piece:
+            parts.append(_text_xml(piece))
+    parts.append("</w:r>")
+    return "".join(parts)
+
+
+class TableCell(NamedTuple):
+    """表格单元格；rowspan为0表示一直合并到表格最后一行"""
+
+    text: str
+    colspan: int = 1
+    rowspan: int = 1
+    header: bool = False
+
+
+def _layout_table(rows: Sequence[Sequence[TableCell]]):
+    """
+    按HTML表格规则确定每个单元格所在的列
+
+    被上方单元格rowspan占用的列跳过，与之重叠的colspan截断。
+    返回(列数, 每行的[(起始列, 跨列数, 单元格或None)])，
+    单元格为None表示上方合并单元格的延续，rowspan已截断到表格末尾。
+    """
+    # 起始列 -> (跨列数, 还要延续的行数)
+    merging: Dict[int, Tuple[int, int]] = {}
+    layout = []
+    columns = 0
+    for index, row in enumerate(rows):
+        slots = [(col, span, None) for col, (span, _) in merging.items()]
+        covered = set()
+        for col, span, _ in slots:
+            covered.update(range(col, col + span))
+        merging = {
+            col: (span, remaining - 1)
+            for col, (span, remaining) in merging.items()
+            if remaining > 1
+        }
+        col = 0
+        for cell in row:
+            while col in covered:
+                col += 1
+            span = 1
+            while span < cell.colspan and col + span not in covered:
+                span += 1
+            rowspan = min(cell.rowspan or len(rows), len(rows) - index)
+            if rowspan > 1:
+                merging[col] = (span, rowspan - 1)
+            slots.append((col, span, cell._replace(rowspan=rowspan)))
+            col += span
+        slots.sort(key=lambda slot: slot[0])
+        if slots:
+            columns = max(columns, slots[-1][0] + slots[-1][1])
+        layout.append(slots)
+    return columns, layout
+
+
+def table_xml(rows: Sequence[Sequence[TableCell]]) -> str:
+    """
+    一次性生成整张表格的<w:tbl>（TableGrid样式，列宽平均分配正文宽度）
+
+    合并单元格使用gridSpan/vMerge，没有单元格的位置补空单元格；
+    开头全部由th组成的行设为标题行（跨页时重复）。
+    """
+    columns, layout = _layout_table(rows)
+    if not columns:
+        return ""
+    width = _TEXT_WIDTH_TWIPS // columns
+    # (跨列数, 合并方式) -> <w:tcPr>，整张表共用
+    properties: Dict[Tuple[int, str], str] = {}
+
+    def cell_xml(span: int, merge: str, text: str) -> str:
+        props = properties.get((span, merge))
+        if props is None:
+            props = f'<w:tcPr><w:tcW w:type="dxa" w:w="{width * span}"/>'
+            if span > 1:
+                props += f'<w:gridSpan w:val="{span}"/>'
+            if merge:
+                props += merge
+            props = properties[(span, merge)] = props + "</w:tcPr>"
+        if text:
+            return f"<w:tc>{props}<w:p>{_run_xml(text)}</w:p></w:tc>"
+        return f"<w:tc>{props}<w:p/></w:tc>"
+
+    parts = [
+        "<w:tbl>",
+        _TABLE_PROPERTIES_XML,
+        "<w:tblGrid>",
+        f'<w:gridCol w:w="{width}"/>' * columns,
+        "</w:tblGrid>",
+    ]
+    header = True
+    for slots in layout:
+        header = header and all(cell and cell.header for _, _, cell in slots)
+        parts.append("<w:tr><w:trPr><w:tblHeader/></w:trPr>" if header else "<w:tr>")
+        col = 0
+        for start, span, cell in slots:
+            if start > col:
+                parts.append(cell_xml(start - col, "", ""))
+            if cell is None:
+                parts.append(cell_xml(span, "<w:vMerge/>", ""))
+            else:
+                merge = '<w:vMerge w:val="restart"/>' if cell.rowspan > 1 else ""
+                parts.append(cell_xml(span, merge, cell.text))
+            col = start + span
+        if col < columns:
+            parts.append(cell_xml(columns - col, "", ""))
+        parts.append("</w:tr>")
+    parts.append("</w:tbl>")
+    return "".join(parts)
+
+
+def append_table(doc, rows: Sequence[Sequence[TableCell]]) -> None:
+    """
+    在文档末尾添加表格
+
+    :param doc: python-docx的Document或StreamingDocxWriter
+    :param rows: 各行的单元格
+    """
+    xml = table_xml(rows)
+    if not xml:
+        return
+    if isinstance(doc, StreamingDocxWriter):
+        doc.append_xml(xml)
+    else:
+        tbl = parse_xml(xml.replace("<w:tbl>", f"<w:tbl {nsdecls('w')}>", 1))
+        doc.element.body._insert_tbl(tbl)
+
+
+class StreamingParagraph:
+    """
+    流式写入中的段落
+
+    段落属性（alignment）只能在写入第一个run之前设置，
+    对应python-docx中先创建段落、再设置对齐方式的常见用法。
+    """
+
+    def __init__(self, writer: "StreamingDocxWriter", style: Optional[str]):
+        self._writer = writer
+        self._style = style
+        self._alignment: Optional[WD_PARAGRAPH_ALIGNMENT] = None
+        self._started = False
+
+    @property
+    def alignment(self) -> Optional[WD_PARAGRAPH_ALIGNMENT]:
+        return self._alignment
+
+    @alignment.setter
+    def alignment(self, value: Optional[WD_PARAGRAPH_ALIGNMENT]) -> None:
+        if self._started:
+            raise RuntimeError("段落内容已写出，不能再修改段落属性")
+        self._alignment = value
+
+    def add_run(self, text: str = "") -> None:
+        self._writer._add_run(self, text)
+
+    def _start_xml(self) -> str:
+        self._started = True
+        props = []
+        if self._style:
+            props.append(f'<w:pStyle w:val="{self._style}"/>')
+        if self._alignment is not None:
+            props.append(f'<w:jc w:val="{self._alignment.xml_value}"/>')
+        if not props:
+            return "<w:p>"
+        return f"<w:p><w:pPr>{''.join(props)}</w:pPr>"
+
+
+class StreamingDocxWriter:
+    """
+    边生成边写入的DOCX文档
+
+    用法::
+
+        with StreamingDocxWriter(output_path) as doc:
+            doc.add_heading("标题", level=0)
+            doc.add_paragraph("正文")
+
+    正常退出时完成文件；出现异常时删除写了一半的文件。
+
+    :param output_path: 输出文件路径
+    :param buffer_size: 正文XML攒够该字节数再写入压缩流
+    """
+
+    def __init__(self, output_path: str, buffer_size: int = 64 * 1024):
+        self.output_path = output_path
+        self.buffer_size = buffer_size
+        self._buffer = []
+        self._buffered = 0
+        self._current: Optional[StreamingParagraph] = None
+        self._pending_run: Optional[str] = None
+        # 图片：sha1 -> rId；待写入的(部件名, 内容, rId, 内容类型)；docPr id
+        self._image_rids: Dict[str, str] = {}
+        self._media: List[Tuple[str, bytes, str, str]] = []
+        self._shape_id = 0
+
+        with zipfile.ZipFile(_TEMPLATE_PATH) as template:
+            document_xml = template.read(_DOCUMENT_PART).decode("utf-8")
+            self._rels_info = template.getinfo(_RELS_PART)
+            self._rels_xml = template.read(_RELS_PART).decode("utf-8")
+            self._types_info = template.getinfo(_CONTENT_TYPES_PART)
+            self._types_xml = template.read(_CONTENT_TYPES_PART).decode("utf-8")
+            self._next_rid = max(int(n) for n in _RID_RE.findall(self._rels_xml)) + 1
+            self._zip = zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED)
+            try:
+                for info in template.infolist():
+                    if info.filename not in (
+                        _DOCUMENT_PART,
+                        _RELS_PART,
+                        _CONTENT_TYPES_PART,
+                    ):
+                        self._zip.writestr(info, template.read(info.filename))
+                # 模板正文只有sectPr：段落写在<w:body>与sectPr之间
+                head_end = document_xml.index(_BODY_OPEN) + len(_BODY_OPEN)
+                tail_start = document_xml.index(_SECT_PR, head_end)
+                self._tail = document_xml[tail_start:]
+                self._stream = self._zip.open(_DOCUMENT_PART, "w")
+                self._write(document_xml[:head_end])
+            except Exception:
+                self._zip.close()
+                os.remove(output_path)
+                raise
+
+    def __enter__(self) -> "StreamingDocxWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add_heading(self, text: str = "", level: int = 1) -> StreamingParagraph:
+        """添加标题，level为0时使用Title样式"""
+        if not 0 <= level <= 9:
+            raise ValueError(f"标题级别必须在0-9之间: {level}")
+        style = "Title" if level == 0 else f"Heading{level}"
+        return self.add_paragraph(text, style)
+
+    def add_paragraph(
+        self, text: str = "", style: Optional[str] = None
+    ) -> StreamingParagraph:
+        """
+        添加段落，之前的段落随之结束
+
+        :param text: 段落初始文本
+        :param style: 段落样式名称（如List Bullet，与python-docx一致）或样式ID，
+            默认正文样式
+        """
+        self._finish_paragraph()
+        if style:
+            # 内置样式的ID为名称去掉空格
+            style = style.replace(" ", "")
+        self._current = StreamingParagraph(self, style)
+        self._pending_run = text or None
+        return self._current
+
+    def add_picture(
+        self,
+        image: Union[str, BinaryIO],
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+    ) -> None:
+        """
+        在单独的段落中添加图片，之前的段落随之结束
+
+        尺寸规则与python-docx一致：只给出宽或高时按比例计算另一边，
+        都不给出时按图片自身的像素和DPI计算。内容相同的图片只保存一份。
+
+        :param image: 图片文件路径或文件对象
+        :param width: 显示宽度（EMU，可传入docx.shared.Length）
+        :param height: 显示高度（EMU）
+        """
+        image = Image.from_file(image)
+        cx, cy = image.scaled_dimensions(width, height)
+        rid = self._image_rids.get(image.sha1)
+        if rid is None:
+            rid = f"rId{self._next_rid}"
+            self._next_rid += 1
+            self._image_rids[image.sha1] = rid
+            partname = f"word/media/image{len(self._media) + 1}.{image.ext}"
+            self._media.append((partname, image.blob, rid, image.content_type))
+
+        self._finish_paragraph()
+        self._shape_id += 1
+        self._write(
+            _PICTURE_XML.format(
+                cx=int(cx),
+                cy=int(cy),
+                shape_id=self._shape_id,
+                filename=escape(image.filename),
+                rid=rid,
+            )
+        )
+
+    def append_xml(self, xml: str) -> None:
+        """
+        在正文中追加块级元素的XML（如table_xml生成的表格），之前的段落随之结束
+
+        :param xml: 使用w等模板根元素已声明的命名空间前缀的XML
+        """
+        self._finish_paragraph()
+        self._write(xml)
+
+    def _add_run(self, paragraph: StreamingParagraph, text: str) -> None:
+        if paragraph is not self._current:
+            raise RuntimeError("只能向最后添加的段落追加内容")
+        self._start_paragraph()
+        self._write(_run_xml(text))
+
+    def _start_paragraph(self) -> None:
+        paragraph = self._current
+        if paragraph._started:
+            return
+        self._write(paragraph._start_xml())
+        if self._pending_run is not None:
+            self._write(_run_xml(self._pending_run))
+            self._pending_run = None
+
+    def _finish_paragraph(self) -> None:
+        paragraph = self._current
+        if paragraph is None:
+            return
+        if paragraph._started:
+            self._write("</w:p>")
+        elif self._pending_run is None and not (
+            paragraph._style or paragraph._alignment is not None
+        ):
+            self._write("<w:p/>")
+        else:
+            self._start_paragraph()
+            self._write("</w:p>")
+        self._current = None
+
+    def _write(self, xml: str) -> None:
+        self._buffer.append(xml)
+        self._buffered += len(xml)
+        if self._buffered >= self.buffer_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._buffer:
+            self._stream.write("".join(self._buffer).encode("utf-8"))
+            self._buffer = []
+            self._buffered = 0
+
+    def close(self) -> None:
+        """结束最后一个段落并完成文件"""
+        if self._zip is None:
+            return
+        try:
+            self._finish_paragraph()
+            self._write(self._tail)
+            self._flush()
+            self._stream.close()
+            # 同一时间zip只能写一个部件，图片和关系等document.xml写完再写入
+            for partname, blob, _, _ in self._media:
+                self._zip.writestr(partname, blob)
+            self._zip.writestr(self._rels_info, self._relationships_xml())
+            self._zip.writestr(self._types_info, self._content_types_xml())
+        finally:
+            self._zip.close()
+            self._zip = None
+
+    def _relationships_xml(self) -> str:
+        """模板的正文关系中补充图片关系"""
+        rels = "".join(
+            f'<Relationship Id="{rid}" Type="{_IMAGE_RELTYPE}" '
+            f'Target="{partname[len("word/"):]}"/>'
+            for partname, _, rid, _ in self._media
+        )
+        return self._rels_xml.replace("</Relationships>", f"{rels}</Relationships>")
+
+    def _content_types_xml(self) -> str:
+        """模板的内容类型中补充图片扩展名"""
+        defaults = {}
+        for partname, _, _, content_type in self._media:
+            ext = partname.rsplit(".", 1)[1]
+            if f'Extension="{ext}"' not in self._types_xml:
+                defaults[ext] = content_type
+        entries = "".join(
+            f'<Default Extension="{ext}" ContentType="{content_type}"/>'
+            for ext, content_type in defaults.items()
+        )
+        return self._types_xml.replace("</Types>", f"{entries}</Types>")
+
+    def abort(self) -> None:
+        """放弃写入并删除不完整的文件"""
+        if self._zip is None:
+            return
+        try:
+            self._stream.close()
+        except Exception:
+            pass
+        finally:
+            self._zip.close()
+            self._zip = None
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
@@ -0,0 +1,101 @@
+"""
+产物下载链接模块
+
+本地存储中的产物可以通过签名的限时链接直接下载：
+    {DOWNLOAD_BASE_URL}/api/v1/download/<文件名>?expires=<时间戳>&sha=<内容哈希>&sig=<签名>
+
+签名是对文件名、过期时间和内容哈希的HMAC-SHA256（密钥DOWNLOAD_SECRET，API和worker
+需要配置相同的值），内容哈希同时作为ETag。文件被覆盖后旧链接不能再以旧ETag返回新内容，
+下载时用current_sha()核对文件当前的哈希，结果按(mtime, size)缓存，文件不变时不重复读取。
+未配置DOWNLOAD_SECRET时不生成链接，下载接口返回404。
+"""
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+from app.core.config import settings
+
+from .artifact_store import artifact_sha256, get_artifact_store
+
+# 文件路径 -> ((mtime_ns, size), 哈希前32位)
+_sha_cache: Dict[str, Tuple[Tuple[int, int], str]] = {}
+_sha_lock = threading.Lock()
+_SHA_CACHE_MAX = 1024
+
+
+def is_enabled() -> bool:
+    return bool(settings.DOWNLOAD_SECRET)
+
+
+def _signature(name: str, expires: int, sha: str) -> str:
+    message = f"{name}\n{expires}\n{sha}".encode("utf-8")
+    key = settings.DOWNLOAD_SECRET.encode("utf-8")
+    return hmac.new(key, message, hashlib.sha256).hexdigest()[:32]
+
+
+def _local_root() -> str:
+    return get_artifact_store("local").root
+
+
+def download_url(uri: str, ttl: int = None, now: float = None) -> Optional[str]:
+    """
+    为产物生成签名的下载链接
+
+    :param uri: 产物地址，只支持本地存储根目录下的文件
+    :param ttl: 可选，有效期（秒），默认DOWNLOAD_LINK_TTL
+    :return: 下载链接；未启用或产物不在本地存储中时返回None
+    """
+    if not is_enabled() or "://" in uri:
+        return None
+    path = os.path.abspath(uri)
+    if os.path.dirname(path) != _local_root() or not os.path.isfile(path):
+        return None
+    name = os.path.basename(path)
+    expires = int(now or time.time()) + (ttl or settings.DOWNLOAD_LINK_TTL)
+    sha = current_sha(path)
+    query = urlencode(
+        {"expires": expires, "sha": sha, "sig": _signature(name, expires, sha)}
+    )
+    base = settings.DOWNLOAD_BASE_URL.rstrip("/")
+    return f"{base}/api/v1/download/{quote(name)}?{query}"
+
+
+def verify(name: str, expires: int, sha: str, sig: str) -> bool:
+    """校验签名（不检查是否过期）"""
+    if not is_enabled():
+        return False
+    return hmac.compare_digest(_signature(name, expires, sha), sig)
+
+
+def resolve(name: str) -> Optional[str]:
+    """文件名对应的本地文件路径，文件名不合法或文件不存在时返回None"""
+    if not name or name != os.path.basename(name) or name.startswith("."):
+        return None
+    path = os.path.join(_local_root(), name)
+    return path if os.path.isfile(path) else None
+
+
+def current_sha(path: str) -> str:
+    """
+    文件当前内容哈希（前32位），按(mtime, size)缓存
+
+    :param path: 本地文件路径
+    :return: 与链接中sha参数格式相同的哈希
+    """
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _sha_lock:
+        cached = _sha_cache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    sha = artifact_sha256(path)[:32]
+    with _sha_lock:
+        if len(_sha_cache) >= _SHA_CACHE_MAX:
+            _sha_cache.clear()
+        _sha_cache[path] = (key, sha)
+    return sha
@@ -2,20 +2,78 @@
 邮件服务模块，负责处理邮件发送相关功能
 """
 
+import base64
 import logging
 import os
 import re
 import smtplib
+from contextlib import contextmanager
+from dataclasses import dataclass
+from email.message import EmailMessage
 from email.mime.application import MIMEApplication
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from pathlib import Path
-from typing import List, Optional, Union
+from email.policy import SMTP as SMTP_POLICY
+from email.utils import make_msgid
+from typing import BinaryIO, Callable, Dict, Iterator, List, Optional, Union
+
+from app.core.metrics import stage
+
+from .artifact_store import artifact_exists, artifact_name, artifact_size, open_artifact
+from .smtp_pool import SMTPConnectionPool
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 流式编码时每次读取的字节数，取57的整数倍使base64输出恰好是完整的76字符行
+_STREAM_CHUNK_SIZE = 57 * 1024
+_DOT_LINE = re.compile(rb"(?m)^\.")
+
+
+def _iter_base64_lines(stream: BinaryIO) -> Iterator[bytes]:
+    """分块读取并base64编码，输出以CRLF结尾的完整行"""
+    rest = b""
+    while True:
+        chunk = stream.read(_STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        data = rest + chunk if rest else chunk
+        cut = len(data) - len(data) % 57
+        rest = data[cut:]
+        if cut:
+            yield base64.encodebytes(data[:cut]).replace(b"\n", b"\r\n")
+    if rest:
+        yield base64.encodebytes(rest).replace(b"\n", b"\r\n")
+
+
+def _fold_headers(msg: EmailMessage) -> bytes:
+    return b"".join(SMTP_POLICY.fold_binary(k, v) for k, v in msg.items())
+
+
+def _rset(server: smtplib.SMTP) -> None:
+    """结束当前事务；连接已断开时忽略，由调用方按断开处理"""
+    try:
+        server.rset()
+    except smtplib.SMTPServerDisconnected:
+        pass
+
+
+@dataclass
+class OutgoingEmail:
+    """一封待发送的邮件，sender为空时使用配置中的发件人"""
+
+    to_email: Union[str, List[str]]
+    subject: str
+    body: str
+    attachments: Optional[List[str]] = None
+    body_type: str = "plain"
+    sender: Optional[str] = None
+
+    @property
+    def to_list(self) -> List[str]:
+        return [self.to_email] if isinstance(self.to_email, str) else self.to_email
+
 
 class EmailConfig:
     """邮件配置类"""
@@ -27,12 +85,20 @@ class EmailConfig:
         smtp_user: str = os.getenv("SMTP_USER", ""),
         smtp_password: str = os.getenv("SMTP_PASSWORD", ""),
         sender_email: str = os.getenv("SENDER_EMAIL", ""),
+        stream_threshold: int = int(
+            os.getenv("EMAIL_STREAM_THRESHOLD_BYTES", str(5 * 1024 * 1024))
+        ),
+        debug: bool = os.getenv("SMTP_DEBUG", "").lower() in ("1", "true", "yes"),
     ):
         self.smtp_server = smtp_server
         self.smtp_port = smtp_port
         self.smtp_user = smtp_user
         self.smtp_password = smtp_password
         self.sender_email = sender_email or smtp_user
+        # 附件总大小超过该值时流式编码发送，避免整封邮件驻留内存
+        self.stream_threshold = stream_threshold
+        # 是否输出SMTP协议调试日志（会包含完整邮件内容，仅排查问题时开启）
+        self.debug = debug
 
     @property
     def is_configured(self) -> bool:
@@ -48,8 +114,8 @@ class EmailConfig:
         )
 
 
-class EmailService:
-    """邮件服务类"""
+class BaseEmailService:
+    """同步和异步邮件服务共用的配置检查、参数校验和邮件构建"""
 
     def __init__(self, config: EmailConfig):
         self.config = config
@@ -59,6 +125,63 @@ class EmailService:
             f"初始化邮件服务: 服务器={config.smtp_server}, 端口={config.smtp_port}"
         )
 
+    def _validate(self, email: OutgoingEmail) -> None:
+        """校验主题、收件人和附件，不通过时抛出ValueError/FileNotFoundError"""
+        # 参数验证
+        if not email.subject:
+            raise ValueError("邮件主题不能为空")
+
+        to_list = email.to_list
+        logger.info(f"准备发送邮件给: {', '.join(to_list)}")
+
+        # 验证所有邮箱格式
+        for address in to_list:
+            if not re.match(r"[^@]+@[^@]+\.[^@]+", address):
+                raise ValueError(f"无效的邮箱地址: {address}")
+
+        # 验证附件
+        if email.attachments:
+            logger.info(f"处理附件: {', '.join(email.attachments)}")
+            for attachment_path in email.attachments:
+                if not artifact_exists(attachment_path):
+                    raise FileNotFoundError(f"附件文件不存在: {attachment_path}")
+
+    def _build_message(self, email: OutgoingEmail) -> MIMEMultipart:
+        """在内存中构建完整邮件，用于小附件"""
+        msg = MIMEMultipart()
+        msg["From"] = email.sender or self.config.sender_email
+        msg["To"] = ", ".join(email.to_list)
+        msg["Subject"] = email.subject
+
+        # 添加邮件正文
+        msg.attach(MIMEText(email.body, email.body_type, "utf-8"))
+        logger.info(f"已添加邮件正文，类型: {email.body_type}")
+
+        # 添加附件
+        for attachment_path in email.attachments or []:
+            with open_artifact(attachment_path) as f:
+                attachment = MIMEApplication(f.read())
+            filename = artifact_name(attachment_path)
+            attachment.add_header(
+                "Content-Disposition", "attachment", filename=filename
+            )
+            msg.attach(attachment)
+            logger.info(f"已添加附件: {filename}")
+        return msg
+
+
+class EmailService(BaseEmailService):
+    """邮件服务类"""
+
+    def __init__(self, config: EmailConfig, pool: Optional[SMTPConnectionPool] = None):
+        """
+        Args:
+            config: 邮件配置
+            pool: 可选，SMTP连接池；为None时每次发送单独建立连接
+        """
+        super().__init__(config)
+        self.pool = pool
+
     def send_email(
         self,
         to_email: Union[str, List[str]],
@@ -74,7 +197,7 @@ class EmailService:
             to_email: 收件人邮箱（单个字符串或列表）
             subject: 邮件主题
             body: 邮件正文
-            attachments: 附件文件路径列表
+            attachments: 附件文件路径或产物URI列表
             body_type: 邮件正文类型（plain或html）
 
         Returns:
@@ -85,100 +208,209 @@ class EmailService:
             FileNotFoundError: 附件文件不存在
             RuntimeError: 发送失败
         """
-        # 参数验证
-        if not subject:
-            raise ValueError("邮件主题不能为空")
+        email = OutgoingEmail(to_email, subject, body, attachments, body_type)
+        self._validate(email)
 
-        # 转换邮箱地址为列表格式
-        to_list = [to_email] if isinstance(to_email, str) else to_email
-        logger.info(f"准备发送邮件给: {', '.join(to_list)}")
+        try:
+            deliver = self._make_delivery(email)
+            # 连接SMTP服务器并发送
+            if self.pool is not None:
+                self.pool.send(deliver)
+            else:
+                with self._connect() as server:
+                    deliver(server)
+            logger.info("邮件发送成功")
+            return True
+        except smtplib.SMTPResponseException as e:
+            if e.smtp_code == -1 and e.smtp_error == b"\x00\x00\x00":
+                logger.warning("SMTP QUIT阶段异常，但邮件已发送成功")
+                return True
+            error_msg = f"SMTP错误: {e.smtp_code} - {e.smtp_error}"
+            logger.error(error_msg)
+            raise RuntimeError(error_msg)
+        except Exception as e:
+            error_msg = f"发送邮件失败: {str(e)}"
+            logger.error(error_msg)
+            raise RuntimeError(error_msg)
 
-        # 验证所有邮箱格式
-        for email in to_list:
-            if not re.match(r"[^@]+@[^@]+\.[^@]+", email):
-                raise ValueError(f"无效的邮箱地址: {email}")
+    def send_many(
+        self, emails: List[Union[OutgoingEmail, dict]]
+    ) -> List[Union[bool, Exception]]:
+        """
+        批量发送邮件：按发件人分组，每组在同一个SMTP会话中依次发送
 
-        # 验证附件
-        if attachments:
-            logger.info(f"处理附件: {', '.join(attachments)}")
-            for attachment_path in attachments:
-                if not os.path.exists(attachment_path):
-                    raise FileNotFoundError(f"附件文件不存在: {attachment_path}")
+        Args:
+            emails: 待发送邮件列表，元素为OutgoingEmail或同名字段的字典
 
-        try:
-            msg = MIMEMultipart()
-            msg["From"] = self.config.sender_email
-            msg["To"] = ", ".join(to_list)
-            msg["Subject"] = subject
-
-            # 添加邮件正文
-            msg.attach(MIMEText(body, body_type, "utf-8"))
-            logger.info(f"已添加邮件正文，类型: {body_type}")
-
-            # 添加附件
-            if attachments:
-                for attachment_path in attachments:
-                    with open(attachment_path, "rb") as f:
-                        attachment = MIMEApplication(f.read())
-                        filename = Path(attachment_path).name
-                        attachment.add_header(
-                            "Content-Disposition", "attachment", filename=filename
+        Returns:
+            List: 与输入顺序一致的结果，成功为True，失败为对应的异常
+                （参数错误为ValueError/FileNotFoundError，发送失败为RuntimeError）
+        """
+        emails = [
+            e if isinstance(e, OutgoingEmail) else OutgoingEmail(**e) for e in emails
+        ]
+        results: List[Union[bool, Exception]] = [None] * len(emails)
+        groups: Dict[str, List[int]] = {}
+        for index, email in enumerate(emails):
+            try:
+                self._validate(email)
+            except (ValueError, FileNotFoundError) as e:
+                results[index] = e
+                continue
+            sender = email.sender or self.config.sender_email
+            groups.setdefault(sender, []).append(index)
+
+        for sender, indexes in groups.items():
+            logger.info(f"发件人 {sender} 共 {len(indexes)} 封邮件")
+            pending = list(indexes)
+            retried = set()
+            while pending:
+                try:
+                    with self._session() as server:
+                        while pending:
+                            index = pending[0]
+                            try:
+                                self._make_delivery(emails[index])(server)
+                                results[index] = True
+                            except smtplib.SMTPServerDisconnected:
+                                raise
+                            except Exception as e:
+                                results[index] = RuntimeError(f"发送邮件失败: {str(e)}")
+                            pending.pop(0)
+                except smtplib.SMTPServerDisconnected as e:
+                    # 会话中途断开：换新会话重试当前这封一次，其余继续发送
+                    if pending and pending[0] in retried:
+                        results[pending.pop(0)] = RuntimeError(
+                            f"发送邮件失败: {str(e)}"
                         )
-                        msg.attach(attachment)
-                        logger.info(f"已添加附件: {filename}")
+                    elif pending:
+                        retried.add(pending[0])
+                except Exception as e:
+                    # 无法建立会话：该发件人剩余邮件全部失败
+                    for index in pending:
+                        results[index] = RuntimeError(f"发送邮件失败: {str(e)}")
+                    pending = []
+        sent = sum(1 for r in results if r is True)
+        logger.info(f"批量发送完成: 成功 {sent}/{len(emails)}")
+        return results
 
-            # 连接SMTP服务器并发送
-            logger.info("正在连接SMTP服务器...")
+    @contextmanager
+    def _connect(self) -> Iterator[smtplib.SMTP]:
+        """单独建立一次性的SMTP连接并登录，退出时QUIT"""
+        logger.info("正在连接SMTP服务器...")
+        with stage("smtp_connect"):
             if self.config.smtp_port == 465:
                 # 使用SSL连接
-                try:
-                    with smtplib.SMTP_SSL(
-                        self.config.smtp_server, self.config.smtp_port
-                    ) as server:
-                        server.set_debuglevel(1)  # 开启SMTP debug日志
-                        logger.info("使用SSL连接SMTP服务器")
-                        server.login(self.config.smtp_user, self.config.smtp_password)
-                        logger.info("SMTP登录成功")
-                        server.send_message(msg)
-                        logger.info("邮件发送成功")
-                    return True
-                except smtplib.SMTPResponseException as e:
-                    if e.smtp_code == -1 and e.smtp_error == b"\x00\x00\x00":
-                        logger.warning("SMTP QUIT阶段异常，但邮件已发送成功")
-                        return True
-                    error_msg = f"SMTP错误: {e.smtp_code} - {e.smtp_error}"
-                    logger.error(error_msg)
-                    raise RuntimeError(error_msg)
-                except Exception as e:
-                    error_msg = f"发送邮件失败: {str(e)}"
-                    logger.error(error_msg)
-                    raise RuntimeError(error_msg)
+                smtp = smtplib.SMTP_SSL(self.config.smtp_server, self.config.smtp_port)
+                logger.info("使用SSL连接SMTP服务器")
             else:
                 # 使用TLS连接
-                try:
-                    with smtplib.SMTP(
-                        self.config.smtp_server, self.config.smtp_port
-                    ) as server:
-                        server.set_debuglevel(1)  # 开启SMTP debug日志
-                        logger.info("使用TLS连接SMTP服务器")
-                        server.starttls()
-                        server.login(self.config.smtp_user, self.config.smtp_password)
-                        logger.info("SMTP登录成功")
-                        server.send_message(msg)
-                        logger.info("邮件发送成功")
-                    return True
-                except smtplib.SMTPResponseException as e:
-                    if e.smtp_code == -1 and e.smtp_error == b"\x00\x00\x00":
-                        logger.warning("SMTP QUIT阶段异常，但邮件已发送成功")
-                        return True
-                    error_msg = f"SMTP错误: {e.smtp_code} - {e.smtp_error}"
-                    logger.error(error_msg)
-                    raise RuntimeError(error_msg)
-                except Exception as e:
-                    error_msg = f"发送邮件失败: {str(e)}"
-                    logger.error(error_msg)
-                    raise RuntimeError(error_msg)
-        except Exception as e:
-            error_msg = f"发送邮件失败: {str(e)}"
-            logger.error(error_msg)
-            raise RuntimeError(error_msg)
+                smtp = smtplib.SMTP(self.config.smtp_server, self.config.smtp_port)
+                logger.info("使用TLS连接SMTP服务器")
+        with smtp as server:
+            if self.config.debug:
+                server.set_debuglevel(1)
+            with stage("smtp_login"):
+                if self.config.smtp_port != 465:
+                    server.starttls()
+                server.login(self.config.smtp_user, self.config.smtp_password)
+            logger.info("SMTP登录成功")
+            yield server
+
+    def _session(self):
+        """取得一个可连续发送多封邮件的会话：有连接池时从池中取用"""
+        if self.pool is not None:
+            return self.pool.connection()
+        return self._connect()
+
+    def _make_delivery(self, email: OutgoingEmail) -> Callable[[smtplib.SMTP], None]:
+        """准备邮件内容，返回在已登录会话上完成发送的函数"""
+        total_size = sum(artifact_size(a) for a in email.attachments or [])
+        if email.attachments and total_size > self.config.stream_threshold:
+            logger.info(f"附件共 {total_size} 字节，使用流式发送")
+            send = lambda server: self._send_streaming(server, email)
+        else:
+            msg = self._build_message(email)
+            send = lambda server: server.send_message(msg)
+
+        def deliver(server: smtplib.SMTP) -> None:
+            with stage("smtp_send"):
+                send(server)
+
+        return deliver
+
+    def _iter_message(self, email: OutgoingEmail) -> Iterator[bytes]:
+        """
+        逐块生成邮件的原始字节（CRLF换行），附件边读边编码，
+        内存占用与附件大小无关。每块都从行首开始、以换行结束。
+        """
+        boundary = "===============" + make_msgid().strip("<>").split("@")[0]
+        headers = EmailMessage(policy=SMTP_POLICY)
+        headers["From"] = email.sender or self.config.sender_email
+        headers["To"] = ", ".join(email.to_list)
+        headers["Subject"] = email.subject
+        headers["MIME-Version"] = "1.0"
+        headers["Content-Type"] = f'multipart/mixed; boundary="{boundary}"'
+        yield _fold_headers(headers) + b"\r\n"
+
+        delimiter = f"--{boundary}\r\n".encode("ascii")
+        yield delimiter
+        yield MIMEText(email.body, email.body_type, "utf-8").as_bytes(
+            policy=SMTP_POLICY
+        )
+        yield b"\r\n"
+
+        for attachment_path in email.attachments:
+            filename = artifact_name(attachment_path)
+            part = EmailMessage(policy=SMTP_POLICY)
+            part["Content-Type"] = "application/octet-stream"
+            part["MIME-Version"] = "1.0"
+            part["Content-Transfer-Encoding"] = "base64"
+            part.add_header("Content-Disposition", "attachment", filename=filename)
+            yield delimiter
+            yield _fold_headers(part) + b"\r\n"
+            with open_artifact(attachment_path) as f:
+                yield from _iter_base64_lines(f)
+            logger.info(f"已流式发送附件: {filename}")
+
+        yield f"--{boundary}--\r\n".encode("ascii")
+
+    def _send_streaming(self, server: smtplib.SMTP, email: OutgoingEmail) -> None:
+        """
+        逐块写入SMTP DATA，替代send_message。
+
+        send_message需要先把整封邮件序列化为字节串，附件在内存中会同时存在
+        原文、base64编码和序列化结果三份。
+        """
+        sender = email.sender or self.config.sender_email
+        to_list = email.to_list
+        server.ehlo_or_helo_if_needed()
+        # DATA之前被拒绝时先RSET结束本次事务，会话才能继续发送下一封（与sendmail一致）
+        code, resp = server.mail(sender)
+        if code != 250:
+            _rset(server)
+            raise smtplib.SMTPSenderRefused(code, resp, sender)
+        refused = {}
+        for recipient in to_list:
+            code, resp = server.rcpt(recipient)
+            if code not in (250, 251):
+                refused[recipient] = (code, resp)
+        if len(refused) == len(to_list):
+            _rset(server)
+            raise smtplib.SMTPRecipientsRefused(refused)
+        code, resp = server.docmd("data")
+        if code != 354:
+            _rset(server)
+            raise smtplib.SMTPDataError(code, resp)
+        try:
+            for chunk in self._iter_message(email):
+                # 行首的"."需要转义（RFC 5321 4.5.2）
+                server.send(_DOT_LINE.sub(b"..", chunk))
+        except Exception:
+            # DATA阶段中断后会话无法复用，直接断开
+            server.close()
+            raise
+        server.send(b".\r\n")
+        code, resp = server.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, resp)
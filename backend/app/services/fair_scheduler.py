@@ -0,0 +1,401 @@
+"""
+渲染任务公平调度模块
+
+Celery队列按先进先出执行，一个用户一次提交几百个链接时其他人的请求会排在后面。
+启用后渲染任务链不直接发布到Celery，而是先放入Redis中按租户（API Key或邮箱）
+划分的待调度队列，由调度器在渲染worker有空位时逐个发布：
+
+- 两条通道：interactive（单个请求）优先，bulk每FAIR_BULK_SHARE次发布至少轮到
+  一次，避免饿死；同一租户在interactive中积压超过FAIR_INTERACTIVE_BURST个任务时
+  （如逐个提交大量链接），后续任务自动降入bulk
+- 通道内各租户按加权轮转（weighted round-robin），每轮连续发布权重个任务
+- 已发布未完成的任务不超过FAIR_DISPATCH_WINDOW个，Celery渲染队列保持很短，
+  新的单个请求最多等待窗口内的任务
+- 准入控制：租户或全局待调度任务超过上限时拒绝，按当前队列深度和
+  渲染耗时的滑动平均估算重试等待时间
+
+批量提交（chord）不经过上述队列，只做准入控制：每个租户尚未渲染完的链接数
+不超过FAIR_BATCH_MAX_PENDING_URLS，批量渲染任务结束时释放。
+
+调度在三个时机进行：提交任务时、渲染任务结束时（task_postrun）和
+渲染worker启动时。发布时恢复提交请求的trace context，任务不会挂到恰好触发调度的
+请求或任务的trace下。Redis不可用时降级为直接发布到Celery。
+"""
+
+import hashlib
+import json
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import redis
+from app.core import tracing
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+LANES = ("interactive", "bulk")
+
+# 原子地做准入检查并入队
+# ARGV: 前缀, 租户, 通道, 任务JSON, 权重, 突发上限, 租户上限, 全局上限
+# 返回 {1, 实际通道} 或 {0, 全局待调度数, 租户待调度数}
+_SUBMIT_SCRIPT = """
+local prefix, tenant = ARGV[1], ARGV[2]
+local pending_key = prefix .. ':pending'
+local interactive = prefix .. ':jobs:interactive:' .. tenant
+local bulk = prefix .. ':jobs:bulk:' .. tenant
+local total = tonumber(redis.call('GET', pending_key) or '0')
+local mine = redis.call('LLEN', interactive) + redis.call('LLEN', bulk)
+if total >= tonumber(ARGV[8]) or mine >= tonumber(ARGV[7]) then
+    return {0, total, mine}
+end
+local lane = ARGV[3]
+if lane == 'interactive' and redis.call('LLEN', interactive) >= tonumber(ARGV[6]) then
+    lane = 'bulk'
+end
+local jobs = prefix .. ':jobs:' .. lane .. ':' .. tenant
+if redis.call('LLEN', jobs) == 0 then
+    redis.call('RPUSH', prefix .. ':ring:' .. lane, tenant)
+end
+redis.call('RPUSH', jobs, ARGV[4])
+redis.call('HSET', prefix .. ':weight', tenant, ARGV[5])
+redis.call('INCR', pending_key)
+return {1, lane}
+"""
+
+# 原子地取出下一个应发布的任务并记为已发布
+# ARGV: 前缀, 窗口, 当前时间, 已发布任务的超时, bulk最少占比
+# 返回任务JSON；窗口已满或没有任务时返回false；遇到空的租户队列时返回''
+_DISPATCH_SCRIPT = """
+local prefix, now = ARGV[1], tonumber(ARGV[3])
+local inflight = prefix .. ':inflight'
+redis.call('ZREMRANGEBYSCORE', inflight, '-inf', now - tonumber(ARGV[4]))
+if redis.call('ZCARD', inflight) >= tonumber(ARGV[2]) then return false end
+local has_interactive = redis.call('LLEN', prefix .. ':ring:interactive') > 0
+local has_bulk = redis.call('LLEN', prefix .. ':ring:bulk') > 0
+local lane
+if has_interactive and has_bulk then
+    local served = redis.call('INCR', prefix .. ':served')
+    if served % tonumber(ARGV[5]) == 0 then lane = 'bulk' else lane = 'interactive' end
+elseif has_interactive then
+    lane = 'interactive'
+elseif has_bulk then
+    lane = 'bulk'
+else
+    return false
+end
+local ring = prefix .. ':ring:' .. lane
+local credits = prefix .. ':credit:' .. lane
+local tenant = redis.call('LINDEX', ring, 0)
+local jobs = prefix .. ':jobs:' .. lane .. ':' .. tenant
+local job = redis.call('LPOP', jobs)
+local credit = tonumber(redis.call('HGET', credits, tenant))
+    or tonumber(redis.call('HGET', prefix .. ':weight', tenant)) or 1
+credit = credit - 1
+if redis.call('LLEN', jobs) == 0 then
+    redis.call('LPOP', ring)
+    redis.call('HDEL', credits, tenant)
+elseif credit <= 0 then
+    redis.call('RPUSH', ring, redis.call('LPOP', ring))
+    redis.call('HDEL', credits, tenant)
+else
+    redis.call('HSET', credits, tenant, credit)
+end
+if not job then return '' end
+redis.call('DECR', prefix .. ':pending')
+redis.call('ZADD', inflight, now, cjson.decode(job)['id'])
+return job
+"""
+
+# 原子地释放已发布任务占用的窗口，并更新单个任务耗时的滑动平均
+# ARGV: 前缀, 任务ID, 当前时间, 平滑系数
+_COMPLETE_SCRIPT = """
+local prefix = ARGV[1]
+local inflight = prefix .. ':inflight'
+local started = redis.call('ZSCORE', inflight, ARGV[2])
+if not started then return 0 end
+redis.call('ZREM', inflight, ARGV[2])
+local elapsed = tonumber(ARGV[3]) - tonumber(started)
+local average = tonumber(redis.call('GET', prefix .. ':average'))
+if average then
+    local alpha = tonumber(ARGV[4])
+    elapsed = average * (1 - alpha) + elapsed * alpha
+end
+redis.call('SET', prefix .. ':average', tostring(elapsed))
+return 1
+"""
+
+# 原子地做批量提交的准入检查并增加租户的未完成链接数
+# ARGV: 前缀, 租户, 链接数, 上限, 过期时间
+# 返回 {1, 提交后的未完成数} 或 {0, 当前未完成数}
+_ADMIT_URLS_SCRIPT = """
+local key = ARGV[1] .. ':urls:' .. ARGV[2]
+local mine = tonumber(redis.call('GET', key) or '0')
+local count = tonumber(ARGV[3])
+if mine > 0 and mine + count > tonumber(ARGV[4]) then return {0, mine} end
+redis.call('INCRBY', key, count)
+redis.call('EXPIRE', key, ARGV[5])
+return {1, mine + count}
+"""
+
+# 原子地减少租户的未完成链接数，减到0时删除
+# ARGV: 前缀, 租户, 链接数
+_RELEASE_URLS_SCRIPT = """
+local key = ARGV[1] .. ':urls:' .. ARGV[2]
+local left = redis.call('DECRBY', key, ARGV[3])
+if left <= 0 then redis.call('DEL', key) end
+return left
+"""
+
+
+@dataclass
+class Admission:
+    """提交结果：accepted为False时表示被准入控制拒绝，retry_after为建议等待秒数"""
+
+    accepted: bool
+    task_id: Optional[str] = None
+    lane: Optional[str] = None
+    retry_after: int = 0
+
+
+def tenant_of(email: str, api_key: Optional[str] = None) -> str:
+    """
+    按API Key（优先）或邮箱确定租户
+
+    API Key只以哈希形式写入Redis。
+    """
+    if api_key:
+        return "key:" + hashlib.sha1(api_key.encode("utf-8")).hexdigest()[:16]
+    return "email:" + email.strip().lower()
+
+
+def weight_of(email: str, api_key: Optional[str] = None) -> int:
+    """租户权重：FAIR_TENANT_WEIGHTS中以API Key或邮箱为键的配置，默认1"""
+    weights = settings.FAIR_TENANT_WEIGHTS
+    if api_key and api_key in weights:
+        return weights[api_key]
+    return weights.get(email.strip().lower(), 1)
+
+
+class FairScheduler:
+    """
+    Redis中的渲染任务公平调度器
+
+    任务以Celery签名（通常是渲染+发邮件的任务链）提交，签名提交时即冻结，
+    任务ID在发布前后保持不变；第一个任务的ID用于在其结束时释放窗口。
+    """
+
+    PREFIX = "wedocx:sched"
+
+    def __init__(self, client: Optional[redis.Redis] = None, app=None):
+        self.client = client or redis.Redis.from_url(
+            settings.REDIS_URL, socket_connect_timeout=1, socket_timeout=2
+        )
+        self.app = app
+        self._submit = self.client.register_script(_SUBMIT_SCRIPT)
+        self._dispatch = self.client.register_script(_DISPATCH_SCRIPT)
+        self._complete = self.client.register_script(_COMPLETE_SCRIPT)
+        self._admit_urls = self.client.register_script(_ADMIT_URLS_SCRIPT)
+        self._release_urls = self.client.register_script(_RELEASE_URLS_SCRIPT)
+
+    def _celery(self):
+        if self.app is None:
+            from app.celery_app import celery_app
+
+            self.app = celery_app
+        return self.app
+
+    def submit(
+        self,
+        signature,
+        tenant: str,
+        lane: str = "interactive",
+        weight: int = 1,
+    ) -> Admission:
+        """
+        提交一个渲染任务（链）
+
+        :param signature: Celery签名或任务链
+        :param tenant: 租户，见tenant_of
+        :param lane: interactive或bulk
+        :param weight: 租户权重，见weight_of
+        :return: Admission；Redis不可用时直接发布到Celery
+        """
+        if lane not in LANES:
+            raise ValueError(f"未知的调度通道: {lane}")
+        result = signature.freeze()
+        first = signature.tasks[0] if hasattr(signature, "tasks") else signature
+        # 记录提交时的trace context，发布时恢复
+        carrier: dict = {}
+        tracing.inject(carrier)
+        job = json.dumps({"id": first.id, "sig": signature, "trace": carrier})
+        try:
+            reply = self._submit(
+                args=[
+                    self.PREFIX,
+                    tenant,
+                    lane,
+                    job,
+                    max(1, int(weight)),
+                    settings.FAIR_INTERACTIVE_BURST,
+                    settings.FAIR_MAX_PENDING_PER_TENANT,
+                    settings.FAIR_MAX_PENDING,
+                ]
+            )
+        except redis.RedisError as e:
+            logger.warning(f"调度器不可用，直接发布任务: {e}")
+            signature.apply_async()
+            return Admission(True, str(result.id), lane)
+
+        if not int(reply[0]):
+            retry_after = self.estimate_wait(int(reply[1]))
+            logger.info(
+                f"拒绝提交: 租户={tenant}, 待调度={reply[1]}, 租户待调度={reply[2]}, "
+                f"建议{retry_after}秒后重试"
+            )
+            return Admission(False, retry_after=retry_after)
+        accepted_lane = reply[1].decode() if isinstance(reply[1], bytes) else reply[1]
+        self.pump()
+        return Admission(True, str(result.id), accepted_lane)
+
+    def pump(self) -> int:
+        """
+        在窗口允许的范围内发布待调度任务
+
+        :return: 本次发布的任务数
+        """
+        dispatched = 0
+        while True:
+            try:
+                job = self._dispatch(
+                    args=[
+                        self.PREFIX,
+                        settings.FAIR_DISPATCH_WINDOW,
+                        time.time(),
+                        settings.FAIR_INFLIGHT_TTL,
+                        max(1, settings.FAIR_BULK_SHARE),
+                    ]
+                )
+            except redis.RedisError as e:
+                logger.warning(f"调度器不可用: {e}")
+                return dispatched
+            if job is None:
+                return dispatched
+            if not job:
+                continue
+            entry = json.loads(job)
+            try:
+                with tracing.use_context(entry.get("trace")):
+                    self._celery().signature(entry["sig"]).apply_async()
+            except Exception as e:
+                logger.error(f"发布任务 {entry['id']} 失败: {e}")
+                self.complete(entry["id"], pump=False)
+                continue
+            dispatched += 1
+
+    def complete(self, task_id: str, pump: bool = True) -> bool:
+        """
+        渲染任务结束（成功或失败）时释放其窗口，并发布下一个任务
+
+        :return: 该任务是否由调度器发布
+        """
+        try:
+            released = bool(
+                self._complete(
+                    args=[self.PREFIX, task_id, time.time(), settings.FAIR_EWMA_ALPHA]
+                )
+            )
+        except redis.RedisError as e:
+            logger.warning(f"调度器不可用: {e}")
+            return False
+        if released and pump:
+            self.pump()
+        return released
+
+    def admit_urls(self, tenant: str, count: int) -> Admission:
+        """
+        批量提交的准入控制：租户尚未渲染完的链接数加上本次不超过上限时接受并计入
+
+        :param tenant: 租户，见tenant_of
+        :param count: 本次提交的链接数
+        :return: Admission；拒绝时retry_after按该租户未完成的批量渲染任务数粗略估算，
+            Redis不可用时接受
+        """
+        try:
+            reply = self._admit_urls(
+                args=[
+                    self.PREFIX,
+                    tenant,
+                    count,
+                    settings.FAIR_BATCH_MAX_PENDING_URLS,
+                    settings.FAIR_BATCH_PENDING_TTL,
+                ]
+            )
+        except redis.RedisError as e:
+            logger.warning(f"调度器不可用，跳过批量准入检查: {e}")
+            return Admission(True)
+        if int(reply[0]):
+            return Admission(True)
+        chunks = math.ceil(int(reply[1]) / max(1, settings.BATCH_CHUNK_SIZE))
+        retry_after = self.estimate_wait(chunks)
+        logger.info(
+            f"拒绝批量提交: 租户={tenant}, 未完成链接={reply[1]}, "
+            f"本次={count}, 建议{retry_after}秒后重试"
+        )
+        return Admission(False, retry_after=retry_after)
+
+    def release_urls(self, tenant: str, count: int) -> None:
+        """批量渲染任务结束（成功或失败）时释放其链接数"""
+        try:
+            self._release_urls(args=[self.PREFIX, tenant, count])
+        except redis.RedisError as e:
+            logger.warning(f"调度器不可用: {e}")
+
+    def stats(self) -> dict:
+        """待调度数、已发布未完成数和单个任务的平均耗时（秒）"""
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(f"{self.PREFIX}:pending")
+        pipe.zcard(f"{self.PREFIX}:inflight")
+        pipe.get(f"{self.PREFIX}:average")
+        pending, inflight, average = pipe.execute()
+        return {
+            "pending": int(pending or 0),
+            "inflight": int(inflight or 0),
+            "average_seconds": (
+                float(average) if average else settings.FAIR_DEFAULT_RENDER_SECONDS
+            ),
+        }
+
+    def estimate_wait(self, pending: Optional[int] = None) -> int:
+        """
+        估算新任务需要等待的秒数：排在前面的任务数 × 平均耗时 / 窗口
+
+        平均耗时从发布到结束计算，包含在Celery队列中的等待，
+        因此窗口大于worker子进程数时估算仍然成立。
+        """
+        try:
+            current = self.stats()
+        except redis.RedisError as e:
+            logger.warning(f"调度器不可用: {e}")
+            return settings.FAIR_RETRY_AFTER_MAX
+        if pending is None:
+            pending = current["pending"]
+        ahead = pending + current["inflight"]
+        window = max(1, settings.FAIR_DISPATCH_WINDOW)
+        seconds = ahead * current["average_seconds"] / window
+        return min(settings.FAIR_RETRY_AFTER_MAX, max(1, math.ceil(seconds)))
+
+
+_scheduler: Optional[FairScheduler] = None
+
+
+def get_fair_scheduler() -> Optional[FairScheduler]:
+    """获取进程级调度器，未启用时返回None"""
+    global _scheduler
+    if not settings.FAIR_SCHEDULER_ENABLED:
+        return None
+    if _scheduler is None:
+        _scheduler = FairScheduler()
+    return _scheduler
@@ -0,0 +1,278 @@
+"""
+DOCX图片处理模块
+
+DOCX中的图片直接取自已经加载完成的页面：ImageCapture在页面打开前监听
+图片响应，页面稳定后按<img>在文档中的顺序读取响应内容，不再重新下载。
+prepare_images按内容哈希去重，在线程池中把图片缩放到正文显示尺寸对应的
+DPI并重新编码（Word不支持的格式如WEBP同样转换），最后按文档顺序把
+图片总大小控制在单个文档的预算内。
+"""
+
+import asyncio
+import base64
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import unquote_to_bytes
+
+from app.core.config import settings
+from playwright.async_api import Page, Response
+
+logger = logging.getLogger(__name__)
+
+# 网页中1英寸对应的CSS像素数
+_CSS_PX_PER_INCH = 96
+_EMU_PER_INCH = 914400
+# python-docx能直接嵌入的格式，其余格式需要重新编码
+_DOCX_FORMATS = frozenset(["PNG", "JPEG", "GIF"])
+
+# 按文档顺序取出<img>的src（懒加载图片取data-src）及浏览器实际加载的地址
+_IMAGE_SOURCES_JS = """
+() => Array.from(document.querySelectorAll('body img'), img => {
+    const src = img.getAttribute('src') || img.getAttribute('data-src');
+    let url = null;
+    try {
+        url = src ? new URL(src, document.baseURI).href : null;
+    } catch (e) {}
+    return [src, img.currentSrc || url, url];
+})
+"""
+
+
+class EmbeddedImage(NamedTuple):
+    """处理后待嵌入DOCX的图片"""
+
+    data: bytes
+    # 显示宽度（EMU），高度按图片比例计算
+    width_emu: int
+
+
+def _import_pil():
+    try:
+        from PIL import Image
+    except ImportError:
+        raise RuntimeError("DOCX图片嵌入需要安装Pillow: pip install Pillow")
+    return Image
+
+
+def _decode_data_uri(uri: str) -> Optional[bytes]:
+    """解码data:URI，格式不正确时返回None"""
+    header, sep, payload = uri.partition(",")
+    if not sep:
+        return None
+    try:
+        if header.endswith(";base64"):
+            return base64.b64decode(payload)
+        return unquote_to_bytes(payload)
+    except ValueError:
+        return None
+
+
+class ImageCapture:
+    """
+    记录页面加载过程中的图片响应
+
+    需要在page.goto之前attach，之后由collect按<img>读取对应的响应内容。
+    经过重定向的图片以最初请求的地址和最终地址都能找到。
+    """
+
+    def __init__(self):
+        self._responses: Dict[str, Response] = {}
+
+    def attach(self, page: Page) -> "ImageCapture":
+        page.on("response", self._on_response)
+        return self
+
+    def _on_response(self, response: Response) -> None:
+        request = response.request
+        if request.resource_type != "image" or not response.ok:
+            return
+        self._responses[response.url] = response
+        while request is not None:
+            self._responses.setdefault(request.url, response)
+            request = request.redirected_from
+
+    async def collect(self, page: Page) -> Dict[str, bytes]:
+        """
+        读取页面中<img>对应的图片内容
+
+        :param page: 已加载完成的页面
+        :return: {src属性值: 图片内容}，按图片在文档中首次出现的顺序；
+            没有捕获到响应或读取失败的图片不在结果中
+        """
+        sources = await page.evaluate(_IMAGE_SOURCES_JS)
+        images: Dict[str, Optional[bytes]] = {}
+        pending: Dict[str, Response] = {}
+        for src, *urls in sources:
+            if not src or src in images:
+                continue
+            if src.startswith("data:"):
+                images[src] = _decode_data_uri(src)
+                continue
+            response = next(
+                (self._responses[url] for url in urls if url in self._responses),
+                None,
+            )
+            images[src] = None
+            if response is not None:
+                pending[src] = response
+
+        # 同一个响应只读取一次
+        bodies: Dict[int, object] = {}
+        unique = list({id(r): r for r in pending.values()}.values())
+        results = await asyncio.gather(
+            *(r.body() for r in unique), return_exceptions=True
+        )
+        for response, body in zip(unique, results):
+            bodies[id(response)] = body
+        for src, response in pending.items():
+            body = bodies[id(response)]
+            if isinstance(body, Exception):
+                logger.debug(f"读取图片失败: {src} {body}")
+            else:
+                images[src] = body
+
+        collected = {src: data for src, data in images.items() if data}
+        logger.info(f"页面图片 {len(images)} 张，取得内容 {len(collected)} 张")
+        return collected
+
+
+_image_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_image_executor() -> ThreadPoolExecutor:
+    """图片缩放/重新编码使用的线程池（进程级）"""
+    global _image_executor
+    if _image_executor is None:
+        _image_executor = ThreadPoolExecutor(
+            max_workers=max(1, settings.DOCX_IMAGE_WORKERS),
+            thread_name_prefix="docx-image",
+        )
+    return _image_executor
+
+
+def _has_alpha(img) -> bool:
+    return img.mode in ("RGBA", "LA", "PA") or (
+        img.mode == "P" and "transparency" in img.info
+    )
+
+
+def _encode(img, source_format: Optional[str], quality: int) -> bytes:
+    """带透明通道或原为PNG/GIF的图片编码为PNG，其余编码为JPEG"""
+    out = BytesIO()
+    if _has_alpha(img) or source_format in ("PNG", "GIF"):
+        if img.mode not in ("RGB", "RGBA", "L", "LA", "P"):
+            img = img.convert("RGBA")
+        img.save(out, "PNG")
+    else:
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.save(out, "JPEG", quality=quality)
+    return out.getvalue()
+
+
+def _process_image(
+    data: bytes, dpi: int, max_width_in: float, quality: int
+) -> Optional[EmbeddedImage]:
+    """
+    按显示尺寸缩放并编码为Word支持的格式
+
+    显示宽度取图片的CSS像素宽度，超过正文宽度时缩小到正文宽度；
+    像素数超过显示宽度×dpi时缩小，不需要缩小且格式可以直接嵌入时保留原始内容。
+    无法识别的图片（如SVG）返回None。
+    """
+    Image = _import_pil()
+    try:
+        with Image.open(BytesIO(data)) as img:
+            source_format = img.format
+            width, height = img.size
+            display_in = min(max_width_in, width / _CSS_PX_PER_INCH)
+            max_px = max(1, int(display_in * dpi))
+            if width > max_px:
+                size = (max_px, max(1, round(height * max_px / width)))
+                # JPEG解码时直接按1/2、1/4、1/8缩小，省去大部分解码和缩放开销
+                img.draft(img.mode, size)
+                if _has_alpha(img) and img.mode != "RGBA":
+                    img = img.convert("RGBA")
+                elif img.mode not in ("RGB", "RGBA", "L"):
+                    img = img.convert("RGB")
+                output = _encode(
+                    img.resize(size, Image.LANCZOS), source_format, quality
+                )
+            elif source_format in _DOCX_FORMATS:
+                output = data
+            else:
+                output = _encode(img, source_format, quality)
+    except Exception as e:
+        logger.debug(f"图片无法处理，跳过: {e}")
+        return None
+    return EmbeddedImage(output, int(display_in * _EMU_PER_INCH))
+
+
+def prepare_images(
+    images: Dict[str, bytes],
+    dpi: Optional[int] = None,
+    max_width_in: Optional[float] = None,
+    jpeg_quality: Optional[int] = None,
+    byte_budget: Optional[int] = None,
+) -> Dict[str, EmbeddedImage]:
+    """
+    去重、缩放并按预算筛选待嵌入的图片
+
+    Args:
+        images: {src: 原始图片内容}，按文档顺序
+        dpi: 目标DPI，默认取配置DOCX_IMAGE_DPI
+        max_width_in: 图片显示宽度上限（英寸），默认取配置DOCX_IMAGE_MAX_WIDTH_IN
+        jpeg_quality: JPEG编码质量，默认取配置DOCX_IMAGE_JPEG_QUALITY
+        byte_budget: 图片总字节数上限，默认取配置DOCX_IMAGE_BYTE_BUDGET；
+            内容相同的图片只计一次，按文档顺序放入，放不下的图片跳过
+
+    Returns:
+        Dict[str, EmbeddedImage]: {src: 处理后的图片}，内容相同的src对应同一个对象；
+            无法识别或超出预算的图片不在结果中
+
+    Raises:
+        RuntimeError: 未安装Pillow
+    """
+    _import_pil()
+    if byte_budget is None:
+        byte_budget = settings.DOCX_IMAGE_BYTE_BUDGET
+
+    # sha256 -> (原始内容, 引用它的src列表)
+    unique: Dict[str, tuple] = {}
+    for src, data in images.items():
+        digest = hashlib.sha256(data).hexdigest()
+        unique.setdefault(digest, (data, []))[1].append(src)
+
+    process = partial(
+        _process_image,
+        dpi=dpi or settings.DOCX_IMAGE_DPI,
+        max_width_in=max_width_in or settings.DOCX_IMAGE_MAX_WIDTH_IN,
+        quality=jpeg_quality or settings.DOCX_IMAGE_JPEG_QUALITY,
+    )
+    entries = list(unique.values())
+    processed: List[Optional[EmbeddedImage]] = list(
+        _get_image_executor().map(process, [data for data, _ in entries])
+    )
+
+    prepared: Dict[str, EmbeddedImage] = {}
+    used = skipped = 0
+    for (_, srcs), image in zip(entries, processed):
+        if image is None:
+            continue
+        if used + len(image.data) > byte_budget:
+            skipped += 1
+            continue
+        used += len(image.data)
+        for src in srcs:
+            prepared[src] = image
+
+    original = sum(len(data) for data, _ in entries)
+    logger.info(
+        f"DOCX图片: {len(images)} 张，去重后 {len(entries)} 张，"
+        f"{original // 1024}KB -> {used // 1024}KB，超出预算跳过 {skipped} 张"
+    )
+    return prepared
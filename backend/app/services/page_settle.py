@@ -0,0 +1,249 @@
+"""
+页面稳定检测模块
+
+替代固定时长的滚动等待：结合IntersectionObserver驱动的懒加载图片、
+网络请求空闲和DOM变更静默三个信号判断页面是否已经加载完成，
+每个信号都有独立的超时上限，并返回各阶段耗时供监控使用。
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+from app.core.config import settings
+from playwright.async_api import Page, Request
+
+logger = logging.getLogger(__name__)
+
+# 在页面内执行：逐屏滚动触发懒加载，等待图片加载完成和DOM静默
+_SETTLE_SCRIPT = """
+async (opts) => {
+    const now = () => performance.now();
+    const sleep = (ms) => new Promise(r => setTimeout(r, Math.max(0, ms)));
+    const nextFrame = () => new Promise(r => {
+        // 页面不可见时rAF不会触发，用定时器兜底
+        const timer = setTimeout(r, 50);
+        requestAnimationFrame(() => requestAnimationFrame(() => {
+            clearTimeout(timer);
+            r();
+        }));
+    });
+    const t0 = now();
+
+    let lastMutation = t0;
+    const mo = new MutationObserver(() => { lastMutation = now(); });
+    mo.observe(document, {
+        subtree: true, childList: true, attributes: true, characterData: true
+    });
+
+    // 图片进入视口附近时改为立即加载，并记录被看到的图片
+    const seen = new Set();
+    const io = new IntersectionObserver((entries) => {
+        for (const entry of entries) {
+            if (!entry.isIntersecting) continue;
+            const img = entry.target;
+            if (img.loading === 'lazy') img.loading = 'eager';
+            seen.add(img);
+            io.unobserve(img);
+        }
+    }, { rootMargin: '100% 0px' });
+    document.querySelectorAll('img').forEach(img => io.observe(img));
+
+    // 逐屏滚动，每步只等待两帧，让页面自身的懒加载逻辑有机会执行
+    const scrollDeadline = t0 + opts.scrollTimeout;
+    const step = Math.max(window.innerHeight || 0, 400);
+    let pos = 0;
+    let timedOut = [];
+    while (pos < document.body.scrollHeight) {
+        if (now() > scrollDeadline) { timedOut.push('scroll'); break; }
+        window.scrollTo(0, pos);
+        await nextFrame();
+        pos += step;
+    }
+    window.scrollTo(0, document.body.scrollHeight);
+    await nextFrame();
+    const tScroll = now();
+
+    // 页面脚本没来得及替换的data-src懒加载图片直接补上真实地址
+    let promoted = 0;
+    document.querySelectorAll('img[data-src]').forEach(img => {
+        const src = img.getAttribute('src') || '';
+        if (!src || src.startsWith('data:')) {
+            img.src = img.dataset.src;
+            promoted++;
+        }
+    });
+
+    const images = Array.from(document.images);
+    const loading = images.filter(img => !img.complete).map(img => new Promise(r => {
+        img.addEventListener('load', r, { once: true });
+        img.addEventListener('error', r, { once: true });
+    }));
+    let imagesDone = loading.length === 0;
+    if (!imagesDone) {
+        imagesDone = await Promise.race([
+            Promise.all(loading).then(() => true),
+            sleep(opts.imageTimeout).then(() => false),
+        ]);
+        if (!imagesDone) timedOut.push('images');
+    }
+    const tImages = now();
+
+    const domDeadline = tImages + opts.domTimeout;
+    while (now() - lastMutation < opts.domQuiet) {
+        if (now() >= domDeadline) { timedOut.push('dom'); break; }
+        await sleep(Math.min(opts.domQuiet - (now() - lastMutation), domDeadline - now()));
+    }
+    const tDom = now();
+
+    mo.disconnect();
+    io.disconnect();
+    window.scrollTo(0, 0);
+    return {
+        scroll_ms: tScroll - t0,
+        image_ms: tImages - tScroll,
+        dom_ms: tDom - tImages,
+        images_total: images.length,
+        images_seen: seen.size,
+        images_pending: images.filter(img => !img.complete).length,
+        lazy_promoted: promoted,
+        timed_out: timedOut,
+    };
+}
+"""
+
+
+@dataclass
+class SettleMetrics:
+    """页面稳定检测的各阶段耗时（毫秒）和图片统计"""
+
+    scroll_ms: float = 0.0
+    image_ms: float = 0.0
+    dom_ms: float = 0.0
+    network_ms: float = 0.0
+    total_ms: float = 0.0
+    images_total: int = 0
+    images_seen: int = 0
+    images_pending: int = 0
+    lazy_promoted: int = 0
+    timed_out: List[str] = field(default_factory=list)
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class NetworkTracker:
+    """
+    跟踪页面上尚未完成的网络请求
+
+    需要在page.goto之前创建，才能看到页面发出的全部请求。
+    """
+
+    def __init__(self, page: Page):
+        self._inflight = set()
+        self._last_activity = time.monotonic()
+        self._changed = asyncio.Event()
+        page.on("request", self._on_request)
+        page.on("requestfinished", self._on_done)
+        page.on("requestfailed", self._on_done)
+
+    @property
+    def inflight(self) -> int:
+        return len(self._inflight)
+
+    def _touch(self) -> None:
+        self._last_activity = time.monotonic()
+        self._changed.set()
+
+    def _on_request(self, request: Request) -> None:
+        self._inflight.add(request)
+        self._touch()
+
+    def _on_done(self, request: Request) -> None:
+        self._inflight.discard(request)
+        self._touch()
+
+    async def wait_for_idle(self, idle_ms: int, timeout_ms: int) -> bool:
+        """
+        等待没有进行中的请求且持续idle_ms毫秒
+
+        :return: 是否在超时前达到空闲
+        """
+        deadline = time.monotonic() + timeout_ms / 1000
+        while True:
+            now = time.monotonic()
+            if not self._inflight:
+                remaining = idle_ms / 1000 - (now - self._last_activity)
+                if remaining <= 0:
+                    return True
+            else:
+                remaining = deadline - now
+            wait = min(remaining, deadline - now)
+            if wait <= 0:
+                return False
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def wait_for_page_settled(
+    page: Page,
+    tracker: Optional[NetworkTracker] = None,
+    scroll_timeout_ms: int = None,
+    image_timeout_ms: int = None,
+    dom_quiet_ms: int = None,
+    dom_timeout_ms: int = None,
+    network_idle_ms: int = None,
+    network_timeout_ms: int = None,
+) -> SettleMetrics:
+    """
+    等待页面稳定：懒加载图片已加载、DOM不再变化、网络请求空闲。
+    未指定的上限取自配置中的 SETTLE_* 项。
+
+    :param page: 已完成导航的页面
+    :param tracker: 可选，导航前挂载的网络请求跟踪器，为None时跳过网络空闲检测
+    :return: 各阶段耗时
+    """
+    start = time.monotonic()
+    options = {
+        "scrollTimeout": scroll_timeout_ms or settings.SETTLE_SCROLL_TIMEOUT_MS,
+        "imageTimeout": image_timeout_ms or settings.SETTLE_IMAGE_TIMEOUT_MS,
+        "domQuiet": (
+            settings.SETTLE_DOM_QUIET_MS if dom_quiet_ms is None else dom_quiet_ms
+        ),
+        "domTimeout": dom_timeout_ms or settings.SETTLE_DOM_TIMEOUT_MS,
+    }
+    result = await page.evaluate(_SETTLE_SCRIPT, options) or {}
+    metrics = SettleMetrics(
+        scroll_ms=result.get("scroll_ms", 0.0),
+        image_ms=result.get("image_ms", 0.0),
+        dom_ms=result.get("dom_ms", 0.0),
+        images_total=result.get("images_total", 0),
+        images_seen=result.get("images_seen", 0),
+        images_pending=result.get("images_pending", 0),
+        lazy_promoted=result.get("lazy_promoted", 0),
+        timed_out=list(result.get("timed_out", [])),
+    )
+
+    if tracker is not None:
+        network_start = time.monotonic()
+        idle = await tracker.wait_for_idle(
+            (
+                settings.SETTLE_NETWORK_IDLE_MS
+                if network_idle_ms is None
+                else network_idle_ms
+            ),
+            network_timeout_ms or settings.SETTLE_NETWORK_TIMEOUT_MS,
+        )
+        metrics.network_ms = (time.monotonic() - network_start) * 1000
+        if not idle:
+            metrics.timed_out.append("network")
+
+    metrics.total_ms = (time.monotonic() - start) * 1000
+    if metrics.timed_out:
+        logger.warning(f"页面稳定检测超时: {metrics.timed_out}")
+    return metrics
@@ -1,22 +1,130 @@
 import asyncio
+import contextvars
+import logging
 import os
 import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Optional
+from functools import partial
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
 
-from playwright.async_api import Response, async_playwright
+from app.core import tracing
+from app.core.config import settings
+from app.core.metrics import RENDERS_IN_FLIGHT, observe_stage, stage
+from app.core.runtime import get_runtime
+from playwright.async_api import Page
 
+from .artifact_store import ArtifactStore
+from .asset_cache import get_asset_cache
+from .browser_pool import close_browser_pool, get_browser_pool
 from .document_service import convert_html_to_docx, convert_html_to_txt
+from .image_pipeline import ImageCapture
+from .page_settle import NetworkTracker, SettleMetrics, wait_for_page_settled
+from .request_filter import RequestFilter
+from .task_progress import advance
+
+logger = logging.getLogger(__name__)
 
 OUTPUT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../output"))
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# export_url支持的导出格式
+EXPORT_FORMATS = ("pdf", "docx", "txt")
+
 
 def sanitize_filename(name: str) -> str:
     # 移除非法字符，保留中英文、数字、下划线、短横线
     return re.sub(r"[^\w\u4e00-\u9fa5-]", "", name)
 
 
+_render_semaphore: Optional[asyncio.Semaphore] = None
+_render_semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _get_render_semaphore() -> asyncio.Semaphore:
+    """获取当前事件循环上限制进程内并发渲染数的信号量"""
+    global _render_semaphore, _render_semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _render_semaphore is None or _render_semaphore_loop is not loop:
+        _render_semaphore = asyncio.Semaphore(max(1, settings.RENDER_MAX_IN_FLIGHT))
+        _render_semaphore_loop = loop
+    return _render_semaphore
+
+
+@asynccontextmanager
+async def _settled_page(
+    url: str, image_capture: Optional[ImageCapture] = None
+) -> AsyncIterator[Page]:
+    """
+    从浏览器池取一个页面，打开url并等待页面稳定
+    :param image_capture: 可选，在访问页面前挂载，记录加载过程中的图片响应
+    :raises: RuntimeError 当页面加载失败时
+    """
+    pool = await get_browser_pool()
+    async with _get_render_semaphore(), pool.new_page() as page:
+        with RENDERS_IN_FLIGHT.track_inprogress(), tracing.span("page.render", url=url):
+            tracker = NetworkTracker(page)
+            # 路由处理器按注册顺序逆序执行：拦截器后注册，先于缓存判断
+            asset_cache = None
+            if settings.ASSET_CACHE_ENABLED:
+                asset_cache = await get_asset_cache().attach(page).install()
+            request_filter = None
+            if settings.REQUEST_FILTER_ENABLED:
+                request_filter = await RequestFilter(url).install(page)
+            if image_capture is not None:
+                image_capture.attach(page)
+
+            # 访问页面并等待加载
+            advance("navigating")
+            try:
+                with stage("navigation"):
+                    response = await page.goto(
+                        url, timeout=10000, wait_until="domcontentloaded"
+                    )
+                if not response:
+                    raise RuntimeError(f"页面加载失败: 无响应")
+                if not response.ok:
+                    raise RuntimeError(f"页面加载失败: HTTP {response.status}")
+                if response.status >= 400:
+                    raise RuntimeError(f"页面加载失败: HTTP {response.status}")
+            except Exception as e:
+                raise RuntimeError(f"页面访问失败: {str(e)}")
+
+            # 等待页面稳定：懒加载图片加载完成、DOM静默、网络空闲
+            advance("settling")
+            metrics = await wait_for_page_settled(page, tracker)
+            logger.info(f"页面稳定耗时 {metrics.total_ms:.0f}ms: {url} {metrics}")
+            _observe_settle(metrics)
+
+            yield page
+
+            if request_filter is not None:
+                logger.info(f"请求拦截统计: {url} {request_filter.stats}")
+            if asset_cache is not None:
+                logger.info(f"资源缓存统计: {url} {asset_cache.stats}")
+
+
+def _observe_settle(metrics: SettleMetrics) -> None:
+    """把页面稳定检测的各阶段耗时计入阶段指标"""
+    observe_stage("settle_scroll", metrics.scroll_ms / 1000)
+    observe_stage("settle_images", metrics.image_ms / 1000)
+    observe_stage("settle_dom", metrics.dom_ms / 1000)
+    observe_stage("settle_network", metrics.network_ms / 1000)
+    observe_stage("settle_total", metrics.total_ms / 1000)
+
+
+async def _default_basename(page: Page) -> Tuple[str, str]:
+    """按时间和页面标题生成文件名（不含扩展名），同时返回清理后的标题"""
+    now_str = datetime.now().strftime("%Y%m%d-%H-%M")
+    title = await page.title()
+    if title:
+        title = sanitize_filename(title.strip())[:10]
+        return f"{now_str}-{title}", title
+    return now_str, ""
+
+
 async def url_to_pdf(
     url: str,
     filename: str = None,
@@ -24,84 +132,42 @@ async def url_to_pdf(
     save_txt: bool = False,
     word_saver: Optional[callable] = None,
     txt_saver: Optional[callable] = None,
+    store: Optional[ArtifactStore] = None,
 ) -> str:
     """
     使用Playwright将指定URL页面渲染为PDF，保存到本地output目录。
     可选：通过参数控制是否额外保存word和txt文件，文件名与pdf一致。
+    指定store时PDF直接渲染为字节写入产物存储，不经过本地临时文件。
+    需要多种格式时优先使用export_url，转换与打印可以并行。
     :param url: 需要转换的网页链接
     :param filename: 可选，指定PDF文件名
     :param save_word: 是否保存为word
     :param save_txt: 是否保存为txt
     :param word_saver: 负责保存word的外部函数，签名(word_path, html, title)
     :param txt_saver: 负责保存txt的外部函数，签名(txt_path, text, title)
-    :return: PDF文件的绝对路径
+    :param store: 可选，产物存储
+    :return: PDF文件的绝对路径，指定store时为产物URI
     :raises: RuntimeError 当URL无效或页面加载失败时
     """
-    now_str = datetime.now().strftime("%Y%m%d-%H-%M")
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch()
-            page = await browser.new_page()
-
-            # 访问页面并等待加载
-            try:
-                response = await page.goto(
-                    url, timeout=10000, wait_until="domcontentloaded"
-                )
-                if not response:
-                    raise RuntimeError(f"页面加载失败: 无响应")
-                if not response.ok:
-                    raise RuntimeError(f"页面加载失败: HTTP {response.status}")
-                if response.status >= 400:
-                    raise RuntimeError(f"页面加载失败: HTTP {response.status}")
-            except Exception as e:
-                raise RuntimeError(f"页面访问失败: {str(e)}")
-
-            # 获取页面标题
-            title = await page.title()
-            if title:
-                title = sanitize_filename(title.strip())[:10]
-                pdf_filename = f"{now_str}-{title}.pdf"
-            else:
-                pdf_filename = f"{now_str}.pdf"
-            if filename:
-                pdf_filename = filename
+        async with _settled_page(url) as page:
+            basename, title = await _default_basename(page)
+            pdf_filename = filename or f"{basename}.pdf"
             pdf_path = os.path.join(OUTPUT_DIR, pdf_filename)
 
-            # 分段滚动页面，确保所有图片都进入可视区域
-            await page.evaluate(
-                """
-                async () => {
-                    const scrollStep = window.innerHeight / 2;
-                    const scrollHeight = document.body.scrollHeight;
-                    let pos = 0;
-                    while (pos < scrollHeight) {
-                        window.scrollTo(0, pos);
-                        await new Promise(r => setTimeout(r, 100));
-                        pos += scrollStep;
-                    }
-                    window.scrollTo(0, document.body.scrollHeight);
-                    await new Promise(r => setTimeout(r, 1000));
-                }
-            """
-            )
-
-            # 等待所有图片加载完成
-            await page.evaluate(
-                """
-                () => {
-                    return Promise.all(Array.from(document.images).map(img => {
-                        if (img.complete) return true;
-                        return new Promise(resolve => {
-                            img.onload = img.onerror = resolve;
-                        });
-                    }));
-                }
-            """
-            )
-
             # 生成PDF
-            await page.pdf(path=pdf_path, format="A4")
+            advance("printing")
+            if store is None:
+                with stage("page_pdf"):
+                    await page.pdf(path=pdf_path, format="A4")
+                artifact_uri = pdf_path
+            else:
+                with stage("page_pdf"):
+                    data = await page.pdf(format="A4")
+                artifact_uri = await asyncio.get_running_loop().run_in_executor(
+                    None, store.put_bytes, pdf_filename, data
+                )
+                del data
 
             # 额外保存word和txt
             if save_word and word_saver:
@@ -114,13 +180,166 @@ async def url_to_pdf(
                 txt_path = pdf_path.replace(".pdf", ".txt")
                 txt_saver(txt_path, text, title or "")
 
-            await browser.close()
-            return pdf_path
+            return artifact_uri
 
     except Exception as e:
         raise RuntimeError(f"PDF转换失败: {str(e)}")
 
 
+_convert_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_convert_executor() -> ThreadPoolExecutor:
+    """DOCX/TXT转换使用的线程池（进程级）"""
+    global _convert_executor
+    if _convert_executor is None:
+        _convert_executor = ThreadPoolExecutor(
+            max_workers=max(1, settings.EXPORT_CONVERT_WORKERS),
+            thread_name_prefix="export-convert",
+        )
+    return _convert_executor
+
+
+def _convert_to_store(
+    store: ArtifactStore, converter: callable, content: str, name: str, title: str
+) -> str:
+    """转换到本地临时文件后写入产物存储"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = os.path.join(tmp_dir, name)
+        converter(content, tmp_path, title)
+        with open(tmp_path, "rb") as f:
+            return store.put_bytes(name, f.read())
+
+
+async def export_url(
+    url: str,
+    formats: Iterable[str] = ("pdf",),
+    filename: str = None,
+    store: Optional[ArtifactStore] = None,
+) -> Dict[str, str]:
+    """
+    加载并等待页面稳定一次，从同一份页面快照生成所需的全部格式。
+    DOCX/TXT转换在线程池中执行，与PDF打印并行；页面在取完快照、
+    打印完成后立即归还浏览器池，不等待转换结束。DOCX中的图片取自
+    页面加载时的响应（配置DOCX_EMBED_IMAGES），不重新下载。
+    :param url: 需要转换的网页链接
+    :param formats: 目标格式，取值为pdf、docx、txt
+    :param filename: 可选，文件名（扩展名会被替换为各格式的扩展名）
+    :param store: 可选，产物存储；为None时写入本地output目录
+    :return: {格式: 文件绝对路径或产物URI}
+    :raises: ValueError 格式不支持时；RuntimeError 页面加载或转换失败时
+    """
+    formats = set(formats)
+    unsupported = formats - set(EXPORT_FORMATS)
+    if not formats or unsupported:
+        raise ValueError(f"不支持的导出格式: {sorted(unsupported) or '空'}")
+
+    loop = asyncio.get_running_loop()
+    executor = _get_convert_executor()
+    results: Dict[str, str] = {}
+    conversions = {}
+    image_capture = None
+    if "docx" in formats and settings.DOCX_EMBED_IMAGES:
+        image_capture = ImageCapture()
+    try:
+        async with _settled_page(url, image_capture) as page:
+            basename, title = await _default_basename(page)
+            if filename:
+                basename = os.path.splitext(filename)[0]
+            names = {fmt: f"{basename}.{fmt}" for fmt in formats}
+            paths = {fmt: os.path.join(OUTPUT_DIR, name) for fmt, name in names.items()}
+
+            # 先取快照，转换和PDF打印同时进行
+            advance("printing" if "pdf" in formats else "converting")
+            jobs = []
+            if "docx" in formats:
+                converter = convert_html_to_docx
+                if image_capture is not None:
+                    images = await image_capture.collect(page)
+                    converter = partial(convert_html_to_docx, images=images)
+                jobs.append(("docx", converter, await page.content()))
+            if "txt" in formats:
+                jobs.append(("txt", convert_html_to_txt, await page.inner_text("body")))
+            for fmt, converter, content in jobs:
+                # 转换线程中的阶段span挂在当前页面的span下
+                converter = partial(contextvars.copy_context().run, converter)
+                if store is None:
+                    future = loop.run_in_executor(
+                        executor, converter, content, paths[fmt], title
+                    )
+                else:
+                    future = loop.run_in_executor(
+                        executor,
+                        _convert_to_store,
+                        store,
+                        converter,
+                        content,
+                        names[fmt],
+                        title,
+                    )
+                conversions[fmt] = future
+
+            if "pdf" in formats:
+                if store is None:
+                    with stage("page_pdf"):
+                        await page.pdf(path=paths["pdf"], format="A4")
+                    results["pdf"] = paths["pdf"]
+                else:
+                    with stage("page_pdf"):
+                        data = await page.pdf(format="A4")
+                    results["pdf"] = await loop.run_in_executor(
+                        None, store.put_bytes, names["pdf"], data
+                    )
+                    del data
+
+        if conversions and "pdf" in formats:
+            advance("converting")
+        for fmt, future in conversions.items():
+            converted = await future
+            results[fmt] = converted if store is not None else paths[fmt]
+        return results
+
+    except Exception as e:
+        for future in conversions.values():
+            future.cancel()
+        raise RuntimeError(f"导出失败: {str(e)}")
+
+
+async def url_to_pdf_many(
+    urls: List[str],
+    filenames: Optional[List[Optional[str]]] = None,
+    return_exceptions: bool = False,
+    store: Optional[ArtifactStore] = None,
+) -> List[Union[str, Exception]]:
+    """
+    在同一个浏览器池内并发渲染多个URL为PDF。
+    并发度受 RENDER_MAX_IN_FLIGHT 和 BROWSER_MAX_PAGES_PER_BROWSER 限制。
+    :param urls: 需要转换的网页链接列表
+    :param filenames: 可选，与urls一一对应的PDF文件名，元素为None时自动命名
+    :param return_exceptions: 为True时失败的URL以异常对象返回，不中断其他渲染
+    :param store: 可选，产物存储，见url_to_pdf
+    :return: 与urls顺序一致的PDF文件绝对路径列表，指定store时为产物URI
+    :raises: RuntimeError 任一URL转换失败且return_exceptions为False时
+    """
+    if filenames is None:
+        filenames = [None] * len(urls)
+    if len(filenames) != len(urls):
+        raise ValueError("filenames与urls数量不一致")
+    return await asyncio.gather(
+        *(
+            url_to_pdf(url, filename, store=store)
+            for url, filename in zip(urls, filenames)
+        ),
+        return_exceptions=return_exceptions,
+    )
+
+
+def shutdown_browser_pool() -> None:
+    """关闭当前进程的浏览器池（worker进程退出时调用）"""
+    runtime = get_runtime()
+    runtime.run(close_browser_pool())
+
+
 # 用于同步调用的包装
 def url_to_pdf_sync(
     url: str,
@@ -129,12 +348,31 @@ def url_to_pdf_sync(
     save_txt=False,
     word_saver=None,
     txt_saver=None,
+    store: Optional[ArtifactStore] = None,
 ) -> str:
-    return asyncio.run(
-        url_to_pdf(url, filename, save_word, save_txt, word_saver, txt_saver)
+    return get_runtime().run(
+        url_to_pdf(url, filename, save_word, save_txt, word_saver, txt_saver, store)
     )
 
 
+def url_to_pdf_many_sync(
+    urls: List[str],
+    filenames: Optional[List[Optional[str]]] = None,
+    return_exceptions: bool = False,
+    store: Optional[ArtifactStore] = None,
+) -> List[Union[str, Exception]]:
+    return get_runtime().run(url_to_pdf_many(urls, filenames, return_exceptions, store))
+
+
+def export_url_sync(
+    url: str,
+    formats: Iterable[str] = ("pdf",),
+    filename: str = None,
+    store: Optional[ArtifactStore] = None,
+) -> Dict[str, str]:
+    return get_runtime().run(export_url(url, formats, filename, store))
+
+
 def url_to_word_sync(url: str, filename: str = None) -> str:
     """
     将网页URL保存为Word（.docx）文件
@@ -142,17 +380,7 @@ def url_to_word_sync(url: str, filename: str = None) -> str:
     :param filename: 可选，指定Word文件名
     :return: Word文件的绝对路径
     """
-
-    def word_saver(word_path, html, title):
-        convert_html_to_docx(html, word_path, title)
-
-    pdf_path = url_to_pdf_sync(
-        url,
-        filename=filename.replace(".docx", ".pdf") if filename else None,
-        save_word=True,
-        word_saver=word_saver,
-    )
-    word_path = pdf_path.replace(".pdf", ".docx")
+    word_path = export_url_sync(url, ("docx",), filename)["docx"]
     if not os.path.exists(word_path):
         raise RuntimeError("Word文件生成失败")
     return word_path
@@ -165,17 +393,7 @@ def url_to_txt_sync(url: str, filename: str = None) -> str:
     :param filename: 可选，指定TXT文件名
     :return: TXT文件的绝对路径
     """
-
-    def txt_saver(txt_path, text, title):
-        convert_html_to_txt(text, txt_path, title)
-
-    pdf_path = url_to_pdf_sync(
-        url,
-        filename=filename.replace(".txt", ".pdf") if filename else None,
-        save_txt=True,
-        txt_saver=txt_saver,
-    )
-    txt_path = pdf_path.replace(".pdf", ".txt")
+    txt_path = export_url_sync(url, ("txt",), filename)["txt"]
     if not os.path.exists(txt_path):
         raise RuntimeError("TXT文件生成失败")
     return txt_path
@@ -0,0 +1,358 @@
+"""
+渲染结果去重缓存模块
+
+以规范化后的URL加上请求的格式集合为键，在Redis中缓存已生成的各格式产物的路径和内容哈希，
+并对同一URL、同一格式集合的并发请求做合并（single-flight）：只有第一个请求真正渲染，
+其余请求登记为等待者，渲染完成后共享同一份结果。
+
+缓存条目形如 {"artifacts": {"pdf": {"path": ..., "content_hash": ...}, ...}, "url": ..., "created_at": ...}
+"""
+
+import hashlib
+import json
+import logging
+import time
+import uuid
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import redis
+from app.core.config import settings
+
+from .artifact_store import artifact_exists, artifact_sha256
+
+logger = logging.getLogger(__name__)
+
+# 不影响页面内容的跟踪参数，对所有网站生效
+TRACKING_PARAMS = {"fbclid", "gclid"}
+TRACKING_PREFIXES = ("utm_",)
+
+# 微信文章的分享/会话参数，只对mp.weixin.qq.com生效；
+# 其他网站上lang、version、key等参数可能对应不同的页面
+WECHAT_HOST = "mp.weixin.qq.com"
+WECHAT_TRACKING_PARAMS = {
+    "spm",
+    "from",
+    "isappinstalled",
+    "chksm",
+    "scene",
+    "subscene",
+    "ascene",
+    "sessionid",
+    "clicktime",
+    "enterid",
+    "devicetype",
+    "version",
+    "nettype",
+    "lang",
+    "exportkey",
+    "pass_ticket",
+    "wx_header",
+    "key",
+    "abtest_cookie",
+    "share_token",
+    "srcid",
+    "mpshare",
+    "poc_token",
+    "realreporttime",
+    "payreadticket",
+}
+WECHAT_TRACKING_PREFIXES = ("sharer_",)
+
+# 原子地在渲染进行中时登记等待者；渲染已结束时返回0
+_JOIN_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+"""
+
+# 渲染锁的值是包含token的JSON，以下脚本只操作token一致（自己持有）的锁
+_OWNED = """
+local function owned(key, token)
+    local raw = redis.call('GET', key)
+    return raw and cjson.decode(raw)['token'] == token
+end
+"""
+
+# 原子地更新渲染者信息（保持过期时间）
+_UPDATE_SCRIPT = (
+    _OWNED
+    + """
+if not owned(KEYS[1], ARGV[1]) then return 0 end
+redis.call('SET', KEYS[1], ARGV[2], 'KEEPTTL')
+return 1
+"""
+)
+
+# 原子地延长自己持有的渲染锁和等待者列表的过期时间
+_TOUCH_SCRIPT = (
+    _OWNED
+    + """
+if not owned(KEYS[1], ARGV[1]) then return 0 end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return 1
+"""
+)
+
+# 原子地写入结果、取出全部等待者并释放渲染锁；
+# 锁已过期并被其他渲染者取得时只写入结果，锁和等待者归新的渲染者
+_FINISH_SCRIPT = (
+    _OWNED
+    + """
+if ARGV[1] ~= '' then redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2]) end
+if redis.call('EXISTS', KEYS[2]) == 1 and not owned(KEYS[2], ARGV[3]) then
+    return {}
+end
+local waiters = redis.call('LRANGE', KEYS[3], 0, -1)
+redis.call('DEL', KEYS[2], KEYS[3])
+return waiters
+"""
+)
+
+
+def normalize_url(url: str) -> str:
+    """
+    规范化URL用于去重：小写协议和主机名，去掉默认端口、片段和跟踪参数
+    （微信文章另外去掉分享参数），剩余查询参数按键排序。
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    port = parts.port
+    if port and not (
+        (scheme == "http" and port == 80) or (scheme == "https" and port == 443)
+    ):
+        host = f"{host}:{port}"
+    params, prefixes = TRACKING_PARAMS, TRACKING_PREFIXES
+    if host == WECHAT_HOST:
+        params = params | WECHAT_TRACKING_PARAMS
+        prefixes = prefixes + WECHAT_TRACKING_PREFIXES
+    query = [
+        (k, v)
+        for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in params and not k.lower().startswith(prefixes)
+    ]
+    query.sort()
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+def format_set(formats: Optional[Iterable[str]] = None) -> List[str]:
+    """去重并排序后的格式列表，默认只有pdf"""
+    return sorted(set(formats or ("pdf",)))
+
+
+def artifact_entry(paths: Dict[str, str]) -> dict:
+    """
+    由{格式: 产物地址}生成缓存条目，同时计算各产物的内容哈希
+
+    :param paths: create_pdf_task或export_task的产物
+    """
+    return {
+        "artifacts": {
+            fmt: {"path": path, "content_hash": file_sha256(path)}
+            for fmt, path in paths.items()
+        }
+    }
+
+
+def artifact_paths(entry: dict) -> Dict[str, str]:
+    """缓存条目中的{格式: 产物地址}"""
+    return {fmt: item["path"] for fmt, item in entry.get("artifacts", {}).items()}
+
+
+def file_sha256(path: str) -> str:
+    """分块计算文件（或产物URI）内容的sha256"""
+    return artifact_sha256(path)
+
+
+class RenderCache:
+    """
+    Redis中的渲染结果缓存
+
+    Redis不可用时所有操作降级为"未命中"，调用方照常渲染，不影响主流程。
+    """
+
+    PREFIX = "wedocx:render"
+
+    def __init__(
+        self,
+        client: Optional[redis.Redis] = None,
+        ttl: int = None,
+        lock_ttl: int = None,
+    ):
+        self.client = client or redis.Redis.from_url(
+            settings.REDIS_URL, socket_connect_timeout=1, socket_timeout=2
+        )
+        self.ttl = ttl or settings.RENDER_CACHE_TTL
+        self.lock_ttl = lock_ttl or settings.RENDER_CACHE_LOCK_TTL
+        self._join = self.client.register_script(_JOIN_SCRIPT)
+        self._update = self.client.register_script(_UPDATE_SCRIPT)
+        self._touch = self.client.register_script(_TOUCH_SCRIPT)
+        self._finish = self.client.register_script(_FINISH_SCRIPT)
+
+    def _keys(self, url: str, formats: Optional[Iterable[str]] = None):
+        # 同一URL请求不同的格式集合时产物不同，分别缓存和合并
+        key = f"{normalize_url(url)} {','.join(format_set(formats))}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        base = f"{self.PREFIX}:{digest}"
+        return f"{base}:result", f"{base}:lock", f"{base}:waiters"
+
+    def get(self, url: str, formats: Optional[Iterable[str]] = None) -> Optional[dict]:
+        """
+        查询已缓存的渲染结果
+
+        :param formats: 请求的格式，默认只有pdf；以下各方法相同
+        :return: 包含artifacts、url和created_at的字典，未命中返回None
+        """
+        result_key, _, _ = self._keys(url, formats)
+        try:
+            raw = self.client.get(result_key)
+        except redis.RedisError as e:
+            logger.warning(f"渲染缓存不可用: {e}")
+            return None
+        if not raw:
+            return None
+        entry = json.loads(raw)
+        # 任一产物已被清理的条目视为未命中
+        paths = artifact_paths(entry)
+        if not paths or not all(artifact_exists(path) for path in paths.values()):
+            return None
+        return entry
+
+    def begin(
+        self, url: str, owner: dict, formats: Optional[Iterable[str]] = None
+    ) -> Optional[str]:
+        """
+        尝试成为该URL的渲染者
+
+        :param owner: 渲染者信息（如计划生成的文件名），供等待者查询
+        :return: 获得渲染权时返回token，之后update_owner、touch和finish都需要它；
+            其他请求正在渲染时返回None；Redis不可用时也返回token
+        """
+        _, lock_key, _ = self._keys(url, formats)
+        token = uuid.uuid4().hex
+        try:
+            acquired = self.client.set(
+                lock_key,
+                json.dumps(dict(owner, token=token)),
+                nx=True,
+                ex=self.lock_ttl,
+            )
+        except redis.RedisError as e:
+            logger.warning(f"渲染缓存不可用: {e}")
+            return token
+        return token if acquired else None
+
+    def update_owner(
+        self,
+        url: str,
+        token: str,
+        owner: dict,
+        formats: Optional[Iterable[str]] = None,
+    ) -> None:
+        """渲染任务提交后补充任务ID等信息"""
+        _, lock_key, _ = self._keys(url, formats)
+        try:
+            self._update(
+                keys=[lock_key], args=[token, json.dumps(dict(owner, token=token))]
+            )
+        except redis.RedisError as e:
+            logger.warning(f"渲染缓存不可用: {e}")
+
+    def touch(
+        self, url: str, token: str, formats: Optional[Iterable[str]] = None
+    ) -> bool:
+        """
+        渲染任务开始执行时重新计算渲染锁的过期时间
+
+        锁从API提交时开始计时，任务在调度器或队列中等待的时间不应占用渲染的时限。
+
+        :return: 是否仍持有渲染锁
+        """
+        _, lock_key, waiters_key = self._keys(url, formats)
+        try:
+            return bool(
+                self._touch(keys=[lock_key, waiters_key], args=[token, self.lock_ttl])
+            )
+        except redis.RedisError as e:
+            logger.warning(f"渲染缓存不可用: {e}")
+            return False
+
+    def current_owner(
+        self, url: str, formats: Optional[Iterable[str]] = None
+    ) -> Optional[dict]:
+        """查询正在进行的渲染，没有时返回None"""
+        _, lock_key, _ = self._keys(url, formats)
+        try:
+            raw = self.client.get(lock_key)
+        except redis.RedisError as e:
+            logger.warning(f"渲染缓存不可用: {e}")
+            return None
+        if not raw:
+            return None
+        owner = json.loads(raw)
+        owner.pop("token", None)
+        return owner
+
+    def join(
+        self, url: str, waiter: dict, formats: Optional[Iterable[str]] = None
+    ) -> bool:
+        """
+        登记为正在进行的渲染的等待者
+
+        :param waiter: 渲染完成后发送邮件所需的参数
+        :return: 渲染仍在进行且已登记返回True；渲染已结束返回False
+        """
+        _, lock_key, waiters_key = self._keys(url, formats)
+        try:
+            return bool(
+                self._join(
+                    keys=[lock_key, waiters_key],
+                    args=[json.dumps(waiter), self.lock_ttl],
+                )
+            )
+        except redis.RedisError as e:
+            logger.warning(f"渲染缓存不可用: {e}")
+            return False
+
+    def finish(
+        self,
+        url: str,
+        entry: Optional[dict],
+        token: Optional[str] = None,
+        formats: Optional[Iterable[str]] = None,
+    ) -> List[dict]:
+        """
+        结束渲染：写入结果（渲染失败时entry为None）、释放自己持有的渲染锁
+
+        :param entry: artifact_entry生成的缓存条目
+        :param token: begin返回的token
+        :return: 渲染期间登记的等待者；锁已被其他渲染者取得时为空
+        """
+        result_key, lock_key, waiters_key = self._keys(url, formats)
+        if entry is not None:
+            entry = dict(entry, url=normalize_url(url), created_at=time.time())
+        try:
+            raw_waiters = self._finish(
+                keys=[result_key, lock_key, waiters_key],
+                args=[json.dumps(entry) if entry else "", self.ttl, token or ""],
+            )
+        except redis.RedisError as e:
+            logger.warning(f"渲染缓存不可用: {e}")
+            return []
+        return [json.loads(w) for w in raw_waiters]
+
+
+_render_cache: Optional[RenderCache] = None
+
+
+def get_render_cache() -> Optional[RenderCache]:
+    """获取进程级渲染缓存，未启用时返回None"""
+    global _render_cache
+    if not settings.RENDER_CACHE_ENABLED:
+        return None
+    if _render_cache is None:
+        _render_cache = RenderCache()
+    return _render_cache
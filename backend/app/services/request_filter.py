@@ -0,0 +1,201 @@
+"""
+请求拦截模块
+
+通过Playwright的page.route拦截页面发出的请求，按资源类型、域名和URL规则
+丢弃对PDF内容没有贡献的请求（统计上报、广告、视频等），降低渲染延迟和出口流量。
+"""
+
+import logging
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterable, List, Optional, Pattern
+from urllib.parse import urlsplit
+
+from app.core.config import settings
+from app.core.metrics import count_allowed_bytes, count_filtered_request
+from playwright.async_api import Page, Response, Route
+
+logger = logging.getLogger(__name__)
+
+# 常见的统计和广告域名，按后缀匹配
+DEFAULT_BLOCKED_DOMAINS = [
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googlesyndication.com",
+    "googleadservices.com",
+    "doubleclick.net",
+    "adservice.google.com",
+    "connect.facebook.net",
+    "hotjar.com",
+    "scorecardresearch.com",
+    "hm.baidu.com",
+    "cnzz.com",
+    "umeng.com",
+    "growingio.com",
+    "sensorsdata.cn",
+]
+
+# 常见的两级公共后缀，用于判断第三方请求
+_TWO_LEVEL_SUFFIXES = {
+    "com.cn",
+    "net.cn",
+    "org.cn",
+    "gov.cn",
+    "edu.cn",
+    "com.hk",
+    "co.uk",
+    "co.jp",
+    "com.au",
+}
+
+
+def _site_of(host: str) -> str:
+    """取主机名的可注册域名（近似），如 mp.weixin.qq.com -> qq.com"""
+    labels = host.lower().rstrip(".").split(".")
+    if len(labels) >= 3 and ".".join(labels[-2:]) in _TWO_LEVEL_SUFFIXES:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+def _domain_matches(host: str, domains: Iterable[str]) -> bool:
+    host = host.lower()
+    return any(host == d or host.endswith("." + d) for d in domains)
+
+
+@dataclass
+class FilterPolicy:
+    """一组请求拦截规则"""
+
+    name: str
+    blocked_resource_types: frozenset = frozenset()
+    blocked_domains: tuple = ()
+    blocked_url_patterns: List[Pattern] = field(default_factory=list)
+    block_third_party_scripts: bool = False
+
+    def match(self, url: str, resource_type: str, page_site: str) -> Optional[str]:
+        """
+        判断请求是否应被拦截
+
+        :return: 拦截原因，为None时放行
+        """
+        host = urlsplit(url).hostname or ""
+        if resource_type in self.blocked_resource_types:
+            return f"type:{resource_type}"
+        if host and _domain_matches(host, self.blocked_domains):
+            return "domain"
+        for pattern in self.blocked_url_patterns:
+            if pattern.search(url):
+                return "pattern"
+        if (
+            self.block_third_party_scripts
+            and resource_type == "script"
+            and host
+            and _site_of(host) != page_site
+        ):
+            return "third-party-script"
+        return None
+
+
+def default_policy() -> FilterPolicy:
+    """通用网页的拦截规则，取自配置"""
+    return FilterPolicy(
+        name="default",
+        blocked_resource_types=frozenset(settings.REQUEST_BLOCK_RESOURCE_TYPES),
+        blocked_domains=tuple(DEFAULT_BLOCKED_DOMAINS + settings.REQUEST_BLOCK_DOMAINS),
+        block_third_party_scripts=settings.REQUEST_BLOCK_THIRD_PARTY_SCRIPTS,
+    )
+
+
+def wechat_policy() -> FilterPolicy:
+    """
+    mp.weixin.qq.com 文章的拦截规则
+
+    正文图片来自 mmbiz.qpic.cn，必须放行；视频、上报、广告和阅读数等接口
+    对PDF没有贡献。文章正文不使用网页字体，字体请求只服务于页面工具栏图标。
+    """
+    base = default_policy()
+    return FilterPolicy(
+        name="wechat",
+        blocked_resource_types=base.blocked_resource_types | {"font"},
+        blocked_domains=base.blocked_domains
+        + ("mpvideo.qpic.cn", "badjs.weixinbridge.com", "wxa.wxs.qq.com"),
+        blocked_url_patterns=[
+            re.compile(
+                r"^https?://mp\.weixin\.qq\.com/mp/"
+                r"(jsmonitor|jsreport|webcommreport|appmsgreport|report|"
+                r"getappmsgad|ad_|advertisement|getappmsgext|videoplayer|"
+                r"getvideo|readtemplate\?t=pages/video)"
+            ),
+            re.compile(r"^https?://[^/]*\.qq\.com/(.*/)?(stat|report|beacon)(/|\?|$)"),
+        ],
+        block_third_party_scripts=True,
+    )
+
+
+def policy_for_url(url: str) -> FilterPolicy:
+    """根据目标页面选择拦截规则"""
+    host = urlsplit(url).hostname or ""
+    if host == "mp.weixin.qq.com":
+        return wechat_policy()
+    return default_policy()
+
+
+@dataclass
+class FilterStats:
+    """单个页面的拦截统计"""
+
+    allowed_requests: int = 0
+    blocked_requests: int = 0
+    # 放行请求的响应体字节数（按Content-Length统计）
+    allowed_bytes: int = 0
+    blocked_by_reason: Dict[str, int] = field(default_factory=dict)
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class RequestFilter:
+    """
+    挂载到单个页面上的请求拦截器
+
+    放行的请求通过route.fallback()交给后注册的其他路由处理器（如资源缓存），
+    没有其他处理器时等同于route.continue_()。
+    """
+
+    def __init__(self, url: str, policy: Optional[FilterPolicy] = None):
+        self.policy = policy or policy_for_url(url)
+        self.page_site = _site_of(urlsplit(url).hostname or "")
+        self.stats = FilterStats()
+
+    async def install(self, page: Page) -> "RequestFilter":
+        """在页面上注册路由和响应统计，需在page.goto之前调用"""
+        await page.route("**/*", self._handle)
+        page.on("response", self._on_response)
+        return self
+
+    async def _handle(self, route: Route) -> None:
+        request = route.request
+        if request.is_navigation_request() and request.frame.parent_frame is None:
+            # 主文档跳转后以新站点判断第三方请求
+            self.page_site = _site_of(urlsplit(request.url).hostname or "")
+            reason = None
+        else:
+            reason = self.policy.match(
+                request.url, request.resource_type, self.page_site
+            )
+        count_filtered_request(reason)
+        if reason is None:
+            self.stats.allowed_requests += 1
+            await route.fallback()
+            return
+        self.stats.blocked_requests += 1
+        self.stats.blocked_by_reason[reason] = (
+            self.stats.blocked_by_reason.get(reason, 0) + 1
+        )
+        await route.abort("blockedbyclient")
+
+    def _on_response(self, response: Response) -> None:
+        length = response.headers.get("content-length")
+        if length and length.isdigit():
+            self.stats.allowed_bytes += int(length)
+            count_allowed_bytes(int(length))
@@ -0,0 +1,263 @@
+"""
+SMTP连接池模块
+
+每个worker进程维护少量已完成TLS握手和登录的SMTP会话，多封邮件复用同一会话，
+避免每封邮件都重新握手、认证（突发流量下这是邮件延迟的大头，也容易被服务商
+按登录频率限流）。空闲会话由后台线程定期发送NOOP保活，失效时自动重连。
+"""
+
+import logging
+import os
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Iterator, List, Optional
+
+from app.core.config import settings
+from app.core.metrics import stage
+
+if TYPE_CHECKING:
+    from .email_service import EmailConfig
+
+logger = logging.getLogger(__name__)
+
+
+def _is_connection_error(exc: BaseException) -> bool:
+    """会话已不可用、需要换新连接的异常（SMTPException本身也是OSError的子类）"""
+    if isinstance(exc, smtplib.SMTPServerDisconnected):
+        return True
+    return isinstance(exc, OSError) and not isinstance(exc, smtplib.SMTPException)
+
+
+class _PooledConnection:
+    """池中的单个SMTP会话"""
+
+    def __init__(self, server: smtplib.SMTP):
+        self.server = server
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.messages = 0
+
+
+class SMTPConnectionPool:
+    """
+    线程安全的SMTP会话池
+
+    :param config: 邮件配置
+    :param max_size: 同时使用的会话上限，超出时等待归还
+    :param max_idle: 空闲超过该秒数的会话直接关闭（服务端通常几分钟后断开空闲连接）
+    :param keepalive_interval: 空闲会话的NOOP保活间隔（秒），为0时不启动保活线程，
+        仅在取用空闲超过该间隔的会话前做一次NOOP检查
+    :param max_messages: 单个会话最多发送的邮件数，达到后关闭重建
+    """
+
+    def __init__(
+        self,
+        config: "EmailConfig",
+        max_size: int = None,
+        max_idle: float = None,
+        keepalive_interval: float = None,
+        max_messages: int = None,
+        timeout: float = None,
+    ):
+        self.config = config
+        self.max_size = max(1, max_size or settings.SMTP_POOL_SIZE)
+        self.max_idle = max_idle or settings.SMTP_POOL_MAX_IDLE
+        self.keepalive_interval = (
+            settings.SMTP_KEEPALIVE_INTERVAL
+            if keepalive_interval is None
+            else keepalive_interval
+        )
+        self.max_messages = max_messages or settings.SMTP_MAX_MESSAGES_PER_CONNECTION
+        self.timeout = timeout or settings.SMTP_TIMEOUT
+        self._idle: List[_PooledConnection] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._stop = threading.Event()
+        self._keepalive_thread: Optional[threading.Thread] = None
+        self.connects = 0
+
+    def _connect(self) -> _PooledConnection:
+        """建立新会话：连接、TLS、登录"""
+        config = self.config
+        with stage("smtp_connect"):
+            if config.smtp_port == 465:
+                server = smtplib.SMTP_SSL(
+                    config.smtp_server, config.smtp_port, timeout=self.timeout
+                )
+            else:
+                server = smtplib.SMTP(
+                    config.smtp_server, config.smtp_port, timeout=self.timeout
+                )
+        try:
+            if config.debug:
+                server.set_debuglevel(1)
+            with stage("smtp_login"):
+                if config.smtp_port != 465:
+                    server.starttls()
+                server.login(config.smtp_user, config.smtp_password)
+        except Exception:
+            self._close(server)
+            raise
+        self.connects += 1
+        logger.info(f"已建立SMTP会话: {config.smtp_server}:{config.smtp_port}")
+        return _PooledConnection(server)
+
+    @staticmethod
+    def _close(server: smtplib.SMTP) -> None:
+        try:
+            server.quit()
+        except Exception:
+            # QQ邮箱等在QUIT阶段可能直接断开，忽略
+            try:
+                server.close()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _is_alive(conn: _PooledConnection) -> bool:
+        try:
+            return conn.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _take_idle(self) -> Optional[_PooledConnection]:
+        """取出一个可用的空闲会话，顺带清理过期会话"""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                conn = self._idle.pop()
+            idle_for = time.monotonic() - conn.last_used
+            if idle_for > self.max_idle or conn.messages >= self.max_messages:
+                self._close(conn.server)
+                continue
+            if idle_for > (self.keepalive_interval or 0) and not self._is_alive(conn):
+                logger.info("空闲SMTP会话已失效，重新连接")
+                self._close(conn.server)
+                continue
+            return conn
+
+    def _put_idle(self, conn: _PooledConnection) -> None:
+        with self._lock:
+            if not self._stop.is_set() and len(self._idle) < self.max_size:
+                self._idle.append(conn)
+                return
+        self._close(conn.server)
+
+    def _ensure_keepalive(self) -> None:
+        if self.keepalive_interval <= 0 or self._keepalive_thread is not None:
+            return
+        with self._lock:
+            if self._keepalive_thread is None:
+                self._keepalive_thread = threading.Thread(
+                    target=self._keepalive_loop, name="smtp-keepalive", daemon=True
+                )
+                self._keepalive_thread.start()
+
+    def _keepalive_loop(self) -> None:
+        while not self._stop.wait(self.keepalive_interval):
+            self.keepalive()
+
+    def keepalive(self) -> int:
+        """
+        对空闲会话发送NOOP，关闭失效或空闲过久的会话
+
+        :return: 仍然可用的空闲会话数
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        now = time.monotonic()
+        alive = []
+        for conn in idle:
+            if now - conn.last_used > self.max_idle or not self._is_alive(conn):
+                self._close(conn.server)
+            else:
+                alive.append(conn)
+        for conn in alive:
+            self._put_idle(conn)
+        return len(alive)
+
+    @contextmanager
+    def connection(self) -> Iterator[smtplib.SMTP]:
+        """
+        取用一个已登录的SMTP会话，用完自动归还
+
+        会话层异常（断线等）时关闭该会话；其他SMTP错误（如收件人被拒）
+        时先RSET复位再归还。
+        """
+        self._slots.acquire()
+        try:
+            conn = self._take_idle() or self._connect()
+            self._ensure_keepalive()
+            try:
+                yield conn.server
+            except Exception as e:
+                if _is_connection_error(e):
+                    self._close(conn.server)
+                    raise
+                try:
+                    conn.server.rset()
+                except Exception:
+                    self._close(conn.server)
+                else:
+                    conn.last_used = time.monotonic()
+                    self._put_idle(conn)
+                raise
+            conn.messages += 1
+            conn.last_used = time.monotonic()
+            self._put_idle(conn)
+        finally:
+            self._slots.release()
+
+    def send(self, deliver: Callable[[smtplib.SMTP], None], retries: int = 1) -> None:
+        """
+        在池中的会话上执行一次投递，复用的会话已被服务端断开时换新连接重试
+
+        :param deliver: 接收已登录会话并完成发送的函数
+        """
+        for attempt in range(retries + 1):
+            try:
+                with self.connection() as server:
+                    deliver(server)
+                return
+            except smtplib.SMTPServerDisconnected:
+                if attempt >= retries:
+                    raise
+                logger.warning("SMTP会话已断开，重新连接后重试")
+
+    def close(self) -> None:
+        """关闭全部空闲会话并停止保活线程"""
+        self._stop.set()
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._close(conn.server)
+        if self._keepalive_thread is not None:
+            self._keepalive_thread.join(timeout=1)
+            self._keepalive_thread = None
+
+
+_pool: Optional[SMTPConnectionPool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def get_smtp_pool(config: "EmailConfig") -> SMTPConnectionPool:
+    """获取当前worker进程的SMTP连接池，fork后的子进程各自新建"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = SMTPConnectionPool(config)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def close_smtp_pool() -> None:
+    """关闭当前进程的SMTP连接池（worker进程退出时调用）"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None and _pool_pid == os.getpid():
+        pool.close()
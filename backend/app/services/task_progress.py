@@ -0,0 +1,307 @@
+"""
+任务进度模块
+
+任务执行过程中按阶段报告进度：queued（API已提交）、navigating（访问页面）、
+settling（等待页面稳定）、printing（打印PDF）、converting（DOCX/TXT转换）、
+ready（产物已生成，启用下载链接时附带downloads）、emailing（发送邮件）、done或failed。
+
+- 写入端：事件放入有界队列后立即返回，由后台线程批量写入Redis
+  （最新状态写入键，同时在频道中发布），不阻塞渲染的事件循环；
+  队列满或Redis不可用时丢弃事件，不影响任务
+- 读取端：API进程内只有一个订阅连接（ProgressHub），按任务ID把事件分发到
+  各SSE连接的asyncio.Queue，打开的连接不占用线程
+
+进度以API返回的task_id（任务链最后一个任务的ID）为键：渲染任务通过参数
+progress_id得知该ID，并用bind绑定到当前上下文，页面渲染各阶段调用advance报告。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Set
+
+import redis
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "wedocx:progress"
+STAGES = (
+    "queued",
+    "navigating",
+    "settling",
+    "printing",
+    "converting",
+    "ready",
+    "emailing",
+    "done",
+    "failed",
+)
+TERMINAL_STAGES = ("done", "failed")
+
+# 当前上下文中任务的进度ID，随contextvars传入异步运行时的协程和转换线程
+_current_id: ContextVar[Optional[str]] = ContextVar("wedocx_progress_id", default=None)
+
+
+def progress_key(task_id: str) -> str:
+    """最新进度所在的键，同时也是发布事件的频道"""
+    return f"{PREFIX}:{task_id}"
+
+
+class ProgressPublisher:
+    """
+    后台线程批量写入进度事件
+
+    调用方只做一次put_nowait，每批事件用一个pipeline写入。
+    """
+
+    BATCH_SIZE = 100
+
+    def __init__(self, client: Optional[redis.Redis] = None, ttl: int = None):
+        self.client = client or redis.Redis.from_url(
+            settings.REDIS_URL, socket_connect_timeout=1, socket_timeout=2
+        )
+        self.ttl = ttl or settings.PROGRESS_TTL
+        self._queue: queue.Queue = queue.Queue(maxsize=settings.PROGRESS_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def _ensure_thread(self) -> None:
+        # fork出的worker子进程中没有父进程的线程，需要重新启动
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=settings.PROGRESS_QUEUE_SIZE)
+            self._thread = threading.Thread(
+                target=self._run, name="wedocx-progress", daemon=True
+            )
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def publish(self, task_id: str, stage: str, **detail) -> bool:
+        """
+        提交一个进度事件，不等待写入
+
+        :return: 是否已放入队列；队列满时丢弃并返回False
+        """
+        self._ensure_thread()
+        event = {"task_id": task_id, "stage": stage, "ts": time.time(), **detail}
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except redis.RedisError as e:
+                logger.warning(f"写入任务进度失败，丢弃{len(batch)}个事件: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, events) -> None:
+        pipe = self.client.pipeline(transaction=False)
+        for event in events:
+            data = json.dumps(event, ensure_ascii=False)
+            key = progress_key(event["task_id"])
+            pipe.set(key, data, ex=self.ttl)
+            pipe.publish(key, data)
+        pipe.execute()
+
+    def flush(self, timeout: float = 2.0) -> bool:
+        """等待已提交的事件写入完成（进程退出前、测试中调用）"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+
+_publisher: Optional[ProgressPublisher] = None
+
+
+def get_progress_publisher() -> ProgressPublisher:
+    global _publisher
+    if _publisher is None:
+        _publisher = ProgressPublisher()
+    return _publisher
+
+
+def flush_progress() -> None:
+    if _publisher is not None:
+        _publisher.flush()
+
+
+def report(task_id: Optional[str], stage: str, **detail) -> None:
+    """报告任务进度，task_id为空或未启用时不做任何事"""
+    if not task_id or not settings.PROGRESS_ENABLED:
+        return
+    get_progress_publisher().publish(task_id, stage, **detail)
+
+
+def advance(stage: str, **detail) -> None:
+    """报告当前上下文中绑定的任务的进度（页面渲染等不直接知道任务ID的位置调用）"""
+    report(_current_id.get(), stage, **detail)
+
+
+@contextmanager
+def bind(
+    task_id: Optional[str], final: Optional[str] = None, **detail
+) -> Iterator[None]:
+    """
+    把进度ID绑定到当前上下文；退出时抛出异常则报告failed，
+    正常结束且给出final时报告该阶段
+
+    :param final: 可选，正常结束时报告的阶段，如done
+    :param detail: 随final阶段一起报告的内容
+    """
+    token = _current_id.set(task_id)
+    try:
+        yield
+    except Exception as e:
+        report(task_id, "failed", error=str(e))
+        raise
+    else:
+        if final:
+            report(task_id, final, **detail)
+    finally:
+        _current_id.reset(token)
+
+
+class ProgressHub:
+    """
+    API进程内的进度事件分发器
+
+    用一个Redis连接按模式订阅全部任务的进度频道，再按任务ID分发给各SSE连接。
+    """
+
+    def __init__(self, url: str = None):
+        self.url = url or settings.REDIS_URL
+        self._listeners: Dict[str, Set[asyncio.Queue]] = {}
+        self._client = None
+        self._task: Optional[asyncio.Task] = None
+        # 频道订阅已生效时置位，断线重连期间清除
+        self._ready: Optional[asyncio.Event] = None
+
+    def _redis(self):
+        if self._client is None:
+            import redis.asyncio as aioredis
+
+            self._client = aioredis.Redis.from_url(
+                self.url, socket_connect_timeout=1, socket_timeout=5
+            )
+        return self._client
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        """开始接收某个任务的进度事件"""
+        if self._task is None or self._task.done():
+            self._ready = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._listen())
+        events: asyncio.Queue = asyncio.Queue(maxsize=100)
+        self._listeners.setdefault(task_id, set()).add(events)
+        return events
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """
+        等待频道订阅生效：subscribe只是启动订阅，在此之前发布的事件收不到
+
+        :return: 是否已生效；超时（如Redis不可用）返回False
+        """
+        if self._ready is None:
+            return False
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def unsubscribe(self, task_id: str, events: asyncio.Queue) -> None:
+        listeners = self._listeners.get(task_id)
+        if listeners is not None:
+            listeners.discard(events)
+            if not listeners:
+                del self._listeners[task_id]
+
+    def dispatch(self, channel: str, data: str) -> None:
+        """把一条频道消息分发给该任务的全部订阅者"""
+        listeners = self._listeners.get(channel[len(PREFIX) + 1 :])
+        if not listeners:
+            return
+        event = json.loads(data)
+        for events in listeners:
+            if events.full():
+                # 慢速客户端只需要最新状态，丢弃最旧的事件
+                events.get_nowait()
+            events.put_nowait(event)
+
+    async def latest(self, task_id: str) -> Optional[dict]:
+        """任务的最新进度，不存在或Redis不可用时返回None"""
+        try:
+            raw = await self._redis().get(progress_key(task_id))
+        except redis.RedisError as e:
+            logger.warning(f"读取任务进度失败: {e}")
+            return None
+        return json.loads(raw) if raw else None
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = self._redis().pubsub()
+            try:
+                await pubsub.psubscribe(f"{PREFIX}:*")
+                self._ready.set()
+                async for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+                    channel = message["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    self.dispatch(channel, message["data"])
+            except redis.RedisError as e:
+                self._ready.clear()
+                logger.warning(f"订阅任务进度失败，稍后重试: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, redis.RedisError):
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+_hub: Optional[ProgressHub] = None
+
+
+def get_progress_hub() -> ProgressHub:
+    global _hub
+    if _hub is None:
+        _hub = ProgressHub()
+    return _hub
@@ -0,0 +1,68 @@
+"""
+文本规范化模块
+
+文档转换时每段文本、每个列表项和表格单元格都要清理一次，是转换过程中
+调用最频繁的函数。这里的正则在模块加载时预编译，单个空格不再作为匹配
+逐个替换，纯空白文本、不含多余空白和不含换行的文本走快速路径；批量接口
+把多段文本拼成一个字符串一起处理，省去逐段调用的开销。
+
+没有改成str.translate或合并成一个正则：中文文本上translate逐字符查表，
+带分组模板的合并正则逐个匹配展开替换，实测都比两个预编译正则慢。
+"""
+
+import re
+from typing import Iterable, List
+
+# 连续的空白（空格、制表符、全角空格）及单个制表符、全角空格替换为一个空格
+_SPACES_RE = re.compile(r"[ \t\u3000]{2,}|[\t\u3000]")
+# 保留中文、英文、数字、常用标点和空白，其余字符删除
+_ALLOWED = r'\w\s\u4e00-\u9fff,.?!，。？！、:：;；"()（）'
+_DISALLOWED_RE = re.compile(rf"[^{_ALLOWED}-]")
+# str.splitlines()认定的换行符
+_LINE_BREAK_RE = re.compile(r"[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
+# 批量处理时的分隔符：不是空白也不会被删除，空白合并和换行处理都不会跨过它
+_SEPARATOR = "\x00"
+_BATCH_DISALLOWED_RE = re.compile(rf"[^{_ALLOWED}\x00-]")
+
+
+def _collapse_spaces(text: str) -> str:
+    """合并空白；大多数文本没有连续空白、制表符和全角空格，先用子串查找跳过正则"""
+    if "  " in text or "\t" in text or "\u3000" in text:
+        return _SPACES_RE.sub(" ", text)
+    return text
+
+
+def _strip_lines(text: str) -> str:
+    """去除每行首尾空白"""
+    if _LINE_BREAK_RE.search(text) is None:
+        return text
+    return "\n".join(line.strip() for line in text.splitlines())
+
+
+def clean_text(text: str) -> str:
+    """清理文本内容，保留换行符，处理特殊字符和多余空白"""
+    if not text or text.isspace():
+        return ""
+    text = _DISALLOWED_RE.sub("", _collapse_spaces(text))
+    return _strip_lines(text).strip()
+
+
+def clean_many(texts: Iterable[str]) -> List[str]:
+    """
+    批量清理多段文本，结果与逐段调用clean_text一致
+
+    Args:
+        texts: 待清理的文本
+
+    Returns:
+        List[str]: 与输入顺序一致的清理结果
+    """
+    texts = list(texts)
+    if not texts:
+        return []
+    joined = _SEPARATOR.join(texts)
+    if joined.count(_SEPARATOR) != len(texts) - 1:
+        # 文本本身含有分隔符时逐段处理
+        return [clean_text(text) for text in texts]
+    joined = _BATCH_DISALLOWED_RE.sub("", _collapse_spaces(joined))
+    return [text.strip() for text in _strip_lines(joined).split(_SEPARATOR)]
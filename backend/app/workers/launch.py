@@ -0,0 +1,94 @@
+"""
+按队列启动Celery worker
+
+- render：浏览器渲染和文档转换。子进程数少，每个子进程只预取一个任务，
+  常驻内存超过上限（Chromium和大文档容易膨胀）或执行一定数量任务后重启子进程
+- deliver：发送邮件。以网络I/O为主，子进程数多，允许预取
+- all：同时消费全部队列，用于开发环境或单机小规模部署
+
+各项参数取自配置CELERY_RENDER_*、CELERY_DELIVER_*，命令行中额外的参数原样传给celery。
+使用-P gevent/eventlet时，与celery命令一样在导入应用模块之前完成monkey patch。
+
+用法（在backend目录下）：
+    python -m app.workers.launch render
+    python -m app.workers.launch deliver --loglevel=debug
+    python -m app.workers.launch render --print    # 只打印等价的celery命令
+"""
+
+import argparse
+import shlex
+import sys
+from typing import List, Optional
+
+PROFILES = ("render", "deliver", "all")
+
+
+def worker_argv(profile: str) -> List[str]:
+    """
+    生成启动某一类worker的celery命令行参数（不含celery -A ...部分）
+
+    :param profile: render、deliver或all
+    :raises: ValueError 未知的profile
+    """
+    from app.core.config import settings
+
+    if profile == "render":
+        queues = [settings.CELERY_RENDER_QUEUE]
+        prefix = "CELERY_RENDER_"
+    elif profile == "deliver":
+        queues = [settings.CELERY_DELIVER_QUEUE]
+        prefix = "CELERY_DELIVER_"
+    elif profile == "all":
+        # 同时消费默认队列，未配置路由的任务也有worker执行
+        queues = [settings.CELERY_RENDER_QUEUE, settings.CELERY_DELIVER_QUEUE, "celery"]
+        prefix = "CELERY_RENDER_"
+    else:
+        raise ValueError(f"未知的worker类型: {profile}，可选 {', '.join(PROFILES)}")
+
+    def option(name: str) -> int:
+        return getattr(settings, prefix + name)
+
+    argv = [
+        "worker",
+        "-Q",
+        ",".join(queues),
+        "-n",
+        f"{profile}@%h",
+        "--concurrency",
+        str(option("CONCURRENCY")),
+        "--prefetch-multiplier",
+        str(option("PREFETCH_MULTIPLIER")),
+    ]
+    if option("MAX_MEMORY_PER_CHILD"):
+        argv += ["--max-memory-per-child", str(option("MAX_MEMORY_PER_CHILD"))]
+    if option("MAX_TASKS_PER_CHILD"):
+        argv += ["--max-tasks-per-child", str(option("MAX_TASKS_PER_CHILD"))]
+    return argv
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="按队列启动Celery worker")
+    parser.add_argument("profile", choices=PROFILES)
+    parser.add_argument(
+        "--print", action="store_true", help="只打印等价的celery命令，不启动"
+    )
+    options, extra = parser.parse_known_args(args)
+    if not options.print:
+        # worker_main不会像celery命令那样处理-P gevent/eventlet，需要在导入
+        # 任何应用模块（及其依赖的socket、smtplib等）之前自行patch
+        from celery import maybe_patch_concurrency
+
+        maybe_patch_concurrency(["celery", *extra])
+
+    argv = worker_argv(options.profile) + extra
+    if options.print:
+        print(shlex.join(["celery", "-A", "app.celery_app.celery_app", *argv]))
+        return
+
+    from app.celery_app import celery_app
+
+    celery_app.worker_main(argv)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
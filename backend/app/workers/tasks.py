@@ -2,31 +2,426 @@
 Celery 任务定义
 """
 
+import logging
+import os
+import shutil
+import zipfile
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
 from app.celery_app import celery_app
 from app.core.config import settings
-from app.services.email_service import EmailConfig, EmailService
-from app.services.pdf_service import url_to_pdf_sync
+from app.core.runtime import get_runtime
+from app.services import download_links
+from app.services.artifact_store import (
+    artifact_name,
+    artifact_size,
+    get_artifact_store,
+    open_artifact,
+)
+from app.services.async_email_service import AsyncEmailService
+from app.services.email_service import EmailConfig, EmailService, OutgoingEmail
+from app.services.fair_scheduler import get_fair_scheduler
+from app.services.pdf_service import (
+    export_url_sync,
+    url_to_pdf_many_sync,
+    url_to_pdf_sync,
+)
+from app.services.render_cache import artifact_entry, format_set, get_render_cache
+from app.services.smtp_pool import get_smtp_pool
+from app.services.task_progress import advance, bind, report
 
+logger = logging.getLogger(__name__)
 
-@celery_app.task
-def create_pdf_task(url: str, output_path: str) -> str:
-    """异步生成PDF文件"""
-    url_to_pdf_sync(url, output_path)
-    return output_path
 
+def _render_pdf(url: str, output_path: str) -> str:
+    """
+    渲染PDF并返回产物地址：本地存储时写入output_path，
+    其他存储时以output_path的文件名为键直接写入存储。
+    """
+    if settings.ARTIFACT_STORE == "local":
+        url_to_pdf_sync(url, output_path)
+        return output_path
+    return url_to_pdf_sync(
+        url, os.path.basename(output_path), store=get_artifact_store()
+    )
 
-@celery_app.task
-def send_email_task(pdf_path: str, to_email: str, subject: str, body: str):
-    """异步发送邮件, pdf_path由上一个任务(create_pdf_task)传来"""
-    config = EmailConfig(
+
+def _render_pdfs(
+    urls: List[str], output_paths: List[str]
+) -> List[Union[str, Exception]]:
+    """批量渲染PDF，产物的存放方式与_render_pdf一致；失败的URL以异常对象返回"""
+    if settings.ARTIFACT_STORE == "local":
+        return url_to_pdf_many_sync(urls, output_paths, return_exceptions=True)
+    return url_to_pdf_many_sync(
+        urls,
+        [os.path.basename(path) for path in output_paths],
+        return_exceptions=True,
+        store=get_artifact_store(),
+    )
+
+
+def _report_ready(progress_id: Optional[str], uris: List[str]) -> None:
+    """启用下载链接时报告ready阶段，用户不必等邮件即可下载产物"""
+    if not progress_id or not download_links.is_enabled():
+        return
+    downloads = [
+        {"name": artifact_name(uri), "url": url}
+        for uri in uris
+        if (url := download_links.download_url(uri))
+    ]
+    if downloads:
+        report(progress_id, "ready", downloads=downloads)
+
+
+def _render_cached(
+    render: Callable[[], Union[str, Dict[str, str]]],
+    url: str,
+    formats: List[str],
+    cache_url: Optional[str],
+    cache_token: Optional[str],
+    progress_id: Optional[str],
+) -> Union[str, Dict[str, str]]:
+    """
+    执行render()并报告进度；cache_url不为空时本次渲染是该URL和格式集合的去重渲染者
+    （cache_token为持有的渲染锁）：完成后写入渲染缓存，并为渲染期间登记的等待者
+    各发一封邮件；渲染失败时向等待者发送失败通知。
+
+    :param render: 生成产物，返回产物地址或{格式: 产物地址}
+    """
+    render_cache = get_render_cache() if cache_url else None
+    if render_cache is not None and cache_token:
+        # 渲染锁从API提交时开始计时，在这里按实际开始渲染的时间重新计算
+        render_cache.touch(cache_url, cache_token, formats=formats)
+    try:
+        with bind(progress_id):
+            result = render()
+        paths = result if isinstance(result, dict) else {"pdf": result}
+        _report_ready(progress_id, list(paths.values()))
+    except Exception as e:
+        if render_cache is not None:
+            waiters = render_cache.finish(cache_url, None, cache_token, formats=formats)
+            if waiters:
+                logger.warning(f"渲染失败，通知 {len(waiters)} 个等待者: {url}")
+                notices = [
+                    dict(
+                        waiter,
+                        subject=f"{waiter['subject']}失败",
+                        body=(
+                            f"网页转换失败，未能生成{'/'.join(formats).upper()}：{url}"
+                            f"\n原因：{e}"
+                        ),
+                    )
+                    for waiter in waiters
+                ]
+                send_emails_task.delay(None, notices)
+        raise
+    if render_cache is not None:
+        waiters = render_cache.finish(
+            cache_url, artifact_entry(paths), cache_token, formats=formats
+        )
+        if waiters:
+            send_emails_task.delay(result, waiters)
+    return result
+
+
+# 渲染任务执行完成后才确认消息：worker整体退出或重启时未完成的渲染会重新投递，
+# 与prefetch=1一起使每个子进程只占用正在执行的那一个渲染任务
+@celery_app.task(acks_late=True)
+def create_pdf_task(
+    url: str,
+    output_path: str,
+    cache_url: Optional[str] = None,
+    progress_id: Optional[str] = None,
+    cache_token: Optional[str] = None,
+) -> str:
+    """
+    异步生成PDF文件
+
+    cache_url、cache_token见_render_cached。
+    progress_id为API返回的任务ID，渲染各阶段的进度以其为键报告。
+    """
+    return _render_cached(
+        lambda: _render_pdf(url, output_path),
+        url,
+        ["pdf"],
+        cache_url,
+        cache_token,
+        progress_id,
+    )
+
+
+@celery_app.task(acks_late=True)
+def export_task(
+    url: str,
+    formats: List[str],
+    output_path: str,
+    progress_id: Optional[str] = None,
+    cache_url: Optional[str] = None,
+    cache_token: Optional[str] = None,
+) -> Dict[str, str]:
+    """
+    一次页面加载生成多种格式
+
+    :param formats: pdf、docx、txt中的若干项
+    :param output_path: 输出文件路径，各格式替换为对应扩展名
+    :param progress_id: 可选，报告进度所用的ID（API返回的任务ID）
+    :param cache_url: 可选，去重渲染的缓存键URL，与cache_token一起见_render_cached
+    :return: {格式: 文件路径或产物URI}
+    """
+
+    def render() -> Dict[str, str]:
+        if settings.ARTIFACT_STORE == "local":
+            return export_url_sync(url, formats, output_path)
+        return export_url_sync(
+            url, formats, os.path.basename(output_path), store=get_artifact_store()
+        )
+
+    return _render_cached(
+        render, url, format_set(formats), cache_url, cache_token, progress_id
+    )
+
+
+@celery_app.task(acks_late=True)
+def create_pdfs_task(
+    urls: List[str], output_paths: List[str], tenant: Optional[str] = None
+) -> List[dict]:
+    """
+    在同一worker内并发生成多个PDF文件，单个URL失败不影响其他URL
+
+    tenant不为空时，结束后从该租户的未完成链接数中释放本批链接（见FairScheduler.admit_urls）。
+    """
+    try:
+        results = _render_pdfs(urls, output_paths)
+    finally:
+        scheduler = get_fair_scheduler() if tenant else None
+        if scheduler is not None:
+            scheduler.release_urls(tenant, len(urls))
+    return [
+        {
+            "url": url,
+            "pdf_path": None if isinstance(result, Exception) else result,
+            "error": str(result) if isinstance(result, Exception) else None,
+        }
+        for url, result in zip(urls, results)
+    ]
+
+
+def _email_config() -> EmailConfig:
+    return EmailConfig(
         smtp_server=settings.SMTP_SERVER,
         smtp_port=settings.SMTP_PORT,
         smtp_user=settings.SMTP_USER,
         smtp_password=settings.SMTP_PASSWORD,
         sender_email=settings.SENDER_EMAIL or settings.SMTP_USER,
+        stream_threshold=settings.EMAIL_STREAM_THRESHOLD_BYTES,
+        debug=settings.SMTP_DEBUG,
     )
-    service = EmailService(config)
-    service.send_email(
-        to_email=to_email, subject=subject, body=body, attachments=[pdf_path]
-    )
+
+
+def _email_service() -> EmailService:
+    """按配置创建邮件服务，启用连接池时复用本worker进程的SMTP会话"""
+    config = _email_config()
+    pool = get_smtp_pool(config) if settings.SMTP_POOL_ENABLED else None
+    return EmailService(config, pool=pool)
+
+
+def _send_email(**kwargs) -> bool:
+    """发送一封邮件，启用EMAIL_ASYNC_ENABLED时在worker的异步运行时上发送"""
+    if settings.EMAIL_ASYNC_ENABLED:
+        service = AsyncEmailService(_email_config())
+        return get_runtime().run(service.send_email(**kwargs))
+    return _email_service().send_email(**kwargs)
+
+
+def _send_many(emails: List[OutgoingEmail]) -> List[Union[bool, Exception]]:
+    """批量发送，启用EMAIL_ASYNC_ENABLED时在异步运行时上并发使用多个会话"""
+    if settings.EMAIL_ASYNC_ENABLED:
+        service = AsyncEmailService(_email_config())
+        return get_runtime().run(service.send_many(emails))
+    return _email_service().send_many(emails)
+
+
+def _as_links(paths: List[str]) -> Tuple[List[dict], List[str]]:
+    """
+    按EMAIL_ATTACHMENT_MODE决定哪些产物改为在邮件中附下载链接
+
+    :return: (下载链接列表, 仍作为附件的产物)；无法生成链接的产物（如不在本地存储中）
+        仍作为附件
+    """
+    mode = settings.EMAIL_ATTACHMENT_MODE
+    if mode == "attachment" or not paths or not download_links.is_enabled():
+        return [], list(paths)
+    if mode == "auto":
+        total = sum(artifact_size(path) for path in paths)
+        if total <= settings.EMAIL_LINK_THRESHOLD_BYTES:
+            return [], list(paths)
+    links, attachments = [], []
+    for path in paths:
+        url = download_links.download_url(path)
+        if url:
+            links.append({"name": artifact_name(path), "url": url})
+        else:
+            attachments.append(path)
+    return links, attachments
+
+
+def _links_text(links: List[dict]) -> str:
+    if not links:
+        return ""
+    days = max(1, settings.DOWNLOAD_LINK_TTL // 86400)
+    lines = "\n".join(f"{link['name']}：{link['url']}" for link in links)
+    return f"\n\n下载链接（{days}天内有效）：\n{lines}"
+
+
+@celery_app.task
+def send_email_task(
+    pdf_path: Union[str, Dict[str, str]], to_email: str, subject: str, body: str
+):
+    """
+    异步发送邮件, pdf_path由上一个任务传来：create_pdf_task返回的本地路径或产物URI，
+    或export_task返回的{格式: 路径}字典（每个格式一个附件）。
+    按EMAIL_ATTACHMENT_MODE可以改为在正文中附下载链接。
+    """
+    paths = list(pdf_path.values()) if isinstance(pdf_path, dict) else [pdf_path]
+    links, attachments = _as_links(paths)
+    body += _links_text(links)
+    detail = {"downloads": links} if links else {}
+    # 本任务是任务链的最后一个，其ID即API返回的任务ID
+    with bind(send_email_task.request.id, final="done", **detail):
+        advance("emailing")
+        _send_email(
+            to_email=to_email, subject=subject, body=body, attachments=attachments
+        )
     return True
+
+
+@celery_app.task
+def send_emails_task(
+    pdf_path: Union[str, Dict[str, str], None], recipients: List[dict]
+) -> List[Optional[str]]:
+    """
+    把同一组文件分别发给多个收件人，在同一个SMTP会话中依次发送
+    （启用EMAIL_ASYNC_ENABLED时并发使用多个会话）
+
+    :param pdf_path: 附件，或export_task返回的{格式: 路径}（每个格式一个附件）；
+        为None时只发送正文（如渲染失败的通知）
+    :param recipients: 每项包含to_email、subject、body
+    :return: 与recipients顺序一致的错误信息，发送成功的项为None
+    """
+    if isinstance(pdf_path, dict):
+        attachments = list(pdf_path.values())
+    else:
+        attachments = [pdf_path] if pdf_path else None
+    results = _send_many(
+        [
+            OutgoingEmail(
+                to_email=r["to_email"],
+                subject=r["subject"],
+                body=r["body"],
+                attachments=attachments,
+            )
+            for r in recipients
+        ]
+    )
+    return [None if r is True else str(r) for r in results]
+
+
+def _split_by_size(paths: List[str], max_bytes: int) -> List[List[str]]:
+    """按顺序把附件分组，每组总大小不超过max_bytes（单个超大的附件独占一组）"""
+    groups: List[List[str]] = []
+    current: List[str] = []
+    current_size = 0
+    for path in paths:
+        size = artifact_size(path)
+        if current and current_size + size > max_bytes:
+            groups.append(current)
+            current, current_size = [], 0
+        current.append(path)
+        current_size += size
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _zip_artifacts(paths: List[str], zip_path: str) -> str:
+    """把多个产物打包为zip；PDF本身已压缩，只存储不再压缩"""
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as archive:
+        for path in paths:
+            with open_artifact(path) as src, archive.open(
+                artifact_name(path), "w"
+            ) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+    return zip_path
+
+
+@celery_app.task
+def send_digest_task(
+    results: List[List[dict]], to_email: str, subject: str, delivery: str = "digest"
+) -> List[Optional[str]]:
+    """
+    批量提交的结果邮件，作为chord的回调在全部渲染任务结束后执行，
+    所有邮件在同一个SMTP会话中发送
+
+    :param results: 各create_pdfs_task的返回值
+    :param delivery: digest（全部PDF作为附件）、zip（打包为zip附件）
+        或separate（每个PDF一封邮件）；附件总大小超过BATCH_DIGEST_MAX_BYTES时拆成多封，
+        按EMAIL_ATTACHMENT_MODE改为下载链接的PDF不再作为附件
+    :return: 与发送的邮件顺序一致的错误信息，发送成功的项为None
+    """
+    items = [item for chunk in results for item in chunk]
+    done = [item for item in items if item["pdf_path"]]
+    failed = [item for item in items if not item["pdf_path"]]
+    summary = f"共{len(items)}个链接，成功{len(done)}个，失败{len(failed)}个。"
+    if failed:
+        summary += "\n\n以下链接转换失败：\n" + "\n".join(
+            f"{item['url']}：{item['error']}" for item in failed
+        )
+    paths = [item["pdf_path"] for item in done]
+
+    emails: List[OutgoingEmail] = []
+    archives: List[str] = []
+    if delivery == "separate":
+        for path in paths:
+            links, attachments = _as_links([path])
+            emails.append(
+                OutgoingEmail(
+                    to_email=to_email,
+                    subject=f"{subject}：{artifact_name(path)}",
+                    body=f"请查收由WeDocX生成的PDF文件：{artifact_name(path)}"
+                    + _links_text(links),
+                    attachments=attachments,
+                )
+            )
+        if failed:
+            emails.append(OutgoingEmail(to_email, subject, summary))
+    else:
+        links, paths = _as_links(paths)
+        summary += _links_text(links)
+        groups = _split_by_size(paths, settings.BATCH_DIGEST_MAX_BYTES) or [[]]
+        for index, group in enumerate(groups, 1):
+            attachments = group
+            if delivery == "zip" and group:
+                stem = os.path.splitext(artifact_name(group[0]))[0]
+                zip_path = os.path.join(settings.OUTPUT_DIR, f"{stem}-{index}.zip")
+                attachments = [_zip_artifacts(group, os.path.abspath(zip_path))]
+                archives.extend(attachments)
+            part = f"（{index}/{len(groups)}）" if len(groups) > 1 else ""
+            emails.append(
+                OutgoingEmail(to_email, f"{subject}{part}", summary, attachments)
+            )
+
+    try:
+        with bind(send_digest_task.request.id, final="done"):
+            advance("emailing", succeeded=len(done), failed=len(failed))
+            results = _send_many(emails)
+    finally:
+        # zip只用于本次发送，发送后删除
+        for archive in archives:
+            try:
+                os.remove(archive)
+            except OSError as e:
+                logger.warning(f"删除临时zip失败: {archive}, {e}")
+    errors = [None if r is True else str(r) for r in results]
+    if any(errors):
+        logger.warning(f"批量结果邮件部分发送失败: {to_email}, {errors}")
+    return errors
@@ -0,0 +1,270 @@
+"""
+文档结构提取基准测试
+
+生成约1MB和10MB的文章型HTML，分别测量解析（BeautifulSoup）和结构提取的
+耗时与峰值内存（tracemalloc）。加 --legacy 同时测量改写前的递归实现，
+加 --parsers 测量各解析方式从HTML源码到文本块的端到端耗时与峰值内存，
+加 --docx 比较python-docx与流式写入生成DOCX的耗时与峰值内存，
+加 --table 比较逐个单元格调用python-docx与整表生成XML写入大表格的耗时。
+
+用法（在backend目录下）：
+    python -m benchmarks.bench_document_service
+    python -m benchmarks.bench_document_service --sizes 1 10 --legacy
+    python -m benchmarks.bench_document_service --shape nested --legacy
+    python -m benchmarks.bench_document_service --parsers html.parser lxml stream
+    python -m benchmarks.bench_document_service --sizes 1 5 --docx
+    python -m benchmarks.bench_document_service --sizes --table 1000
+"""
+
+import argparse
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from app.services.document_service import (
+    _clean_text,
+    convert_html_to_docx,
+    extract_blocks,
+    iter_blocks,
+)
+from app.services.docx_stream import TableCell, append_table
+from bs4 import BeautifulSoup, NavigableString, Tag
+from docx import Document
+
+
+def build_nested_html(target_bytes: int, depth: int = 500) -> str:
+    """生成深层嵌套的HTML：每组depth层div，每层一个段落（递归实现的最坏情况）"""
+    level = "<div><p>第{i}层段落文本</p>"
+    parts = ["<html><body>"]
+    size = 0
+    i = 0
+    while size < target_bytes:
+        group = [level.format(i=i + d) for d in range(depth)]
+        group.append("</div>" * depth)
+        chunk = "".join(group)
+        parts.append(chunk)
+        size += len(chunk.encode("utf-8"))
+        i += depth
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def build_html(target_bytes: int) -> str:
+    """生成接近目标大小的HTML：段落、嵌套div、列表和表格混合"""
+    section = (
+        "<div class='section'><h2>第{i}节 标题</h2>"
+        "<p>这是一段用于测试的正文内容，包含<b>加粗</b>和<a href='#'>链接</a>。"
+        "Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>"
+        "<div><div><p>嵌套段落{i}<br>换行之后的文本</p></div></div>"
+        "<ul><li>列表项一</li><li>列表项二</li><li>列表项三</li></ul>"
+        "<table><tr><th>列1</th><th>列2</th></tr><tr><td>{i}</td><td>值</td></tr></table>"
+        "<script>var x = {i};</script></div>"
+    )
+    parts = ["<html><body><article>"]
+    size = 0
+    i = 0
+    while size < target_bytes:
+        chunk = section.format(i=i)
+        parts.append(chunk)
+        size += len(chunk.encode("utf-8"))
+        i += 1
+    parts.append("</article></body></html>")
+    return "".join(parts)
+
+
+def legacy_extract(elem):
+    """改写前的递归实现（仅用于对比）"""
+    results = []
+    if isinstance(elem, NavigableString):
+        text = _clean_text(str(elem))
+        if text:
+            results.append((text, "", ""))
+        return results
+    if elem.name in ["script", "style", "meta", "link"]:
+        return results
+    if elem.name == "br":
+        results.append(("\n", "br", ""))
+        return results
+    class_name = " ".join(elem.get("class", []))
+    if elem.name in ["ul", "ol"]:
+        for i, li in enumerate(elem.find_all("li", recursive=False)):
+            prefix = f"{i+1}. " if elem.name == "ol" else "• "
+            text = _clean_text(li.get_text())
+            if text:
+                results.append((f"{prefix}{text}", "li", class_name))
+        results.append(("\n", "ulol", class_name))
+        return results
+    if elem.name == "table":
+        for row in elem.find_all("tr", recursive=False):
+            cells = [
+                _clean_text(c.get_text())
+                for c in row.find_all(["td", "th"], recursive=False)
+            ]
+            if cells:
+                results.append((" | ".join(cells), "table", class_name))
+        results.append(("\n", "table", ""))
+        return results
+    for child in elem.children:
+        if isinstance(child, (Tag, NavigableString)):
+            results.extend(legacy_extract(child))
+    if elem.name in ["p", "div", "h1", "h2", "h3", "h4", "h5", "h6"]:
+        if results and not results[-1][0].endswith("\n"):
+            results.append(("\n", "", ""))
+        if results and not results[0][0].startswith("\n"):
+            results.insert(0, ("\n", "", ""))
+    return results
+
+
+def measure(func, *args):
+    """返回(结果, 耗时秒, 峰值内存字节)"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def count_blocks(root) -> int:
+    return sum(1 for _ in iter_blocks(root))
+
+
+def count_extracted(html: str, parser: str) -> int:
+    return sum(1 for _ in extract_blocks(html, parser))
+
+
+# (名称, 解析方式, 是否流式写入)
+DOCX_MODES = [
+    ("python-docx", "html.parser", False),
+    ("stream-write", "html.parser", True),
+    ("stream-all", "stream", True),
+]
+
+
+def write_docx(html: str, parser: str, streaming: bool) -> int:
+    """生成DOCX到临时文件，返回文件大小"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bench.docx")
+        convert_html_to_docx(html, path, parser=parser, streaming=streaming)
+        return os.path.getsize(path)
+
+
+def build_table_html(rows: int, cols: int = 5) -> str:
+    """生成一张rows行的表格，表头跨列、每10行有一个跨行单元格"""
+    parts = [
+        f"<html><body><table><thead><tr><th colspan='{cols}'>表头</th></tr></thead><tbody>"
+    ]
+    for i in range(rows):
+        cells = [f"<td>第{i}行第{j}列</td>" for j in range(cols)]
+        if i % 10 == 0:
+            cells[0] = f"<td rowspan='2'>第{i}组</td>"
+        elif i % 10 == 1:
+            cells = cells[1:]
+        parts.append(f"<tr>{''.join(cells)}</tr>")
+    parts.append("</tbody></table></body></html>")
+    return "".join(parts)
+
+
+def table_python_docx_cells(rows, cols: int) -> None:
+    """逐个单元格调用python-docx（改写前生成Word表格的常见做法）"""
+    doc = Document()
+    table = doc.add_table(rows=0, cols=cols)
+    for row in rows:
+        cells = table.add_row().cells
+        for cell, value in zip(cells, row):
+            cell.text = value.text
+
+
+def table_python_docx_xml(rows) -> None:
+    doc = Document()
+    append_table(doc, rows)
+
+
+def convert_table(html: str, parser: str, streaming: bool) -> int:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bench.docx")
+        convert_html_to_docx(html, path, parser=parser, streaming=streaming)
+        return os.path.getsize(path)
+
+
+def bench_table(rows: int, cols: int = 5) -> None:
+    cells = [[TableCell(f"第{i}行第{j}列") for j in range(cols)] for i in range(rows)]
+    html = build_table_html(rows, cols)
+    print(f"{'rows':>6} {'stage':<22} {'time(s)':>9} {'peak(MB)':>9}")
+    for name, func, args in [
+        ("python-docx cells", table_python_docx_cells, (cells, cols)),
+        ("python-docx table_xml", table_python_docx_xml, (cells,)),
+        ("convert python-docx", convert_table, (html, "html.parser", False)),
+        ("convert stream", convert_table, (html, "stream", True)),
+    ]:
+        _, t, peak = measure(func, *args)
+        print(f"{rows:>6} {name:<22} {t:>9.3f} {peak / 2**20:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="*", default=[1, 10], help="MB")
+    parser.add_argument("--legacy", action="store_true", help="同时测量递归实现")
+    parser.add_argument(
+        "--shape", choices=["article", "nested"], default="article", help="HTML结构"
+    )
+    parser.add_argument(
+        "--parsers", nargs="+", default=[], help="端到端测量的解析方式，如 lxml stream"
+    )
+    parser.add_argument(
+        "--docx", action="store_true", help="比较python-docx与流式写入生成DOCX"
+    )
+    parser.add_argument(
+        "--table", type=int, default=0, help="测量生成该行数的表格（0为不测量）"
+    )
+    args = parser.parse_args()
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+
+    if args.table:
+        bench_table(args.table)
+    if not args.sizes:
+        return
+
+    print(f"{'size':>6} {'stage':<16} {'time(s)':>9} {'peak(MB)':>9} {'blocks':>8}")
+    for size_mb in args.sizes:
+        builder = build_nested_html if args.shape == "nested" else build_html
+        html = builder(size_mb * 1024 * 1024)
+        soup, t, peak = measure(BeautifulSoup, html, "html.parser")
+        print(f"{size_mb:>4}MB {'parse':<16} {t:>9.3f} {peak / 2**20:>9.1f}")
+        root = soup.body or soup
+
+        n, t, peak = measure(count_blocks, root)
+        print(
+            f"{size_mb:>4}MB {'iter_blocks':<16} {t:>9.3f} {peak / 2**20:>9.1f} {n:>8}"
+        )
+        if args.legacy:
+            blocks, t, peak = measure(legacy_extract, root)
+            print(
+                f"{size_mb:>4}MB {'legacy(list)':<16} {t:>9.3f} "
+                f"{peak / 2**20:>9.1f} {len(blocks):>8}"
+            )
+        del soup, root
+
+        for name in args.parsers:
+            n, t, peak = measure(count_extracted, html, name)
+            print(
+                f"{size_mb:>4}MB {'e2e:' + name:<16} {t:>9.3f} "
+                f"{peak / 2**20:>9.1f} {n:>8}"
+            )
+
+        if args.docx:
+            for name, doc_parser, streaming in DOCX_MODES:
+                size, t, peak = measure(write_docx, html, doc_parser, streaming)
+                print(
+                    f"{size_mb:>4}MB {'docx:' + name:<16} {t:>9.3f} "
+                    f"{peak / 2**20:>9.1f} {size // 1024:>6}KB"
+                )
+
+
+if __name__ == "__main__":
+    main()
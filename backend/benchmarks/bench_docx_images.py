@@ -0,0 +1,132 @@
+"""
+DOCX图片嵌入基准测试
+
+生成图片密集的公众号式文章：手机拍摄尺寸的JPEG照片、PNG截图、WEBP图片，
+以及反复出现的分隔线和二维码。分别测量嵌入原图（只做格式转换，不缩放）、
+去重并缩放到目标DPI（1个线程和多个线程）时图片处理与生成DOCX的耗时和文件大小。
+
+用法（在backend目录下）：
+    python -m benchmarks.bench_docx_images
+    python -m benchmarks.bench_docx_images --photos 60 --workers 1 4
+    python -m benchmarks.bench_docx_images --dpi 96 --budget-mb 5
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from io import BytesIO
+
+from app.core.config import settings
+from app.services import image_pipeline
+from app.services.document_service import convert_html_to_docx
+from docx import Document
+from PIL import Image
+
+
+def _photo(seed: int, size=(1080, 1440)) -> Image.Image:
+    """带噪声的渐变图，压缩率接近真实照片"""
+    noise = Image.effect_noise(size, 40 + seed % 20)
+    gradient = Image.linear_gradient("L").resize(size)
+    return Image.merge("RGB", (noise, gradient, noise.rotate(180)))
+
+
+def _save(img: Image.Image, fmt: str, **kwargs) -> bytes:
+    buffer = BytesIO()
+    img.save(buffer, fmt, **kwargs)
+    return buffer.getvalue()
+
+
+def build_article(photos: int, screenshots: int, webps: int, repeats: int):
+    """
+    生成文章HTML和{src: 图片内容}
+
+    分隔线和二维码的内容相同但地址不同（公众号图片地址带不同参数），
+    每张照片之后出现一次分隔线，每隔若干段出现一次二维码。
+    """
+    images = {}
+    parts = ["<html><body><h1>图片密集的文章</h1>"]
+    divider = _save(Image.new("RGB", (1080, 40), "#eeeeee"), "PNG")
+    qrcode = _save(Image.effect_noise((430, 430), 120).convert("1"), "PNG")
+    for i in range(photos):
+        src = f"https://mmbiz.qpic.cn/photo{i}.jpg"
+        images[src] = _save(_photo(i), "JPEG", quality=92)
+        parts.append(f"<p>第{i}张照片的说明文字。</p><img data-src='{src}'>")
+        if i < repeats:
+            src = f"https://mmbiz.qpic.cn/divider.png?wx_fmt=png&from={i}"
+            images[src] = divider
+            parts.append(f"<img src='{src}'>")
+        if i % 10 == 0:
+            src = f"https://mmbiz.qpic.cn/qrcode.png?t={i}"
+            images[src] = qrcode
+            parts.append(f"<p>扫码关注</p><img src='{src}'>")
+    for i in range(screenshots):
+        src = f"https://mmbiz.qpic.cn/screenshot{i}.png"
+        images[src] = _save(_photo(i, (1242, 2688)).convert("L"), "PNG")
+        parts.append(f"<p>截图{i}</p><img src='{src}'>")
+    for i in range(webps):
+        src = f"https://mmbiz.qpic.cn/image{i}.webp"
+        images[src] = _save(_photo(i, (800, 600)), "WEBP", quality=80)
+        parts.append(f"<p>WEBP图片{i}</p><img src='{src}'>")
+    parts.append("</body></html>")
+    return "".join(parts), images
+
+
+def run(html: str, images: dict, workers: int, **settings_overrides):
+    """生成DOCX，返回(耗时秒, 文件大小, 嵌入的图片数)"""
+    for key, value in dict(DOCX_IMAGE_WORKERS=workers, **settings_overrides).items():
+        setattr(settings, key, value)
+    image_pipeline._image_executor = None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "bench.docx")
+        start = time.perf_counter()
+        convert_html_to_docx(html, path, images=images)
+        elapsed = time.perf_counter() - start
+        shapes = len(Document(path).inline_shapes)
+        return elapsed, os.path.getsize(path), shapes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--photos", type=int, default=30, help="JPEG照片数")
+    parser.add_argument("--screenshots", type=int, default=5, help="PNG截图数")
+    parser.add_argument("--webps", type=int, default=5, help="WEBP图片数")
+    parser.add_argument("--repeats", type=int, default=20, help="重复分隔线数")
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 4], help="缩放线程数"
+    )
+    parser.add_argument("--dpi", type=int, default=settings.DOCX_IMAGE_DPI)
+    parser.add_argument(
+        "--budget-mb",
+        type=float,
+        default=settings.DOCX_IMAGE_BYTE_BUDGET / 2**20,
+        help="单个文档图片预算（MB）",
+    )
+    args = parser.parse_args()
+
+    html, images = build_article(
+        args.photos, args.screenshots, args.webps, args.repeats
+    )
+    total = sum(len(data) for data in images.values())
+    print(f"图片 {len(images)} 张，原始大小 {total / 2**20:.1f}MB")
+
+    budget = int(args.budget_mb * 2**20)
+    # 原图：DPI足够大时不缩放，预算不限
+    modes = [("original", 1, dict(DOCX_IMAGE_DPI=10**6, DOCX_IMAGE_BYTE_BUDGET=2**62))]
+    for workers in args.workers:
+        modes.append(
+            (
+                f"downscale x{workers}",
+                workers,
+                dict(DOCX_IMAGE_DPI=args.dpi, DOCX_IMAGE_BYTE_BUDGET=budget),
+            )
+        )
+
+    print(f"{'mode':<16} {'time(s)':>9} {'docx(MB)':>9} {'images':>7}")
+    for name, workers, overrides in modes:
+        elapsed, size, shapes = run(html, images, workers, **overrides)
+        print(f"{name:<16} {elapsed:>9.3f} {size / 2**20:>9.1f} {shapes:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+"""
+端到端基准测试
+
+在本地启动合成页面的HTTP服务和只计数的SMTP接收端（见benchmarks.fixtures），
+对每个目标×页面组合重复执行，报告延迟分位数（p50/p95/p99）、吞吐（页/秒）和
+进程树（含浏览器子进程）的峰值RSS，并可输出JSON与上一次的结果比较。
+
+目标：
+- pdf：url_to_pdf渲染PDF（需要Playwright浏览器）
+- export：export_url一次加载生成PDF、DOCX和TXT（需要Playwright浏览器）
+- docx / txt：convert_html_to_docx / convert_html_to_txt直接转换页面HTML，
+  长文章的图片取自HTTP服务，不需要浏览器
+- chain-eager：与/api/v1/process-url相同的create_pdf_task→send_email_task任务链，
+  在当前进程中以eager模式执行，邮件发到SMTP接收端
+- chain-worker：任务链提交到Redis，由另外启动的worker执行；worker需要能访问
+  本进程的HTTP服务，SMTP配置指向本进程的SMTP接收端（启动时会打印所需的环境变量）
+
+页面：short（短文本）、article（带懒加载图片的公众号式长文章）、table（大表格）。
+
+用法（在backend目录下）：
+    python -m benchmarks.bench_e2e --targets docx txt -n 20
+    python -m benchmarks.bench_e2e --targets pdf chain-eager --concurrency 4
+    python -m benchmarks.bench_e2e --targets chain-worker --http-port 8765 --smtp-port 8025
+    python -m benchmarks.bench_e2e --output base.json
+    python -m benchmarks.bench_e2e --output head.json --compare base.json --threshold 0.15
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from app.core.config import settings
+from benchmarks.fixtures import PAGES, FixtureServer, SmtpSink
+
+TARGETS = ("pdf", "export", "docx", "txt", "chain-eager", "chain-worker")
+# 分位数/吞吐变化超过该比例视为回退
+DEFAULT_THRESHOLD = 0.15
+
+
+def percentile(values: List[float], p: float) -> float:
+    """线性插值的分位数（与numpy默认方式相同）"""
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _process_rss(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _child_pids(pid: int) -> List[int]:
+    children = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def tree_rss(pid: int) -> int:
+    """进程及其全部子进程（如Chromium）的RSS之和（字节），仅Linux"""
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        total += _process_rss(current)
+        pending.extend(_child_pids(current))
+    return total
+
+
+class RssSampler:
+    """在后台线程中定期采样进程树RSS，记录峰值"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        pid = os.getpid()
+        while not self._stop.is_set():
+            self.peak = max(self.peak, tree_rss(pid))
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "RssSampler":
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+        if not self.peak:
+            # 没有/proc时退回到本进程生命周期内的峰值（Linux上单位为KB）
+            self.peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Harness:
+    """持有HTTP服务、SMTP接收端和本次运行产生的文件"""
+
+    def __init__(self, server: FixtureServer, sink: Optional[SmtpSink]):
+        self.server = server
+        self.sink = sink
+        self.output_dir = os.path.abspath(str(settings.OUTPUT_DIR))
+        self._files: List[str] = []
+        self._tmp_dir = tempfile.TemporaryDirectory()
+
+    def output_path(self, ext: str) -> str:
+        """worker也能写入的输出路径，结束时删除"""
+        path = os.path.join(self.output_dir, f"bench-{uuid.uuid4().hex}.{ext}")
+        self._files.append(path)
+        return path
+
+    def tmp_path(self, ext: str) -> str:
+        return os.path.join(self._tmp_dir.name, f"{uuid.uuid4().hex}.{ext}")
+
+    def images(self, html: str) -> Dict[str, bytes]:
+        """页面中<img>的src/data-src对应的图片内容"""
+        images = {}
+        for src in re.findall(r"<img[^>]*?(?:data-)?src='([^']+)'", html):
+            data = self.server.image(src)
+            if data is not None:
+                images[src] = data
+        return images
+
+    def cleanup(self) -> None:
+        for path in self._files:
+            for candidate in (path,) + tuple(
+                os.path.splitext(path)[0] + ext for ext in (".docx", ".txt")
+            ):
+                if os.path.exists(candidate):
+                    os.remove(candidate)
+        self._files.clear()
+        self._tmp_dir.cleanup()
+
+
+def _chain(harness: Harness, url: str, wait: Callable):
+    from app.workers.tasks import create_pdf_task, send_email_task
+    from celery import chain
+
+    def run():
+        result = chain(
+            create_pdf_task.s(url, harness.output_path("pdf"), None),
+            send_email_task.s("bench@example.com", "基准测试", "基准测试邮件"),
+        ).apply_async()
+        wait(result)
+
+    return run
+
+
+def make_runner(target: str, harness: Harness, page: str, timeout: float) -> Callable:
+    """返回执行一次目标的函数"""
+    url = harness.server.url(page)
+    html = harness.server.pages[page].decode("utf-8")
+
+    if target == "pdf":
+        from app.services.pdf_service import url_to_pdf_sync
+
+        return lambda: url_to_pdf_sync(url, harness.output_path("pdf"))
+    if target == "export":
+        from app.services.pdf_service import export_url_sync
+
+        return lambda: export_url_sync(
+            url, ("pdf", "docx", "txt"), harness.output_path("pdf")
+        )
+    if target == "docx":
+        from app.services.document_service import convert_html_to_docx
+
+        images = harness.images(html) if settings.DOCX_EMBED_IMAGES else None
+        return lambda: convert_html_to_docx(
+            html, harness.tmp_path("docx"), page, images=images
+        )
+    if target == "txt":
+        from app.services.document_service import convert_html_to_txt
+
+        return lambda: convert_html_to_txt(html, harness.tmp_path("txt"), page)
+    if target == "chain-eager":
+        return _chain(harness, url, lambda result: result.get(timeout=timeout))
+    if target == "chain-worker":
+        return _chain(
+            harness, url, lambda result: result.get(timeout=timeout, interval=0.05)
+        )
+    raise ValueError(f"未知的目标: {target}")
+
+
+def run_scenario(
+    target: str,
+    page: str,
+    runner: Callable,
+    iterations: int,
+    warmup: int,
+    concurrency: int,
+    sink: Optional[SmtpSink] = None,
+) -> dict:
+    """预热后以concurrency个线程共执行iterations次，返回统计结果"""
+    result = {
+        "target": target,
+        "page": page,
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "errors": 0,
+    }
+    try:
+        for _ in range(warmup):
+            runner()
+    except Exception as e:
+        result.update(errors=iterations, error=f"预热失败: {e}")
+        return result
+
+    latencies: List[float] = []
+    errors: List[str] = []
+
+    def once(_):
+        start = time.perf_counter()
+        try:
+            runner()
+        except Exception as e:
+            errors.append(str(e))
+            return
+        latencies.append(time.perf_counter() - start)
+
+    mails_before = sink.messages if sink is not None else 0
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(once, range(iterations)))
+        elapsed = time.perf_counter() - start
+
+    result["errors"] = len(errors)
+    if errors:
+        result["error"] = errors[0]
+    result["peak_rss_mb"] = round(rss.peak / 2**20, 1)
+    if sink is not None and target.startswith("chain"):
+        # 邮件由SMTP会话异步交给接收端，稍等片刻再计数
+        sink.wait_for(mails_before + len(latencies), timeout=5)
+        result["mails"] = sink.messages - mails_before
+    if latencies:
+        result["latency_ms"] = {
+            "p50": round(percentile(latencies, 50) * 1000, 1),
+            "p95": round(percentile(latencies, 95) * 1000, 1),
+            "p99": round(percentile(latencies, 99) * 1000, 1),
+            "mean": round(sum(latencies) / len(latencies) * 1000, 1),
+            "max": round(max(latencies) * 1000, 1),
+        }
+        result["pages_per_sec"] = round(len(latencies) / elapsed, 3)
+    return result
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return (
+            subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+            or None
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: List[dict]) -> None:
+    print(
+        f"{'target':<13} {'page':<8} {'n':>4} {'conc':>4} {'p50(ms)':>9} "
+        f"{'p95(ms)':>9} {'p99(ms)':>9} {'pages/s':>8} {'rss(MB)':>8} {'err':>4}"
+    )
+    for r in results:
+        lat = r.get("latency_ms")
+        cols = (
+            f"{lat['p50']:>9.1f} {lat['p95']:>9.1f} {lat['p99']:>9.1f} "
+            f"{r['pages_per_sec']:>8.2f}"
+            if lat
+            else f"{'-':>9} {'-':>9} {'-':>9} {'-':>8}"
+        )
+        print(
+            f"{r['target']:<13} {r['page']:<8} {r['iterations']:>4} "
+            f"{r['concurrency']:>4} {cols} {r.get('peak_rss_mb', 0):>8.1f} "
+            f"{r['errors']:>4}"
+        )
+        if r.get("error"):
+            print(f"    错误: {r['error'][:200]}")
+
+
+def compare(results: List[dict], baseline: dict, threshold: float) -> List[str]:
+    """
+    与基准结果比较，返回回退项的描述
+
+    p95延迟升高或吞吐下降超过threshold（比例）视为回退，只比较两边都成功的组合
+    """
+    base = {(r["target"], r["page"]): r for r in baseline.get("results", [])}
+    regressions = []
+    print(f"\n与 {baseline.get('meta', {}).get('commit') or '基准'} 比较:")
+    for r in results:
+        old = base.get((r["target"], r["page"]))
+        if not old or "latency_ms" not in old or "latency_ms" not in r:
+            continue
+        p95 = r["latency_ms"]["p95"] / old["latency_ms"]["p95"] - 1
+        rate = r["pages_per_sec"] / old["pages_per_sec"] - 1
+        flag = ""
+        if p95 > threshold or rate < -threshold:
+            flag = "  <- 回退"
+            regressions.append(
+                f"{r['target']}/{r['page']}: p95 {p95:+.0%}, pages/s {rate:+.0%}"
+            )
+        print(
+            f"  {r['target']:<13} {r['page']:<8} p95 {p95:+7.1%}  pages/s {rate:+7.1%}{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--targets", nargs="+", choices=TARGETS, default=["docx", "txt", "pdf"]
+    )
+    parser.add_argument("--pages", nargs="+", choices=list(PAGES), default=list(PAGES))
+    parser.add_argument("-n", "--iterations", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=1, help="不计入统计的预热次数")
+    parser.add_argument("--concurrency", type=int, default=1, help="并发线程数")
+    parser.add_argument(
+        "--timeout", type=float, default=120, help="单次任务链超时（秒）"
+    )
+    parser.add_argument("--article-images", type=int, default=30)
+    parser.add_argument("--table-rows", type=int, default=2000)
+    parser.add_argument(
+        "--image-delay-ms", type=int, default=0, help="图片响应延迟，模拟CDN"
+    )
+    parser.add_argument("--http-host", default="127.0.0.1")
+    parser.add_argument("--http-port", type=int, default=0)
+    parser.add_argument("--smtp-port", type=int, default=0)
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    parser.add_argument("--compare", help="与之前输出的JSON比较，有回退时退出码为1")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    chains = [t for t in args.targets if t.startswith("chain")]
+    server = FixtureServer(args.http_host, args.http_port, args.image_delay_ms)
+    sink = SmtpSink(args.http_host, args.smtp_port) if chains else None
+    builders = {
+        "short": lambda: PAGES["short"](),
+        "article": lambda: PAGES["article"](images=args.article_images),
+        "table": lambda: PAGES["table"](rows=args.table_rows),
+    }
+    for page in args.pages:
+        server.add_page(page, builders[page]())
+
+    results = []
+    with server, sink if sink is not None else nullcontext():
+        harness = Harness(server, sink)
+        if sink is not None:
+            _configure_smtp(sink)
+        if "chain-worker" in args.targets:
+            print(
+                "chain-worker需要已启动的worker，环境变量: "
+                f"SMTP_SERVER={sink.host} SMTP_PORT={sink.port} "
+                "SMTP_USER=bench@example.com SMTP_PASSWORD=bench"
+            )
+        try:
+            for target in args.targets:
+                eager = target == "chain-eager"
+                if chains:
+                    from app.celery_app import celery_app
+
+                    celery_app.conf.task_always_eager = eager
+                    celery_app.conf.task_eager_propagates = eager
+                for page in args.pages:
+                    runner = make_runner(target, harness, page, args.timeout)
+                    results.append(
+                        run_scenario(
+                            target,
+                            page,
+                            runner,
+                            args.iterations,
+                            args.warmup,
+                            args.concurrency,
+                            sink,
+                        )
+                    )
+        finally:
+            harness.cleanup()
+            if {"pdf", "export", "chain-eager"} & set(args.targets):
+                from app.services.pdf_service import shutdown_browser_pool
+
+                shutdown_browser_pool()
+
+    print_results(results)
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print("\n性能回退:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+
+def _configure_smtp(sink: SmtpSink) -> None:
+    """当前进程内的邮件发送（eager模式）指向SMTP接收端"""
+    settings.SMTP_SERVER = sink.host
+    settings.SMTP_PORT = sink.port
+    settings.SMTP_USER = "bench@example.com"
+    settings.SMTP_PASSWORD = "bench"
+    settings.SENDER_EMAIL = "bench@example.com"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+文本规范化基准测试
+
+生成以中文为主的文本片段（模拟正文段落、列表项和表格单元格），比较改写前的
+_clean_text、预编译的clean_text逐段调用以及clean_many批量调用的耗时。
+
+用法（在backend目录下）：
+    python -m benchmarks.bench_text_normalizer
+    python -m benchmarks.bench_text_normalizer --fragments 100000 --repeat 5
+    python -m benchmarks.bench_text_normalizer --whitespace-ratio 0
+"""
+
+import argparse
+import random
+import re
+import time
+
+from app.services.text_normalizer import clean_many, clean_text
+
+SAMPLE = (
+    "微信公众号文章的正文内容，包含中文标点。还有一些English words和数字2024！"
+    "“引号”里的内容（括号）、顿号；冒号：以及@符号#话题#。"
+)
+
+
+def legacy_clean_text(text: str) -> str:
+    """改写前的实现"""
+    text = re.sub(r"[ \t\u3000]+", " ", text)
+    text = re.sub(r'[^\w\s\u4e00-\u9fff,.?!，。？！、:：;；""' "()（）\n-]", "", text)
+    text = "\n".join(line.strip() for line in text.splitlines())
+    return text.strip()
+
+
+def build_fragments(count: int, seed: int = 0, whitespace_ratio: float = 0.4):
+    """
+    生成长短不一的片段：多数为短文本，部分带首尾空白和换行；
+    whitespace_ratio比例的片段是纯空白（对应格式化HTML中标签之间的缩进）
+    """
+    rng = random.Random(seed)
+    fragments = []
+    for _ in range(count):
+        if rng.random() < whitespace_ratio:
+            fragments.append("\n" + " " * rng.choice([2, 4, 8]))
+            continue
+        start = rng.randrange(len(SAMPLE))
+        text = (SAMPLE * 2)[start : start + rng.choice([4, 12, 40, 120])]
+        if rng.random() < 0.3:
+            text = f"  {text}\n\u3000"
+        if rng.random() < 0.1:
+            text = text.replace("，", "\n  ")
+        fragments.append(text)
+    return fragments
+
+
+def timed(func, repeat: int) -> float:
+    """多次运行取最短耗时（秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--fragments", type=int, default=50000, help="片段数")
+    parser.add_argument("--batch", type=int, default=20, help="clean_many每批片段数")
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数")
+    parser.add_argument(
+        "--whitespace-ratio", type=float, default=0.4, help="纯空白片段的比例"
+    )
+    args = parser.parse_args()
+
+    fragments = build_fragments(args.fragments, whitespace_ratio=args.whitespace_ratio)
+    batches = [
+        fragments[i : i + args.batch] for i in range(0, len(fragments), args.batch)
+    ]
+    expected = [legacy_clean_text(t) for t in fragments]
+    assert [clean_text(t) for t in fragments] == expected
+    assert [t for batch in batches for t in clean_many(batch)] == expected
+
+    results = [
+        (
+            "legacy",
+            timed(lambda: [legacy_clean_text(t) for t in fragments], args.repeat),
+        ),
+        ("clean_text", timed(lambda: [clean_text(t) for t in fragments], args.repeat)),
+        (
+            f"clean_many({args.batch})",
+            timed(lambda: [clean_many(batch) for batch in batches], args.repeat),
+        ),
+    ]
+    baseline = results[0][1]
+    print(f"{'impl':<16} {'time(s)':>9} {'speedup':>8}")
+    for name, elapsed in results:
+        print(f"{name:<16} {elapsed:>9.3f} {baseline / elapsed:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
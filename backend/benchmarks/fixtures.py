@@ -0,0 +1,317 @@
+"""
+端到端基准测试的本地环境
+
+- FixtureServer：在本机线程中提供合成页面和图片的HTTP服务，图片可设置响应延迟
+  以模拟CDN；页面包括短文本、带懒加载图片的公众号式长文章和大表格
+- SmtpSink：本地SMTP服务器（aiosmtpd），支持STARTTLS和任意账号登录，
+  只统计收到的邮件，不投递
+
+两者都可以在基准测试之外单独启动，供真实worker模式下的worker进程访问：
+    python -m benchmarks.fixtures --http-port 8765 --smtp-port 8025
+"""
+
+import argparse
+import os
+import re
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Dict, List, Optional
+
+from benchmarks.bench_document_service import build_table_html
+
+# 公众号正文的懒加载：图片进入视口前只有data-src
+_LAZY_SCRIPT = """
+<script>
+const observer = new IntersectionObserver(entries => entries.forEach(entry => {
+    if (entry.isIntersecting && entry.target.dataset.src) {
+        entry.target.src = entry.target.dataset.src;
+        observer.unobserve(entry.target);
+    }
+}), {rootMargin: '200px'});
+document.querySelectorAll('img[data-src]').forEach(img => observer.observe(img));
+</script>
+"""
+
+
+def build_short_page(paragraphs: int = 5) -> str:
+    """几段纯文本的短页面"""
+    body = "".join(
+        f"<p>第{i}段正文，用于测量页面加载和打印的固定开销。</p>"
+        for i in range(paragraphs)
+    )
+    return f"<html><head><title>短文本</title></head><body><h1>短文本</h1>{body}</body></html>"
+
+
+def build_wechat_article(paragraphs: int = 200, images: int = 30) -> str:
+    """
+    公众号式长文章：rich_media_content正文、带span的段落、
+    data-src懒加载图片（由IntersectionObserver在滚动到附近时加载）
+    """
+    every = max(1, paragraphs // max(1, images))
+    parts = [
+        "<html><head><title>长文章</title><meta charset='utf-8'></head><body>",
+        "<div class='rich_media_area_primary'>",
+        "<h1 class='rich_media_title'>图文并茂的长文章</h1>",
+        "<div id='js_content' class='rich_media_content'>",
+    ]
+    shown = 0
+    for i in range(paragraphs):
+        if i % 20 == 0:
+            parts.append(f"<h2><span>第{i // 20 + 1}部分</span></h2>")
+        parts.append(
+            f"<p style='margin: 0 8px;'><span style='font-size: 15px;'>"
+            f"第{i}段正文，公众号文章通常由大量短段落组成，中间穿插图片、"
+            f"<strong>加粗</strong>的要点和引用。</span></p>"
+        )
+        if i % every == 0 and shown < images:
+            parts.append(
+                f"<p><img class='rich_pages wxw-img' data-ratio='0.75' data-w='1080' "
+                f"data-src='/img/{shown}.jpg?wx_fmt=jpeg' style='width: 100%;'></p>"
+            )
+            shown += 1
+    parts.append("</div></div>")
+    parts.append(_LAZY_SCRIPT)
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def build_table_page(rows: int = 2000) -> str:
+    html = build_table_html(rows)
+    return html.replace("<html>", "<html><head><title>大表格</title></head>", 1)
+
+
+def build_image(index: int, size=(1080, 810)) -> bytes:
+    """带噪声的JPEG图片，压缩率接近真实照片"""
+    from PIL import Image
+
+    noise = Image.effect_noise(size, 40 + index % 20)
+    gradient = Image.linear_gradient("L").resize(size)
+    img = Image.merge("RGB", (noise, gradient, noise.rotate(180)))
+    buffer = BytesIO()
+    img.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+# 页面名 -> 生成函数
+PAGES = {
+    "short": build_short_page,
+    "article": build_wechat_article,
+    "table": build_table_page,
+}
+
+
+class FixtureServer:
+    """提供/page/<name>和/img/<n>.jpg的本地HTTP服务"""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        image_delay_ms: int = 0,
+        distinct_images: int = 8,
+    ):
+        self.image_delay_ms = image_delay_ms
+        self.pages: Dict[str, bytes] = {}
+        # 图片内容循环复用，避免生成大量图片拖慢启动
+        self._images: List[bytes] = [build_image(i) for i in range(distinct_images)]
+        self.requests = 0
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def add_page(self, name: str, html: str) -> str:
+        """注册页面，返回其URL"""
+        self.pages[name] = html.encode("utf-8")
+        return self.url(name)
+
+    def url(self, name: str) -> str:
+        return f"{self.base_url}/page/{name}"
+
+    def image(self, src: str) -> Optional[bytes]:
+        """按图片地址取内容（与HTTP响应相同）"""
+        match = re.search(r"/img/(\d+)\.jpg", src)
+        if match is None:
+            return None
+        return self._images[int(match.group(1)) % len(self._images)]
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server.requests += 1
+                path = self.path.split("?", 1)[0]
+                if path.startswith("/page/"):
+                    body = server.pages.get(path[len("/page/") :])
+                    content_type = "text/html; charset=utf-8"
+                else:
+                    body = server.image(path)
+                    content_type = "image/jpeg"
+                    if body is not None and server.image_delay_ms:
+                        time.sleep(server.image_delay_ms / 1000)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Cache-Control", "no-store")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "FixtureServer":
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name="bench-http", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FixtureServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def _self_signed_context(directory: str) -> ssl.SSLContext:
+    """用openssl生成自签名证书，供STARTTLS使用（客户端不校验证书）"""
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    try:
+        subprocess.run(
+            [
+                "openssl",
+                "req",
+                "-x509",
+                "-newkey",
+                "rsa:2048",
+                "-nodes",
+                "-days",
+                "1",
+                "-subj",
+                "/CN=localhost",
+                "-keyout",
+                key,
+                "-out",
+                cert,
+            ],
+            check=True,
+            capture_output=True,
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise RuntimeError(f"SMTP接收端需要openssl生成自签名证书: {e}")
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+class SmtpSink:
+    """只计数不投递的本地SMTP服务器，接受任意账号登录"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        try:
+            from aiosmtpd.controller import Controller
+            from aiosmtpd.smtp import AuthResult
+        except ImportError:
+            raise RuntimeError("SMTP接收端需要安装aiosmtpd: pip install aiosmtpd")
+
+        if not port:
+            import socket
+
+            with socket.socket() as s:
+                s.bind((host, 0))
+                port = s.getsockname()[1]
+        self.messages = 0
+        self.bytes = 0
+        self._lock = threading.Condition()
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._controller = Controller(
+            self,
+            hostname=host,
+            port=port,
+            tls_context=_self_signed_context(self._tmp_dir.name),
+            authenticator=lambda *args: AuthResult(success=True),
+            auth_required=True,
+        )
+
+    @property
+    def host(self) -> str:
+        return self._controller.hostname
+
+    @property
+    def port(self) -> int:
+        return self._controller.port
+
+    async def handle_DATA(self, server, session, envelope):
+        with self._lock:
+            self.messages += 1
+            self.bytes += len(envelope.content)
+            self._lock.notify_all()
+        return "250 Message accepted for delivery"
+
+    def wait_for(self, count: int, timeout: float) -> bool:
+        """等待收到的邮件数达到count"""
+        with self._lock:
+            return self._lock.wait_for(lambda: self.messages >= count, timeout)
+
+    def start(self) -> "SmtpSink":
+        self._controller.start()
+        return self
+
+    def stop(self) -> None:
+        self._controller.stop()
+        self._tmp_dir.cleanup()
+
+    def __enter__(self) -> "SmtpSink":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="启动基准测试的本地HTTP服务和SMTP接收端"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--http-port", type=int, default=8765)
+    parser.add_argument("--smtp-port", type=int, default=8025)
+    parser.add_argument("--image-delay-ms", type=int, default=0)
+    args = parser.parse_args()
+
+    with FixtureServer(args.host, args.http_port, args.image_delay_ms) as server:
+        with SmtpSink(args.host, args.smtp_port) as sink:
+            for name, build in PAGES.items():
+                print(server.add_page(name, build()))
+            print(f"SMTP: {sink.host}:{sink.port}")
+            try:
+                while True:
+                    time.sleep(10)
+                    print(f"HTTP请求 {server.requests} 次，收到邮件 {sink.messages} 封")
+            except KeyboardInterrupt:
+                pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,132 @@
+import asyncio
+import hmac
+import json
 import os
+import time
 import traceback
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+from urllib.parse import quote
 
+from app.core import tracing
+from app.core.config import settings
+from app.core.metrics import render_latest
+from app.services import download_links
+from app.services.fair_scheduler import get_fair_scheduler, tenant_of, weight_of
 from app.services.pdf_service import url_to_pdf_sync
-from app.workers.tasks import create_pdf_task, send_email_task
-from celery import chain
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, EmailStr, HttpUrl
+from app.services.render_cache import (
+    artifact_paths,
+    format_set,
+    get_render_cache,
+    normalize_url,
+)
+from app.services.task_progress import TERMINAL_STAGES, get_progress_hub, report
+from app.workers.tasks import (
+    create_pdf_task,
+    create_pdfs_task,
+    export_task,
+    send_digest_task,
+    send_email_task,
+)
+from celery import chain, chord, group
+from celery.result import AsyncResult
+from celery.utils import uuid
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import BaseModel, EmailStr, Field, HttpUrl, TypeAdapter, ValidationError
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await get_progress_hub().close()
+
 
 app = FastAPI(
     title="WeDocX API",
     description="API for WeDocX to process URLs into PDFs.",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
+tracing.init_tracing("wedocx-api")
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    为每个请求创建根span，客户端带traceparent时接续其trace；
+    请求中提交的Celery任务通过消息头继承该span
+    """
+    if not tracing.is_enabled() or request.url.path == "/metrics":
+        return await call_next(request)
+    async with tracing.span(
+        f"{request.method} {request.url.path}",
+        carrier=dict(request.headers),
+        kind="server",
+        **{"http.request.method": request.method, "url.path": request.url.path},
+    ) as current:
+        response = await call_next(request)
+        current.set_attribute("http.response.status_code", response.status_code)
+        return response
+
 
 class ProcessUrlRequest(BaseModel):
     url: HttpUrl
     email: EmailStr
+    # 需要生成并发送的格式，多个格式共用一次页面加载；不能为空
+    formats: List[Literal["pdf", "docx", "txt"]] = Field(["pdf"], min_length=1)
+
+
+def _submit_render(
+    task_chain, email: str, api_key: Optional[str], lane: str = "interactive"
+) -> str:
+    """
+    发布渲染任务链并返回任务ID；启用公平调度时交给调度器排队，
+    被准入控制拒绝时返回429，Retry-After为按队列深度估算的等待秒数
+
+    提交和调度都要访问Redis，异步端点中需放到线程池执行，见process_url
+    """
+    scheduler = get_fair_scheduler()
+    if scheduler is None:
+        task_id = str(task_chain.apply_async().id)
+        report(task_id, "queued")
+        return task_id
+    admission = scheduler.submit(
+        task_chain, tenant_of(email, api_key), lane, weight_of(email, api_key)
+    )
+    if not admission.accepted:
+        raise HTTPException(
+            status_code=429,
+            detail="提交的任务过多，请稍后重试",
+            headers={"Retry-After": str(admission.retry_after)},
+        )
+    report(admission.task_id, "queued", lane=admission.lane)
+    return admission.task_id
+
+
+def _files_body(pdf_only: bool, files: List[str]) -> str:
+    """邮件正文，列出附带的文件名"""
+    if pdf_only:
+        return f"请查收由WeDocX生成的PDF文件：{files[0]}"
+    return f"请查收由WeDocX生成的文件：{', '.join(files)}"
+
+
+def _files_result(pdf_only: bool, files: List[str]) -> dict:
+    """响应中的文件名：只生成PDF时为pdf_file，多格式时为files"""
+    return {"pdf_file": files[0]} if pdf_only else {"files": files}
+
+
+class ProcessUrlsRequest(BaseModel):
+    # 逐个校验，无效的链接单独列出，不影响其他链接
+    urls: List[str] = Field(..., min_length=1)
+    email: EmailStr
+    # digest：一封邮件附带全部PDF；zip：打包为zip附件；separate：每个PDF一封邮件
+    delivery: Literal["digest", "zip", "separate"] = "digest"
+
+
+_http_url = TypeAdapter(HttpUrl)
 
 
 @app.get("/")
@@ -27,10 +137,25 @@ async def read_root():
     return {"status": "ok", "message": "Welcome to WeDocX API!"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus指标：各阶段耗时、任务统计和队列长度
+    """
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="指标未启用")
+    # 读取队列长度需要访问Redis，放到线程池中执行
+    data, content_type = await run_in_threadpool(render_latest)
+    return Response(content=data, media_type=content_type)
+
+
 @app.post("/api/v1/process-url")
-async def process_url(request: ProcessUrlRequest):
+async def process_url(
+    request: ProcessUrlRequest, x_api_key: Optional[str] = Header(None)
+):
     """
     接收用户提交的URL和目标邮箱，调用PDF转换服务（异步任务链）。
+    启用公平调度时按X-API-Key（没有时按邮箱）区分用户。
     """
     try:
         # 生成输出文件名
@@ -47,22 +172,323 @@ async def process_url(request: ProcessUrlRequest):
         pdf_filename = f"{now_str}-{base_name}.pdf"
         pdf_path = os.path.join(pdf_output_dir, pdf_filename)
 
-        # 任务链：先生成PDF，再发邮件
+        subject = "网页转PDF"
+        url = str(request.url)
+        email = str(request.email)
+
+        # 任务链最后一个任务的ID作为返回给客户端的任务ID，渲染任务以其报告进度
+        task_id = uuid()
+        formats = format_set(request.formats)
+        pdf_only = formats == ["pdf"]
+        if pdf_only:
+            files = [pdf_filename]
+        else:
+            # 多格式：一次页面加载生成全部格式，作为多个附件发到同一封邮件
+            stem = os.path.splitext(pdf_filename)[0]
+            files = [f"{stem}.{fmt}" for fmt in formats]
+
+        # 同一URL、同一格式集合已渲染过或正在渲染时直接共享结果，不再重复启动浏览器；
+        # 缓存的每次操作都要访问Redis，放到线程池中执行，Redis不可用时不阻塞事件循环
+        render_cache = get_render_cache()
+        cache_url = cache_token = None
+        if render_cache is not None:
+            cached = await run_in_threadpool(render_cache.get, url, formats)
+            if cached is None:
+                owner = await run_in_threadpool(
+                    render_cache.current_owner, url, formats
+                )
+                if owner is not None:
+                    body = _files_body(pdf_only, owner["files"])
+                    waiter = {"to_email": email, "subject": subject, "body": body}
+                    if await run_in_threadpool(render_cache.join, url, waiter, formats):
+                        return {
+                            "status": "success",
+                            "task_id": owner.get("task_id"),
+                            **_files_result(pdf_only, owner["files"]),
+                            "deduplicated": True,
+                        }
+                # 刚好渲染结束时再查一次结果
+                cached = await run_in_threadpool(render_cache.get, url, formats)
+            if cached is not None:
+                paths = artifact_paths(cached)
+                cached_files = [os.path.basename(paths[fmt]) for fmt in formats]
+                result = send_email_task.delay(
+                    paths["pdf"] if pdf_only else paths,
+                    email,
+                    subject,
+                    _files_body(pdf_only, cached_files),
+                )
+                report(str(result.id), "queued")
+                return {
+                    "status": "success",
+                    "task_id": str(result.id),
+                    **_files_result(pdf_only, cached_files),
+                    "deduplicated": True,
+                }
+            cache_token = await run_in_threadpool(
+                render_cache.begin, url, {"files": files}, formats
+            )
+            if cache_token is not None:
+                cache_url = url
+
+        if pdf_only:
+            # 任务链：先生成PDF，再发邮件
+            render = create_pdf_task.s(
+                url, pdf_path, cache_url, progress_id=task_id, cache_token=cache_token
+            )
+        else:
+            render = export_task.s(
+                url,
+                formats,
+                pdf_path,
+                progress_id=task_id,
+                cache_url=cache_url,
+                cache_token=cache_token,
+            )
         task_chain = chain(
-            create_pdf_task.s(str(request.url), pdf_path),
-            send_email_task.s(
-                str(request.email),
-                "网页转PDF",
-                f"请查收由WeDocX生成的PDF文件：{pdf_filename}",
+            render,
+            send_email_task.s(email, subject, _files_body(pdf_only, files)).set(
+                task_id=task_id
             ),
         )
-        result = task_chain.apply_async()
+        try:
+            task_id = await run_in_threadpool(
+                _submit_render, task_chain, email, x_api_key
+            )
+        except HTTPException:
+            # 未能排队时释放渲染锁，后续同一URL的请求重新渲染
+            if cache_url is not None:
+                await run_in_threadpool(
+                    render_cache.finish, url, None, cache_token, formats
+                )
+            raise
+        if cache_url is not None:
+            await run_in_threadpool(
+                render_cache.update_owner,
+                url,
+                cache_token,
+                {"files": files, "task_id": task_id},
+                formats,
+            )
+        return {
+            "status": "success",
+            "task_id": task_id,
+            **_files_result(pdf_only, files),
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        print("API端点异常:", e)
+        print(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"任务提交失败: {e}")
+
+
+@app.post("/api/v1/process-urls")
+async def process_urls(
+    request: ProcessUrlsRequest, x_api_key: Optional[str] = Header(None)
+):
+    """
+    批量提交URL：校验并按规范化URL去重后，每BATCH_CHUNK_SIZE个链接组成一个
+    批量渲染任务，作为一个Celery chord提交，全部完成后发送汇总邮件。
+    批量渲染任务以较低的消息优先级进入渲染队列，不影响单个请求的等待时间。
+    启用公平调度时按租户限制尚未渲染完的链接数，超过时返回429。
+    """
+    if len(request.urls) > settings.BATCH_MAX_URLS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"单次最多提交{settings.BATCH_MAX_URLS}个链接",
+        )
+
+    urls, rejected, seen = [], [], set()
+    for raw in request.urls:
+        try:
+            url = str(_http_url.validate_python(raw.strip()))
+        except ValidationError as e:
+            rejected.append({"url": raw, "error": e.errors()[0]["msg"]})
+            continue
+        key = normalize_url(url)
+        if key not in seen:
+            seen.add(key)
+            urls.append(url)
+    if not urls:
+        raise HTTPException(
+            status_code=422, detail={"message": "没有有效的链接", "rejected": rejected}
+        )
+
+    scheduler = get_fair_scheduler()
+    tenant = None
+    if scheduler is not None:
+        tenant = tenant_of(str(request.email), x_api_key)
+        admission = await run_in_threadpool(scheduler.admit_urls, tenant, len(urls))
+        if not admission.accepted:
+            raise HTTPException(
+                status_code=429,
+                detail="尚未完成的批量任务过多，请稍后重试",
+                headers={"Retry-After": str(admission.retry_after)},
+            )
+
+    try:
+        from datetime import datetime
+
+        pdf_output_dir = os.path.abspath(
+            os.path.join(os.path.dirname(__file__), "output")
+        )
+        os.makedirs(pdf_output_dir, exist_ok=True)
+        now_str = datetime.now().strftime("%Y%m%d-%H-%M-%S")
+        pdf_files = [
+            f"{now_str}-{i:03d}-{url.rstrip('/').split('/')[-1][:10] or 'file'}.pdf"
+            for i, url in enumerate(urls, 1)
+        ]
+        pdf_paths = [os.path.join(pdf_output_dir, name) for name in pdf_files]
+
+        size = max(1, settings.BATCH_CHUNK_SIZE)
+        header = group(
+            [
+                create_pdfs_task.s(
+                    urls[i : i + size], pdf_paths[i : i + size], tenant=tenant
+                ).set(priority=settings.BATCH_RENDER_PRIORITY)
+                for i in range(0, len(urls), size)
+            ]
+        )
+        body = send_digest_task.s(str(request.email), "网页转PDF", request.delivery)
+        result = chord(header, body).apply_async()
+        report(str(result.id), "queued", urls=len(urls))
         return {
             "status": "success",
             "task_id": str(result.id),
-            "pdf_file": pdf_filename,
+            "pdf_files": pdf_files,
+            "duplicates": len(request.urls) - len(rejected) - len(urls),
+            "rejected": rejected,
         }
     except Exception as e:
         print("API端点异常:", e)
         print(traceback.format_exc())
+        if tenant is not None:
+            await run_in_threadpool(scheduler.release_urls, tenant, len(urls))
         raise HTTPException(status_code=500, detail=f"任务提交失败: {e}")
+
+
+@app.get("/api/v1/tasks/{task_id}")
+async def task_status(task_id: str):
+    """
+    查询任务状态：Celery中的执行状态和最近一次报告的进度阶段
+    （queued、navigating、settling、printing、converting、ready、emailing、done、failed）
+    """
+    progress = await get_progress_hub().latest(task_id)
+    result = AsyncResult(task_id, app=send_email_task.app)
+    # 读取结果需要访问Redis，放到线程池中执行
+    state = await run_in_threadpool(lambda: result.state)
+    if progress is None and state == "PENDING":
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    response = {
+        "task_id": task_id,
+        "state": state,
+        "stage": progress["stage"] if progress else None,
+        "progress": progress,
+    }
+    if state == "FAILURE":
+        response["error"] = str(result.result)
+    return response
+
+
+def _sse(event: dict) -> str:
+    return f"event: progress\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@app.get("/api/v1/tasks/{task_id}/events")
+async def task_events(task_id: str, request: Request):
+    """
+    以Server-Sent Events推送任务进度，任务结束（done或failed）后关闭。
+    连接先收到当前进度，之后每个阶段一条事件；所有连接共用进程内的一个Redis订阅，
+    不为每个连接占用线程。
+    """
+    hub = get_progress_hub()
+
+    async def stream():
+        # 先订阅并等待订阅生效，再读取当前进度，此后发布的事件都能收到
+        events = hub.subscribe(task_id)
+        try:
+            await hub.wait_ready(settings.PROGRESS_SSE_KEEPALIVE)
+            last_ts = 0
+            latest = await hub.latest(task_id)
+            if latest is not None:
+                yield _sse(latest)
+                last_ts = latest.get("ts", 0)
+                if latest["stage"] in TERMINAL_STAGES:
+                    return
+            deadline = time.monotonic() + settings.PROGRESS_SSE_MAX_SECONDS
+            while time.monotonic() < deadline:
+                try:
+                    event = await asyncio.wait_for(
+                        events.get(), timeout=settings.PROGRESS_SSE_KEEPALIVE
+                    )
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        return
+                    # 订阅断线重连期间的事件收不到，空闲时以最新进度补上
+                    latest = await hub.latest(task_id)
+                    if latest is None or latest.get("ts", 0) <= last_ts:
+                        yield ": keepalive\n\n"
+                        continue
+                    event = latest
+                yield _sse(event)
+                last_ts = max(last_ts, event.get("ts", 0))
+                if event["stage"] in TERMINAL_STAGES:
+                    return
+        finally:
+            hub.unsubscribe(task_id, events)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/v1/download/{name}")
+async def download_artifact(
+    name: str,
+    expires: int,
+    sha: str,
+    sig: str,
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    通过签名链接下载本地存储中的产物（链接由worker生成，见download_links）
+
+    - ETag为链接中的内容哈希，文件已被覆盖（哈希不一致）时返回410，If-None-Match匹配时返回304
+    - Range/If-Range由FileResponse处理，返回206；服务器支持http.response.pathsend
+      扩展时由服务器直接发送文件
+    - 配置DOWNLOAD_ACCEL_REDIRECT时只校验签名，文件交给nginx用sendfile发送
+    """
+    if not download_links.is_enabled():
+        raise HTTPException(status_code=404, detail="未启用下载")
+    if not download_links.verify(name, expires, sha, sig):
+        raise HTTPException(status_code=403, detail="下载链接无效")
+    if expires < time.time():
+        raise HTTPException(status_code=410, detail="下载链接已过期")
+    path = download_links.resolve(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="文件不存在或已清理")
+    try:
+        current = await run_in_threadpool(download_links.current_sha, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="文件不存在或已清理")
+    if not hmac.compare_digest(current, sha):
+        raise HTTPException(status_code=410, detail="文件已更新，下载链接失效")
+
+    etag = f'"{sha}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"private, max-age={max(0, expires - int(time.time()))}",
+    }
+    # 弱比较：去掉W/前缀再比较
+    tags = [tag.strip() for tag in if_none_match.split(",")] if if_none_match else []
+    tags = [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+    if "*" in tags or etag in tags:
+        return Response(status_code=304, headers=headers)
+    if settings.DOWNLOAD_ACCEL_REDIRECT:
+        headers["X-Accel-Redirect"] = settings.DOWNLOAD_ACCEL_REDIRECT + quote(name)
+        headers["Content-Disposition"] = f"attachment; filename*=utf-8''{quote(name)}"
+        return Response(headers=headers)
+    return FileResponse(path, filename=name, headers=headers)
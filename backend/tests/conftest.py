@@ -107,10 +107,15 @@ def api_url(api_config):
 def client(monkeypatch):
     """
     提供一个模拟了Celery的TestClient实例。
-    通过模拟app.celery_app，防止在测试期间尝试连接Redis。
+    通过模拟app.celery_app并关闭渲染缓存和进度报告，防止在测试期间尝试连接Redis。
     """
     monkeypatch.setitem(sys.modules, "app.celery_app", MagicMock())
 
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "RENDER_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "PROGRESS_ENABLED", False)
+
     from fastapi.testclient import TestClient
     from main import app as fastapi_app
 
@@ -126,3 +131,19 @@ def temp_output_dir(file_config, tmp_path):
     temp_dir = tmp_path / output_dir_name
     temp_dir.mkdir()
     return temp_dir
+
+
+@pytest.fixture(scope="function")
+def download_dir(temp_output_dir, monkeypatch):
+    """启用下载链接，以临时输出目录作为本地产物存储"""
+    from app.core.config import settings
+    from app.services import artifact_store
+
+    monkeypatch.setattr(settings, "DOWNLOAD_SECRET", "test-secret")
+    monkeypatch.setattr(settings, "DOWNLOAD_BASE_URL", "http://testserver")
+    monkeypatch.setattr(
+        artifact_store,
+        "_stores",
+        {"local": artifact_store.LocalArtifactStore(temp_output_dir)},
+    )
+    return temp_output_dir
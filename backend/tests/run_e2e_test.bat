@@ -26,7 +26,7 @@ echo [INFO] Please ensure Redis server is running on its default port.
 REM 4. 启动 Celery worker 和 FastAPI (后台)
 echo.
 echo [3/6] Starting Celery worker in the background...
-start "CeleryWorker" /b python -m celery -A app.celery_app worker -P gevent --loglevel=info > ../output/celery_worker.log 2>&1
+start "CeleryWorker" /b python -m app.workers.launch all -P gevent --loglevel=info > ../output/celery_worker.log 2>&1
 echo [INFO] Celery worker started. Log: backend\celery_worker.log
 timeout /t 5 >nul
 
@@ -11,11 +11,13 @@ conda activate WeDocX
 echo "[1/5] 启动 Redis 服务（请确保本地已安装并配置好Redis，或手动启动）"
 echo "    Windows用户请手动启动Redis服务"
 
-# 2. 启动Celery worker（后台）
+# 2. 启动Celery worker（后台），渲染和发邮件各一个worker
 echo "[2/5] 启动 Celery worker..."
 cd backend
-nohup celery -A app.celery_app.celery_app worker --loglevel=info > ../output/celery_worker.log 2>&1 &
-CELERY_PID=$!
+nohup python -m app.workers.launch render --loglevel=info > ../output/celery_render.log 2>&1 &
+RENDER_PID=$!
+nohup python -m app.workers.launch deliver --loglevel=info > ../output/celery_deliver.log 2>&1 &
+DELIVER_PID=$!
 sleep 3
 
 # 3. 启动FastAPI服务（后台）
@@ -30,7 +32,7 @@ pytest backend/tests/test_e2e_process_url.py
 
 # 5. 清理后台进程
 echo "[5/5] 清理后台服务进程..."
-kill $CELERY_PID $UVICORN_PID || true
+kill $RENDER_PID $DELIVER_PID $UVICORN_PID || true
 cd ..
 
 echo "端到端测试流程已完成。请检查终端输出和目标邮箱收件情况。" 
\ No newline at end of file
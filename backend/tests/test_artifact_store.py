@@ -0,0 +1,80 @@
+"""
+产物存储测试模块
+"""
+
+import hashlib
+
+import pytest
+from app.services import artifact_store
+from app.services.artifact_store import (
+    ArtifactStore,
+    LocalArtifactStore,
+    MemoryArtifactStore,
+    S3ArtifactStore,
+    artifact_name,
+    artifact_sha256,
+    store_for_uri,
+)
+
+
+def test_local_store_roundtrip(temp_output_dir):
+    """测试本地存储读写，URI即文件路径"""
+    store = LocalArtifactStore(temp_output_dir)
+    uri = store.put_bytes("a.pdf", b"%PDF-1.4")
+
+    assert uri == str(temp_output_dir / "a.pdf")
+    assert store.exists(uri)
+    assert store.size(uri) == 8
+    with store.open(uri) as f:
+        assert f.read() == b"%PDF-1.4"
+    store.delete(uri)
+    assert not store.exists(uri)
+
+
+def test_memory_store_roundtrip():
+    """测试内存存储读写"""
+    store = MemoryArtifactStore()
+    uri = store.put_bytes("/some/dir/a.pdf", b"data")
+
+    assert uri == "mem://a.pdf"
+    assert store.exists(uri)
+    assert store.size(uri) == 4
+    assert store.open(uri).read() == b"data"
+    store.delete(uri)
+    assert not store.exists(uri)
+    with pytest.raises(FileNotFoundError):
+        store.open(uri)
+
+
+def test_store_for_uri_dispatch(monkeypatch, temp_output_dir):
+    """测试按URI协议选择存储，普通路径视为本地文件"""
+    monkeypatch.setattr(artifact_store, "_stores", {})
+    monkeypatch.setattr(
+        artifact_store.settings, "OUTPUT_DIR", temp_output_dir, raising=False
+    )
+    assert isinstance(store_for_uri("mem://a.pdf"), MemoryArtifactStore)
+    assert isinstance(store_for_uri(str(temp_output_dir / "a.pdf")), LocalArtifactStore)
+
+    uri = store_for_uri("mem://").put_bytes("b.pdf", b"abc")
+    assert artifact_sha256(uri) == hashlib.sha256(b"abc").hexdigest()
+    assert artifact_name(uri) == "b.pdf"
+    assert artifact_name("s3://bucket/dir/c.pdf") == "c.pdf"
+
+
+def test_s3_store_requires_boto3(monkeypatch):
+    """测试未安装boto3时S3存储给出明确错误"""
+    monkeypatch.setitem(__import__("sys").modules, "boto3", None)
+    with pytest.raises(RuntimeError) as exc_info:
+        S3ArtifactStore(bucket="wedocx")
+    assert "boto3" in str(exc_info.value)
+
+
+def test_incomplete_store_cannot_be_created():
+    """测试未实现全部方法的存储后端在创建时即报错"""
+
+    class PartialStore(ArtifactStore):
+        def put_bytes(self, name, data):
+            return name
+
+    with pytest.raises(TypeError):
+        PartialStore()
@@ -0,0 +1,143 @@
+"""
+静态资源缓存测试模块
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from app.services.asset_cache import AssetCache
+
+IMAGE_URL = "https://mmbiz.qpic.cn/mmbiz_png/abc/640?wx_fmt=png"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    c = AssetCache(cache_dir=tmp_path / "assets", max_bytes=1024 * 1024)
+    yield c
+    c.close()
+
+
+def _make_response(status=200, headers=None, body=b"image-bytes"):
+    response = MagicMock()
+    response.status = status
+    response.headers = headers or {}
+    response.body = AsyncMock(return_value=body)
+    return response
+
+
+def _make_route(url, responses, resource_type="image"):
+    route = MagicMock()
+    route.request.url = url
+    route.request.method = "GET"
+    route.request.resource_type = resource_type
+    route.request.headers = {"accept": "image/*"}
+    route.fetch = AsyncMock(side_effect=responses)
+    route.fulfill = AsyncMock()
+    route.fallback = AsyncMock()
+    return route
+
+
+def _serve(cache, route):
+    session = cache.attach(MagicMock())
+    asyncio.run(session._handle(route))
+    return session.stats
+
+
+def test_fresh_entry_served_without_network(cache):
+    """测试新鲜的缓存条目直接由缓存返回"""
+    headers = {"cache-control": "max-age=3600", "content-type": "image/png"}
+    first = _make_route(IMAGE_URL, [_make_response(headers=headers)])
+    stats = _serve(cache, first)
+    assert stats.misses == 1 and stats.stored == 1
+
+    second = _make_route(IMAGE_URL, [])
+    stats = _serve(cache, second)
+    assert stats.hits == 1
+    assert stats.bytes_served == len(b"image-bytes")
+    second.fetch.assert_not_called()
+    kwargs = second.fulfill.call_args.kwargs
+    assert kwargs["body"] == b"image-bytes"
+    assert kwargs["headers"]["content-type"] == "image/png"
+
+
+def test_stale_entry_revalidated_with_etag(cache):
+    """测试过期条目携带ETag回源，304时复用缓存内容"""
+    headers = {"cache-control": "no-cache", "etag": '"v1"'}
+    _serve(cache, _make_route(IMAGE_URL, [_make_response(headers=headers)]))
+
+    route = _make_route(IMAGE_URL, [_make_response(status=304, body=b"")])
+    stats = _serve(cache, route)
+
+    assert stats.revalidated == 1
+    sent_headers = route.fetch.call_args.kwargs["headers"]
+    assert sent_headers["if-none-match"] == '"v1"'
+    assert route.fulfill.call_args.kwargs["body"] == b"image-bytes"
+
+
+def test_session_exports_prometheus_counters(cache):
+    """测试命中、未命中和重新校验同时计入Prometheus指标"""
+    from prometheus_client import REGISTRY
+
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0.0
+
+    before = {
+        result: sample("wedocx_asset_cache_requests_total", result=result)
+        for result in ("hit", "miss", "revalidated")
+    }
+    served = sample("wedocx_asset_cache_bytes_served_total")
+
+    fresh = {"cache-control": "max-age=3600"}
+    _serve(cache, _make_route(IMAGE_URL, [_make_response(headers=fresh)]))
+    _serve(cache, _make_route(IMAGE_URL, []))
+    stale_url = IMAGE_URL + "&v=2"
+    stale = {"cache-control": "no-cache", "etag": '"v1"'}
+    _serve(cache, _make_route(stale_url, [_make_response(headers=stale)]))
+    _serve(cache, _make_route(stale_url, [_make_response(status=304, body=b"")]))
+
+    for result, count in (("hit", 1), ("miss", 2), ("revalidated", 1)):
+        assert sample("wedocx_asset_cache_requests_total", result=result) == (
+            before[result] + count
+        )
+    assert sample("wedocx_asset_cache_bytes_served_total") == served + 2 * len(
+        b"image-bytes"
+    )
+
+
+def test_no_store_and_uncacheable_types_bypass_cache(cache):
+    """测试no-store响应不入缓存，非静态资源类型直接放行"""
+    no_store = _make_route(
+        IMAGE_URL, [_make_response(headers={"cache-control": "no-store"})]
+    )
+    assert _serve(cache, no_store).stored == 0
+    assert cache.lookup(IMAGE_URL) is None
+
+    xhr = _make_route("https://example.com/api", [], resource_type="xhr")
+    _serve(cache, xhr)
+    xhr.fallback.assert_awaited_once()
+
+
+def test_identical_content_shares_one_blob(cache):
+    """测试不同URL的相同内容只存一份"""
+    headers = {"cache-control": "max-age=60"}
+    cache.store("https://a.example.com/logo.png", 200, headers, b"same", 10)
+    cache.store("https://b.example.com/logo.png", 200, headers, b"same", 10)
+    assert cache.total_bytes() == 4
+    assert len(list(cache.blob_dir.rglob("*"))) == 2  # 一个子目录 + 一个文件
+
+
+def test_lru_eviction_keeps_recent_entries(tmp_path):
+    """测试超出容量时淘汰最久未访问的条目"""
+    cache = AssetCache(cache_dir=tmp_path / "lru", max_bytes=250)
+    headers = {"cache-control": "max-age=60"}
+    for i in range(3):
+        if i == 2:
+            # 访问第一个条目，使第二个成为最久未使用的
+            cache.read(cache.lookup("https://example.com/0.png"))
+        cache.store(f"https://example.com/{i}.png", 200, headers, bytes([i]) * 100, 5)
+    assert cache.lookup("https://example.com/0.png") is not None
+    assert cache.lookup("https://example.com/1.png") is None
+    assert cache.lookup("https://example.com/2.png") is not None
+    assert cache.total_bytes() <= 250
+    cache.close()
@@ -0,0 +1,217 @@
+"""
+异步邮件服务测试模块，使用aiosmtpd在本地启动SMTP服务器
+"""
+
+import asyncio
+import email
+import shutil
+import socket
+import ssl
+import subprocess
+
+import pytest
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+from app.services.async_email_service import AsyncEmailService
+from app.services.email_service import EmailConfig
+
+pytestmark = pytest.mark.filterwarnings("ignore:Requiring AUTH")
+
+
+class _RecordingHandler:
+    """记录收到的邮件"""
+
+    def __init__(self):
+        self.messages = []
+        self.sessions = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(id(session))
+        self.messages.append((envelope.mail_from, envelope.rcpt_tos, envelope.content))
+        return "250 Message accepted for delivery"
+
+
+def _authenticator(server, session, envelope, mechanism, auth_data):
+    return AuthResult(
+        success=auth_data.login == b"user@example.com"
+        and auth_data.password == b"secret"
+    )
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def tls_cert(tmp_path_factory):
+    """为127.0.0.1生成自签名证书，没有openssl命令时跳过"""
+    if shutil.which("openssl") is None:
+        pytest.skip("需要openssl生成测试证书")
+    directory = tmp_path_factory.mktemp("tls")
+    cert, key = directory / "cert.pem", directory / "key.pem"
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=127.0.0.1",
+            "-addext",
+            "subjectAltName=IP:127.0.0.1",
+            "-keyout",
+            str(key),
+            "-out",
+            str(cert),
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return str(cert), str(key)
+
+
+def _start_server(tls_cert=None, authenticator=_authenticator, **kwargs):
+    """启动本地SMTP服务器，给出证书时要求STARTTLS"""
+    handler = _RecordingHandler()
+    if tls_cert is not None:
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(*tls_cert)
+        kwargs.update(tls_context=context, require_starttls=True)
+    controller = Controller(
+        handler,
+        hostname="127.0.0.1",
+        port=_free_port(),
+        authenticator=authenticator,
+        auth_required=True,
+        **kwargs,
+    )
+    controller.start()
+    return controller, handler
+
+
+@pytest.fixture
+def smtp_server(tls_cert):
+    """本地SMTP服务器，要求STARTTLS后认证"""
+    controller, handler = _start_server(tls_cert)
+    yield controller, handler
+    controller.stop()
+
+
+@pytest.fixture
+def client_tls(tls_cert):
+    """信任测试证书的客户端TLS上下文"""
+    return ssl.create_default_context(cafile=tls_cert[0])
+
+
+@pytest.fixture
+def async_config(smtp_server):
+    controller, _ = smtp_server
+    return EmailConfig(
+        smtp_server=controller.hostname,
+        smtp_port=controller.port,
+        smtp_user="user@example.com",
+        smtp_password="secret",
+        sender_email="user@example.com",
+    )
+
+
+def test_async_send_email_with_attachment(
+    smtp_server, async_config, temp_output_dir, client_tls
+):
+    """测试异步发送带附件的邮件"""
+    _, handler = smtp_server
+    test_file = temp_output_dir / "报告.pdf"
+    test_file.write_bytes(b"%PDF-1.4 test")
+
+    service = AsyncEmailService(async_config, tls_context=client_tls)
+    result = asyncio.run(
+        service.send_email(
+            to_email="to@example.com",
+            subject="网页转PDF",
+            body="请查收",
+            attachments=[str(test_file)],
+        )
+    )
+
+    assert result is True
+    mail_from, rcpt_tos, content = handler.messages[0]
+    assert mail_from == "user@example.com"
+    assert rcpt_tos == ["to@example.com"]
+    msg = email.message_from_bytes(content)
+    attachment = msg.get_payload()[1]
+    assert attachment.get_filename() == test_file.name
+    assert attachment.get_payload(decode=True) == b"%PDF-1.4 test"
+
+
+def test_async_send_email_validation(async_config, client_tls):
+    """测试异步发送的参数校验与同步版本一致"""
+    service = AsyncEmailService(async_config, tls_context=client_tls)
+    with pytest.raises(ValueError) as exc_info:
+        asyncio.run(service.send_email("invalid", "Test Subject", "Test Body"))
+    assert "无效的邮箱地址" in str(exc_info.value)
+
+    with pytest.raises(FileNotFoundError) as exc_info:
+        asyncio.run(
+            service.send_email(
+                "to@example.com", "Test", "Body", attachments=["nonexistent.pdf"]
+            )
+        )
+    assert "附件文件不存在" in str(exc_info.value)
+
+
+def test_async_send_email_connection_error(async_config, client_tls):
+    """测试无法连接服务器时抛出RuntimeError"""
+    async_config.smtp_port = _free_port()
+    service = AsyncEmailService(async_config, tls_context=client_tls)
+    with pytest.raises(RuntimeError) as exc_info:
+        asyncio.run(service.send_email("to@example.com", "Test", "Body"))
+    assert "发送邮件失败" in str(exc_info.value)
+
+
+def test_async_send_many_bounded_sessions(smtp_server, async_config, client_tls):
+    """测试批量发送复用有限个会话，结果与输入顺序一致"""
+    _, handler = smtp_server
+    service = AsyncEmailService(async_config, max_concurrency=2, tls_context=client_tls)
+    emails = [
+        {"to_email": f"to{i}@example.com", "subject": f"s{i}", "body": "b"}
+        for i in range(6)
+    ]
+    emails.insert(3, {"to_email": "invalid", "subject": "bad", "body": "b"})
+
+    results = asyncio.run(service.send_many(emails))
+
+    assert [r is True for r in results] == [True] * 3 + [False] + [True] * 3
+    assert isinstance(results[3], ValueError)
+    assert len(handler.messages) == 6
+    assert len(handler.sessions) == 2
+
+
+def test_async_send_email_requires_starttls(async_config):
+    """测试服务器不支持STARTTLS时发送失败，不以明文发送登录密码"""
+    attempts = []
+
+    def authenticator(server, session, envelope, mechanism, auth_data):
+        attempts.append(auth_data)
+        return AuthResult(success=True)
+
+    controller, handler = _start_server(
+        authenticator=authenticator, auth_require_tls=False
+    )
+    async_config.smtp_port = controller.port
+    try:
+        with pytest.raises(RuntimeError, match="STARTTLS"):
+            asyncio.run(
+                AsyncEmailService(async_config).send_email(
+                    "to@example.com", "Test", "Body"
+                )
+            )
+    finally:
+        controller.stop()
+    assert attempts == []
+    assert handler.messages == []
@@ -0,0 +1,190 @@
+"""
+浏览器池测试模块
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from app.services.browser_pool import BrowserPool
+
+
+class FakeBrowser:
+    """模拟Playwright Browser，记录上下文创建和关闭"""
+
+    def __init__(self):
+        self.connected = True
+        self.closed = False
+        self.contexts = 0
+        self._handlers = []
+
+    def on(self, event, handler):
+        if event == "disconnected":
+            self._handlers.append(handler)
+
+    def is_connected(self):
+        return self.connected
+
+    def crash(self):
+        self.connected = False
+        for handler in self._handlers:
+            handler(self)
+
+    async def new_context(self, **kwargs):
+        if not self.connected:
+            raise RuntimeError("Target closed")
+        self.contexts += 1
+        context = MagicMock()
+        context.new_page = AsyncMock(return_value=MagicMock())
+        context.close = AsyncMock()
+        return context
+
+    async def close(self):
+        self.closed = True
+        self.connected = False
+
+
+@pytest.fixture
+def fake_playwright():
+    """替换async_playwright，返回记录已启动浏览器的列表"""
+    launched = []
+
+    async def launch(**kwargs):
+        browser = FakeBrowser()
+        launched.append(browser)
+        return browser
+
+    playwright = MagicMock()
+    playwright.chromium.launch = launch
+    playwright.stop = AsyncMock()
+    starter = MagicMock()
+    starter.start = AsyncMock(return_value=playwright)
+    with patch("app.services.browser_pool.async_playwright", return_value=starter):
+        yield launched
+
+
+def test_pool_reuses_warm_browser(fake_playwright):
+    """测试多次借用复用同一个已启动的浏览器"""
+
+    async def run():
+        pool = BrowserPool(size=1, max_pages_per_browser=10)
+        for _ in range(3):
+            async with pool.new_page():
+                pass
+        await pool.close()
+
+    asyncio.run(run())
+    assert len(fake_playwright) == 1
+    assert fake_playwright[0].contexts == 3
+
+
+def test_pool_recycles_after_max_pages(fake_playwright):
+    """测试浏览器服务满指定页数后被重启"""
+
+    async def run():
+        pool = BrowserPool(size=1, max_pages_per_browser=2)
+        for _ in range(5):
+            async with pool.new_page():
+                pass
+        await pool.close()
+
+    asyncio.run(run())
+    assert len(fake_playwright) == 3
+    assert fake_playwright[0].closed
+    assert fake_playwright[1].closed
+
+
+def test_pool_relaunches_crashed_browser(fake_playwright):
+    """测试浏览器崩溃后下一次借用前自动重启"""
+
+    async def run():
+        pool = BrowserPool(size=1, max_pages_per_browser=100)
+        with pytest.raises(RuntimeError):
+            async with pool.new_page():
+                fake_playwright[0].crash()
+                raise RuntimeError("页面崩溃")
+        async with pool.new_page():
+            pass
+        await pool.close()
+
+    asyncio.run(run())
+    assert len(fake_playwright) == 2
+    assert fake_playwright[1].contexts == 1
+
+
+def test_pool_health_check_replaces_dead_browsers(fake_playwright):
+    """测试健康检查重启空闲的失联浏览器"""
+
+    async def run():
+        pool = BrowserPool(size=2, max_pages_per_browser=100)
+        await pool.start()
+        fake_playwright[1].crash()
+        relaunched = await pool.health_check()
+        await pool.close()
+        return relaunched
+
+    assert asyncio.run(run()) == 1
+    assert len(fake_playwright) == 3
+
+
+def test_pool_concurrent_first_use_starts_once(fake_playwright):
+    """测试冷启动时并发借用只启动一个驱动，每个槽位只启动一次浏览器"""
+    from app.services import browser_pool
+
+    starts = []
+
+    async def run():
+        playwright = await browser_pool.async_playwright().start()
+        real_launch = playwright.chromium.launch
+
+        async def slow_start():
+            starts.append(1)
+            await asyncio.sleep(0.01)
+            return playwright
+
+        async def slow_launch(**kwargs):
+            await asyncio.sleep(0.01)
+            return await real_launch(**kwargs)
+
+        playwright.chromium.launch = slow_launch
+        browser_pool.async_playwright.return_value.start = slow_start
+        await browser_pool.close_browser_pool()
+
+        async def render():
+            pool = await browser_pool.get_browser_pool()
+            async with pool.new_page():
+                await asyncio.sleep(0)
+
+        await asyncio.gather(*(render() for _ in range(4)))
+        pool = await browser_pool.get_browser_pool()
+        await browser_pool.close_browser_pool()
+        return pool
+
+    with patch.object(browser_pool.settings, "BROWSER_POOL_SIZE", 1):
+        pool = asyncio.run(run())
+    assert len(starts) == 1
+    assert len(fake_playwright) == 1
+    assert fake_playwright[0].contexts == 4
+    assert pool._closed
+
+
+def test_pool_retries_failed_start(fake_playwright):
+    """测试启动失败后下一次借用重新启动"""
+    from app.services import browser_pool
+
+    async def run():
+        starter = browser_pool.async_playwright.return_value
+        playwright = await starter.start()
+        starter.start = AsyncMock(
+            side_effect=[RuntimeError("驱动启动失败"), playwright]
+        )
+        pool = BrowserPool(size=1)
+        with pytest.raises(RuntimeError):
+            async with pool.new_page():
+                pass
+        async with pool.new_page():
+            pass
+        await pool.close()
+
+    asyncio.run(run())
+    assert len(fake_playwright) == 1
@@ -1,6 +1,28 @@
 """文档服务测试模块"""
 
-from app.services.document_service import convert_html_to_docx, convert_html_to_txt
+import random
+import sys
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from app.services import document_service
+from app.services.document_service import (
+    _clean_text,
+    _extract_text_with_structure,
+    convert_html_to_docx,
+    convert_html_to_txt,
+    extract_blocks,
+    iter_blocks,
+    iter_blocks_stream,
+)
+from app.services.docx_stream import TableCell
+from bs4 import BeautifulSoup, NavigableString, Tag
+from docx import Document
+from docx.shared import Inches
+from PIL import Image
+
+GOLDEN_DIR = Path(__file__).parent / "data" / "documents"
 
 
 def test_convert_html_to_txt(file_config, temp_output_dir):
@@ -29,3 +51,352 @@ def test_convert_html_to_docx(file_config, temp_output_dir):
 
     assert output_path.exists()
     assert output_path.stat().st_size > 0  # 确保文件不为空
+
+
+def _legacy_extract(elem):
+    """改写前的递归实现，用于校验新实现的输出保持一致"""
+    results = []
+    if isinstance(elem, NavigableString):
+        text = _clean_text(str(elem))
+        if text:
+            results.append((text, "", ""))
+        return results
+    if elem.name in ["script", "style", "meta", "link"]:
+        return results
+    if elem.name == "br":
+        results.append(("\n", "br", ""))
+        return results
+    class_name = " ".join(elem.get("class", []))
+    if elem.name in ["ul", "ol"]:
+        for i, li in enumerate(elem.find_all("li", recursive=False)):
+            prefix = f"{i+1}. " if elem.name == "ol" else "• "
+            text = _clean_text(li.get_text())
+            if text:
+                results.append((f"{prefix}{text}", "li", class_name))
+        results.append(("\n", "ulol", class_name))
+        return results
+    if elem.name == "table":
+        for row in elem.find_all("tr", recursive=False):
+            cells = [
+                _clean_text(cell.get_text())
+                for cell in row.find_all(["td", "th"], recursive=False)
+            ]
+            if cells:
+                results.append((" | ".join(cells), "table", class_name))
+        results.append(("\n", "table", ""))
+        return results
+    for child in elem.children:
+        if isinstance(child, (Tag, NavigableString)):
+            results.extend(_legacy_extract(child))
+    if elem.name in ["p", "div", "h1", "h2", "h3", "h4", "h5", "h6"]:
+        if results and not results[-1][0].endswith("\n"):
+            results.append(("\n", "", ""))
+        if results and not results[0][0].startswith("\n"):
+            results.insert(0, ("\n", "", ""))
+    return results
+
+
+def _random_html(rng, depth=0):
+    tags = ["div", "p", "span", "h2", "b", "section", "br", "script", "ul", "table"]
+    parts = []
+    for _ in range(rng.randint(0, 4)):
+        choice = rng.random()
+        if choice < 0.3 or depth > 5:
+            parts.append(rng.choice(["", " ", "文本", "\n", "a  b", "。", "x\ny"]))
+            continue
+        tag = rng.choice(tags)
+        if tag == "br":
+            parts.append("<br>")
+        elif tag == "script":
+            parts.append("<script>var a = 1;</script>")
+        elif tag == "ul":
+            items = "".join(f"<li>项{i}</li>" for i in range(rng.randint(0, 2)))
+            parts.append(f'<ul class="c">{items}</ul>')
+        elif tag == "table":
+            parts.append("<table><tr><td>1</td><th>2</th></tr><tr></tr></table>")
+        else:
+            parts.append(f"<{tag}>{_random_html(rng, depth + 1)}</{tag}>")
+    return "".join(parts)
+
+
+def test_iter_blocks_matches_recursive_extractor(file_config):
+    """测试迭代实现与原递归实现输出一致"""
+    rng = random.Random(20240501)
+    samples = [file_config["test_content"]["html"]]
+    samples += [_random_html(rng) for _ in range(300)]
+    for html in samples:
+        soup = BeautifulSoup(html, "html.parser")
+        root = soup.body or soup
+        # 原实现不附带列表/表格结构，只比较文本、标签和class
+        actual = [block[:3] for block in iter_blocks(root)]
+        assert actual == _legacy_extract(root), html
+
+
+def test_iter_blocks_handles_deep_dom():
+    """测试超过递归上限的嵌套深度"""
+    depth = sys.getrecursionlimit() + 500
+    html = "<div>" * depth + "深层文本" + "</div>" * depth
+    soup = BeautifulSoup(html, "html.parser")
+
+    blocks = _extract_text_with_structure(soup)
+
+    assert [b.text for b in blocks] == ["\n", "深层文本", "\n"]
+
+
+def _malformed_html(rng, depth=0):
+    """包含未闭合标签、多余结束标签、注释、实体和多个body的随机HTML"""
+    fragments = [
+        "",
+        " ",
+        "文本",
+        "\n",
+        "\r",
+        "a  b",
+        "&amp;",
+        "&lt",
+        "&nbsp;",
+        "&foo;",
+        "&#65;",
+        "&#x4e2d;",
+        "&#128;",
+        "<!-- 注释 -->",
+        "<!DOCTYPE html>",
+        "<![CDATA[cd]]>",
+        "<br>",
+        "<br/>",
+        "</br>",
+        "<div/>",
+        "<img src=x>",
+        '<img data-src="y" src>',
+        "</div>",
+        "</li>",
+        "</td>",
+        "<body>",
+        "</body>",
+        "</html>",
+        "<script>if(a<b){}</script>",
+    ]
+    tags = ["div", "p", "h2", "b", "ul", "ol", "li", "table", "tr", "td", "th"]
+    tags += ["pre", "template", "body", "tbody", "thead"]
+    parts = []
+    for _ in range(rng.randint(0, 5)):
+        if rng.random() < 0.45 or depth > 5:
+            parts.append(rng.choice(fragments))
+            continue
+        tag = rng.choice(tags)
+        attrs = rng.choice(["", ' class="a  b"', ' colspan="2"', " rowspan=0"])
+        end = f"</{tag}>" if rng.random() < 0.85 else ""
+        parts.append(f"<{tag}{attrs}>{_malformed_html(rng, depth + 1)}{end}")
+    return "".join(parts)
+
+
+def test_stream_parser_matches_html_parser(file_config):
+    """测试流式解析与html.parser建树后的输出一致（包括不规范的标记）"""
+    rng = random.Random(20240502)
+    samples = [file_config["test_content"]["html"]]
+    samples += [_random_html(rng) for _ in range(100)]
+    samples += [_malformed_html(rng) for _ in range(400)]
+    for html in samples:
+        soup = BeautifulSoup(html, "html.parser")
+        expected = list(iter_blocks(soup.body or soup))
+        # 分块大小不影响结果
+        chunk_size = rng.choice([1, 7, 64 * 1024])
+        assert list(iter_blocks_stream(html, chunk_size)) == expected, html
+        expected = list(iter_blocks(soup.body or soup, images=True))
+        actual = list(iter_blocks_stream(html, chunk_size, images=True))
+        assert actual == expected, html
+
+
+@pytest.mark.parametrize("parser", document_service.PARSERS)
+@pytest.mark.parametrize("name", ["article", "lists_tables"])
+def test_convert_html_to_txt_golden(parser, name, temp_output_dir):
+    """测试各解析方式对中文文档的TXT输出与基准文件一致"""
+    html = (GOLDEN_DIR / f"{name}.html").read_text(encoding="utf-8")
+    expected = (GOLDEN_DIR / f"{name}.txt").read_text(encoding="utf-8")
+    output_path = temp_output_dir / f"{name}-{parser}.txt"
+
+    convert_html_to_txt(html, str(output_path), parser=parser)
+
+    assert output_path.read_text(encoding="utf-8") == expected
+
+
+@pytest.mark.parametrize("name", ["article", "lists_tables"])
+def test_parsers_produce_identical_blocks(name):
+    """测试各解析方式产出的文本块（含标签和class）完全一致"""
+    html = (GOLDEN_DIR / f"{name}.html").read_text(encoding="utf-8")
+    expected = list(extract_blocks(html, "html.parser"))
+    assert list(extract_blocks(html, "lxml")) == expected
+    assert list(extract_blocks(html, "stream")) == expected
+
+
+def test_image_blocks():
+    """测试图片块：取src或data-src，列表和表格中的图片不产出，各解析方式一致"""
+    html = (
+        "<body><p>前文<img src='a.png'>后文</p><img data-src='b.jpg'><img>"
+        "<ul><li><img src='c.png'>列表</li></ul></body>"
+    )
+    expected = [
+        document_service.Block("\n", "", ""),
+        document_service.Block("前文", "", ""),
+        document_service.Block("a.png", "img", ""),
+        document_service.Block("后文", "", ""),
+        document_service.Block("\n", "", ""),
+        document_service.Block("b.jpg", "img", ""),
+        document_service.Block("• 列表", "li", ""),
+        document_service.Block(
+            "\n", "ulol", "", (document_service.ListItem(0, "• 列表"),)
+        ),
+    ]
+    for parser in document_service.PARSERS:
+        assert list(extract_blocks(html, parser, images=True)) == expected
+        # 默认不产出图片块
+        assert all(b.tag != "img" for b in extract_blocks(html, parser))
+
+
+NESTED_HTML = """<body>
+<ol class="steps">
+  <li>第一步
+    <ul><li>要点A</li><li>要点B<ol><li>细节</li></ol></li></ul>
+    说明
+  </li>
+  <li></li>
+  <li><div>第三步</div></li>
+</ol>
+<table>
+  <thead><tr><th colspan="2">标题</th></tr></thead>
+  <tbody>
+    <tr><td rowspan="2">合并</td><td>1</td></tr>
+    <tr><td>2</td></tr>
+  </tbody>
+</table>
+</body>"""
+
+
+def test_nested_list_and_table_structure():
+    """测试嵌套列表展开为带层级的列表项，thead/tbody中的行和合并单元格保留"""
+    expected_items = (
+        document_service.ListItem(0, "1. 第一步\n\n说明"),
+        document_service.ListItem(1, "• 要点A"),
+        document_service.ListItem(1, "• 要点B"),
+        document_service.ListItem(2, "1. 细节"),
+        document_service.ListItem(0, "3. 第三步"),
+    )
+    expected_rows = (
+        (TableCell("标题", colspan=2, header=True),),
+        (TableCell("合并", rowspan=2), TableCell("1")),
+        (TableCell("2"),),
+    )
+    for parser in document_service.PARSERS:
+        blocks = list(extract_blocks(NESTED_HTML, parser))
+        lists = [b for b in blocks if b.tag == "ulol"]
+        tables = [b for b in blocks if b.tag == "table" and b.data is not None]
+        assert lists[0].data == expected_items, parser
+        assert lists[0].class_name == "steps"
+        assert tables[0].data == expected_rows, parser
+        # 文本块保持原样：嵌套列表内容计入外层列表项
+        assert [b.text for b in blocks if b.tag == "li"][0].startswith("1. 第一步")
+        assert "标题" in [b.text for b in blocks if b.tag == "table"]
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_convert_html_to_docx_structured(streaming, temp_output_dir):
+    """测试DOCX中生成Word表格和按层级设置样式的列表段落"""
+    output_path = temp_output_dir / f"structured-{streaming}.docx"
+
+    convert_html_to_docx(NESTED_HTML, str(output_path), streaming=streaming)
+
+    doc = Document(output_path)
+    assert len(doc.tables) == 1
+    table = doc.tables[0]
+    assert table.cell(0, 1).text == "标题"
+    assert table.cell(2, 0).text == "合并"
+    styles = [(p.style.name, p.text) for p in doc.paragraphs if p.text]
+    assert styles[:3] == [
+        ("List", "1. 第一步\n\n说明"),
+        ("List 2", "• 要点A"),
+        ("List 2", "• 要点B"),
+    ]
+    assert ("List 3", "1. 细节") in styles
+
+
+def test_convert_html_to_docx_unstructured(temp_output_dir):
+    """测试关闭结构化输出时表格逐行、列表逐项写为段落"""
+    output_path = temp_output_dir / "flat.docx"
+
+    convert_html_to_docx(NESTED_HTML, str(output_path), structured=False)
+
+    doc = Document(output_path)
+    assert not doc.tables
+    texts = [p.text for p in doc.paragraphs if p.text]
+    assert "合并 | 1" in texts
+    assert texts[0].startswith("1. 第一步")
+
+
+def test_convert_html_to_docx_with_images(temp_output_dir):
+    """测试DOCX嵌入图片：相同内容只保存一份，未取得内容的图片忽略"""
+    buffer = BytesIO()
+    Image.new("RGB", (192, 96), "red").save(buffer, "PNG")
+    png = buffer.getvalue()
+    html = (
+        "<body><p>正文</p><img src='a.png'><p>中间</p>"
+        "<img src='copy.png'><img src='missing.png'></body>"
+    )
+
+    for streaming in (True, False):
+        output_path = temp_output_dir / f"images-{streaming}.docx"
+        convert_html_to_docx(
+            html,
+            str(output_path),
+            streaming=streaming,
+            images={"a.png": png, "copy.png": png},
+        )
+
+        doc = Document(output_path)
+        shapes = doc.inline_shapes
+        assert len(shapes) == 2
+        # 192像素按96 CSS像素/英寸显示为2英寸
+        assert shapes[0].width == Inches(2)
+        assert shapes[0].height == Inches(1)
+        media = [
+            rel for rel in doc.part.rels.values() if rel.reltype.endswith("/image")
+        ]
+        assert len(media) == 1
+        assert [p.text for p in doc.paragraphs if p.text] == ["正文", "中间"]
+
+
+def test_convert_html_to_docx_without_pillow(monkeypatch, temp_output_dir):
+    """测试图片处理不可用时仍生成不含图片的文档"""
+
+    def fail(images):
+        raise RuntimeError("DOCX图片嵌入需要安装Pillow")
+
+    monkeypatch.setattr(document_service, "prepare_images", fail)
+    output_path = temp_output_dir / "no-images.docx"
+
+    convert_html_to_docx(
+        "<body><p>正文</p><img src='a.png'></body>",
+        str(output_path),
+        images={"a.png": b"data"},
+    )
+
+    assert output_path.exists()
+
+
+def test_stream_parser_does_not_build_tree(monkeypatch, temp_output_dir):
+    """测试流式解析不构建BeautifulSoup树"""
+
+    def fail(*args, **kwargs):
+        raise AssertionError("不应构建DOM树")
+
+    monkeypatch.setattr(document_service, "BeautifulSoup", fail)
+    output_path = temp_output_dir / "stream.txt"
+
+    convert_html_to_txt("<body><p>流式</p></body>", str(output_path), parser="stream")
+
+    assert output_path.read_text(encoding="utf-8") == "\n流式\n"
+
+
+def test_extract_blocks_rejects_unknown_parser():
+    """测试不支持的解析方式"""
+    with pytest.raises(ValueError):
+        extract_blocks("<p>x</p>", "html5lib")
@@ -0,0 +1,230 @@
+"""流式DOCX写入测试模块"""
+
+import zipfile
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+from app.services.document_service import convert_html_to_docx
+from app.services.docx_stream import (
+    StreamingDocxWriter,
+    TableCell,
+    append_table,
+    table_xml,
+)
+from docx import Document
+from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+from docx.shared import Inches
+from lxml import etree
+from PIL import Image
+
+GOLDEN_DIR = Path(__file__).parent / "data" / "documents"
+
+
+def _body_children(path):
+    """读取document.xml正文的各子元素（规范化后），用于比较两份文档"""
+    with zipfile.ZipFile(path) as zf:
+        parser = etree.XMLParser(remove_blank_text=True)
+        root = etree.fromstring(zf.read("word/document.xml"), parser)
+    body = root.find(
+        "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}body"
+    )
+    return [
+        etree.tostring(child, method="c14n", exclusive=True, with_tail=False)
+        for child in body
+    ]
+
+
+def _write_both(tmp_path, build):
+    """分别用python-docx和StreamingDocxWriter执行同样的写入"""
+    expected_path = tmp_path / "python-docx.docx"
+    doc = Document()
+    build(doc)
+    doc.save(expected_path)
+
+    actual_path = tmp_path / "stream.docx"
+    with StreamingDocxWriter(str(actual_path)) as writer:
+        build(writer)
+    return expected_path, actual_path
+
+
+def test_writer_matches_python_docx(tmp_path):
+    """测试标题、空段落、对齐、多个run、换行和需要转义的字符与python-docx一致"""
+
+    def build(doc):
+        heading = doc.add_heading("文档标题", level=0)
+        heading.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+        doc.add_paragraph()
+        doc.add_heading("第一章", level=1)
+        doc.add_heading("小节", level=9)
+        paragraph = doc.add_paragraph()
+        paragraph.add_run("第一段")
+        paragraph.add_run(" 带空格 ")
+        paragraph.add_run("a < b & c > d")
+        item = doc.add_paragraph("• 列表项\n第二行\t制表")
+        item.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT
+        item.add_run("追加")
+        doc.add_paragraph("最后一段")
+
+    expected_path, actual_path = _write_both(tmp_path, build)
+
+    assert _body_children(actual_path) == _body_children(expected_path)
+    # python-docx能正常读取
+    paragraphs = Document(actual_path).paragraphs
+    assert paragraphs[0].style.name == "Title"
+    assert paragraphs[0].alignment == WD_PARAGRAPH_ALIGNMENT.CENTER
+    assert paragraphs[5].text == "• 列表项\n第二行\t制表追加"
+
+
+def _image_bytes(fmt, size=(300, 200), color="red"):
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def test_writer_pictures_match_python_docx(tmp_path):
+    """测试图片段落、尺寸、关系和媒体部件与python-docx一致，相同图片只保存一份"""
+    png = _image_bytes("PNG")
+    jpeg = _image_bytes("JPEG", (40, 30), "blue")
+
+    def build(doc):
+        doc.add_paragraph("图片前")
+        doc.add_picture(BytesIO(png), width=Inches(2))
+        doc.add_picture(BytesIO(png))
+        doc.add_picture(BytesIO(jpeg), height=Inches(1))
+        doc.add_paragraph("图片后")
+
+    expected_path, actual_path = _write_both(tmp_path, build)
+
+    assert _body_children(actual_path) == _body_children(expected_path)
+    with zipfile.ZipFile(expected_path) as expected, zipfile.ZipFile(
+        actual_path
+    ) as actual:
+        assert actual.testzip() is None
+        media = sorted(n for n in actual.namelist() if n.startswith("word/media/"))
+        assert media == sorted(
+            n for n in expected.namelist() if n.startswith("word/media/")
+        )
+        for name in media:
+            assert actual.read(name) == expected.read(name)
+    shapes = Document(actual_path).inline_shapes
+    assert [(s.width, s.height) for s in shapes] == [
+        (s.width, s.height) for s in Document(expected_path).inline_shapes
+    ]
+
+
+def test_table_merged_cells(tmp_path):
+    """测试colspan/rowspan布局：被上方合并占用的列跳过，短行补空单元格"""
+    rows = [
+        [
+            TableCell("A", colspan=2, header=True),
+            TableCell("B", rowspan=2, header=True),
+        ],
+        [TableCell("C"), TableCell("D")],
+        [TableCell("E"), TableCell("F", rowspan=0)],
+        [TableCell("G")],
+    ]
+    output_path = tmp_path / "stream.docx"
+    with StreamingDocxWriter(str(output_path)) as writer:
+        append_table(writer, rows)
+
+    table = Document(output_path).tables[0]
+    grid = [[table.cell(r, c).text for c in range(3)] for r in range(4)]
+    assert grid == [
+        ["A", "A", "B"],
+        ["C", "D", "B"],
+        ["E", "F", ""],
+        ["G", "F", ""],
+    ]
+    xml = table_xml(rows)
+    # 全部为th的首行设为标题行
+    assert xml.count("<w:tblHeader/>") == 1
+    assert xml.count('<w:vMerge w:val="restart"/>') == 2
+
+
+def test_table_matches_between_writers(tmp_path):
+    """测试python-docx文档与流式写入添加的表格XML一致"""
+    rows = [[TableCell("名称", header=True), TableCell("值", header=True)]]
+    rows += [[TableCell(f"第{i}行"), TableCell("a < b\n换行")] for i in range(20)]
+
+    def build(doc):
+        doc.add_paragraph("表格前")
+        append_table(doc, rows)
+        doc.add_paragraph("List Bullet样式", style="List Bullet")
+
+    expected_path, actual_path = _write_both(tmp_path, build)
+
+    assert _body_children(actual_path) == _body_children(expected_path)
+    table = Document(actual_path).tables[0]
+    assert len(table.rows) == 21
+    assert table.cell(20, 1).text == "a < b\n换行"
+    assert table_xml([]) == ""
+
+
+def test_writer_copies_template_parts(tmp_path):
+    """测试除正文外的部件与默认模板一致"""
+    output_path = tmp_path / "stream.docx"
+    with StreamingDocxWriter(str(output_path)) as writer:
+        writer.add_paragraph("正文")
+
+    with zipfile.ZipFile(output_path) as zf:
+        names = zf.namelist()
+        assert zf.testzip() is None
+    assert "word/styles.xml" in names
+    assert "[Content_Types].xml" in names
+    assert names.count("word/document.xml") == 1
+
+
+def test_writer_drops_invalid_xml_characters(tmp_path):
+    """测试XML不允许的控制字符被删除而不是生成损坏的文件"""
+    output_path = tmp_path / "stream.docx"
+    with StreamingDocxWriter(str(output_path)) as writer:
+        writer.add_paragraph("a\x00b\x1fc")
+
+    assert Document(output_path).paragraphs[0].text == "abc"
+
+
+def test_alignment_after_content_raises(tmp_path):
+    """测试段落内容写出后不能再修改段落属性"""
+    with StreamingDocxWriter(str(tmp_path / "stream.docx")) as writer:
+        paragraph = writer.add_paragraph("正文")
+        paragraph.add_run("追加")
+        with pytest.raises(RuntimeError):
+            paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.LEFT
+
+
+def test_writer_removes_partial_file_on_error(tmp_path):
+    """测试写入过程中出错时删除不完整的文件"""
+    output_path = tmp_path / "stream.docx"
+    with pytest.raises(ValueError):
+        with StreamingDocxWriter(str(output_path)) as writer:
+            writer.add_paragraph("正文")
+            raise ValueError("转换失败")
+
+    assert not output_path.exists()
+
+
+def test_writer_flushes_in_small_buffers(tmp_path):
+    """测试缓冲区很小时（频繁写入压缩流）内容完整"""
+    output_path = tmp_path / "stream.docx"
+    with StreamingDocxWriter(str(output_path), buffer_size=16) as writer:
+        for i in range(200):
+            writer.add_paragraph(f"第{i}段")
+
+    paragraphs = Document(output_path).paragraphs
+    assert [p.text for p in paragraphs] == [f"第{i}段" for i in range(200)]
+
+
+@pytest.mark.parametrize("name", ["article", "lists_tables"])
+def test_convert_html_to_docx_streaming_matches_python_docx(name, tmp_path):
+    """测试流式写入与python-docx生成的正文一致"""
+    html = (GOLDEN_DIR / f"{name}.html").read_text(encoding="utf-8")
+    expected_path = tmp_path / "python-docx.docx"
+    actual_path = tmp_path / "stream.docx"
+
+    convert_html_to_docx(html, str(expected_path), title="标题", streaming=False)
+    convert_html_to_docx(
+        html, str(actual_path), title="标题", parser="stream", streaming=True
+    )
+
+    assert _body_children(actual_path) == _body_children(expected_path)
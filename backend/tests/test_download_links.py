@@ -0,0 +1,73 @@
+"""
+产物下载链接测试模块
+"""
+
+import hashlib
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from app.core.config import settings
+from app.services import download_links
+
+
+def _query(url):
+    return {k: v[0] for k, v in parse_qs(urlsplit(url).query).items()}
+
+
+def test_download_url_signed(download_dir):
+    """测试链接包含过期时间、内容哈希和签名，签名可以校验"""
+    path = download_dir / "report.pdf"
+    path.write_bytes(b"%PDF-1.4 test")
+
+    url = download_links.download_url(str(path), ttl=60, now=1000)
+
+    assert url.startswith("http://testserver/api/v1/download/report.pdf?")
+    query = _query(url)
+    assert query["expires"] == "1060"
+    assert query["sha"] == hashlib.sha256(b"%PDF-1.4 test").hexdigest()[:32]
+    assert download_links.verify("report.pdf", 1060, query["sha"], query["sig"])
+    # 任一字段被改动时签名失效
+    assert not download_links.verify("other.pdf", 1060, query["sha"], query["sig"])
+    assert not download_links.verify("report.pdf", 9999, query["sha"], query["sig"])
+
+
+def test_download_url_only_for_local_artifacts(download_dir, tmp_path, monkeypatch):
+    """测试只为本地存储根目录下的文件生成链接，未配置密钥时不生成"""
+    outside = tmp_path / "outside.pdf"
+    outside.write_bytes(b"x")
+    assert download_links.download_url(str(outside)) is None
+    assert download_links.download_url("s3://bucket/a.pdf") is None
+    assert download_links.download_url(str(download_dir / "missing.pdf")) is None
+
+    (download_dir / "a.pdf").write_bytes(b"x")
+    monkeypatch.setattr(settings, "DOWNLOAD_SECRET", "")
+    assert download_links.download_url(str(download_dir / "a.pdf")) is None
+    assert not download_links.verify("a.pdf", int(time.time()) + 60, "", "")
+
+
+def test_current_sha_cached_by_mtime_and_size(download_dir, monkeypatch):
+    path = download_dir / "a.pdf"
+    path.write_bytes(b"one")
+    calls = []
+    real = download_links.artifact_sha256
+
+    def counting(uri):
+        calls.append(uri)
+        return real(uri)
+
+    monkeypatch.setattr(download_links, "artifact_sha256", counting)
+    first = download_links.current_sha(str(path))
+    assert download_links.current_sha(str(path)) == first
+    assert len(calls) == 1
+
+    path.write_bytes(b"other")
+    assert download_links.current_sha(str(path)) != first
+    assert len(calls) == 2
+
+
+def test_resolve_rejects_unsafe_names(download_dir):
+    (download_dir / "a.pdf").write_bytes(b"x")
+    assert download_links.resolve("a.pdf") == str(download_dir / "a.pdf")
+    assert download_links.resolve("../a.pdf") is None
+    assert download_links.resolve(".hidden") is None
+    assert download_links.resolve("missing.pdf") is None
@@ -3,6 +3,7 @@
 """
 
 import os
+import smtplib
 from unittest.mock import MagicMock, patch
 
 import pytest
@@ -201,3 +202,196 @@ def test_smtp_connection_error(
         )
     assert "发送邮件失败" in str(exc_info.value)
     assert "Connection refused" in str(exc_info.value)
+
+
+def _streaming_server():
+    """模拟逐条响应SMTP命令的连接，记录写入DATA的原始字节"""
+    server = MagicMock()
+    server.mail.return_value = (250, b"OK")
+    server.rcpt.return_value = (250, b"OK")
+    server.docmd.return_value = (354, b"Go ahead")
+    server.getreply.return_value = (250, b"Queued")
+    return server
+
+
+def _unstuff(raw: bytes) -> bytes:
+    """还原SMTP点转义，去掉结束标记"""
+    assert raw.endswith(b"\r\n.\r\n")
+    lines = raw[: -len(b".\r\n")].split(b"\r\n")
+    return b"\r\n".join(line[1:] if line.startswith(b".") else line for line in lines)
+
+
+@patch("smtplib.SMTP")
+@patch("smtplib.SMTP_SSL")
+def test_send_email_streams_large_attachment(
+    mock_smtp_ssl, mock_smtp, email_config, email_test_cases, temp_output_dir
+):
+    """测试大附件流式编码发送，收到的邮件可以正确解析出原始附件"""
+    import email as email_lib
+
+    payload = os.urandom(300 * 1024 + 7)
+    test_file = temp_output_dir / "网页-大文件.pdf"
+    test_file.write_bytes(payload)
+
+    mock_smtp_instance = _streaming_server()
+    mock_smtp.return_value.__enter__.return_value = mock_smtp_instance
+    mock_smtp_ssl.return_value.__enter__.return_value = mock_smtp_instance
+
+    service = EmailService(EmailConfig(**email_config, stream_threshold=1024))
+    result = service.send_email(
+        to_email=email_test_cases["recipient"],
+        subject="网页转PDF",
+        body=".\n以点开头的正文",
+        attachments=[str(test_file)],
+    )
+
+    assert result is True
+    assert not mock_smtp_instance.send_message.called
+    chunks = [c.args[0] for c in mock_smtp_instance.send.call_args_list]
+    # 附件按块写入，没有整体序列化
+    assert max(len(c) for c in chunks) < len(payload)
+
+    msg = email_lib.message_from_bytes(_unstuff(b"".join(chunks)))
+    assert (
+        str(
+            email_lib.header.make_header(email_lib.header.decode_header(msg["Subject"]))
+        )
+        == "网页转PDF"
+    )
+    text, attachment = msg.get_payload()
+    assert text.get_payload(decode=True).decode("utf-8") == ".\n以点开头的正文"
+    assert attachment.get_filename() == test_file.name
+    assert attachment.get_payload(decode=True) == payload
+
+
+def test_send_many_resets_session_after_refused_recipient(
+    email_config, temp_output_dir
+):
+    """测试流式发送在DATA之前被拒绝时先RSET，同一会话中的下一封照常发送"""
+    attachment = temp_output_dir / "a.pdf"
+    attachment.write_bytes(b"%PDF" * 1024)
+    server = _streaming_server()
+    server.rcpt.side_effect = [(550, b"No such user"), (250, b"OK")]
+    pool = MagicMock()
+    pool.connection.return_value.__enter__.return_value = server
+
+    service = EmailService(EmailConfig(**email_config, stream_threshold=1), pool=pool)
+    results = service.send_many(
+        [
+            {
+                "to_email": "gone@example.com",
+                "subject": "s",
+                "body": "b",
+                "attachments": [str(attachment)],
+            },
+            {
+                "to_email": "ok@example.com",
+                "subject": "s",
+                "body": "b",
+                "attachments": [str(attachment)],
+            },
+        ]
+    )
+
+    assert isinstance(results[0], RuntimeError)
+    assert results[1] is True
+    server.rset.assert_called_once()
+    assert server.mail.call_count == 2
+
+
+@patch("smtplib.SMTP")
+@patch("smtplib.SMTP_SSL")
+def test_send_email_with_artifact_uri(
+    mock_smtp_ssl, mock_smtp, email_config, email_test_cases
+):
+    """测试附件为内存产物URI"""
+    from app.services.artifact_store import get_artifact_store
+
+    uri = get_artifact_store("memory").put_bytes("report.pdf", b"%PDF-1.4")
+    mock_smtp_instance = MagicMock()
+    mock_smtp.return_value.__enter__.return_value = mock_smtp_instance
+    mock_smtp_ssl.return_value.__enter__.return_value = mock_smtp_instance
+
+    service = EmailService(EmailConfig(**email_config))
+    service.send_email(
+        to_email=email_test_cases["recipient"],
+        subject="Test Subject",
+        body="Test Body",
+        attachments=[uri],
+    )
+
+    msg = mock_smtp_instance.send_message.call_args[0][0]
+    assert msg.get_payload()[1].get_filename() == "report.pdf"
+    assert msg.get_payload()[1].get_payload(decode=True) == b"%PDF-1.4"
+
+
+def test_send_many_groups_by_sender(email_config, email_test_cases):
+    """测试批量发送按发件人分组，每组复用一个会话"""
+    pool = MagicMock()
+    sessions = []
+
+    def connection():
+        server = MagicMock()
+        sessions.append(server)
+        cm = MagicMock()
+        cm.__enter__.return_value = server
+        cm.__exit__.return_value = False
+        return cm
+
+    pool.connection.side_effect = connection
+    service = EmailService(EmailConfig(**email_config), pool=pool)
+    recipient = email_test_cases["recipient"]
+
+    results = service.send_many(
+        [
+            {"to_email": recipient, "subject": "1", "body": "b"},
+            {
+                "to_email": recipient,
+                "subject": "2",
+                "body": "b",
+                "sender": "x@example.com",
+            },
+            {"to_email": "invalid", "subject": "3", "body": "b"},
+            {"to_email": recipient, "subject": "4", "body": "b"},
+        ]
+    )
+
+    assert results[0] is True and results[1] is True and results[3] is True
+    assert isinstance(results[2], ValueError)
+    assert len(sessions) == 2
+    subjects = [
+        [c.args[0]["Subject"] for c in s.send_message.call_args_list] for s in sessions
+    ]
+    assert subjects == [["1", "4"], ["2"]]
+    assert sessions[1].send_message.call_args[0][0]["From"] == "x@example.com"
+
+
+def test_send_many_retries_after_disconnect(email_config, email_test_cases):
+    """测试批量发送中会话断开后换新会话继续"""
+    pool = MagicMock()
+    sessions = []
+
+    def connection():
+        server = MagicMock()
+        if not sessions:
+            server.send_message.side_effect = [
+                None,
+                smtplib.SMTPServerDisconnected("gone"),
+            ]
+        sessions.append(server)
+        cm = MagicMock()
+        cm.__enter__.return_value = server
+        cm.__exit__.return_value = False
+        return cm
+
+    pool.connection.side_effect = connection
+    service = EmailService(EmailConfig(**email_config), pool=pool)
+    recipient = email_test_cases["recipient"]
+
+    results = service.send_many(
+        [{"to_email": recipient, "subject": str(i), "body": "b"} for i in range(3)]
+    )
+
+    assert results == [True, True, True]
+    assert len(sessions) == 2
+    assert sessions[1].send_message.call_count == 2
@@ -0,0 +1,329 @@
+"""
+渲染任务公平调度测试模块
+"""
+
+import json
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+import redis
+from app import celery_app
+from app.core.config import settings
+from app.services import fair_scheduler
+from app.services.fair_scheduler import FairScheduler, tenant_of, weight_of
+from app.workers.tasks import create_pdf_task, send_email_task
+from celery import chain
+
+
+def _scheduler(submit=None, dispatch=None, complete=None, stats=None):
+    """创建使用模拟Redis的调度器，调度用的三个Lua脚本替换为给定的模拟对象"""
+    client = MagicMock()
+    scripts = [submit or MagicMock(), dispatch or MagicMock(), complete or MagicMock()]
+    # 其余脚本（批量准入）使用默认的模拟对象
+    client.register_script.side_effect = scripts + [MagicMock(), MagicMock()]
+    client.pipeline.return_value.execute.return_value = stats or [None, 0, None]
+    app = MagicMock()
+    return FairScheduler(client=client, app=app), scripts, app
+
+
+def _render_chain(url="https://example.com/a"):
+    return chain(
+        create_pdf_task.s(url, "/tmp/a.pdf", None),
+        send_email_task.s("reader@example.com", "subject", "body"),
+    )
+
+
+def test_tenant_and_weight(monkeypatch):
+    """测试API Key优先于邮箱确定租户，API Key只以哈希出现，权重按配置查找"""
+    monkeypatch.setattr(
+        settings, "FAIR_TENANT_WEIGHTS", {"vip@example.com": 3, "secret-key": 5}
+    )
+    assert tenant_of(" Reader@Example.com ") == "email:reader@example.com"
+    tenant = tenant_of("reader@example.com", "secret-key")
+    assert tenant.startswith("key:") and "secret-key" not in tenant
+    assert weight_of("VIP@example.com") == 3
+    assert weight_of("vip@example.com", "secret-key") == 5
+    assert weight_of("reader@example.com", "other-key") == 1
+
+
+def test_submit_enqueues_frozen_chain():
+    """测试提交时冻结任务链：返回最后一个任务的ID，以第一个任务的ID登记窗口"""
+    submit = MagicMock(return_value=[1, b"bulk"])
+    dispatch = MagicMock(return_value=None)
+    scheduler, _, _ = _scheduler(submit=submit, dispatch=dispatch)
+    signature = _render_chain()
+
+    admission = scheduler.submit(signature, "email:reader@example.com", weight=2)
+
+    assert admission.accepted is True
+    assert admission.lane == "bulk"
+    assert admission.task_id == signature.tasks[-1].id
+    args = submit.call_args.kwargs["args"]
+    assert args[1:3] == ["email:reader@example.com", "interactive"]
+    assert args[4] == 2
+    job = json.loads(args[3])
+    assert job["id"] == signature.tasks[0].id
+    assert job["sig"]["kwargs"]["tasks"][0]["options"]["task_id"] == job["id"]
+    # 提交后立即尝试发布
+    dispatch.assert_called_once()
+
+
+def test_submit_rejected_with_retry_estimate(monkeypatch):
+    """测试超过待调度上限时拒绝，等待时间按队列深度和平均耗时估算"""
+    monkeypatch.setattr(settings, "FAIR_DISPATCH_WINDOW", 4)
+    submit = MagicMock(return_value=[0, 40, 500])
+    scheduler, (_, dispatch, _), _ = _scheduler(
+        submit=submit, stats=[b"40", 4, b"12.0"]
+    )
+
+    admission = scheduler.submit(_render_chain(), "email:bulk@example.com")
+
+    assert admission.accepted is False
+    # (40个待调度 + 4个执行中) × 12秒 / 窗口4
+    assert admission.retry_after == 132
+    dispatch.assert_not_called()
+
+
+def test_retry_estimate_bounds(monkeypatch):
+    """测试等待时间至少1秒、不超过上限，没有统计时使用默认耗时"""
+    monkeypatch.setattr(settings, "FAIR_DISPATCH_WINDOW", 2)
+    monkeypatch.setattr(settings, "FAIR_DEFAULT_RENDER_SECONDS", 10.0)
+    monkeypatch.setattr(settings, "FAIR_RETRY_AFTER_MAX", 300)
+    scheduler, _, _ = _scheduler(stats=[None, 0, None])
+    assert scheduler.estimate_wait() == 1
+    assert scheduler.estimate_wait(5) == 25
+    assert scheduler.estimate_wait(1000) == 300
+
+
+def test_pump_publishes_until_window_full():
+    """测试逐个发布调度脚本取出的任务，跳过空队列标记，直到窗口已满"""
+    jobs = [
+        json.dumps({"id": "job-1", "sig": {"task": "a"}}),
+        b"",
+        json.dumps({"id": "job-2", "sig": {"task": "b"}}),
+        None,
+    ]
+    dispatch = MagicMock(side_effect=jobs)
+    scheduler, _, app = _scheduler(dispatch=dispatch)
+
+    assert scheduler.pump() == 2
+    assert [c.args[0] for c in app.signature.call_args_list] == [
+        {"task": "a"},
+        {"task": "b"},
+    ]
+    assert app.signature.return_value.apply_async.call_count == 2
+
+
+def test_pump_releases_slot_when_publish_fails():
+    """测试发布失败时释放该任务占用的窗口，继续发布后续任务"""
+    dispatch = MagicMock(
+        side_effect=[json.dumps({"id": "job-1", "sig": {"task": "a"}}), None]
+    )
+    complete = MagicMock(return_value=1)
+    scheduler, _, app = _scheduler(dispatch=dispatch, complete=complete)
+    app.signature.return_value.apply_async.side_effect = redis.ConnectionError()
+
+    assert scheduler.pump() == 0
+    assert complete.call_args.kwargs["args"][1] == "job-1"
+    # 释放窗口时不再递归发布
+    assert dispatch.call_count == 2
+
+
+def test_complete_pumps_only_for_scheduled_tasks():
+    """测试只有调度器发布的任务结束时才继续发布"""
+    complete = MagicMock(side_effect=[1, 0])
+    dispatch = MagicMock(return_value=None)
+    scheduler, _, _ = _scheduler(complete=complete, dispatch=dispatch)
+
+    assert scheduler.complete("job-1") is True
+    assert scheduler.complete("other") is False
+    assert dispatch.call_count == 1
+
+
+def test_scheduler_degrades_when_redis_unavailable():
+    """测试Redis不可用时直接发布到Celery"""
+    error = MagicMock(side_effect=redis.ConnectionError("refused"))
+    scheduler, _, _ = _scheduler(submit=error, dispatch=error, complete=error)
+    signature = _render_chain()
+    apply_async = MagicMock()
+    signature.apply_async = apply_async
+
+    admission = scheduler.submit(signature, "email:reader@example.com")
+
+    assert admission.accepted is True
+    assert admission.task_id == signature.tasks[-1].id
+    apply_async.assert_called_once()
+    assert scheduler.pump() == 0
+    assert scheduler.complete(admission.task_id) is False
+
+
+def test_unknown_lane_rejected():
+    scheduler, _, _ = _scheduler()
+    with pytest.raises(ValueError):
+        scheduler.submit(_render_chain(), "email:reader@example.com", lane="urgent")
+
+
+def test_render_task_end_releases_slot(monkeypatch):
+    """测试渲染任务结束时释放窗口，投递任务不占用窗口"""
+    scheduler = MagicMock()
+    monkeypatch.setattr(fair_scheduler, "get_fair_scheduler", lambda: scheduler)
+
+    render = SimpleNamespace(name="app.workers.tasks.create_pdf_task")
+    deliver = SimpleNamespace(name="app.workers.tasks.send_email_task")
+    celery_app._release_render_slot(task_id="t1", task=render)
+    celery_app._release_render_slot(task_id="t2", task=deliver)
+
+    scheduler.complete.assert_called_once_with("t1")
+
+
+class _Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def real_scheduler(monkeypatch):
+    """
+    使用fakeredis执行真实Lua脚本的调度器，未安装fakeredis[lua]时跳过；
+    返回(调度器, 已发布任务的URL列表, 时钟)
+    """
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    clock = _Clock()
+    monkeypatch.setattr(fair_scheduler, "time", clock)
+    monkeypatch.setattr(settings, "FAIR_INTERACTIVE_BURST", 100)
+    published = []
+    app = MagicMock()
+
+    def signature(sig):
+        first = sig["kwargs"]["tasks"][0]
+        published.append((first["args"][0], first["options"]["task_id"]))
+        return MagicMock()
+
+    app.signature.side_effect = signature
+    return FairScheduler(client=fakeredis.FakeRedis(), app=app), published, clock
+
+
+def _enqueue(scheduler, monkeypatch, jobs):
+    """在窗口为0时依次提交(租户, 通道, URL)，全部留在待调度队列中"""
+    monkeypatch.setattr(settings, "FAIR_DISPATCH_WINDOW", 0)
+    admissions = [
+        scheduler.submit(_render_chain(url), tenant, lane=lane, weight=weight)
+        for tenant, lane, url, weight in jobs
+    ]
+    monkeypatch.setattr(settings, "FAIR_DISPATCH_WINDOW", 100)
+    return admissions
+
+
+def test_weighted_round_robin(real_scheduler, monkeypatch):
+    """测试同一通道内按权重轮转：权重2的租户每轮连续发布2个"""
+    scheduler, published, _ = real_scheduler
+    _enqueue(
+        scheduler,
+        monkeypatch,
+        [("a", "interactive", f"a{i}", 2) for i in range(4)]
+        + [("b", "interactive", f"b{i}", 1) for i in range(3)],
+    )
+
+    assert scheduler.pump() == 7
+    assert [url for url, _ in published] == ["a0", "a1", "b0", "a2", "a3", "b1", "b2"]
+
+
+def test_bulk_lane_gets_minimum_share(real_scheduler, monkeypatch):
+    """测试interactive优先，两条通道都有任务时每FAIR_BULK_SHARE次发布轮到一次bulk"""
+    scheduler, published, _ = real_scheduler
+    monkeypatch.setattr(settings, "FAIR_BULK_SHARE", 3)
+    _enqueue(
+        scheduler,
+        monkeypatch,
+        [("bulk", "bulk", f"k{i}", 1) for i in range(3)]
+        + [("user", "interactive", f"i{i}", 1) for i in range(5)],
+    )
+
+    scheduler.pump()
+    assert [url for url, _ in published] == [
+        "i0",
+        "i1",
+        "k0",
+        "i2",
+        "i3",
+        "k1",
+        "i4",
+        "k2",
+    ]
+
+
+def test_burst_demoted_to_bulk(real_scheduler, monkeypatch):
+    """测试同一租户在interactive中积压超过突发上限后，后续任务降入bulk"""
+    scheduler, _, _ = real_scheduler
+    monkeypatch.setattr(settings, "FAIR_INTERACTIVE_BURST", 2)
+    admissions = _enqueue(
+        scheduler, monkeypatch, [("a", "interactive", f"a{i}", 1) for i in range(4)]
+    )
+    assert [a.lane for a in admissions] == [
+        "interactive",
+        "interactive",
+        "bulk",
+        "bulk",
+    ]
+
+
+def test_admission_limits(real_scheduler, monkeypatch):
+    """测试租户待调度数达到上限时拒绝，其他租户不受影响"""
+    scheduler, _, _ = real_scheduler
+    monkeypatch.setattr(settings, "FAIR_MAX_PENDING_PER_TENANT", 2)
+    admissions = _enqueue(
+        scheduler,
+        monkeypatch,
+        [("a", "bulk", f"a{i}", 1) for i in range(3)] + [("b", "bulk", "b0", 1)],
+    )
+    assert [a.accepted for a in admissions] == [True, True, False, True]
+    assert admissions[2].retry_after >= 1
+    assert scheduler.stats()["pending"] == 3
+
+
+def test_window_and_ewma(real_scheduler, monkeypatch):
+    """测试已发布未完成的任务不超过窗口，完成时发布下一个并更新平均耗时"""
+    scheduler, published, clock = real_scheduler
+    monkeypatch.setattr(settings, "FAIR_EWMA_ALPHA", 0.5)
+    _enqueue(scheduler, monkeypatch, [("a", "bulk", f"a{i}", 1) for i in range(4)])
+    monkeypatch.setattr(settings, "FAIR_DISPATCH_WINDOW", 2)
+
+    assert scheduler.pump() == 2
+    assert scheduler.pump() == 0
+    assert scheduler.stats()["inflight"] == 2
+
+    clock.now += 10
+    assert scheduler.complete(published[0][1]) is True
+    assert len(published) == 3
+    assert scheduler.stats()["average_seconds"] == 10
+
+    clock.now += 20
+    # 第二个任务从1000秒起共30秒，第三个任务从1010秒起共20秒
+    assert scheduler.complete(published[1][1]) is True
+    assert scheduler.stats()["average_seconds"] == 20
+    # 不是调度器发布的任务不释放窗口
+    assert scheduler.complete("unknown") is False
+    assert scheduler.stats() == {"pending": 0, "inflight": 2, "average_seconds": 20}
+
+
+def test_batch_url_admission(real_scheduler, monkeypatch):
+    """测试批量提交按租户未完成的链接数准入，释放后可以再次提交"""
+    scheduler, _, _ = real_scheduler
+    monkeypatch.setattr(settings, "FAIR_BATCH_MAX_PENDING_URLS", 10)
+
+    # 没有未完成链接时，超过上限的一批也接受
+    assert scheduler.admit_urls("a", 12).accepted
+    rejected = scheduler.admit_urls("a", 1)
+    assert not rejected.accepted and rejected.retry_after >= 1
+    assert scheduler.admit_urls("b", 5).accepted
+
+    scheduler.release_urls("a", 5)
+    assert not scheduler.admit_urls("a", 4).accepted
+    assert scheduler.admit_urls("a", 3).accepted
+    scheduler.release_urls("a", 10)
+    assert scheduler.client.get(f"{FairScheduler.PREFIX}:urls:a") is None
@@ -0,0 +1,152 @@
+"""DOCX图片处理测试模块"""
+
+import asyncio
+import base64
+from io import BytesIO
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from app.services import image_pipeline
+from app.services.image_pipeline import ImageCapture, prepare_images
+from PIL import Image
+
+
+def _image_bytes(fmt, size=(300, 200), mode="RGB", color="red"):
+    buffer = BytesIO()
+    Image.new(mode, size, color).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def _open(data):
+    return Image.open(BytesIO(data))
+
+
+def test_prepare_images_deduplicates_by_content():
+    """测试内容相同的图片只处理一次，各src得到同一个结果"""
+    png = _image_bytes("PNG")
+    prepared = prepare_images(
+        {"a.png": png, "b.png": png, "c.png": _image_bytes("GIF")}
+    )
+
+    assert prepared["a.png"] is prepared["b.png"]
+    assert prepared["a.png"].data == png
+    assert _open(prepared["c.png"].data).format == "GIF"
+
+
+def test_prepare_images_downscales_to_dpi():
+    """测试超过正文宽度的图片缩小到正文宽度×DPI，比例不变"""
+    jpeg = _image_bytes("JPEG", (3000, 1500))
+    prepared = prepare_images({"big.jpg": jpeg}, dpi=100, max_width_in=6.0)
+
+    image = prepared["big.jpg"]
+    assert image.width_emu == 6 * 914400
+    with _open(image.data) as img:
+        assert img.format == "JPEG"
+        assert img.size == (600, 300)
+
+
+def test_prepare_images_keeps_small_images():
+    """测试不超过目标像素数的PNG/JPEG保留原始内容，按CSS像素计算显示宽度"""
+    png = _image_bytes("PNG", (192, 96))
+    prepared = prepare_images({"small.png": png}, dpi=150)
+
+    assert prepared["small.png"].data == png
+    assert prepared["small.png"].width_emu == 2 * 914400
+
+
+def test_prepare_images_keeps_transparency():
+    """测试缩小带透明通道的图片时编码为PNG"""
+    rgba = _image_bytes("PNG", (2000, 1000), mode="RGBA", color=(0, 0, 0, 0))
+    prepared = prepare_images({"alpha.png": rgba}, dpi=50)
+
+    with _open(prepared["alpha.png"].data) as img:
+        assert img.format == "PNG"
+        assert img.mode == "RGBA"
+        assert img.size == (300, 150)
+
+
+def test_prepare_images_converts_unsupported_formats():
+    """测试Word不支持的格式（WEBP）重新编码，无法识别的内容跳过"""
+    webp = _image_bytes("WEBP", (100, 50))
+    prepared = prepare_images({"a.webp": webp, "a.svg": b"<svg></svg>"})
+
+    assert _open(prepared["a.webp"].data).format == "JPEG"
+    assert "a.svg" not in prepared
+
+
+def test_prepare_images_byte_budget():
+    """测试按文档顺序放入预算，放不下的图片跳过、后面更小的图片仍可放入"""
+    small = _image_bytes("PNG", (10, 10))
+    large = _image_bytes("BMP", (500, 500))
+    other = _image_bytes("PNG", (10, 10), color="blue")
+    budget = len(small) + len(other) + 10
+
+    prepared = prepare_images(
+        {"small.png": small, "large.bmp": large, "other.png": other},
+        byte_budget=budget,
+    )
+
+    assert list(prepared) == ["small.png", "other.png"]
+
+
+def test_prepare_images_requires_pillow(monkeypatch):
+    """测试未安装Pillow时给出安装提示"""
+
+    def missing():
+        raise RuntimeError("DOCX图片嵌入需要安装Pillow: pip install Pillow")
+
+    monkeypatch.setattr(image_pipeline, "_import_pil", missing)
+    with pytest.raises(RuntimeError, match="Pillow"):
+        prepare_images({"a.png": b"data"})
+
+
+def _response(url, body, resource_type="image", ok=True, redirected_from=None):
+    request = MagicMock(
+        url=url, resource_type=resource_type, redirected_from=redirected_from
+    )
+    response = MagicMock(url=url, ok=ok, request=request)
+    response.body = AsyncMock(side_effect=[body] if isinstance(body, bytes) else body)
+    return response
+
+
+def test_image_capture_collects_in_document_order():
+    """测试按<img>顺序取得图片内容：重定向、data URI、相同地址只读取一次"""
+    page = MagicMock()
+    capture = ImageCapture().attach(page)
+    on_response = page.on.call_args[0][1]
+
+    original = MagicMock(url="https://a.com/old.png", redirected_from=None)
+    moved = _response("https://cdn.a.com/new.png", b"moved", redirected_from=original)
+    shared = _response("https://a.com/1.jpg", b"jpeg")
+    for response in (
+        moved,
+        shared,
+        _response("https://a.com/404.png", b"", ok=False),
+        _response("https://a.com/app.js", b"js", resource_type="script"),
+        _response("https://a.com/broken.png", [Exception("No resource")]),
+    ):
+        on_response(response)
+
+    inline = "data:image/png;base64," + base64.b64encode(b"inline").decode()
+    page.evaluate = AsyncMock(
+        return_value=[
+            ["1.jpg", "https://a.com/1.jpg", "https://a.com/1.jpg"],
+            ["/old.png", "https://a.com/old.png", "https://a.com/old.png"],
+            ["1.jpg", "https://a.com/1.jpg", "https://a.com/1.jpg"],
+            ["?v=1", "https://a.com/1.jpg", "https://a.com/?v=1"],
+            [inline, inline, inline],
+            ["404.png", "https://a.com/404.png", "https://a.com/404.png"],
+            ["broken.png", "https://a.com/broken.png", "https://a.com/broken.png"],
+            [None, "", None],
+        ]
+    )
+
+    images = asyncio.run(capture.collect(page))
+
+    assert images == {
+        "1.jpg": b"jpeg",
+        "/old.png": b"moved",
+        "?v=1": b"jpeg",
+        inline: b"inline",
+    }
+    assert shared.body.await_count == 1
@@ -0,0 +1,86 @@
+"""按队列启动worker测试模块"""
+
+import pytest
+from app.core.config import settings
+from app.workers import launch
+
+
+def _option(argv, name):
+    return argv[argv.index(name) + 1]
+
+
+def test_render_profile(monkeypatch):
+    """测试渲染worker只消费render队列，每次只取一个任务并限制子进程内存"""
+    monkeypatch.setattr(settings, "CELERY_RENDER_CONCURRENCY", 3)
+    argv = launch.worker_argv("render")
+
+    assert argv[0] == "worker"
+    assert _option(argv, "-Q") == "render"
+    assert _option(argv, "--concurrency") == "3"
+    assert _option(argv, "--prefetch-multiplier") == "1"
+    assert _option(argv, "--max-memory-per-child") == str(
+        settings.CELERY_RENDER_MAX_MEMORY_PER_CHILD
+    )
+
+
+def test_deliver_profile_skips_disabled_limits(monkeypatch):
+    """测试投递worker的参数取自CELERY_DELIVER_*，为0的限制不传给celery"""
+    monkeypatch.setattr(settings, "CELERY_DELIVER_MAX_MEMORY_PER_CHILD", 0)
+    monkeypatch.setattr(settings, "CELERY_DELIVER_MAX_TASKS_PER_CHILD", 0)
+    argv = launch.worker_argv("deliver")
+
+    assert _option(argv, "-Q") == "deliver"
+    assert _option(argv, "-n") == "deliver@%h"
+    assert _option(argv, "--prefetch-multiplier") == str(
+        settings.CELERY_DELIVER_PREFETCH_MULTIPLIER
+    )
+    assert "--max-memory-per-child" not in argv
+    assert "--max-tasks-per-child" not in argv
+
+
+def test_all_profile_consumes_every_queue():
+    """测试all同时消费渲染、投递和默认队列"""
+    assert _option(launch.worker_argv("all"), "-Q") == "render,deliver,celery"
+
+
+def test_unknown_profile():
+    with pytest.raises(ValueError, match="未知的worker类型"):
+        launch.worker_argv("gpu")
+
+
+def test_main_passes_extra_arguments(monkeypatch):
+    """测试命令行中额外的参数原样传给celery"""
+    started = []
+    monkeypatch.setattr(
+        "app.celery_app.celery_app.worker_main", lambda argv: started.append(argv)
+    )
+
+    launch.main(["deliver", "--loglevel=debug"])
+
+    assert started[0][:3] == ["worker", "-Q", "deliver"]
+    assert started[0][-1] == "--loglevel=debug"
+
+
+def test_main_patches_concurrency_before_start(monkeypatch):
+    """测试-P gevent在启动worker之前完成monkey patch"""
+    calls = []
+    monkeypatch.setattr(
+        "celery.maybe_patch_concurrency", lambda argv: calls.append(("patch", argv))
+    )
+    monkeypatch.setattr(
+        "app.celery_app.celery_app.worker_main",
+        lambda argv: calls.append(("start", argv)),
+    )
+
+    launch.main(["all", "-P", "gevent", "--loglevel=info"])
+
+    assert calls[0] == ("patch", ["celery", "-P", "gevent", "--loglevel=info"])
+    assert calls[1][0] == "start"
+    assert calls[1][1][-3:] == ["-P", "gevent", "--loglevel=info"]
+
+
+def test_main_print(capsys):
+    launch.main(["render", "--print"])
+    assert capsys.readouterr().out.startswith(
+        "celery -A app.celery_app.celery_app worker -Q render"
+    )
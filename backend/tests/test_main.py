@@ -1,4 +1,8 @@
+import asyncio
+import json
+import time
 from unittest.mock import MagicMock
+from urllib.parse import parse_qs, urlsplit
 
 import pytest
 
@@ -45,3 +49,515 @@ def test_process_url_endpoint_invalid_payload(client, email_test_cases):
     data_invalid_email = {"url": "https://example.com", "email": "not-an-email"}
     response = client.post("/api/v1/process-url", json=data_invalid_email)
     assert response.status_code == 422
+
+
+def test_process_url_reuses_cached_render(client, monkeypatch, valid_urls, tmp_path):
+    """测试 /api/v1/process-url 端点 - 命中渲染缓存时只发送邮件"""
+    cached_pdf = tmp_path / "cached.pdf"
+    cached_pdf.write_bytes(b"%PDF-1.4")
+    render_cache = MagicMock()
+    render_cache.get.return_value = {
+        "artifacts": {"pdf": {"path": str(cached_pdf), "content_hash": "x"}}
+    }
+    monkeypatch.setattr("main.get_render_cache", lambda: render_cache)
+    mock_chain = MagicMock()
+    monkeypatch.setattr("main.chain", mock_chain)
+    mock_send = MagicMock()
+    mock_send.delay.return_value.id = "mock-email-task"
+    monkeypatch.setattr("main.send_email_task", mock_send)
+
+    data = {"url": valid_urls["complex"], "email": "reader@example.com"}
+    response = client.post("/api/v1/process-url", json=data)
+
+    assert response.status_code == 200
+    resp_json = response.json()
+    assert resp_json["deduplicated"] is True
+    assert resp_json["pdf_file"] == "cached.pdf"
+    assert resp_json["task_id"] == "mock-email-task"
+    assert mock_send.delay.call_args[0][:2] == (str(cached_pdf), "reader@example.com")
+    mock_chain.assert_not_called()
+
+
+def test_process_url_joins_inflight_render(client, monkeypatch, valid_urls):
+    """测试 /api/v1/process-url 端点 - 同一URL正在渲染时登记为等待者"""
+    render_cache = MagicMock()
+    render_cache.get.return_value = None
+    render_cache.current_owner.return_value = {
+        "files": ["leader.pdf"],
+        "task_id": "leader-task",
+    }
+    render_cache.join.return_value = True
+    monkeypatch.setattr("main.get_render_cache", lambda: render_cache)
+    mock_chain = MagicMock()
+    monkeypatch.setattr("main.chain", mock_chain)
+
+    data = {"url": valid_urls["complex"], "email": "reader@example.com"}
+    response = client.post("/api/v1/process-url", json=data)
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "status": "success",
+        "task_id": "leader-task",
+        "pdf_file": "leader.pdf",
+        "deduplicated": True,
+    }
+    waiter = render_cache.join.call_args[0][1]
+    assert waiter["to_email"] == "reader@example.com"
+    assert "leader.pdf" in waiter["body"]
+    assert render_cache.join.call_args[0][2] == ["pdf"]
+    mock_chain.assert_not_called()
+
+
+def test_process_url_multiple_formats_deduplicated(
+    client, monkeypatch, valid_urls, tmp_path
+):
+    """测试 /api/v1/process-url 端点 - 多格式请求按URL和格式集合去重"""
+    paths = {}
+    for fmt in ("docx", "txt"):
+        paths[fmt] = str(tmp_path / f"cached.{fmt}")
+        with open(paths[fmt], "w") as f:
+            f.write(fmt)
+    render_cache = MagicMock()
+    render_cache.get.return_value = {
+        "artifacts": {fmt: {"path": p, "content_hash": "x"} for fmt, p in paths.items()}
+    }
+    monkeypatch.setattr("main.get_render_cache", lambda: render_cache)
+    mock_chain = MagicMock()
+    monkeypatch.setattr("main.chain", mock_chain)
+    mock_send = MagicMock()
+    mock_send.delay.return_value.id = "mock-email-task"
+    monkeypatch.setattr("main.send_email_task", mock_send)
+
+    data = {
+        "url": valid_urls["complex"],
+        "email": "reader@example.com",
+        "formats": ["txt", "docx", "txt"],
+    }
+    response = client.post("/api/v1/process-url", json=data)
+
+    assert response.status_code == 200
+    assert response.json()["files"] == ["cached.docx", "cached.txt"]
+    assert response.json()["deduplicated"] is True
+    assert render_cache.get.call_args[0][1] == ["docx", "txt"]
+    assert mock_send.delay.call_args[0][0] == paths
+    mock_chain.assert_not_called()
+
+
+def test_process_url_multiple_formats_takes_render_lock(
+    client, monkeypatch, valid_urls
+):
+    """测试 /api/v1/process-url 端点 - 多格式请求的渲染者把渲染锁交给导出任务"""
+    render_cache = MagicMock()
+    render_cache.get.return_value = None
+    render_cache.current_owner.return_value = None
+    render_cache.begin.return_value = "owner-token"
+    monkeypatch.setattr("main.get_render_cache", lambda: render_cache)
+    mock_chain = MagicMock()
+    mock_chain.return_value.apply_async.return_value.id = "mock-export"
+    monkeypatch.setattr("main.chain", mock_chain)
+    mock_export = MagicMock()
+    monkeypatch.setattr("main.export_task", mock_export)
+
+    data = {
+        "url": valid_urls["simple"],
+        "email": "reader@example.com",
+        "formats": ["pdf", "txt"],
+    }
+    response = client.post("/api/v1/process-url", json=data)
+
+    assert response.status_code == 200
+    owner, formats = render_cache.begin.call_args[0][1:]
+    assert formats == ["pdf", "txt"]
+    assert owner["files"] == response.json()["files"]
+    kwargs = mock_export.s.call_args[1]
+    assert kwargs["cache_url"] == mock_export.s.call_args[0][0]
+    assert kwargs["cache_token"] == "owner-token"
+    assert render_cache.update_owner.call_args[0][3] == ["pdf", "txt"]
+
+
+def test_process_url_multiple_formats(client, monkeypatch, valid_urls):
+    """测试 /api/v1/process-url 端点 - 多格式导出走单次加载的导出任务"""
+    mock_chain = MagicMock()
+    mock_chain.return_value.apply_async.return_value.id = "mock-export"
+    monkeypatch.setattr("main.chain", mock_chain)
+    mock_export = MagicMock()
+    monkeypatch.setattr("main.export_task", mock_export)
+
+    data = {
+        "url": valid_urls["simple"],
+        "email": "reader@example.com",
+        "formats": ["txt", "pdf", "docx"],
+    }
+    response = client.post("/api/v1/process-url", json=data)
+
+    assert response.status_code == 200
+    resp_json = response.json()
+    assert resp_json["task_id"] == "mock-export"
+    assert [f.rsplit(".", 1)[1] for f in resp_json["files"]] == ["docx", "pdf", "txt"]
+    assert mock_export.s.call_args[0][1] == ["docx", "pdf", "txt"]
+
+    data["formats"] = ["png"]
+    assert client.post("/api/v1/process-url", json=data).status_code == 422
+    data["formats"] = []
+    assert client.post("/api/v1/process-url", json=data).status_code == 422
+
+
+def test_process_url_rejected_when_scheduler_full(client, monkeypatch, valid_urls):
+    """测试 /api/v1/process-url 端点 - 公平调度拒绝时返回429并释放渲染锁"""
+    from app.services.fair_scheduler import Admission
+
+    render_cache = MagicMock()
+    render_cache.get.return_value = None
+    render_cache.current_owner.return_value = None
+    render_cache.begin.return_value = "owner-token"
+    monkeypatch.setattr("main.get_render_cache", lambda: render_cache)
+    scheduler = MagicMock()
+    scheduler.submit.return_value = Admission(False, retry_after=42)
+    monkeypatch.setattr("main.get_fair_scheduler", lambda: scheduler)
+    monkeypatch.setattr("main.chain", MagicMock())
+
+    data = {"url": valid_urls["simple"], "email": "bulk@example.com"}
+    response = client.post(
+        "/api/v1/process-url", json=data, headers={"X-API-Key": "import-key"}
+    )
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "42"
+    tenant = scheduler.submit.call_args[0][1]
+    assert tenant.startswith("key:")
+    assert render_cache.finish.call_args[0][1:] == (None, "owner-token", ["pdf"])
+
+
+def test_process_url_scheduled(client, monkeypatch, valid_urls):
+    """测试 /api/v1/process-url 端点 - 启用公平调度时单个请求进入interactive通道"""
+    from app.services.fair_scheduler import Admission
+
+    in_loop = []
+
+    def submit(*args):
+        # 提交应在线程池中执行，不占用事件循环
+        try:
+            asyncio.get_running_loop()
+            in_loop.append(True)
+        except RuntimeError:
+            in_loop.append(False)
+        return Admission(True, "scheduled-task", "interactive")
+
+    scheduler = MagicMock()
+    scheduler.submit.side_effect = submit
+    monkeypatch.setattr("main.get_fair_scheduler", lambda: scheduler)
+    mock_chain = MagicMock()
+    monkeypatch.setattr("main.chain", mock_chain)
+
+    data = {"url": valid_urls["simple"], "email": "Reader@example.com"}
+    response = client.post("/api/v1/process-url", json=data)
+
+    assert response.status_code == 200
+    assert response.json()["task_id"] == "scheduled-task"
+    signature, tenant, lane, weight = scheduler.submit.call_args[0]
+    assert signature is mock_chain.return_value
+    assert (tenant, lane, weight) == ("email:reader@example.com", "interactive", 1)
+    assert in_loop == [False]
+    mock_chain.return_value.apply_async.assert_not_called()
+
+
+def test_process_urls_batches_into_chord(client, monkeypatch):
+    """测试 /api/v1/process-urls 端点 - 校验、去重并分组提交为一个chord"""
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "BATCH_CHUNK_SIZE", 2)
+    mock_chord = MagicMock()
+    mock_chord.return_value.apply_async.return_value.id = "digest-task"
+    monkeypatch.setattr("main.chord", mock_chord)
+    mock_render = MagicMock()
+    monkeypatch.setattr("main.create_pdfs_task", mock_render)
+    mock_digest = MagicMock()
+    monkeypatch.setattr("main.send_digest_task", mock_digest)
+
+    data = {
+        "urls": [
+            "https://example.com/a",
+            "https://example.com/a?utm_source=wx",
+            "not-a-url",
+            "https://example.com/b",
+            "https://example.com/c",
+        ],
+        "email": "reader@example.com",
+        "delivery": "zip",
+    }
+    response = client.post("/api/v1/process-urls", json=data)
+
+    assert response.status_code == 200
+    resp_json = response.json()
+    assert resp_json["task_id"] == "digest-task"
+    assert len(resp_json["pdf_files"]) == 3
+    assert resp_json["duplicates"] == 1
+    assert [r["url"] for r in resp_json["rejected"]] == ["not-a-url"]
+    # 3个链接每组2个，共两个批量渲染任务，以较低优先级进入渲染队列
+    chunks = [c.args[0] for c in mock_render.s.call_args_list]
+    assert chunks == [
+        ["https://example.com/a", "https://example.com/b"],
+        ["https://example.com/c"],
+    ]
+    mock_render.s.return_value.set.assert_called_with(
+        priority=settings.BATCH_RENDER_PRIORITY
+    )
+    assert mock_digest.s.call_args[0] == ("reader@example.com", "网页转PDF", "zip")
+    mock_chord.return_value.apply_async.assert_called_once()
+
+
+def test_process_urls_rejects_invalid_batch(client, monkeypatch):
+    """测试 /api/v1/process-urls 端点 - 没有有效链接或超过数量上限时返回422"""
+    from app.core.config import settings
+
+    mock_chord = MagicMock()
+    monkeypatch.setattr("main.chord", mock_chord)
+
+    data = {"urls": ["not-a-url", "ftp:/x"], "email": "reader@example.com"}
+    response = client.post("/api/v1/process-urls", json=data)
+    assert response.status_code == 422
+    assert len(response.json()["detail"]["rejected"]) == 2
+
+    monkeypatch.setattr(settings, "BATCH_MAX_URLS", 2)
+    data["urls"] = ["https://example.com/a"] * 3
+    assert client.post("/api/v1/process-urls", json=data).status_code == 422
+    data["urls"] = []
+    assert client.post("/api/v1/process-urls", json=data).status_code == 422
+    mock_chord.assert_not_called()
+
+
+def test_process_urls_admission_per_tenant(client, monkeypatch):
+    """测试 /api/v1/process-urls 端点 - 启用公平调度时按租户限制未完成的链接数"""
+    from app.services.fair_scheduler import Admission
+
+    scheduler = MagicMock()
+    scheduler.admit_urls.return_value = Admission(False, retry_after=90)
+    monkeypatch.setattr("main.get_fair_scheduler", lambda: scheduler)
+    mock_chord = MagicMock()
+    monkeypatch.setattr("main.chord", mock_chord)
+    mock_render = MagicMock()
+    monkeypatch.setattr("main.create_pdfs_task", mock_render)
+
+    data = {
+        "urls": ["https://example.com/a", "https://example.com/b"],
+        "email": "bulk@example.com",
+    }
+    response = client.post(
+        "/api/v1/process-urls", json=data, headers={"X-API-Key": "import-key"}
+    )
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "90"
+    tenant, count = scheduler.admit_urls.call_args[0]
+    assert tenant.startswith("key:") and count == 2
+    mock_chord.assert_not_called()
+
+    # 接受时批量渲染任务带上租户，结束时释放计数
+    scheduler.admit_urls.return_value = Admission(True)
+    response = client.post(
+        "/api/v1/process-urls", json=data, headers={"X-API-Key": "import-key"}
+    )
+    assert response.status_code == 200
+    assert mock_render.s.call_args.kwargs["tenant"] == tenant
+
+
+class _FakeHub:
+    """预置当前进度和后续事件的进度分发器"""
+
+    def __init__(self, latest=None, events=()):
+        self._latest = latest
+        self._events = list(events)
+        self.unsubscribed = False
+
+    def subscribe(self, task_id):
+        import asyncio
+
+        queue = asyncio.Queue()
+        for event in self._events:
+            queue.put_nowait(event)
+        return queue
+
+    def unsubscribe(self, task_id, queue):
+        self.unsubscribed = True
+
+    async def wait_ready(self, timeout):
+        return True
+
+    async def latest(self, task_id):
+        return self._latest
+
+    async def close(self):
+        pass
+
+
+def test_task_status(client, monkeypatch):
+    """测试 /api/v1/tasks/{id} 端点 - 返回Celery状态和最新进度，未知任务返回404"""
+    hub = _FakeHub(latest={"task_id": "t1", "stage": "printing"})
+    monkeypatch.setattr("main.get_progress_hub", lambda: hub)
+    monkeypatch.setattr(
+        "main.AsyncResult", lambda task_id, app: MagicMock(state="PENDING")
+    )
+
+    response = client.get("/api/v1/tasks/t1")
+    assert response.status_code == 200
+    assert response.json()["stage"] == "printing"
+    assert response.json()["state"] == "PENDING"
+
+    hub._latest = None
+    assert client.get("/api/v1/tasks/unknown").status_code == 404
+
+
+def test_task_events_stream_until_done(client, monkeypatch):
+    """测试 /api/v1/tasks/{id}/events 端点 - 先推送当前进度，任务结束后关闭连接"""
+    hub = _FakeHub(
+        latest={"task_id": "t1", "stage": "queued"},
+        events=[
+            {"task_id": "t1", "stage": "navigating"},
+            {"task_id": "t1", "stage": "emailing"},
+            {"task_id": "t1", "stage": "done"},
+            {"task_id": "t1", "stage": "ignored"},
+        ],
+    )
+    monkeypatch.setattr("main.get_progress_hub", lambda: hub)
+
+    response = client.get("/api/v1/tasks/t1/events")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    stages = [
+        json.loads(line[len("data: ") :])["stage"]
+        for line in response.text.splitlines()
+        if line.startswith("data: ")
+    ]
+    assert stages == ["queued", "navigating", "emailing", "done"]
+    assert hub.unsubscribed
+
+
+def test_task_events_recovers_missed_terminal_event(client, monkeypatch):
+    """测试 /api/v1/tasks/{id}/events 端点 - 错过的结束事件在空闲时从最新进度补上"""
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "PROGRESS_SSE_KEEPALIVE", 0.01)
+    hub = _FakeHub(latest={"task_id": "t1", "stage": "printing", "ts": 1.0})
+    monkeypatch.setattr("main.get_progress_hub", lambda: hub)
+    calls = []
+
+    async def latest(task_id):
+        calls.append(task_id)
+        # 第二次读取时任务已结束，但订阅没有收到done事件
+        if len(calls) == 1:
+            return {"task_id": "t1", "stage": "printing", "ts": 1.0}
+        return {"task_id": "t1", "stage": "done", "ts": 2.0}
+
+    hub.latest = latest
+
+    response = client.get("/api/v1/tasks/t1/events")
+
+    stages = [
+        json.loads(line[len("data: ") :])["stage"]
+        for line in response.text.splitlines()
+        if line.startswith("data: ")
+    ]
+    assert stages == ["printing", "done"]
+
+
+def test_process_url_reports_queued_under_returned_id(client, monkeypatch, valid_urls):
+    """测试 /api/v1/process-url 端点 - 渲染任务以返回的任务ID报告进度"""
+    mock_chain = MagicMock()
+    monkeypatch.setattr("main.chain", mock_chain)
+    mock_render = MagicMock()
+    monkeypatch.setattr("main.create_pdf_task", mock_render)
+    mock_send = MagicMock()
+    monkeypatch.setattr("main.send_email_task", mock_send)
+    reported = []
+    monkeypatch.setattr("main.report", lambda *args, **kw: reported.append(args))
+
+    data = {"url": valid_urls["simple"], "email": "reader@example.com"}
+    client.post("/api/v1/process-url", json=data)
+
+    task_id = mock_send.s.return_value.set.call_args.kwargs["task_id"]
+    assert mock_render.s.call_args.kwargs["progress_id"] == task_id
+    assert reported[0][1] == "queued"
+
+
+def _download_path(url):
+    parts = urlsplit(url)
+    return f"{parts.path}?{parts.query}"
+
+
+def test_download_artifact(client, download_dir):
+    """测试 /api/v1/download 端点 - 完整下载、Range请求和If-None-Match"""
+    from app.services import download_links
+
+    (download_dir / "report.pdf").write_bytes(b"0123456789")
+    url = _download_path(download_links.download_url(str(download_dir / "report.pdf")))
+
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.content == b"0123456789"
+    etag = response.headers["etag"]
+    assert etag == f'"{parse_qs(urlsplit(url).query)["sha"][0]}"'
+    assert "report.pdf" in response.headers["content-disposition"]
+
+    response = client.get(url, headers={"Range": "bytes=2-5"})
+    assert response.status_code == 206
+    assert response.content == b"2345"
+    assert response.headers["content-range"] == "bytes 2-5/10"
+
+    response = client.get(url, headers={"If-None-Match": f'W/"x", {etag}'})
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_download_artifact_rejects_bad_links(client, download_dir, monkeypatch):
+    """测试 /api/v1/download 端点 - 签名错误403、过期410、文件已清理404"""
+    from app.core.config import settings
+    from app.services import download_links
+
+    path = download_dir / "report.pdf"
+    path.write_bytes(b"data")
+    url = _download_path(download_links.download_url(str(path)))
+
+    assert client.get(url.replace("sig=", "sig=0")).status_code == 403
+    expired = download_links.download_url(str(path), ttl=1, now=time.time() - 10)
+    assert client.get(_download_path(expired)).status_code == 410
+    path.unlink()
+    assert client.get(url).status_code == 404
+    monkeypatch.setattr(settings, "DOWNLOAD_SECRET", "")
+    assert client.get(url).status_code == 404
+
+
+def test_download_artifact_rejects_overwritten_file(client, download_dir):
+    """测试 /api/v1/download 端点 - 文件被覆盖后旧链接返回410，新链接正常下载"""
+    from app.services import download_links
+
+    path = download_dir / "report.pdf"
+    path.write_bytes(b"old")
+    old_url = _download_path(download_links.download_url(str(path)))
+    assert client.get(old_url).content == b"old"
+
+    path.write_bytes(b"new content")
+    assert client.get(old_url).status_code == 410
+    new_url = _download_path(download_links.download_url(str(path)))
+    response = client.get(new_url)
+    assert response.status_code == 200
+    assert response.content == b"new content"
+
+
+def test_download_artifact_accel_redirect(client, download_dir, monkeypatch):
+    """测试 /api/v1/download 端点 - 配置X-Accel-Redirect时只返回头，由nginx发送文件"""
+    from app.core.config import settings
+    from app.services import download_links
+
+    monkeypatch.setattr(settings, "DOWNLOAD_ACCEL_REDIRECT", "/protected/")
+    (download_dir / "报告.pdf").write_bytes(b"data")
+    url = _download_path(download_links.download_url(str(download_dir / "报告.pdf")))
+
+    response = client.get(url)
+
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["x-accel-redirect"] == "/protected/%E6%8A%A5%E5%91%8A.pdf"
+    assert "filename*=utf-8''%E6%8A%A5%E5%91%8A.pdf" in (
+        response.headers["content-disposition"]
+    )
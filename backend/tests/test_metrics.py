@@ -0,0 +1,132 @@
+"""Prometheus指标测试模块"""
+
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+from app.core import metrics
+from app.core.config import settings
+from app.core.metrics import QueueDepthCollector, build_registry, stage
+from prometheus_client import CollectorRegistry, generate_latest
+
+
+def _sample(name, **labels):
+    return metrics.REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_stage_records_duration_and_errors():
+    """测试阶段耗时计入直方图，抛出异常时同时计入错误次数"""
+    count = _sample("wedocx_stage_duration_seconds_count", stage="unit_stage")
+    errors = _sample("wedocx_stage_errors_total", stage="unit_stage")
+
+    with stage("unit_stage"):
+        pass
+    with pytest.raises(ValueError):
+        with stage("unit_stage"):
+            raise ValueError("boom")
+
+    assert _sample("wedocx_stage_duration_seconds_count", stage="unit_stage") == (
+        count + 2
+    )
+    assert _sample("wedocx_stage_errors_total", stage="unit_stage") == errors + 1
+
+
+def test_stage_async_context():
+    """测试stage可用于async with"""
+    count = _sample("wedocx_stage_duration_seconds_count", stage="unit_async")
+
+    async def run():
+        async with stage("unit_async"):
+            await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert (
+        _sample("wedocx_stage_duration_seconds_count", stage="unit_async") == count + 1
+    )
+
+
+def test_stage_disabled(monkeypatch):
+    """测试关闭指标时不记录"""
+    monkeypatch.setattr(settings, "METRICS_ENABLED", False)
+    with stage("unit_disabled"):
+        pass
+    metrics.observe_stage("unit_disabled", 1.0)
+
+    assert _sample("wedocx_stage_duration_seconds_count", stage="unit_disabled") == 0
+
+
+def test_observe_task():
+    """测试任务按名称和结束状态计数"""
+    before = _sample("wedocx_tasks_total", task="unit.task", state="SUCCESS")
+    metrics.observe_task("unit.task", "SUCCESS", 0.5)
+    metrics.observe_task("unit.task", "FAILURE", None)
+
+    assert _sample("wedocx_tasks_total", task="unit.task", state="SUCCESS") == (
+        before + 1
+    )
+    assert _sample("wedocx_tasks_total", task="unit.task", state="FAILURE") >= 1
+    assert _sample("wedocx_task_duration_seconds_count", task="unit.task") >= 1
+
+
+def test_queue_depth_collector():
+    """测试抓取时按队列读取Redis列表长度（含优先级子列表），Redis不可用时不报告"""
+    client = MagicMock()
+    # 每个队列依次为优先级档位0、3、6、9的列表长度，批量渲染的消息在档位9
+    client.pipeline.return_value.execute.return_value = [3, 0, 0, 0, 1, 0, 0, 40]
+    registry = CollectorRegistry()
+    registry.register(QueueDepthCollector(["celery", "render"], client=client))
+
+    assert registry.get_sample_value("wedocx_queue_depth", {"queue": "celery"}) == 3
+    assert registry.get_sample_value("wedocx_queue_depth", {"queue": "render"}) == 41
+    names = [c.args[0] for c in client.pipeline.return_value.llen.call_args_list]
+    assert names[-4:] == [
+        "render",
+        "render\x06\x163",
+        "render\x06\x166",
+        "render\x06\x169",
+    ]
+
+    client.pipeline.return_value.execute.side_effect = ConnectionError("down")
+    assert registry.get_sample_value("wedocx_queue_depth", {"queue": "celery"}) is None
+
+
+def test_build_registry_includes_process_metrics(monkeypatch):
+    """测试单进程模式下导出本进程已注册的指标"""
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+    with stage("unit_export"):
+        pass
+
+    output = generate_latest(build_registry()).decode()
+    assert 'wedocx_stage_duration_seconds_count{stage="unit_export"}' in output
+
+
+def test_start_worker_exporter(monkeypatch):
+    """测试worker导出端口为0或指标关闭时不启动，端口占用时不影响worker"""
+    server = MagicMock()
+    monkeypatch.setattr(metrics, "start_http_server", server)
+
+    assert metrics.start_worker_exporter(0) is False
+    assert metrics.start_worker_exporter(9999) is True
+    assert server.call_args[0][0] == 9999
+
+    server.side_effect = OSError("Address already in use")
+    assert metrics.start_worker_exporter(9999) is False
+
+    monkeypatch.setattr(settings, "METRICS_ENABLED", False)
+    assert metrics.start_worker_exporter(9999) is False
+
+
+def test_metrics_endpoint(client, monkeypatch):
+    """测试 /metrics 端点返回Prometheus文本格式"""
+    monkeypatch.setattr(metrics, "_api_registry", build_registry(), raising=False)
+    with stage("unit_endpoint"):
+        pass
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'stage="unit_endpoint"' in response.text
+
+    monkeypatch.setattr(settings, "METRICS_ENABLED", False)
+    assert client.get("/metrics").status_code == 404
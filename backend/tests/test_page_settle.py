@@ -0,0 +1,104 @@
+"""
+页面稳定检测测试模块
+"""
+
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock
+
+from app.services.page_settle import NetworkTracker, wait_for_page_settled
+
+
+class FakePage:
+    """模拟Page的事件注册和evaluate"""
+
+    def __init__(self, evaluate_result=None):
+        self.handlers = {}
+        self.evaluate = AsyncMock(return_value=evaluate_result or {})
+
+    def on(self, event, handler):
+        self.handlers.setdefault(event, []).append(handler)
+
+    def emit(self, event, payload):
+        for handler in self.handlers.get(event, []):
+            handler(payload)
+
+
+def test_network_tracker_idle_immediately_without_requests():
+    """测试没有请求时在空闲窗口后立即返回"""
+
+    async def run():
+        tracker = NetworkTracker(FakePage())
+        start = time.monotonic()
+        idle = await tracker.wait_for_idle(idle_ms=50, timeout_ms=1000)
+        return idle, time.monotonic() - start
+
+    idle, elapsed = asyncio.run(run())
+    assert idle is True
+    assert elapsed < 0.5
+
+
+def test_network_tracker_waits_for_inflight_requests():
+    """测试有进行中的请求时等待其完成"""
+
+    async def run():
+        page = FakePage()
+        tracker = NetworkTracker(page)
+        request = MagicMock()
+        page.emit("request", request)
+        assert tracker.inflight == 1
+
+        async def finish_later():
+            await asyncio.sleep(0.1)
+            page.emit("requestfinished", request)
+
+        asyncio.ensure_future(finish_later())
+        start = time.monotonic()
+        idle = await tracker.wait_for_idle(idle_ms=20, timeout_ms=1000)
+        return idle, time.monotonic() - start
+
+    idle, elapsed = asyncio.run(run())
+    assert idle is True
+    assert 0.1 <= elapsed < 0.5
+
+
+def test_network_tracker_times_out_on_hanging_request():
+    """测试请求一直不结束时在上限处超时"""
+
+    async def run():
+        page = FakePage()
+        tracker = NetworkTracker(page)
+        page.emit("request", MagicMock())
+        return await tracker.wait_for_idle(idle_ms=20, timeout_ms=100)
+
+    assert asyncio.run(run()) is False
+
+
+def test_wait_for_page_settled_collects_metrics():
+    """测试稳定检测汇总页面内和网络空闲的耗时"""
+    page = FakePage(
+        {
+            "scroll_ms": 120.0,
+            "image_ms": 30.0,
+            "dom_ms": 5.0,
+            "images_total": 12,
+            "images_pending": 1,
+            "lazy_promoted": 3,
+            "timed_out": ["images"],
+        }
+    )
+
+    async def run():
+        tracker = NetworkTracker(page)
+        return await wait_for_page_settled(
+            page, tracker, network_idle_ms=0, image_timeout_ms=1500
+        )
+
+    metrics = asyncio.run(run())
+    assert metrics.scroll_ms == 120.0
+    assert metrics.images_total == 12
+    assert metrics.lazy_promoted == 3
+    assert metrics.timed_out == ["images"]
+    assert metrics.total_ms >= metrics.network_ms
+    options = page.evaluate.call_args[0][1]
+    assert options["imageTimeout"] == 1500
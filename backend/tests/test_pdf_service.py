@@ -2,10 +2,18 @@
 PDF服务测试模块
 """
 
+import asyncio
 import os
+from contextlib import asynccontextmanager
+from io import BytesIO
+from unittest.mock import AsyncMock, MagicMock
 
 import pytest
+from app.services import pdf_service
+from app.services.artifact_store import MemoryArtifactStore
 from app.services.pdf_service import url_to_pdf_sync, url_to_txt_sync, url_to_word_sync
+from docx import Document
+from PIL import Image
 
 
 def clean_file(file_path: str, keep_files: bool = False):
@@ -95,3 +103,200 @@ def test_complex_webpage_conversion(valid_urls, temp_output_dir, keep_files):
     assert os.path.exists(txt_path)
     assert os.path.getsize(txt_path) > 0
     clean_file(txt_path, keep_files)
+
+
+class _FakePool:
+    """模拟浏览器池，记录同时打开的页面数"""
+
+    def __init__(self, fail_urls=()):
+        self.fail_urls = set(fail_urls)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.pages_opened = 0
+
+    def _make_page(self):
+        page = MagicMock()
+        response = MagicMock(ok=True, status=200)
+
+        async def goto(url, **kwargs):
+            if url in self.fail_urls:
+                raise TimeoutError("navigation timeout")
+            return response
+
+        async def pdf(path=None, **kwargs):
+            await asyncio.sleep(0.05)
+            if path is None:
+                return b"%PDF-1.4"
+            with open(path, "wb") as f:
+                f.write(b"%PDF-1.4")
+
+        page.goto = goto
+        page.pdf = pdf
+        page.title = AsyncMock(return_value="")
+        page.content = AsyncMock(return_value="<html><body><p>正文</p></body></html>")
+        page.inner_text = AsyncMock(return_value="正文")
+        page.evaluate = AsyncMock(return_value={})
+        page.route = AsyncMock()
+        return page
+
+    @asynccontextmanager
+    async def new_page(self, **kwargs):
+        self.pages_opened += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            yield self._make_page()
+        finally:
+            self.in_flight -= 1
+
+
+def test_url_to_pdf_many_bounded_concurrency(monkeypatch, temp_output_dir):
+    """测试批量渲染并发执行且不超过进程内并发上限"""
+    pool = _FakePool()
+    monkeypatch.setattr(pdf_service, "get_browser_pool", AsyncMock(return_value=pool))
+    monkeypatch.setattr(pdf_service.settings, "RENDER_MAX_IN_FLIGHT", 3)
+    monkeypatch.setattr(pdf_service.settings, "ASSET_CACHE_ENABLED", False)
+    monkeypatch.setattr(pdf_service.settings, "SETTLE_NETWORK_IDLE_MS", 0)
+
+    urls = [f"https://example.com/{i}" for i in range(10)]
+    filenames = [str(temp_output_dir / f"{i}.pdf") for i in range(10)]
+    paths = asyncio.run(pdf_service.url_to_pdf_many(urls, filenames))
+
+    assert paths == filenames
+    assert all(os.path.exists(p) for p in paths)
+    assert pool.max_in_flight == 3
+
+
+def test_url_to_pdf_many_return_exceptions(monkeypatch, temp_output_dir):
+    """测试批量渲染中单个URL失败不影响其他URL"""
+    pool = _FakePool(fail_urls={"https://example.com/bad"})
+    monkeypatch.setattr(pdf_service, "get_browser_pool", AsyncMock(return_value=pool))
+    monkeypatch.setattr(pdf_service.settings, "ASSET_CACHE_ENABLED", False)
+    monkeypatch.setattr(pdf_service.settings, "SETTLE_NETWORK_IDLE_MS", 0)
+
+    urls = ["https://example.com/ok", "https://example.com/bad"]
+    filenames = [str(temp_output_dir / "ok.pdf"), str(temp_output_dir / "bad.pdf")]
+    results = asyncio.run(
+        pdf_service.url_to_pdf_many(urls, filenames, return_exceptions=True)
+    )
+
+    assert results[0] == filenames[0]
+    assert isinstance(results[1], RuntimeError)
+    with pytest.raises(RuntimeError):
+        asyncio.run(pdf_service.url_to_pdf_many(urls, filenames))
+
+
+def test_url_to_pdf_into_artifact_store(monkeypatch, temp_output_dir):
+    """测试指定产物存储时PDF以字节写入存储，不落本地文件"""
+    pool = _FakePool()
+    monkeypatch.setattr(pdf_service, "get_browser_pool", AsyncMock(return_value=pool))
+    monkeypatch.setattr(pdf_service.settings, "ASSET_CACHE_ENABLED", False)
+    monkeypatch.setattr(pdf_service.settings, "SETTLE_NETWORK_IDLE_MS", 0)
+    store = MemoryArtifactStore()
+
+    uri = asyncio.run(
+        pdf_service.url_to_pdf("https://example.com/a", "a.pdf", store=store)
+    )
+
+    assert uri == "mem://a.pdf"
+    assert store.open(uri).read() == b"%PDF-1.4"
+    assert not os.path.exists(os.path.join(pdf_service.OUTPUT_DIR, "a.pdf"))
+
+
+def test_url_to_pdf_many_into_artifact_store(monkeypatch, temp_output_dir):
+    """测试批量渲染指定产物存储时每个PDF都写入存储"""
+    pool = _FakePool()
+    monkeypatch.setattr(pdf_service, "get_browser_pool", AsyncMock(return_value=pool))
+    monkeypatch.setattr(pdf_service.settings, "ASSET_CACHE_ENABLED", False)
+    monkeypatch.setattr(pdf_service.settings, "SETTLE_NETWORK_IDLE_MS", 0)
+    store = MemoryArtifactStore()
+
+    uris = asyncio.run(
+        pdf_service.url_to_pdf_many(
+            ["https://example.com/a", "https://example.com/b"],
+            ["a.pdf", "b.pdf"],
+            store=store,
+        )
+    )
+
+    assert uris == ["mem://a.pdf", "mem://b.pdf"]
+    assert all(store.open(uri).read() == b"%PDF-1.4" for uri in uris)
+
+
+def test_export_url_single_page_load(monkeypatch, temp_output_dir):
+    """测试多格式导出只加载一次页面，生成全部格式"""
+    pool = _FakePool()
+    monkeypatch.setattr(pdf_service, "get_browser_pool", AsyncMock(return_value=pool))
+    monkeypatch.setattr(pdf_service.settings, "ASSET_CACHE_ENABLED", False)
+    monkeypatch.setattr(pdf_service.settings, "SETTLE_NETWORK_IDLE_MS", 0)
+
+    filename = str(temp_output_dir / "article.pdf")
+    paths = asyncio.run(
+        pdf_service.export_url(
+            "https://example.com/a", ["pdf", "docx", "txt"], filename
+        )
+    )
+
+    assert pool.pages_opened == 1
+    assert paths == {
+        "pdf": str(temp_output_dir / "article.pdf"),
+        "docx": str(temp_output_dir / "article.docx"),
+        "txt": str(temp_output_dir / "article.txt"),
+    }
+    assert all(os.path.getsize(p) > 0 for p in paths.values())
+    assert "正文" in (temp_output_dir / "article.txt").read_text(encoding="utf-8")
+
+
+def test_export_url_embeds_captured_images(monkeypatch, temp_output_dir):
+    """测试DOCX使用页面加载时捕获的图片，不再下载"""
+    pool = _FakePool()
+    monkeypatch.setattr(pdf_service, "get_browser_pool", AsyncMock(return_value=pool))
+    monkeypatch.setattr(pdf_service.settings, "ASSET_CACHE_ENABLED", False)
+    monkeypatch.setattr(pdf_service.settings, "SETTLE_NETWORK_IDLE_MS", 0)
+    monkeypatch.setattr(pdf_service.settings, "DOCX_EMBED_IMAGES", True)
+    buffer = BytesIO()
+    Image.new("RGB", (96, 96), "red").save(buffer, "PNG")
+    attached = []
+
+    class FakeCapture:
+        def attach(self, page):
+            attached.append(page)
+            page.content = AsyncMock(
+                return_value="<html><body><p>正文</p><img src='a.png'></body></html>"
+            )
+            return self
+
+        async def collect(self, page):
+            return {"a.png": buffer.getvalue()}
+
+    monkeypatch.setattr(pdf_service, "ImageCapture", FakeCapture)
+
+    filename = str(temp_output_dir / "images.docx")
+    paths = asyncio.run(
+        pdf_service.export_url("https://example.com/a", ["docx"], filename)
+    )
+
+    assert len(attached) == 1
+    assert len(Document(paths["docx"]).inline_shapes) == 1
+
+
+def test_export_url_into_artifact_store(monkeypatch):
+    """测试多格式导出写入产物存储"""
+    pool = _FakePool()
+    monkeypatch.setattr(pdf_service, "get_browser_pool", AsyncMock(return_value=pool))
+    monkeypatch.setattr(pdf_service.settings, "ASSET_CACHE_ENABLED", False)
+    monkeypatch.setattr(pdf_service.settings, "SETTLE_NETWORK_IDLE_MS", 0)
+    store = MemoryArtifactStore()
+
+    uris = asyncio.run(
+        pdf_service.export_url("https://example.com/a", ["txt", "pdf"], "b", store)
+    )
+
+    assert uris == {"pdf": "mem://b.pdf", "txt": "mem://b.txt"}
+    assert "正文" in store.open(uris["txt"]).read().decode("utf-8")
+
+
+def test_export_url_rejects_unknown_format():
+    """测试不支持的导出格式"""
+    with pytest.raises(ValueError):
+        asyncio.run(pdf_service.export_url("https://example.com/a", ["png"]))
@@ -0,0 +1,160 @@
+"""
+渲染结果去重缓存测试模块
+"""
+
+import json
+from unittest.mock import MagicMock
+
+import pytest
+import redis
+from app.services.render_cache import (
+    RenderCache,
+    artifact_entry,
+    artifact_paths,
+    file_sha256,
+    normalize_url,
+)
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        (
+            "https://mp.weixin.qq.com/s?__biz=MzA&mid=2651&idx=1&sn=abc"
+            "&chksm=84a1&scene=21&sessionid=1700#rd",
+            "https://mp.weixin.qq.com/s?__biz=MzA&idx=1&mid=2651&sn=abc",
+        ),
+        (
+            "HTTPS://Example.COM:443/post?utm_source=wx&utm_medium=share&id=7",
+            "https://example.com/post?id=7",
+        ),
+        ("http://example.com:8080", "http://example.com:8080/"),
+        (
+            "https://mp.weixin.qq.com/s/z7NZ5ilDNtwqnN8R39DKqw?sharer_shareid=x",
+            "https://mp.weixin.qq.com/s/z7NZ5ilDNtwqnN8R39DKqw",
+        ),
+        # 微信的分享参数在其他网站上可能决定页面内容
+        (
+            "https://example.com/doc?lang=en&version=2&key=k&gclid=x",
+            "https://example.com/doc?key=k&lang=en&version=2",
+        ),
+    ],
+)
+def test_normalize_url(url, expected):
+    """测试URL规范化去掉跟踪参数并排序查询参数，微信分享参数只对微信文章生效"""
+    assert normalize_url(url) == expected
+
+
+def test_same_article_shares_cache_keys():
+    """测试不同分享参数的同一文章映射到同一组缓存键"""
+    cache = RenderCache(client=MagicMock())
+    a = cache._keys("https://mp.weixin.qq.com/s/abc?scene=1&chksm=x")
+    b = cache._keys("https://mp.weixin.qq.com/s/abc?scene=2")
+    assert a == b
+
+
+def test_render_cache_degrades_when_redis_unavailable():
+    """测试Redis不可用时降级为未命中且允许渲染"""
+    client = MagicMock()
+    client.get.side_effect = redis.ConnectionError("refused")
+    client.set.side_effect = redis.ConnectionError("refused")
+    client.register_script.return_value = MagicMock(
+        side_effect=redis.ConnectionError("refused")
+    )
+    cache = RenderCache(client=client)
+
+    assert cache.get("https://example.com/a") is None
+    assert cache.begin("https://example.com/a", {"pdf_file": "a.pdf"})
+    assert cache.join("https://example.com/a", {"to_email": "x@example.com"}) is False
+    assert cache.finish("https://example.com/a", {"artifacts": {}}) == []
+
+
+def test_render_cache_ignores_entries_with_missing_files(tmp_path):
+    """测试缓存的产物文件已被清理时视为未命中"""
+    client = MagicMock()
+    cache = RenderCache(client=client)
+    existing = tmp_path / "a.pdf"
+    existing.write_bytes(b"%PDF")
+    entry = artifact_entry({"pdf": str(existing)})
+    client.get.return_value = json.dumps(entry).encode()
+    assert artifact_paths(cache.get("https://example.com/a")) == {"pdf": str(existing)}
+
+    # 任一格式的产物已被清理都视为未命中
+    entry["artifacts"]["txt"] = {"path": "/nonexistent/file.txt", "content_hash": ""}
+    client.get.return_value = json.dumps(entry).encode()
+    assert cache.get("https://example.com/a", ["pdf", "txt"]) is None
+
+
+@pytest.fixture
+def real_cache():
+    """使用fakeredis执行真实Lua脚本的渲染缓存，未安装fakeredis[lua]时跳过"""
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")
+    return RenderCache(client=fakeredis.FakeRedis(), ttl=60, lock_ttl=30)
+
+
+def test_render_cache_single_flight(real_cache, tmp_path):
+    """测试第一个请求取得渲染锁，其余登记为等待者，结束时取出等待者并写入结果"""
+    url = "https://example.com/a"
+    pdf = tmp_path / "a.pdf"
+    pdf.write_bytes(b"%PDF")
+
+    token = real_cache.begin(url, {"pdf_file": "a.pdf"})
+    assert token
+    assert real_cache.begin(url, {"pdf_file": "b.pdf"}) is None
+    # 其他格式集合是独立的渲染
+    assert real_cache.begin(url, {"files": ["a.docx"]}, ["docx"])
+    real_cache.update_owner(url, token, {"pdf_file": "a.pdf", "task_id": "t1"})
+    assert real_cache.current_owner(url) == {"pdf_file": "a.pdf", "task_id": "t1"}
+    assert real_cache.join(url, {"to_email": "x@example.com"})
+
+    waiters = real_cache.finish(url, artifact_entry({"pdf": str(pdf)}), token)
+
+    assert waiters == [{"to_email": "x@example.com"}]
+    assert real_cache.current_owner(url) is None
+    assert artifact_paths(real_cache.get(url)) == {"pdf": str(pdf)}
+    assert real_cache.get(url, ["docx"]) is None
+    assert real_cache.current_owner(url, ["docx"]) == {"files": ["a.docx"]}
+    assert not real_cache.join(url, {"to_email": "y@example.com"})
+
+
+def test_format_set_keys(tmp_path):
+    """测试格式集合与顺序和重复无关，默认只有pdf"""
+    cache = RenderCache(client=MagicMock())
+    url = "https://example.com/a"
+    assert cache._keys(url) == cache._keys(url, ["pdf", "pdf"])
+    assert cache._keys(url, ["txt", "docx"]) == cache._keys(url, ["docx", "txt"])
+    assert cache._keys(url) != cache._keys(url, ["pdf", "txt"])
+
+    txt = tmp_path / "a.txt"
+    txt.write_text("text")
+    entry = artifact_entry({"txt": str(txt)})
+    assert entry["artifacts"]["txt"]["content_hash"] == file_sha256(str(txt))
+
+
+def test_render_cache_finish_keeps_other_owners_lock(real_cache):
+    """测试渲染锁过期后被其他渲染者取得时，原渲染者结束不会释放新锁或取走其等待者"""
+    url = "https://example.com/a"
+    stale = real_cache.begin(url, {"pdf_file": "a.pdf"})
+    real_cache.client.delete(real_cache._keys(url)[1])  # 模拟锁过期
+    current = real_cache.begin(url, {"pdf_file": "b.pdf"})
+    real_cache.join(url, {"to_email": "x@example.com"})
+
+    assert not real_cache.touch(url, stale)
+    real_cache.update_owner(url, stale, {"pdf_file": "a.pdf", "task_id": "old"})
+    assert real_cache.finish(url, None, stale) == []
+
+    assert real_cache.current_owner(url) == {"pdf_file": "b.pdf"}
+    assert real_cache.touch(url, current)
+    assert real_cache.finish(url, None, current) == [{"to_email": "x@example.com"}]
+
+
+def test_render_cache_touch_restarts_lock_ttl(real_cache):
+    """测试渲染开始时按锁的完整有效期重新计时"""
+    url = "https://example.com/a"
+    token = real_cache.begin(url, {"pdf_file": "a.pdf"})
+    lock_key = real_cache._keys(url)[1]
+    real_cache.client.expire(lock_key, 1)
+
+    assert real_cache.touch(url, token)
+    assert real_cache.client.ttl(lock_key) == 30
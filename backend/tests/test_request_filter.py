@@ -0,0 +1,122 @@
+"""
+请求拦截测试模块
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from app.services.request_filter import RequestFilter, policy_for_url
+
+WECHAT_ARTICLE = "https://mp.weixin.qq.com/s/z7NZ5ilDNtwqnN8R39DKqw"
+
+
+@pytest.mark.parametrize(
+    "url, resource_type",
+    [
+        ("https://mmbiz.qpic.cn/mmbiz_png/abc/640?wx_fmt=png", "image"),
+        ("https://res.wx.qq.com/mmbizappmsg/zh_CN/htmledition/js/appmsg.js", "script"),
+        (
+            "https://res.wx.qq.com/mmbizappmsg/zh_CN/htmledition/style/page.css",
+            "stylesheet",
+        ),
+        (WECHAT_ARTICLE, "document"),
+        ("https://res.wx.qq.com/static/js/appmsg.js", "script"),
+        ("https://res.wx.qq.com/statistics/style/page.css", "stylesheet"),
+    ],
+)
+def test_wechat_policy_keeps_article_content(url, resource_type):
+    """测试微信文章规则放行正文图片、样式和脚本"""
+    policy = policy_for_url(WECHAT_ARTICLE)
+    assert policy.name == "wechat"
+    assert policy.match(url, resource_type, "qq.com") is None
+
+
+@pytest.mark.parametrize(
+    "url, resource_type",
+    [
+        ("https://mp.weixin.qq.com/mp/jsmonitor?idkey=1", "xhr"),
+        ("https://mp.weixin.qq.com/mp/getappmsgext?__biz=x", "xhr"),
+        ("https://mpvideo.qpic.cn/0bc3/v.f10002.mp4", "media"),
+        ("https://badjs.weixinbridge.com/badjs?id=1", "image"),
+        ("https://btrace.qq.com/stat?id=1", "image"),
+        ("https://report.qq.com/cgi/beacon/", "xhr"),
+        ("https://res.wx.qq.com/t/fed_upload/font/iconfont.woff2", "font"),
+        ("https://hm.baidu.com/hm.js?abc", "script"),
+    ],
+)
+def test_wechat_policy_blocks_noise(url, resource_type):
+    """测试微信文章规则拦截上报、视频、字体和统计脚本"""
+    policy = policy_for_url(WECHAT_ARTICLE)
+    assert policy.match(url, resource_type, "qq.com") is not None
+
+
+def test_default_policy_blocks_trackers_and_media():
+    """测试通用规则拦截统计域名和媒体资源，默认放行第三方脚本"""
+    policy = policy_for_url("https://www.example.com/post")
+    assert policy.name == "default"
+    assert policy.match(
+        "https://www.google-analytics.com/analytics.js", "script", "example.com"
+    )
+    assert policy.match("https://cdn.example.com/a.mp4", "media", "example.com")
+    assert policy.match("https://cdn.other.com/lib.js", "script", "example.com") is None
+    assert policy.match("https://cdn.example.com/a.png", "image", "example.com") is None
+
+
+def _make_route(url, resource_type, navigation=False):
+    route = MagicMock()
+    route.request.url = url
+    route.request.resource_type = resource_type
+    route.request.is_navigation_request.return_value = navigation
+    route.request.frame.parent_frame = None
+    route.abort = AsyncMock()
+    route.fallback = AsyncMock()
+    return route
+
+
+def _sample(name, **labels):
+    from prometheus_client import REGISTRY
+
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_request_filter_counts_and_routes():
+    """测试拦截器对放行请求调用fallback、对拦截请求调用abort并计数"""
+    allowed_before = _sample(
+        "wedocx_request_filter_requests_total", decision="allowed", reason=""
+    )
+    blocked_before = _sample(
+        "wedocx_request_filter_requests_total", decision="blocked", reason="type:media"
+    )
+    bytes_before = _sample("wedocx_request_filter_allowed_bytes_total")
+    request_filter = RequestFilter(WECHAT_ARTICLE)
+    allowed = _make_route("https://mmbiz.qpic.cn/a.png", "image")
+    blocked = _make_route("https://mpvideo.qpic.cn/v.mp4", "media")
+    navigation = _make_route(WECHAT_ARTICLE, "document", navigation=True)
+
+    async def run():
+        for route in (navigation, allowed, blocked):
+            await request_filter._handle(route)
+
+    asyncio.run(run())
+
+    allowed.fallback.assert_awaited_once()
+    navigation.fallback.assert_awaited_once()
+    blocked.abort.assert_awaited_once_with("blockedbyclient")
+    assert request_filter.stats.allowed_requests == 2
+    assert request_filter.stats.blocked_requests == 1
+    assert request_filter.stats.blocked_by_reason == {"type:media": 1}
+
+    response = MagicMock()
+    response.headers = {"content-length": "2048"}
+    request_filter._on_response(response)
+    assert request_filter.stats.allowed_bytes == 2048
+
+    # 同时计入Prometheus指标
+    assert _sample(
+        "wedocx_request_filter_requests_total", decision="allowed", reason=""
+    ) == (allowed_before + 2)
+    assert _sample(
+        "wedocx_request_filter_requests_total", decision="blocked", reason="type:media"
+    ) == (blocked_before + 1)
+    assert _sample("wedocx_request_filter_allowed_bytes_total") == bytes_before + 2048
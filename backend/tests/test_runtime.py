@@ -0,0 +1,81 @@
+"""
+异步运行时测试模块
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from app.core.runtime import AsyncRuntime, get_runtime
+
+
+@pytest.fixture
+def runtime():
+    rt = AsyncRuntime(name="test-runtime").start()
+    yield rt
+    rt.stop()
+
+
+def test_runtime_reuses_one_loop(runtime):
+    """测试多次提交的协程运行在同一个事件循环上"""
+
+    async def current_loop():
+        return asyncio.get_running_loop()
+
+    first = runtime.run(current_loop())
+    second = runtime.run(current_loop())
+    assert first is second is runtime.loop
+
+
+def test_runtime_overlaps_submissions_from_threads(runtime):
+    """测试多个线程提交的协程在运行时内并发执行"""
+
+    async def sleeper():
+        await asyncio.sleep(0.2)
+        return threading.current_thread().name
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        names = list(executor.map(lambda _: runtime.run(sleeper()), range(5)))
+    elapsed = time.monotonic() - start
+
+    assert set(names) == {"test-runtime"}
+    assert elapsed < 0.8
+
+
+def test_runtime_run_timeout_cancels(runtime):
+    """测试等待超时后协程被取消"""
+    cancelled = threading.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(TimeoutError):
+        runtime.run(slow(), timeout=0.1)
+    assert cancelled.wait(1)
+
+
+def test_runtime_rejects_blocking_call_from_loop_thread(runtime):
+    """测试在运行时线程内同步等待会抛出异常而不是死锁"""
+
+    async def nested():
+        async def inner():
+            return 1
+
+        return runtime.run(inner())
+
+    with pytest.raises(RuntimeError):
+        runtime.run(nested())
+
+
+def test_get_runtime_is_process_singleton():
+    """测试进程级运行时为单例并处于运行状态"""
+    rt = get_runtime()
+    assert rt is get_runtime()
+    assert rt.is_running
@@ -0,0 +1,104 @@
+"""
+SMTP连接池测试模块
+"""
+
+import smtplib
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+from app.services.email_service import EmailConfig
+from app.services.smtp_pool import SMTPConnectionPool
+
+
+def _new_server(*args, **kwargs):
+    server = MagicMock()
+    server.noop.return_value = (250, b"OK")
+    return server
+
+
+@pytest.fixture
+def pool(email_config):
+    pool = SMTPConnectionPool(
+        EmailConfig(**email_config), max_size=2, keepalive_interval=0
+    )
+    yield pool
+    pool.close()
+
+
+@patch("smtplib.SMTP", side_effect=_new_server)
+@patch("smtplib.SMTP_SSL", side_effect=_new_server)
+def test_pool_reuses_authenticated_session(mock_smtp_ssl, mock_smtp, pool):
+    """测试多次发送复用同一个已登录会话"""
+    servers = []
+    for _ in range(3):
+        with pool.connection() as server:
+            servers.append(server)
+
+    assert pool.connects == 1
+    assert servers[0] is servers[1] is servers[2]
+    servers[0].login.assert_called_once()
+    # 未开启调试时不输出协议日志
+    assert not servers[0].set_debuglevel.called
+
+
+@patch("smtplib.SMTP", side_effect=_new_server)
+@patch("smtplib.SMTP_SSL", side_effect=_new_server)
+def test_pool_replaces_dead_idle_session(mock_smtp_ssl, mock_smtp, pool):
+    """测试空闲会话NOOP失败时重新连接"""
+    with pool.connection() as first:
+        pass
+    first.noop.side_effect = smtplib.SMTPServerDisconnected("closed")
+    pool._idle[0].last_used = time.monotonic() - 10
+
+    with pool.connection() as second:
+        pass
+
+    assert second is not first
+    assert pool.connects == 2
+
+
+@patch("smtplib.SMTP", side_effect=_new_server)
+@patch("smtplib.SMTP_SSL", side_effect=_new_server)
+def test_pool_send_retries_on_disconnect(mock_smtp_ssl, mock_smtp, pool):
+    """测试发送中会话断开时换新连接重试"""
+    attempts = []
+
+    def deliver(server):
+        attempts.append(server)
+        if len(attempts) == 1:
+            raise smtplib.SMTPServerDisconnected("gone")
+
+    pool.send(deliver)
+
+    assert len(attempts) == 2
+    assert attempts[0] is not attempts[1]
+    assert pool.connects == 2
+    assert len(pool._idle) == 1
+
+
+@patch("smtplib.SMTP", side_effect=_new_server)
+@patch("smtplib.SMTP_SSL", side_effect=_new_server)
+def test_pool_resets_session_after_smtp_error(mock_smtp_ssl, mock_smtp, pool):
+    """测试收件人被拒等错误后会话复位并继续复用"""
+    with pytest.raises(smtplib.SMTPRecipientsRefused):
+        with pool.connection() as server:
+            raise smtplib.SMTPRecipientsRefused({})
+
+    server.rset.assert_called_once()
+    with pool.connection() as again:
+        pass
+    assert again is server
+
+
+@patch("smtplib.SMTP", side_effect=_new_server)
+@patch("smtplib.SMTP_SSL", side_effect=_new_server)
+def test_pool_keepalive_drops_dead_sessions(mock_smtp_ssl, mock_smtp, pool):
+    """测试保活检查关闭失效的空闲会话"""
+    with pool.connection() as a, pool.connection() as b:
+        pass
+    b.noop.side_effect = OSError("reset")
+
+    assert pool.keepalive() == 1
+    a.noop.assert_called_once()
+    assert [c.server for c in pool._idle] == [a]
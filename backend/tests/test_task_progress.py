@@ -0,0 +1,156 @@
+"""
+任务进度测试模块
+"""
+
+import asyncio
+import json
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+import redis
+from app.core.config import settings
+from app.services import task_progress
+from app.services.task_progress import ProgressHub, ProgressPublisher, advance, bind
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """把进度事件记录到列表中，不写入Redis"""
+    events = []
+    publisher = MagicMock()
+    publisher.publish.side_effect = lambda task_id, stage, **detail: events.append(
+        (task_id, stage, detail)
+    )
+    monkeypatch.setattr(task_progress, "_publisher", publisher)
+    monkeypatch.setattr(settings, "PROGRESS_ENABLED", True)
+    return events
+
+
+def test_advance_reports_bound_task(published):
+    """测试advance只在绑定了进度ID的上下文中报告，正常结束时报告final阶段"""
+    advance("navigating")
+    with bind("task-1", final="done"):
+        advance("navigating")
+        advance("printing")
+    advance("settling")
+
+    assert published == [
+        ("task-1", "navigating", {}),
+        ("task-1", "printing", {}),
+        ("task-1", "done", {}),
+    ]
+
+
+def test_bind_reports_final_detail(published):
+    """测试final阶段附带给出的内容（如下载链接）"""
+    with bind("task-1", final="done", downloads=[{"name": "a.pdf"}]):
+        pass
+    assert published == [("task-1", "done", {"downloads": [{"name": "a.pdf"}]})]
+
+
+def test_bind_reports_failure(published):
+    """测试绑定的上下文中抛出异常时报告failed并继续抛出"""
+    with pytest.raises(RuntimeError):
+        with bind("task-2", final="done"):
+            raise RuntimeError("页面访问失败")
+
+    assert published == [("task-2", "failed", {"error": "页面访问失败"})]
+
+
+def test_report_disabled(published, monkeypatch):
+    monkeypatch.setattr(settings, "PROGRESS_ENABLED", False)
+    task_progress.report("task-3", "queued")
+    with bind(None):
+        advance("navigating")
+    assert published == []
+
+
+def test_publisher_writes_latest_and_publishes():
+    """测试后台线程把事件写入最新状态并发布到任务频道"""
+    client = MagicMock()
+    publisher = ProgressPublisher(client=client, ttl=60)
+
+    assert publisher.publish("task-1", "queued")
+    assert publisher.publish("task-1", "navigating", url="https://example.com")
+    assert publisher.flush()
+
+    pipe = client.pipeline.return_value
+    keys = [c.args[0] for c in pipe.set.call_args_list]
+    assert keys == ["wedocx:progress:task-1"] * 2
+    assert all(c.kwargs["ex"] == 60 for c in pipe.set.call_args_list)
+    last = json.loads(pipe.publish.call_args.args[1])
+    assert last["stage"] == "navigating"
+    assert last["url"] == "https://example.com"
+
+
+def test_publisher_drops_events_without_blocking(monkeypatch):
+    """测试Redis写入卡住时事件被丢弃，publish不阻塞调用方"""
+    monkeypatch.setattr(settings, "PROGRESS_QUEUE_SIZE", 1)
+    release = threading.Event()
+    client = MagicMock()
+    client.pipeline.return_value.execute.side_effect = lambda: release.wait(5)
+    publisher = ProgressPublisher(client=client)
+
+    accepted = [publisher.publish("task-1", "navigating") for _ in range(5)]
+    release.set()
+
+    assert accepted.count(False) >= 3
+    assert publisher.dropped == accepted.count(False)
+    assert publisher.flush()
+
+
+def test_publisher_survives_redis_errors():
+    """测试Redis不可用时丢弃该批事件，后续事件照常写入"""
+    client = MagicMock()
+    client.pipeline.return_value.execute.side_effect = [
+        redis.ConnectionError("refused"),
+        None,
+    ]
+    publisher = ProgressPublisher(client=client)
+
+    publisher.publish("task-1", "queued")
+    assert publisher.flush()
+    publisher.publish("task-1", "done")
+    assert publisher.flush()
+    assert client.pipeline.return_value.execute.call_count == 2
+
+
+def test_hub_dispatches_by_task_id():
+    """测试频道消息只分发给对应任务的订阅者，慢速订阅者丢弃最旧的事件"""
+
+    async def scenario():
+        hub = ProgressHub()
+        hub._task = asyncio.get_running_loop().create_future()  # 不启动订阅连接
+        first = hub.subscribe("task-1")
+        other = hub.subscribe("task-2")
+        for i in range(101):
+            hub.dispatch(
+                "wedocx:progress:task-1", json.dumps({"stage": "settling", "i": i})
+            )
+        hub.unsubscribe("task-1", first)
+        hub.dispatch("wedocx:progress:task-1", json.dumps({"stage": "done"}))
+        return first, other, hub
+
+    first, other, hub = asyncio.run(scenario())
+    assert first.qsize() == 100
+    assert first.get_nowait()["i"] == 1
+    assert other.empty()
+    assert hub._listeners == {"task-2": {other}}
+
+
+def test_hub_wait_ready():
+    """测试订阅生效前wait_ready等待，Redis不可用时超时返回False"""
+
+    async def scenario():
+        hub = ProgressHub()
+        assert await hub.wait_ready(0.01) is False
+        hub._listen = lambda: asyncio.sleep(3600)  # 不连接Redis
+        hub.subscribe("task-1")
+        assert await hub.wait_ready(0.01) is False
+        hub._ready.set()
+        ready = await hub.wait_ready(0.01)
+        hub._task.cancel()
+        return ready
+
+    assert asyncio.run(scenario()) is True
@@ -1,6 +1,14 @@
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
-from app.workers.tasks import create_pdf_task, send_email_task
+import pytest
+from app.workers.tasks import (
+    create_pdf_task,
+    create_pdfs_task,
+    export_task,
+    send_digest_task,
+    send_email_task,
+    send_emails_task,
+)
 
 
 @patch("app.workers.tasks.url_to_pdf_sync")
@@ -36,3 +44,401 @@ def test_send_email_task_success(mock_email_service, email_test_cases, temp_outp
         to_email=to_email, subject=subject, body=body, attachments=[pdf_path]
     )
     assert result is True
+
+
+@patch("app.workers.tasks.url_to_pdf_many_sync")
+def test_create_pdfs_task_reports_per_url_results(mock_many, temp_output_dir):
+    """测试批量PDF任务 - 逐个URL返回结果与错误"""
+    urls = ["https://example.com/a", "https://example.com/b"]
+    output_paths = [str(temp_output_dir / "a.pdf"), str(temp_output_dir / "b.pdf")]
+    mock_many.return_value = [output_paths[0], RuntimeError("页面访问失败")]
+
+    result = create_pdfs_task(urls, output_paths)
+
+    mock_many.assert_called_once_with(urls, output_paths, return_exceptions=True)
+    assert result[0] == {"url": urls[0], "pdf_path": output_paths[0], "error": None}
+    assert result[1]["pdf_path"] is None
+    assert "页面访问失败" in result[1]["error"]
+
+
+@patch("app.workers.tasks.get_artifact_store")
+@patch("app.workers.tasks.url_to_pdf_many_sync")
+def test_create_pdfs_task_writes_to_artifact_store(
+    mock_many, mock_get_store, monkeypatch, temp_output_dir
+):
+    """测试配置非本地产物存储时批量渲染同样写入存储，结果为产物URI"""
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "ARTIFACT_STORE", "s3")
+    urls = ["https://example.com/a", "https://example.com/b"]
+    output_paths = [str(temp_output_dir / "a.pdf"), str(temp_output_dir / "b.pdf")]
+    mock_many.return_value = ["s3://bucket/a.pdf", "s3://bucket/b.pdf"]
+
+    result = create_pdfs_task(urls, output_paths)
+
+    mock_many.assert_called_once_with(
+        urls,
+        ["a.pdf", "b.pdf"],
+        return_exceptions=True,
+        store=mock_get_store.return_value,
+    )
+    assert [r["pdf_path"] for r in result] == mock_many.return_value
+
+
+@patch("app.workers.tasks.send_emails_task")
+@patch("app.workers.tasks.get_render_cache")
+@patch("app.workers.tasks.url_to_pdf_sync")
+def test_create_pdf_task_notifies_dedup_waiters(
+    mock_url_to_pdf_sync, mock_get_cache, mock_send, valid_urls, temp_output_dir
+):
+    """测试去重渲染者完成后写入缓存并通知等待者"""
+    url = valid_urls["complex"]
+    output_path = temp_output_dir / "shared.pdf"
+    output_path.write_bytes(b"%PDF-1.4")
+    render_cache = mock_get_cache.return_value
+    render_cache.finish.return_value = [
+        {"to_email": "a@example.com", "subject": "s", "body": "b"},
+        {"to_email": "b@example.com", "subject": "s", "body": "b"},
+    ]
+
+    result = create_pdf_task(url, str(output_path), url)
+
+    assert result == str(output_path)
+    entry = render_cache.finish.call_args[0][1]
+    assert entry["artifacts"]["pdf"]["path"] == str(output_path)
+    assert len(entry["artifacts"]["pdf"]["content_hash"]) == 64
+    assert render_cache.finish.call_args[1] == {"formats": ["pdf"]}
+    mock_send.delay.assert_called_once_with(
+        str(output_path), render_cache.finish.return_value
+    )
+
+
+@patch("app.workers.tasks.send_emails_task")
+@patch("app.workers.tasks.get_render_cache")
+@patch("app.workers.tasks.url_to_pdf_sync")
+def test_create_pdf_task_notifies_waiters_on_failure(
+    mock_url_to_pdf_sync, mock_get_cache, mock_send, valid_urls
+):
+    """测试去重渲染者失败时向等待者发送失败通知，并按token释放渲染锁"""
+    url = valid_urls["complex"]
+    mock_url_to_pdf_sync.side_effect = RuntimeError("页面访问失败")
+    render_cache = mock_get_cache.return_value
+    render_cache.finish.return_value = [
+        {"to_email": "a@example.com", "subject": "网页转PDF", "body": "b"}
+    ]
+
+    with pytest.raises(RuntimeError):
+        create_pdf_task(url, "/tmp/a.pdf", url, cache_token="owner-token")
+
+    render_cache.touch.assert_called_once_with(url, "owner-token", formats=["pdf"])
+    assert render_cache.finish.call_args[0] == (url, None, "owner-token")
+    pdf_path, (notice,) = mock_send.delay.call_args[0]
+    assert pdf_path is None
+    assert notice["to_email"] == "a@example.com"
+    assert notice["subject"] == "网页转PDF失败"
+    assert "页面访问失败" in notice["body"]
+
+
+@patch("app.workers.tasks.send_emails_task")
+@patch("app.workers.tasks.get_render_cache")
+@patch("app.workers.tasks.export_url_sync")
+def test_export_task_shares_render_with_waiters(
+    mock_export, mock_get_cache, mock_send, valid_urls, temp_output_dir
+):
+    """测试多格式导出同样写入渲染缓存，等待者收到全部格式的附件"""
+    url = valid_urls["complex"]
+    paths = {}
+    for fmt in ("docx", "txt"):
+        paths[fmt] = str(temp_output_dir / f"shared.{fmt}")
+        with open(paths[fmt], "wb") as f:
+            f.write(fmt.encode())
+    mock_export.return_value = paths
+    render_cache = mock_get_cache.return_value
+    render_cache.finish.return_value = [
+        {"to_email": "a@example.com", "subject": "s", "body": "b"}
+    ]
+
+    result = export_task(
+        url,
+        ["txt", "docx"],
+        str(temp_output_dir / "shared.pdf"),
+        cache_url=url,
+        cache_token="owner-token",
+    )
+
+    assert result == paths
+    render_cache.touch.assert_called_once_with(
+        url, "owner-token", formats=["docx", "txt"]
+    )
+    entry = render_cache.finish.call_args[0][1]
+    assert {fmt: a["path"] for fmt, a in entry["artifacts"].items()} == paths
+    assert render_cache.finish.call_args[1] == {"formats": ["docx", "txt"]}
+    mock_send.delay.assert_called_once_with(paths, render_cache.finish.return_value)
+
+
+@patch("app.workers.tasks._send_many")
+def test_send_emails_task_attaches_every_format(mock_send_many):
+    """测试send_emails_task收到{格式: 路径}时每个格式一个附件"""
+    mock_send_many.return_value = [True]
+    paths = {"docx": "/tmp/a.docx", "txt": "/tmp/a.txt"}
+
+    send_emails_task(
+        paths, [{"to_email": "a@example.com", "subject": "s", "body": "b"}]
+    )
+
+    (email,) = mock_send_many.call_args[0][0]
+    assert email.attachments == ["/tmp/a.docx", "/tmp/a.txt"]
+
+
+@patch("app.workers.tasks.EmailService")
+def test_send_emails_task_reports_per_recipient(mock_email_service, temp_output_dir):
+    """测试批量发送任务 - 逐个收件人返回错误信息"""
+    service_instance = mock_email_service.return_value
+    service_instance.send_many.return_value = [True, RuntimeError("发送邮件失败")]
+    pdf_path = str(temp_output_dir / "shared.pdf")
+    recipients = [
+        {"to_email": "a@example.com", "subject": "s", "body": "b"},
+        {"to_email": "b@example.com", "subject": "s", "body": "b"},
+    ]
+
+    result = send_emails_task(pdf_path, recipients)
+
+    emails = service_instance.send_many.call_args[0][0]
+    assert [e.to_email for e in emails] == ["a@example.com", "b@example.com"]
+    assert all(e.attachments == [pdf_path] for e in emails)
+    assert result == [None, "发送邮件失败"]
+
+
+@patch("app.workers.tasks.export_url_sync")
+def test_export_task_success(mock_export, valid_urls, temp_output_dir):
+    """测试多格式导出任务"""
+    url = valid_urls["simple"]
+    output_path = str(temp_output_dir / "a.pdf")
+    mock_export.return_value = {"pdf": output_path}
+
+    result = export_task(url, ["pdf", "txt"], output_path)
+
+    mock_export.assert_called_once_with(url, ["pdf", "txt"], output_path)
+    assert result == {"pdf": output_path}
+
+
+@patch("app.workers.tasks.EmailService")
+def test_send_email_task_with_export_result(mock_email_service):
+    """测试发送邮件任务 - 多格式导出结果作为多个附件"""
+    service_instance = mock_email_service.return_value
+    paths = {"pdf": "/tmp/a.pdf", "docx": "/tmp/a.docx"}
+
+    send_email_task(paths, "reader@example.com", "s", "b")
+
+    assert service_instance.send_email.call_args.kwargs["attachments"] == [
+        "/tmp/a.pdf",
+        "/tmp/a.docx",
+    ]
+
+
+def test_task_routing():
+    """测试渲染任务和投递任务进入各自的队列，渲染任务执行完成后才确认"""
+    from app.celery_app import celery_app
+
+    router = celery_app.amqp.router
+    for task in (create_pdf_task, create_pdfs_task, export_task):
+        assert router.route({}, task.name)["queue"].name == "render"
+        assert task.acks_late
+    for task in (send_email_task, send_emails_task, send_digest_task):
+        assert router.route({}, task.name)["queue"].name == "deliver"
+        assert not task.acks_late
+
+
+def _digest_results(temp_output_dir, sizes):
+    """构造chord传给汇总任务的结果：每个PDF一组，最后追加一个失败的链接"""
+    chunks = []
+    for i, size in enumerate(sizes):
+        path = temp_output_dir / f"{i:03d}.pdf"
+        path.write_bytes(b"%" * size)
+        chunks.append([{"url": f"https://example.com/{i}", "pdf_path": str(path)}])
+    chunks.append(
+        [{"url": "https://example.com/bad", "pdf_path": None, "error": "超时"}]
+    )
+    return chunks
+
+
+@patch("app.workers.tasks.EmailService")
+def test_send_digest_task_splits_by_size(
+    mock_email_service, temp_output_dir, monkeypatch
+):
+    """测试汇总邮件 - 附件超过大小上限时拆成多封，正文列出失败的链接"""
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "BATCH_DIGEST_MAX_BYTES", 100)
+    service_instance = mock_email_service.return_value
+    service_instance.send_many.return_value = [True, True]
+    results = _digest_results(temp_output_dir, [60, 30, 50])
+
+    assert send_digest_task(results, "reader@example.com", "网页转PDF") == [None, None]
+
+    emails = service_instance.send_many.call_args[0][0]
+    assert [e.subject for e in emails] == ["网页转PDF（1/2）", "网页转PDF（2/2）"]
+    assert [len(e.attachments) for e in emails] == [2, 1]
+    assert "成功3个，失败1个" in emails[0].body
+    assert "https://example.com/bad：超时" in emails[0].body
+
+
+@patch("app.workers.tasks.EmailService")
+def test_send_digest_task_zip(mock_email_service, temp_output_dir, monkeypatch):
+    """测试汇总邮件 - zip方式把全部PDF打包为一个附件，发送后删除zip"""
+    import os
+    import zipfile
+
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "OUTPUT_DIR", temp_output_dir)
+    contents = {}
+
+    def send_many(emails):
+        (archive,) = emails[0].attachments
+        with zipfile.ZipFile(archive) as zf:
+            contents.update({name: zf.read(name) for name in zf.namelist()})
+        return [True]
+
+    service_instance = mock_email_service.return_value
+    service_instance.send_many.side_effect = send_many
+    results = _digest_results(temp_output_dir, [10, 20])
+
+    send_digest_task(results, "reader@example.com", "网页转PDF", "zip")
+
+    assert sorted(contents) == ["000.pdf", "001.pdf"]
+    assert len(contents["001.pdf"]) == 20
+    (email,) = service_instance.send_many.call_args[0][0]
+    assert not os.path.exists(email.attachments[0])
+
+
+@patch("app.workers.tasks.EmailService")
+def test_send_digest_task_separate(mock_email_service, temp_output_dir):
+    """测试汇总邮件 - separate方式每个PDF一封，另附一封失败说明"""
+    service_instance = mock_email_service.return_value
+    service_instance.send_many.return_value = [True, True, RuntimeError("拒收")]
+    results = _digest_results(temp_output_dir, [10, 20])
+
+    errors = send_digest_task(results, "reader@example.com", "网页转PDF", "separate")
+
+    emails = service_instance.send_many.call_args[0][0]
+    assert [e.attachments for e in emails[:2]] == [
+        [str(temp_output_dir / "000.pdf")],
+        [str(temp_output_dir / "001.pdf")],
+    ]
+    assert emails[2].attachments is None
+    assert errors == [None, None, "拒收"]
+
+
+@patch("app.workers.tasks.url_to_pdf_sync")
+def test_create_pdf_task_reports_progress(mock_url_to_pdf_sync, monkeypatch):
+    """测试创建PDF任务 - 渲染期间绑定进度ID，失败时以该ID报告failed"""
+    from app.core.config import settings
+    from app.services import task_progress
+
+    reported = []
+    monkeypatch.setattr(settings, "PROGRESS_ENABLED", True)
+    monkeypatch.setattr(
+        task_progress,
+        "_publisher",
+        MagicMock(
+            publish=lambda task_id, stage, **kw: reported.append((task_id, stage))
+        ),
+    )
+
+    def render(url, output_path):
+        task_progress.advance("navigating")
+        raise RuntimeError("页面访问失败")
+
+    mock_url_to_pdf_sync.side_effect = render
+    with pytest.raises(RuntimeError):
+        create_pdf_task("https://example.com", "/tmp/a.pdf", progress_id="api-task")
+
+    assert reported == [("api-task", "navigating"), ("api-task", "failed")]
+
+
+@patch("app.workers.tasks.EmailService")
+def test_send_email_task_link_mode(mock_email_service, download_dir, monkeypatch):
+    """测试发送邮件任务 - auto方式下超过阈值的产物改为下载链接"""
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "EMAIL_ATTACHMENT_MODE", "auto")
+    monkeypatch.setattr(settings, "EMAIL_LINK_THRESHOLD_BYTES", 100)
+    small = download_dir / "small.pdf"
+    small.write_bytes(b"x" * 10)
+    large = download_dir / "large.pdf"
+    large.write_bytes(b"x" * 200)
+    service_instance = mock_email_service.return_value
+
+    send_email_task(str(small), "reader@example.com", "主题", "正文")
+    assert service_instance.send_email.call_args.kwargs["attachments"] == [str(small)]
+
+    send_email_task(str(large), "reader@example.com", "主题", "正文")
+    kwargs = service_instance.send_email.call_args.kwargs
+    assert kwargs["attachments"] == []
+    assert "下载链接（7天内有效）" in kwargs["body"]
+    assert "http://testserver/api/v1/download/large.pdf?" in kwargs["body"]
+
+
+@patch("app.workers.tasks.url_to_pdf_sync")
+def test_create_pdf_task_reports_ready_with_link(
+    mock_url_to_pdf_sync, download_dir, monkeypatch
+):
+    """测试创建PDF任务 - 启用下载链接时渲染完成即报告ready阶段"""
+    from app.core.config import settings
+    from app.services import task_progress
+
+    reported = []
+    monkeypatch.setattr(settings, "PROGRESS_ENABLED", True)
+    monkeypatch.setattr(
+        task_progress,
+        "_publisher",
+        MagicMock(publish=lambda task_id, stage, **kw: reported.append((stage, kw))),
+    )
+    output_path = str(download_dir / "page.pdf")
+    mock_url_to_pdf_sync.side_effect = lambda url, path: open(path, "wb").close()
+
+    create_pdf_task("https://example.com", output_path, progress_id="api-task")
+
+    ((stage, detail),) = reported
+    assert stage == "ready"
+    assert detail["downloads"][0]["url"].startswith(
+        "http://testserver/api/v1/download/page.pdf?"
+    )
+
+
+@patch("app.workers.tasks.get_runtime")
+@patch("app.workers.tasks.AsyncEmailService")
+@patch("app.workers.tasks.EmailService")
+def test_send_emails_task_async_engine(
+    mock_email_service, mock_async_service, mock_get_runtime, monkeypatch
+):
+    """测试启用异步邮件服务时批量发送在worker的异步运行时上执行"""
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "EMAIL_ASYNC_ENABLED", True)
+    mock_get_runtime.return_value.run.return_value = [True, RuntimeError("拒收")]
+    recipients = [
+        {"to_email": f"{name}@example.com", "subject": "s", "body": "b"}
+        for name in ("a", "b")
+    ]
+
+    assert send_emails_task(None, recipients) == [None, "拒收"]
+
+    send_many = mock_async_service.return_value.send_many
+    (emails,) = send_many.call_args[0]
+    assert [e.to_email for e in emails] == ["a@example.com", "b@example.com"]
+    mock_get_runtime.return_value.run.assert_called_once_with(send_many.return_value)
+    mock_email_service.assert_not_called()
+
+
+@patch("app.workers.tasks.get_fair_scheduler")
+@patch("app.workers.tasks.url_to_pdf_many_sync")
+def test_create_pdfs_task_releases_batch_urls(mock_many, mock_get_scheduler):
+    """测试批量渲染任务结束时（包括失败）释放租户的未完成链接数"""
+    mock_many.side_effect = RuntimeError("浏览器启动失败")
+
+    with pytest.raises(RuntimeError):
+        create_pdfs_task(["https://example.com/a"] * 3, ["/tmp/a.pdf"] * 3, "key:x")
+
+    mock_get_scheduler.return_value.release_urls.assert_called_once_with("key:x", 3)
@@ -0,0 +1,70 @@
+"""文本规范化测试模块"""
+
+import random
+import re
+
+from app.services.text_normalizer import clean_many, clean_text
+
+
+def _legacy_clean_text(text):
+    """改写前的实现，用于校验新实现的输出保持一致"""
+    text = re.sub(r"[ \t\u3000]+", " ", text)
+    text = re.sub(r'[^\w\s\u4e00-\u9fff,.?!，。？！、:：;；""' "()（）\n-]", "", text)
+    text = "\n".join(line.strip() for line in text.splitlines())
+    return text.strip()
+
+
+# 覆盖各类空白、换行符、中英文和会被删除的符号
+_ALPHABET = list("ab1 中文，。？！、：；（）()-_\"'“”@#&*") + [
+    "\t",
+    "\u3000",
+    "\xa0",
+    "\n",
+    "\r",
+    "\r\n",
+    "\v",
+    "\f",
+    "\x1c",
+    "\x1f",
+    "\x85",
+    "\u2028",
+    "\u2029",
+    "\x00",
+    "😀",
+]
+
+
+def _random_text(rng):
+    return "".join(rng.choice(_ALPHABET) for _ in range(rng.randint(0, 20)))
+
+
+def test_clean_text_matches_legacy():
+    """测试与原实现输出一致"""
+    rng = random.Random(20240503)
+    for _ in range(5000):
+        text = _random_text(rng)
+        assert clean_text(text) == _legacy_clean_text(text), repr(text)
+
+
+def test_clean_text_examples():
+    """测试典型中文文本"""
+    assert clean_text("  微信\u3000\u3000公众号\t文章  ") == "微信 公众号 文章"
+    assert clean_text("第一行 \r\n \n  第三行") == "第一行\n\n第三行"
+    assert clean_text("点击“复制链接”@") == "点击复制链接"
+    assert clean_text(" \n\t ") == ""
+
+
+def test_clean_many_matches_clean_text():
+    """测试批量清理与逐段清理结果一致"""
+    rng = random.Random(20240504)
+    for _ in range(500):
+        texts = [_random_text(rng) for _ in range(rng.randint(1, 8))]
+        assert clean_many(texts) == [clean_text(t) for t in texts], texts
+
+
+def test_clean_many_edge_cases():
+    """测试空输入、生成器输入和含分隔符的文本"""
+    assert clean_many([]) == []
+    assert clean_many(t for t in ["a ", " b"]) == ["a", "b"]
+    assert clean_many(["a\x00b", "c"]) == ["ab", "c"]
+    assert clean_many(["", "\n"]) == ["", ""]
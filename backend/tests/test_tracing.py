@@ -0,0 +1,173 @@
+"""分布式追踪测试模块"""
+
+import json
+from types import SimpleNamespace
+
+import pytest
+from app import celery_app
+from app.core import tracing
+from app.core.config import settings
+from app.core.metrics import stage
+from app.core.runtime import AsyncRuntime
+
+pytest.importorskip("opentelemetry.sdk")
+
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import (  # noqa: E402
+    InMemorySpanExporter,
+)
+
+
+@pytest.fixture
+def exporter():
+    """启用追踪并把span导出到内存"""
+    memory = InMemorySpanExporter()
+    assert tracing.init_tracing("wedocx-test", exporter=memory)
+    yield memory
+    tracing.shutdown_tracing()
+
+
+def _finished(exporter):
+    tracing._provider.force_flush()
+    return {span.name: span for span in exporter.get_finished_spans()}
+
+
+def test_span_disabled_is_noop():
+    """测试未启用追踪时span为空操作，不写入消息头"""
+    assert not tracing.is_enabled()
+    headers = {}
+    with tracing.span("noop") as current:
+        current.set_attribute("key", "value")
+    tracing.inject(headers)
+    assert headers == {}
+
+
+def test_init_tracing_unsupported_exporter(monkeypatch):
+    """测试导出方式配置错误时记录警告并保持关闭"""
+    monkeypatch.setattr(settings, "TRACING_EXPORTER", "zipkin")
+    assert tracing.init_tracing("wedocx-test") is False
+    assert not tracing.is_enabled()
+
+
+def test_stage_creates_child_span(exporter):
+    """测试metrics.stage在当前span下创建子span，异常记录在span上"""
+    with tracing.span("render", url="https://example.com"):
+        with stage("navigation"):
+            pass
+        with pytest.raises(RuntimeError):
+            with stage("page_pdf"):
+                raise RuntimeError("boom")
+
+    spans = _finished(exporter)
+    root = spans["render"]
+    assert root.attributes["url"] == "https://example.com"
+    assert spans["navigation"].parent.span_id == root.context.span_id
+    assert spans["page_pdf"].parent.span_id == root.context.span_id
+    assert not spans["page_pdf"].status.is_ok
+
+
+def test_runtime_submit_keeps_trace_context(exporter):
+    """测试提交到异步运行时的协程继承提交方的当前span"""
+    runtime = AsyncRuntime(name="test-tracing-runtime").start()
+
+    async def render():
+        async with stage("browser_launch"):
+            pass
+
+    try:
+        with tracing.span("task"):
+            runtime.run(render(), timeout=5)
+    finally:
+        runtime.stop()
+
+    spans = _finished(exporter)
+    assert spans["browser_launch"].parent.span_id == spans["task"].context.span_id
+
+
+def test_celery_headers_propagate_trace(exporter):
+    """测试发布任务时写入traceparent，worker执行时以其为父span，任务链依次衔接"""
+    headers = {}
+    with tracing.span("POST /api/v1/process-url"):
+        celery_app._inject_trace_context(headers=headers)
+    assert "traceparent" in headers
+
+    def run_task(task_id, name, request_headers):
+        task = SimpleNamespace(name=name, request=SimpleNamespace(**request_headers))
+        celery_app._record_task_start(task_id=task_id, task=task)
+        published = {}
+        # 任务链的下一个任务在当前任务执行期间发布
+        celery_app._inject_trace_context(headers=published)
+        celery_app._record_task_end(task_id=task_id, task=task, state="SUCCESS")
+        return published
+
+    next_headers = run_task("t1", "create_pdf_task", headers)
+    run_task("t2", "send_email_task", next_headers)
+
+    spans = _finished(exporter)
+    api = spans["POST /api/v1/process-url"]
+    render = spans["create_pdf_task"]
+    email = spans["send_email_task"]
+    assert render.context.trace_id == email.context.trace_id == api.context.trace_id
+    assert render.parent.span_id == api.context.span_id
+    assert email.parent.span_id == render.context.span_id
+    assert email.attributes["celery.state"] == "SUCCESS"
+
+
+def test_task_failure_recorded(exporter):
+    """测试任务失败时异常记录在任务span上"""
+    task = SimpleNamespace(name="export_task", request=SimpleNamespace())
+    celery_app._record_task_start(task_id="t3", task=task)
+    celery_app._record_task_failure(task_id="t3", exception=ValueError("bad"))
+    celery_app._record_task_end(task_id="t3", task=task, state="FAILURE")
+
+    span = _finished(exporter)["export_task"]
+    assert not span.status.is_ok
+    assert span.events[0].name == "exception"
+
+
+def test_json_file_exporter(tmp_path):
+    """测试file导出方式每行写入一个span的JSON"""
+    path = tmp_path / "traces.jsonl"
+    assert tracing.init_tracing(
+        "wedocx-test", exporter=tracing.JsonFileSpanExporter(str(path))
+    )
+    try:
+        with tracing.span("smtp_send"):
+            pass
+        with tracing.span("smtp_login"):
+            pass
+    finally:
+        tracing.shutdown_tracing()
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["name"] for line in lines] == ["smtp_send", "smtp_login"]
+
+
+def test_scheduler_publishes_under_submitter_trace(exporter):
+    """测试调度器发布排队的任务时恢复提交请求的trace，而不是触发发布的请求的trace"""
+    from unittest.mock import MagicMock
+
+    from app.services.fair_scheduler import FairScheduler
+    from app.workers.tasks import create_pdf_task
+
+    submit, dispatch = MagicMock(return_value=[1, b"interactive"]), MagicMock()
+    client = MagicMock()
+    client.register_script.side_effect = [submit, dispatch] + [MagicMock()] * 3
+    app = MagicMock()
+    scheduler = FairScheduler(client=client, app=app)
+
+    dispatch.return_value = None
+    with tracing.span("POST /api/v1/process-url"):
+        scheduler.submit(create_pdf_task.s("https://example.com", "/tmp/a.pdf"), "t")
+    job = submit.call_args.kwargs["args"][3]
+
+    published = {}
+    app.signature.return_value.apply_async.side_effect = lambda: tracing.inject(
+        published
+    )
+    dispatch.side_effect = [job, None]
+    with tracing.span("POST /api/v1/process-url other"):
+        assert scheduler.pump() == 1
+
+    spans = _finished(exporter)
+    trace_id = spans["POST /api/v1/process-url"].context.trace_id
+    assert published["traceparent"].split("-")[1] == f"{trace_id:032x}"